@@ -1,37 +1,133 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, session
+# 起動時間の計測（openpyxl・requests・jpholiday・Firestore クライアントは最初の使用時に読み込む）
+from startup_report import startup_report
+
+with startup_report.measure('flask'):
+    from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, session, g
 from datetime import datetime, timedelta
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+import asyncio
 import os
+import time
 import json
-import tempfile
+import logging
 from io import BytesIO
-from dateutil.relativedelta import relativedelta
-from math import floor
-import requests
 import sys
 
-# Firestore関連のインポート
-from firestore_config import firestore_manager
-from auth_firestore import firestore_auth_manager, firestore_login_required
-from attendance_firestore import firestore_attendance_manager
+# Firestore関連のインポート（クライアントは最初の使用時に作成される）
+with startup_report.measure('firestore_managers'):
+    from firestore_config import firestore_manager
+    from auth_firestore import firestore_auth_manager, firestore_login_required
+    from attendance_firestore import firestore_attendance_manager
+    from async_attendance import async_attendance_manager
+
+# 祝日・土日・休業日の表（jpholidayは最初の参照時に読み込む）
+from work_calendar import work_calendar
+
+# 作業時間報告書（openpyxlは最初の出力時に読み込む）
+from excel_report import excel_report_engine, report_filename, TEMPLATE_VERSION
+from report_cache import report_cache, month_data_version
+from bulk_export import bulk_exporter, ExportJob, parse_months
+from export_jobs import export_job_queue, JOB_DONE
+from timesheet import Timesheet, format_minutes
+from diagnostics import storage_diagnostics
+from rpc_ledger import open_ledger, close_ledger, current_ledger, rpc_budget, RpcBudgetExceeded
+from metrics import metrics_registry, request_duration, requests_total, requests_in_flight
 
-# jpholidayのインポートを安全に行う
-try:
-    import jpholiday
-    JPHOLIDAY_AVAILABLE = True
-except (ImportError, TypeError) as e:
-    print(f"jpholidayインポートエラー: {e}")
-    JPHOLIDAY_AVAILABLE = False
+logger = logging.getLogger(__name__)
+
+# 勤怠データが変更された月の作成済みレポートを破棄
+firestore_attendance_manager.add_change_listener(report_cache.on_months_changed)
 
 app = Flask(__name__)
 
+@app.after_request
+def record_first_request(response):
+    """最初のリクエストの応答時刻を起動時間レポートに記録"""
+    startup_report.mark_first_request(request.path)
+    return response
+
+# RPC 予算を超えたリクエストを失敗させる（テスト用。通常はログのみ）
+app.config['RPC_BUDGET_STRICT'] = os.environ.get('RPC_BUDGET_STRICT', 'false').lower() == 'true'
+
+@app.before_request
+def open_request_ledger():
+    """リクエスト中の Firestore の RPC（操作・コレクション・時間・バイト数）の記録を開始"""
+    g.rpc_ledger_token = open_ledger()
+
+@app.after_request
+def report_request_ledger(response):
+    """RPC の合計を Server-Timing ヘッダーで返し、ビューの RPC 予算と比較"""
+    ledger = current_ledger()
+    if ledger is None or 'rpc_ledger_token' not in g:
+        return response
+    response.headers['Server-Timing'] = ledger.server_timing()
+    
+    budget = getattr(app.view_functions.get(request.endpoint), 'rpc_budget', None)
+    violations = budget.violations(ledger) if budget else []
+    if violations:
+        message = f"RPC予算超過 {request.endpoint}: {', '.join(violations)} {ledger.summary()['by_operation']}"
+        if app.config['RPC_BUDGET_STRICT']:
+            raise RpcBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+@app.teardown_request
+def close_request_ledger(exc):
+    token = g.pop('rpc_ledger_token', None)
+    if token is not None:
+        close_ledger(token)
+
+@app.before_request
+def start_request_metrics():
+    """処理中のリクエスト数と応答時間の計測を開始"""
+    requests_in_flight.inc()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    """エンドポイントごとの応答時間・ステータスごとのリクエスト数を記録（例外時は 500）"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    requests_in_flight.dec()
+    # 存在しない URL はまとめる（ラベルの種類を URL の数だけ増やさない）
+    endpoint = request.endpoint or 'unmatched'
+    request_duration.labels(endpoint, request.method).observe(time.perf_counter() - started)
+    requests_total.labels(endpoint, request.method, g.pop('response_status', 500)).inc()
+
+def collect_cache_metrics():
+    """キャッシュのヒット・ミス数とヒット率（/metrics の出力時に各キャッシュの統計から作成）"""
+    caches = {
+        'attendance_read': get_attendance_manager().read_cache.stats(),
+        'auth_users': get_auth_manager().cache_stats(),
+    }
+    report_stats = report_cache.stats()
+    caches['excel_report'] = dict(hits=report_stats['memory_hits'] + report_stats['disk_hits'], misses=report_stats['misses'])
+    
+    yield ('cache_requests_total', 'counter', 'キャッシュの参照数',
+           [({'cache': name, 'result': result}, stats[key])
+            for name, stats in caches.items() for result, key in (('hit', 'hits'), ('miss', 'misses'))])
+    yield ('cache_hit_ratio', 'gauge', 'キャッシュのヒット率（プロセス開始から）',
+           [({'cache': name}, stats['hits'] / (stats['hits'] + stats['misses']) if stats['hits'] + stats['misses'] else 0.0)
+            for name, stats in caches.items()])
+    yield ('cache_entries', 'gauge', 'キャッシュの件数',
+           [({'cache': name}, stats['entries']) for name, stats in caches.items() if 'entries' in stats])
+
+metrics_registry.add_collector(collect_cache_metrics)
+
 # 全テンプレートで現在の年を利用できるようにする
 @app.context_processor
 def inject_now():
     from datetime import datetime
     return {'now': datetime.now()}
 
+# 分を 'H:MM' で表示するフィルター
+app.jinja_env.filters['hours_minutes'] = format_minutes
+
 # セッション用の秘密鍵（環境変数から取得、なければランダム生成）
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
@@ -48,6 +144,17 @@ def get_attendance_manager():
     """適切な勤怠マネージャーを取得"""
     return firestore_attendance_manager
 
+def get_async_attendance_manager():
+    """async ビュー用の勤怠マネージャーを取得（キャッシュは同期版と共有）"""
+    return async_attendance_manager
+
+def configure_storage_backend(backend):
+    """ストレージバックエンドを差し替える（テスト・ベンチマークで FakeFirestoreManager 等を注入）"""
+    global firestore_manager
+    firestore_manager = backend
+    get_auth_manager().set_storage_backend(backend)
+    get_attendance_manager().set_storage_backend(backend)
+
 def get_login_required_decorator():
     """適切なログイン必須デコレータを取得"""
     return firestore_login_required
@@ -89,6 +196,7 @@ def save_data(data):
 
 def load_data_from_gist():
     """GitHub Gistからデータを読み込む"""
+    requests = startup_report.import_module('requests')
     try:
         headers = {
             'Authorization': f'token {GITHUB_TOKEN}',
@@ -109,6 +217,7 @@ def load_data_from_gist():
 
 def save_data_to_gist(data):
     """GitHub Gistにデータを保存する"""
+    requests = startup_report.import_module('requests')
     try:
         print(f"DEBUG: Gist保存開始 - データサイズ: {len(json.dumps(data))}")
         headers = {
@@ -156,15 +265,38 @@ def save_data_to_gist(data):
         print(f"DEBUG: エラー詳細: {traceback.format_exc()}")
 
 def check_holiday(date):
-    """祝日チェック（jpholidayライブラリを使用）"""
-    if not JPHOLIDAY_AVAILABLE:
-        return False
-    
+    """祝日・休業日チェック（年ごとの祝日表を参照）"""
+    return work_calendar.is_holiday(date)
+
+def build_attendance_rows(year, month, user_data, sheet=None):
+    """勤怠ページ用に月の日ごとの表示データを作成（実働時間は Timesheet で計算）"""
+    if sheet is None:
+        sheet = Timesheet.from_month(year, month, user_data)
+    daily_work = sheet.daily_work_minutes()
+    attendance_data = []
+    for index, day in enumerate(work_calendar.month_days(year, month)):
+        date_str = day.date.strftime('%Y-%m-%d')
+        attendance_data.append({
+            'date': date_str,
+            'display_date': day.date.day,
+            'weekday': day.weekday_name,
+            'is_holiday': day.is_holiday or day.is_closure,
+            'holiday_name': day.holiday_name,
+            'work_minutes': daily_work[index],
+            'data': user_data.get(date_str, {})
+        })
+    return attendance_data
+
+def parse_attendance_field_key(key):
+    """フォームのフィールド名（例: 'check_in_2025-07-08'）を (フィールド, 日付) に分解"""
+    if '_' not in key:
+        return None
+    field, date_str = key.rsplit('_', 1)
     try:
-        return jpholiday.is_holiday(date)
-    except Exception as e:
-        print(f"祝日チェックエラー: {e}")
-        return False
+        datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return field, date_str
 
 def get_month_range(year, month):
     """指定された年月の開始日と終了日を取得"""
@@ -176,316 +308,8 @@ def get_month_range(year, month):
     return start_date, end_date
 
 def create_excel_report(year, month, data, user_display_name):
-    """Excelレポートを作成（Vercel環境対応・メモリ上で作成）"""
-    import calendar
-    from openpyxl.utils import get_column_letter
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "template"
-    
-    # 和暦変換関数
-    def to_wareki(y, m):
-        if y > 2019 or (y == 2019 and m >= 5):
-            return f"令和 {y-2018}"
-        else:
-            return f"平成 {y-1988 if y >= 1989 else y}"
-    
-    # スタイル定義
-    title_font = Font(name='MS Gothic', size=16, bold=True)
-    header_font = Font(name='MS Gothic', size=10, bold=True)
-    normal_font = Font(name='MS Gothic', size=9)
-    red_font = Font(name='MS Gothic', size=9, color="FF0000", bold=True)
-    bold_font = Font(name='MS Gothic', size=9, bold=True)
-    
-    # 色定義
-    table_fill = PatternFill(start_color="CCFFCC", end_color="CCFFCC", fill_type="solid")
-    header_fill = PatternFill(start_color="99FF99", end_color="99FF99", fill_type="solid")
-    company_fill = PatternFill(start_color="E6FFE6", end_color="E6FFE6", fill_type="solid")
-    white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    
-    # 罫線定義
-    thin = Side(style='thin', color='000000')
-    thin_border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    
-    # 配置定義
-    center = Alignment(horizontal='center', vertical='center')
-    left = Alignment(horizontal='left', vertical='center')
-    top = Alignment(horizontal='left', vertical='top')
-    
-    # 列幅設定
-    col_widths = [5, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4]
-    for i, w in enumerate(col_widths):
-        ws.column_dimensions[get_column_letter(i+1)].width = w
-    
-    # 行高設定
-    for r in range(1, 60):
-        ws.row_dimensions[r].height = 22
-    ws.row_dimensions[2].height = 32
-    
-    # タイトル
-    ws.merge_cells('B2:T2')
-    ws['B2'] = "作業時間報告書"
-    ws['B2'].font = title_font
-    ws['B2'].alignment = center
-    
-    # 年月度
-    ws['B4'] = to_wareki(year, month)
-    ws['C4'] = f"{year}"
-    ws['D4'] = "年"
-    ws['E4'] = f"{month}"
-    ws['F4'] = "月度"
-    for cell in ['B4', 'C4', 'D4', 'E4', 'F4']:
-        ws[cell].font = header_font
-        ws[cell].alignment = center
-    
-    # 会社情報
-    ws['B7'] = "対応客先名"
-    ws['C7'] = "株式会社LINE"
-    ws['F7'] = "会社名"
-    ws['G7'] = "HIGHFLAT"
-    ws['I7'] = "氏名"
-    ws['J7'] = user_display_name or ""
-    
-    # 会社情報のスタイル
-    for label_cell in ['B7', 'F7', 'I7']:
-        ws[label_cell].font = header_font
-        ws[label_cell].alignment = center
-    for value_cell in ['C7', 'G7', 'J7']:
-        ws[value_cell].font = normal_font
-        ws[value_cell].alignment = left
-        ws[value_cell].fill = company_fill
-    
-    # テーブルヘッダー（左側と右側）
-    headers = ["日付", "曜日", "出勤時間", "退勤時間", "実働時間", "交通費", "出発駅", "目的駅", "備考"]
-    
-    # 左側ヘッダー（B列～J列）
-    for i, h in enumerate(headers):
-        cell = ws.cell(row=13, column=2+i, value=h)
-        cell.font = header_font
-        cell.alignment = center
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    # 右側ヘッダー（L列～T列）
-    for i, h in enumerate(headers):
-        cell = ws.cell(row=13, column=12+i, value=h)
-        cell.font = header_font
-        cell.alignment = center
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    # 月の日付範囲を取得
-    start_date, end_date = get_month_range(year, month)
-    days = []
-    current_date = start_date
-    while current_date <= end_date:
-        days.append(current_date)
-        current_date += timedelta(days=1)
-    
-    # 左側（1-16日）と右側（17-31日）に分割
-    left_days = days[:16]
-    right_days = days[16:]
-    
-    total_work = 0
-    total_travel = 0
-    
-    # 左側データ（B列～J列）
-    for idx, d in enumerate(left_days):
-        r = 14 + idx
-        date_str = d.strftime('%Y-%m-%d')
-        weekday = d.strftime('%a')
-        jp_week = {'Mon':'月','Tue':'火','Wed':'水','Thu':'木','Fri':'金','Sat':'土','Sun':'日'}[weekday]
-        
-        # データ取得（Firestoreデータフォーマットに対応）
-        att = data.get(date_str, {})
-        check_in = att.get('check_in', '')
-        check_out = att.get('check_out', '')
-        break_time = float(att.get('break_time', '1.0') or 1.0)
-        notes = att.get('notes', '')
-        travel_cost = att.get('travel_cost', '')
-        travel_from = att.get('travel_from', '')
-        travel_to = att.get('travel_to', '')
-        
-        is_holiday = check_holiday(d)
-        
-        # 実働時間計算
-        def get_minutes(t):
-            if not t: return None
-            try:
-                h, m = map(int, t.split(':'))
-                return h*60 + m
-            except:
-                return None
-        
-        work_min = None
-        if check_in and check_out:
-            in_min = get_minutes(check_in)
-            out_min = get_minutes(check_out)
-            if in_min is not None and out_min is not None:
-                work_min = out_min - in_min - int(break_time*60)
-                if work_min < 0: work_min = None
-        
-        if work_min:
-            total_work += work_min
-        
-        try:
-            if travel_cost:
-                total_travel += float(travel_cost)
-        except:
-            pass
-        
-        # セルに値を設定
-        ws.cell(row=r, column=2, value=d.day).font = normal_font
-        
-        # 曜日（土日祝は赤色）
-        weekday_cell = ws.cell(row=r, column=3, value=jp_week)
-        if jp_week in ['土','日'] or is_holiday:
-            weekday_cell.font = red_font
-        else:
-            weekday_cell.font = normal_font
-        
-        ws.cell(row=r, column=4, value=check_in).font = normal_font
-        ws.cell(row=r, column=5, value=check_out).font = normal_font
-        ws.cell(row=r, column=6, value=(f"{work_min/60:.2f}" if work_min is not None else "")).font = normal_font
-        ws.cell(row=r, column=7, value=travel_cost).font = normal_font
-        ws.cell(row=r, column=8, value=travel_from).font = normal_font
-        ws.cell(row=r, column=9, value=travel_to).font = normal_font
-        ws.cell(row=r, column=10, value=notes).font = normal_font
-        
-        # スタイル適用
-        for i in range(9):
-            c = ws.cell(row=r, column=2+i)
-            c.fill = table_fill
-            c.border = thin_border
-            c.alignment = center if i not in [8] else left  # 備考欄は左寄せ
-    
-    # 右側データ（L列～T列）
-    for idx, d in enumerate(right_days):
-        r = 14 + idx
-        date_str = d.strftime('%Y-%m-%d')
-        weekday = d.strftime('%a')
-        jp_week = {'Mon':'月','Tue':'火','Wed':'水','Thu':'木','Fri':'金','Sat':'土','Sun':'日'}[weekday]
-        
-        # データ取得
-        att = data.get(date_str, {})
-        check_in = att.get('check_in', '')
-        check_out = att.get('check_out', '')
-        break_time = float(att.get('break_time', '1.0') or 1.0)
-        notes = att.get('notes', '')
-        travel_cost = att.get('travel_cost', '')
-        travel_from = att.get('travel_from', '')
-        travel_to = att.get('travel_to', '')
-        
-        is_holiday = check_holiday(d)
-        
-        # 実働時間計算
-        work_min = None
-        if check_in and check_out:
-            in_min = get_minutes(check_in)
-            out_min = get_minutes(check_out)
-            if in_min is not None and out_min is not None:
-                work_min = out_min - in_min - int(break_time*60)
-                if work_min < 0: work_min = None
-        
-        if work_min:
-            total_work += work_min
-        
-        try:
-            if travel_cost:
-                total_travel += float(travel_cost)
-        except:
-            pass
-        
-        # セルに値を設定
-        ws.cell(row=r, column=12, value=d.day).font = normal_font
-        
-        # 曜日（土日祝は赤色）
-        weekday_cell = ws.cell(row=r, column=13, value=jp_week)
-        if jp_week in ['土','日'] or is_holiday:
-            weekday_cell.font = red_font
-        else:
-            weekday_cell.font = normal_font
-        
-        ws.cell(row=r, column=14, value=check_in).font = normal_font
-        ws.cell(row=r, column=15, value=check_out).font = normal_font
-        ws.cell(row=r, column=16, value=(f"{work_min/60:.2f}" if work_min is not None else "")).font = normal_font
-        ws.cell(row=r, column=17, value=travel_cost).font = normal_font
-        ws.cell(row=r, column=18, value=travel_from).font = normal_font
-        ws.cell(row=r, column=19, value=travel_to).font = normal_font
-        ws.cell(row=r, column=20, value=notes).font = normal_font
-        
-        # スタイル適用
-        for i in range(9):
-            c = ws.cell(row=r, column=12+i)
-            c.fill = table_fill
-            c.border = thin_border
-            c.alignment = center if i not in [8] else left  # 備考欄は左寄せ
-    
-    # 合計行（右側のみ）
-    sum_row = 14+max(len(left_days), len(right_days))
-    
-    # 実働時間合計
-    ws.cell(row=sum_row, column=15, value="計").font = bold_font
-    ws.cell(row=sum_row, column=15).fill = header_fill
-    ws.cell(row=sum_row, column=15).border = thin_border
-    ws.cell(row=sum_row, column=15).alignment = center
-    
-    ws.cell(row=sum_row, column=16, value=f"{total_work/60:.2f}").font = bold_font
-    ws.cell(row=sum_row, column=16).fill = header_fill
-    ws.cell(row=sum_row, column=16).border = thin_border
-    ws.cell(row=sum_row, column=16).alignment = center
-    
-    # 交通費合計
-    ws.cell(row=sum_row, column=18, value="交通費合計").font = bold_font
-    ws.cell(row=sum_row, column=18).fill = header_fill
-    ws.cell(row=sum_row, column=18).border = thin_border
-    ws.cell(row=sum_row, column=18).alignment = center
-    
-    ws.cell(row=sum_row, column=19, value=f"{total_travel:.0f}").font = bold_font
-    ws.cell(row=sum_row, column=19).fill = header_fill
-    ws.cell(row=sum_row, column=19).border = thin_border
-    ws.cell(row=sum_row, column=19).alignment = center
-    
-    # 備考欄
-    notes_row = sum_row + 2
-    ws.merge_cells(f'B{notes_row}:H{notes_row+7}')
-    ws.cell(row=notes_row, column=2, value="備考").font = header_font
-    ws.cell(row=notes_row, column=2).alignment = top
-    ws.cell(row=notes_row, column=2).fill = white_fill
-    ws.cell(row=notes_row, column=2).border = thin_border
-    
-    # 備考欄の罫線
-    for r in range(notes_row, notes_row+8):
-        for c in range(2, 9):
-            ws.cell(row=r, column=c).border = thin_border
-    
-    # 下部情報
-    info_row = notes_row
-    ws.cell(row=info_row, column=13, value="実働時間合計").font = header_font
-    ws.cell(row=info_row, column=13).alignment = left
-    ws.cell(row=info_row, column=14, value=f"{total_work/60:.2f} h").font = normal_font
-    ws.cell(row=info_row, column=14).alignment = left
-    
-    ws.cell(row=info_row+2, column=13, value="自").font = normal_font
-    ws.cell(row=info_row+2, column=13).alignment = left
-    ws.cell(row=info_row+2, column=14, value=f"{year}年{month}月1日").font = normal_font
-    ws.cell(row=info_row+2, column=14).alignment = left
-    
-    ws.cell(row=info_row+3, column=13, value="至").font = normal_font
-    ws.cell(row=info_row+3, column=13).alignment = left
-    ws.cell(row=info_row+3, column=14, value=f"{year}年{month}月{days[-1].day}日").font = normal_font
-    ws.cell(row=info_row+3, column=14).alignment = left
-    
-    # ファイル名
-    filename = f"作業時間報告書_{year}年{month}月_{user_display_name or '氏名未入力'}.xlsx"
-    
-    # メモリ上でファイルを作成（Vercel環境対応）
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return output, filename
+    """Excelレポートを作成（Vercel環境対応・メモリ上で作成、静的レイアウトはプロセス内で再利用）"""
+    return excel_report_engine.build(year, month, data, user_display_name)
 
 # ルート定義
 @app.route('/auth', methods=['GET', 'POST'])
@@ -531,13 +355,6 @@ def auth():
                 print(f"DEBUG: 認証キャッシュ内ユーザー数={len(firestore_auth_manager.users_cache)}")
                 print(f"DEBUG: 認証キャッシュ内ユーザー一覧={list(firestore_auth_manager.users_cache.keys())}")
                 
-                # Firestoreから直接確認
-                if firestore_manager.is_available():
-                    existing_user = firestore_manager.get_document('users', username)
-                    print(f"DEBUG: Firestore直接確認結果={existing_user is not None}")
-                    if existing_user:
-                        print(f"DEBUG: 既存ユーザー情報={existing_user}")
-                        
             except Exception as debug_e:
                 print(f"DEBUG: デバッグ情報取得エラー={str(debug_e)}")
             
@@ -578,7 +395,7 @@ def logout():
 
 @app.route('/')
 @login_required_decorator
-def index():
+async def index():
     """勤怠打刻画面（ホーム）"""
     from datetime import timezone
     
@@ -588,10 +405,9 @@ def index():
     jst = timezone(timedelta(hours=9))
     today = datetime.now(jst).strftime('%Y-%m-%d')
     
-    # 現在のユーザーのデータを取得
+    # 現在のユーザーの本日分のデータを取得（本日を含む月のみ読み込む）
     current_user = auth_mgr.get_current_user()
-    data = load_user_data(current_user)
-    today_data = data.get(today, {})
+    today_data = await get_async_attendance_manager().get_user_daily_data(current_user, today)
     
     return render_template('punch.html', 
                          today=today,
@@ -602,10 +418,10 @@ def index():
 
 @app.route('/attendance_info')
 @login_required_decorator
-def attendance_info():
+async def attendance_info():
     """勤怠情報ページ"""
     auth_mgr = get_auth_manager()
-    attendance_mgr = get_attendance_manager()
+    attendance_mgr = get_async_attendance_manager()
     
     year = int(request.args.get('year', datetime.now().year))
     month = int(request.args.get('month', datetime.now().month))
@@ -614,34 +430,19 @@ def attendance_info():
     current_user = auth_mgr.get_current_user()
     display_name = auth_mgr.get_current_display_name()
     
-    # 月の日付範囲を取得
-    start_date, end_date = get_month_range(int(year), int(month))
-    
     # ユーザー別勤怠データを読み込み
     if attendance_mgr:
-        user_data = attendance_mgr.get_user_monthly_data(current_user, year, month)
+        user_data = await attendance_mgr.get_user_month_records(current_user, year, month)
     else:
         user_data = load_user_data(current_user)
     
-    # 日付ごとのデータを準備
-    attendance_data = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        weekday = current_date.strftime('%A')
-        is_holiday = check_holiday(current_date)
-        
-        attendance_data.append({
-            'date': date_str,
-            'display_date': current_date.day,
-            'weekday': weekday,
-            'is_holiday': is_holiday,
-            'data': user_data.get(date_str, {})
-        })
-        current_date += timedelta(days=1)
+    # 日付ごとのデータと月の集計を準備（曜日・祝日は年ごとの表から取得）
+    sheet = Timesheet.from_month(year, month, user_data)
+    attendance_data = build_attendance_rows(year, month, user_data, sheet)
     
     return render_template('attendance_info.html', 
                          attendance_data=attendance_data,
+                         summary=sheet.summary(),
                          year=year, 
                          month=month, 
                          current_user=current_user,
@@ -650,10 +451,10 @@ def attendance_info():
 
 @app.route('/attendance')
 @login_required_decorator
-def attendance():
+async def attendance():
     """勤怠入力ページ"""
     auth_mgr = get_auth_manager()
-    attendance_mgr = get_attendance_manager()
+    attendance_mgr = get_async_attendance_manager()
     
     year = int(request.args.get('year', datetime.now().year))
     month = int(request.args.get('month', datetime.now().month))
@@ -662,34 +463,19 @@ def attendance():
     current_user = auth_mgr.get_current_user()
     display_name = auth_mgr.get_current_display_name()
     
-    # 月の日付範囲を取得
-    start_date, end_date = get_month_range(int(year), int(month))
-    
     # ユーザー別勤怠データを読み込み
     if attendance_mgr:
-        user_data = attendance_mgr.get_user_monthly_data(current_user, year, month)
+        user_data = await attendance_mgr.get_user_month_records(current_user, year, month)
     else:
         user_data = load_user_data(current_user)
     
-    # 日付ごとのデータを準備
-    attendance_data = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        weekday = current_date.strftime('%A')
-        is_holiday = check_holiday(current_date)
-        
-        attendance_data.append({
-            'date': date_str,
-            'display_date': current_date.day,
-            'weekday': weekday,
-            'is_holiday': is_holiday,
-            'data': user_data.get(date_str, {})
-        })
-        current_date += timedelta(days=1)
+    # 日付ごとのデータと月の集計を準備（曜日・祝日は年ごとの表から取得）
+    sheet = Timesheet.from_month(year, month, user_data)
+    attendance_data = build_attendance_rows(year, month, user_data, sheet)
     
     return render_template('attendance.html', 
                          attendance_data=attendance_data,
+                         summary=sheet.summary(),
                          year=year, 
                          month=month, 
                          current_user=current_user,
@@ -705,14 +491,17 @@ def save_attendance():
     current_user = auth_mgr.get_current_user()
     
     if attendance_mgr:
-        # Firestore版
+        # Firestore版 - フォーム全体を1回のバッチで保存
+        changes = []
         for key, value in request.form.items():
             # 例: key = 'check_in_2025-07-08'
-            if '_' in key and len(key.split('_')) >= 2:
-                parts = key.split('_')
-                field = parts[0]
-                date_str = '_'.join(parts[1:])  # 日付に_が含まれる場合に対応
-                attendance_mgr.update_user_attendance_data(current_user, date_str, field, value)
+            parsed = parse_attendance_field_key(key)
+            if parsed:
+                field, date_str = parsed
+                changes.append((date_str, field, value))
+        
+        if not attendance_mgr.bulk_update_user_attendance_data(current_user, changes):
+            print(f"ERROR: 勤怠フォーム一括保存失敗 - {current_user} ({len(changes)}件)")
     else:
         # 従来版
         pass # Firestore専用なので従来版は使用しない
@@ -721,7 +510,7 @@ def save_attendance():
 
 @app.route('/export_excel')
 @login_required_decorator
-def export_excel():
+async def export_excel():
     """Excelファイルをエクスポート（Vercel環境対応）"""
     try:
         auth_mgr = get_auth_manager()
@@ -741,24 +530,48 @@ def export_excel():
             print("ERROR: ユーザー認証失敗")
             return redirect(url_for('auth'))
         
-        # ユーザー別データを取得
-        user_data = load_user_data(current_user)
+        # 出力対象月のデータのみ取得
+        user_data = await get_async_attendance_manager().get_user_month_records(current_user, year, month)
         print(f"DEBUG: 取得データ件数={len(user_data)}")
         
         if not user_data:
             print("WARNING: 勤怠データが存在しません")
         
-        # Excelファイルをメモリ上で生成
-        excel_data, filename = create_excel_report(year, month, user_data, display_name)
-        print(f"DEBUG: Excel生成完了 - ファイル名={filename}")
+        # ユーザー・年月・データの内容・表示名・テンプレートの版から ETag を計算
+        etag = report_cache.etag_for(current_user, year, month, month_data_version(user_data),
+                                     display_name, TEMPLATE_VERSION)
+        if request.if_none_match.contains(etag):
+            # ブラウザが同じ内容のファイルを持っている
+            report_cache.record_not_modified()
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        
+        # 作成済みのレポートがあれば再利用、無ければメモリ上で生成
+        content = report_cache.get(current_user, year, month, etag)
+        if content is not None:
+            filename = report_filename(year, month, display_name)
+            print(f"DEBUG: Excel作成済みレポートを使用 - ファイル名={filename}")
+        else:
+            # ブックの作成は CPU 処理のためスレッドで行う（イベントループを止めない）
+            excel_data, filename = await asyncio.to_thread(create_excel_report, year, month, user_data, display_name)
+            content = excel_data.getvalue()
+            report_cache.put(current_user, year, month, etag, content)
+            print(f"DEBUG: Excel生成完了 - ファイル名={filename}")
         
         # メモリ上のファイルをレスポンスとして返す
-        return send_file(
-            excel_data,
+        response = send_file(
+            BytesIO(content),
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            etag=etag
         )
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
         
     except Exception as e:
         print(f"ERROR: Excel出力エラー - {str(e)}")
@@ -768,12 +581,13 @@ def export_excel():
 
 @app.route('/api/punch', methods=['POST'])
 @login_required_decorator
-def api_punch():
+@rpc_budget(reads=0, writes=1)
+async def api_punch():
     """打刻API"""
     try:
         print("DEBUG: 打刻API呼び出し開始")
         auth_mgr = get_auth_manager()
-        attendance_mgr = get_attendance_manager()
+        attendance_mgr = get_async_attendance_manager()
         
         current_user = auth_mgr.get_current_user()
         print(f"DEBUG: 現在のユーザー={current_user}")
@@ -815,17 +629,15 @@ def api_punch():
 
         # データ保存
         if attendance_mgr:
-            # Firestore版
-            success = attendance_mgr.update_user_attendance_data(current_user, date_str, field, time_str)
-            if success:
+            # Firestore版 - 書き込み結果から更新後の記録を返す（再読み込みなし）
+            result = await attendance_mgr.update_user_attendance_record(current_user, date_str, field, time_str)
+            if result:
                 print("DEBUG: Firestore勤怠データ保存完了")
-                # 保存後に最新データを取得して返す
-                updated_data = attendance_mgr.get_user_attendance_data(current_user)
-                today_data = updated_data.get(date_str, {})
                 return jsonify({
                     'success': True, 
                     'time': time_str,
-                    'updated_data': today_data
+                    'updated_data': result['data'],
+                    'version': result['version']
                 })
             else:
                 print("ERROR: Firestore勤怠データ保存失敗")
@@ -857,6 +669,7 @@ def api_punch():
 
 @app.route('/api/save_attendance', methods=['POST'])
 @login_required_decorator
+@rpc_budget(reads=0, writes=1)
 def api_save_attendance():
     """API経由で勤怠データを保存"""
     auth_mgr = get_auth_manager()
@@ -879,11 +692,12 @@ def api_save_attendance():
 
 @app.route('/api/save_field', methods=['POST'])
 @login_required_decorator
-def api_save_field():
+@rpc_budget(reads=0, writes=1)
+async def api_save_field():
     """フィールド保存API"""
     try:
         auth_mgr = get_auth_manager()
-        attendance_mgr = get_attendance_manager()
+        attendance_mgr = get_async_attendance_manager()
         current_user = auth_mgr.get_current_user()
         
         req = request.get_json()
@@ -895,15 +709,13 @@ def api_save_field():
             return jsonify({'success': False, 'error': 'Missing parameters'}), 400
         
         if attendance_mgr:
-            # Firestore版
-            success = attendance_mgr.update_user_attendance_data(current_user, date_str, field, value)
-            if success:
-                # 保存後に最新データを取得
-                updated_data = attendance_mgr.get_user_attendance_data(current_user)
-                day_data = updated_data.get(date_str, {})
+            # Firestore版 - 書き込み結果から更新後の記録を返す（再読み込みなし）
+            result = await attendance_mgr.update_user_attendance_record(current_user, date_str, field, value)
+            if result:
                 return jsonify({
                     'success': True,
-                    'updated_data': day_data
+                    'updated_data': result['data'],
+                    'version': result['version']
                 })
             else:
                 return jsonify({'success': False, 'error': 'Failed to save data'}), 500
@@ -919,6 +731,42 @@ def api_save_field():
         print(f"ERROR: フィールド保存API例外発生 - {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/save_fields', methods=['POST'])
+@login_required_decorator
+def api_save_fields():
+    """複数フィールド一括保存API（自動保存のまとめ送信用）"""
+    try:
+        auth_mgr = get_auth_manager()
+        attendance_mgr = get_attendance_manager()
+        current_user = auth_mgr.get_current_user()
+        
+        req = request.get_json(silent=True) or {}
+        items = req.get('changes')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'Missing parameters'}), 400
+        
+        changes = []
+        for item in items:
+            date_str = item.get('date') if isinstance(item, dict) else None
+            field = item.get('field') if isinstance(item, dict) else None
+            if not date_str or not field:
+                return jsonify({'success': False, 'error': 'Missing parameters'}), 400
+            changes.append((date_str, field, item.get('value')))
+        
+        result = attendance_mgr.bulk_update_user_attendance_records(current_user, changes)
+        if result:
+            return jsonify({
+                'success': True,
+                'updated_data': result['records'],
+                'version': result['version']
+            })
+        else:
+            return jsonify({'success': False, 'error': 'Failed to save data'}), 500
+            
+    except Exception as e:
+        print(f"ERROR: 一括保存API例外発生 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # データ移行エンドポイント（管理者用）
 @app.route('/admin/migrate_to_firestore', methods=['POST'])
 @login_required_decorator
@@ -948,9 +796,293 @@ def migrate_to_firestore():
         print(f"ERROR: データ移行失敗 - {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/admin/migrate_to_monthly', methods=['POST'])
+@login_required_decorator
+def migrate_to_monthly():
+    """ユーザー単位の勤怠ドキュメントを月別ドキュメントに移行"""
+    auth_mgr = get_auth_manager()
+    attendance_mgr = get_attendance_manager()
+    
+    # 管理者権限チェック（簡単な実装）
+    current_user = auth_mgr.get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    try:
+        req = request.get_json(silent=True) or {}
+        result = attendance_mgr.migrate_to_monthly_layout(
+            usernames=req.get('usernames'),
+            purge_legacy=bool(req.get('purge_legacy', False))
+        )
+        
+        return jsonify({'success': not result['failed_users'], 'result': result})
+        
+    except Exception as e:
+        print(f"ERROR: 月別レイアウト移行失敗 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/export_zip', methods=['GET'])
+@login_required_decorator
+def admin_export_zip():
+    """全ユーザー（または指定ユーザー）× 指定月の作業時間報告書を ZIP で一括出力（管理者用）
+    
+    クエリ: months=2025-04,2025-05（省略時は当月）、users=user1,user2（省略時は全ユーザー）
+    """
+    auth_mgr = get_auth_manager()
+    attendance_mgr = get_attendance_manager()
+    
+    # 管理者権限チェック（簡単な実装）
+    current_user = auth_mgr.get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    try:
+        now = datetime.now()
+        months = parse_months(request.args.get('months')) or [(now.year, now.month)]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'不正な月の指定: {str(e)}'}), 400
+    
+    usernames = [name.strip() for name in request.args.get('users', '').split(',') if name.strip()]
+    if not usernames:
+        usernames = sorted(auth_mgr.get_user_list())
+    # 表示名はユーザーキャッシュからまとめて取得（ユーザーごとの読み込みをしない）
+    display_names = auth_mgr.get_display_names(usernames)
+    jobs = [
+        ExportJob(username, display_names[username], year, month)
+        for year, month in months
+        for username in usernames
+    ]
+    print(f"DEBUG: 一括出力開始 - {len(usernames)}ユーザー × {len(months)}ヶ月")
+    
+    def load_month(username, year, month):
+        # ワーカープロセスへ渡すため辞書形式に変換
+        return attendance_mgr.get_user_month_records(username, year, month).to_dict()
+    
+    first, last = months[0], months[-1]
+    filename = f"timesheets_{first[0]:04d}{first[1]:02d}-{last[0]:04d}{last[1]:02d}.zip"
+    return app.response_class(
+        bulk_exporter.stream_zip(jobs, load_month),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/api/timesheet_summary', methods=['GET'])
+@login_required_decorator
+async def api_timesheet_summary():
+    """勤怠集計API（実働・時間外・深夜・休日出勤・交通費の月合計と週・日ごとの実働時間）
+    
+    クエリ: year, month（省略時は当月）、months=2025-04,2025-05（複数月を指定する場合）
+    """
+    try:
+        current_user = get_auth_manager().get_current_user()
+        now = datetime.now()
+        try:
+            months = parse_months(request.args.get('months')) or \
+                [(int(request.args.get('year', now.year)), int(request.args.get('month', now.month)))]
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'不正な月の指定: {str(e)}'}), 400
+        if any(not 1 <= month <= 12 for _, month in months):
+            return jsonify({'success': False, 'error': 'Invalid year or month'}), 400
+        
+        # 各月の読み込みは同時に行う
+        records = await get_async_attendance_manager().get_user_months_records(current_user, months)
+        sheet = Timesheet.from_months(
+            (f"{year:04d}-{month:02d}", year, month, month_records)
+            for (year, month), month_records in zip(months, records)
+        )
+        return jsonify({'success': True, 'summaries': sheet.summaries(daily=True)})
+        
+    except Exception as e:
+        print(f"ERROR: 勤怠集計API例外発生 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/monthly_summary', methods=['GET'])
+@login_required_decorator
+def api_monthly_summary():
+    """月別集計API（集計ドキュメントを1件読むだけで、月の勤怠データは読み直さない）
+    
+    クエリ: year, month（省略時は当月）
+    """
+    try:
+        current_user = get_auth_manager().get_current_user()
+        try:
+            year = int(request.args.get('year', datetime.now().year))
+            month = int(request.args.get('month', datetime.now().month))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid year or month'}), 400
+        if not 1 <= month <= 12:
+            return jsonify({'success': False, 'error': 'Invalid year or month'}), 400
+        
+        summary = get_attendance_manager().get_user_monthly_summary(current_user, year, month)
+        return jsonify({'success': True, 'summary': summary})
+        
+    except Exception as e:
+        print(f"ERROR: 月別集計API例外発生 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/monthly_summaries', methods=['GET'])
+@login_required_decorator
+def admin_monthly_summaries():
+    """チームの月別集計一覧（管理者用。全ユーザー分の集計ドキュメントを1回のクエリで取得）
+    
+    クエリ: month=2025-04（省略時は当月）
+    """
+    auth_mgr = get_auth_manager()
+    attendance_mgr = get_attendance_manager()
+    
+    # 管理者権限チェック（簡単な実装）
+    current_user = auth_mgr.get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    try:
+        now = datetime.now()
+        year, month = (parse_months(request.args.get('month')) or [(now.year, now.month)])[0]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'不正な月の指定: {str(e)}'}), 400
+    
+    try:
+        month_key = f"{year:04d}-{month:02d}"
+        summaries = attendance_mgr.monthly_summaries.get_month(month_key) if attendance_mgr.monthly_summaries.enabled else []
+        # 集計ドキュメントの無いユーザー（その月の記録が無い・未集計）と要再集計のユーザー
+        summarized = {summary.get('username') for summary in summaries}
+        missing_users = sorted(set(auth_mgr.get_user_list()) - summarized)
+        dirty_users = [summary.get('username') for summary in summaries if summary.get('dirty')]
+        return jsonify({'success': True, 'month': month_key, 'summaries': summaries,
+                        'missing_users': missing_users, 'dirty_users': dirty_users})
+        
+    except Exception as e:
+        print(f"ERROR: 月別集計一覧取得失敗 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/rebuild_monthly_summaries', methods=['POST'])
+@login_required_decorator
+def admin_rebuild_monthly_summaries():
+    """月別集計ドキュメントを勤怠データから作り直す（管理者用）
+    
+    JSON: usernames（省略時は全ユーザー）、months='2025-04,2025-05'（省略時は記録のある全ての月）、
+    dirty=true（要再集計の印が付いた月のみ）
+    """
+    auth_mgr = get_auth_manager()
+    attendance_mgr = get_attendance_manager()
+    
+    # 管理者権限チェック（簡単な実装）
+    current_user = auth_mgr.get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    try:
+        req = request.get_json(silent=True) or {}
+        try:
+            months = parse_months(req.get('months')) or None
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'不正な月の指定: {str(e)}'}), 400
+        
+        result = attendance_mgr.rebuild_monthly_summaries(usernames=req.get('usernames'), months=months,
+                                                          dirty_only=bool(req.get('dirty')))
+        return jsonify({'success': not result['failed_users'], 'result': result})
+        
+    except Exception as e:
+        print(f"ERROR: 月別集計の再集計失敗 - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def export_job_response(job):
+    """Excel出力ジョブの状態をレスポンス用の辞書で取得"""
+    payload = job.to_dict()
+    payload['status_url'] = url_for('api_export_job_status', job_id=job.job_id)
+    payload['download_url'] = url_for('api_export_job_download', job_id=job.job_id)
+    return payload
+
+@app.route('/api/export_jobs', methods=['POST'])
+@login_required_decorator
+def api_submit_export_job():
+    """Excel出力ジョブ登録API（ジョブIDをすぐに返し、作成はバックグラウンドで行う）"""
+    try:
+        auth_mgr = get_auth_manager()
+        current_user = auth_mgr.get_current_user()
+        display_name = auth_mgr.get_current_display_name()
+        
+        req = request.get_json(silent=True) or {}
+        try:
+            year = int(req.get('year', datetime.now().year))
+            month = int(req.get('month', datetime.now().month))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid year or month'}), 400
+        if not 1 <= month <= 12:
+            return jsonify({'success': False, 'error': 'Invalid year or month'}), 400
+        
+        # ワーカースレッドへ渡すため辞書形式に変換（登録時点のデータで作成する）
+        user_data = get_attendance_manager().get_user_month_records(current_user, year, month).to_dict()
+        job = export_job_queue.submit(current_user, year, month, user_data, display_name)
+        print(f"DEBUG: Excel出力ジョブ - {job.job_id} 状態={job.status}")
+        return jsonify({'success': True, 'job': export_job_response(job)}), 202
+        
+    except Exception as e:
+        print(f"ERROR: Excel出力ジョブ登録エラー - {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/export_jobs/<job_id>', methods=['GET'])
+@login_required_decorator
+def api_export_job_status(job_id):
+    """Excel出力ジョブの状態取得API"""
+    job = export_job_queue.get(job_id, get_auth_manager().get_current_user())
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': export_job_response(job)})
+
+@app.route('/api/export_jobs/<job_id>/download', methods=['GET'])
+@login_required_decorator
+def api_export_job_download(job_id):
+    """Excel出力ジョブで作成したファイルのダウンロード"""
+    job = export_job_queue.get(job_id, get_auth_manager().get_current_user())
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job.status != JOB_DONE:
+        return jsonify({'success': False, 'job': export_job_response(job)}), 409
+    
+    response = send_file(
+        BytesIO(job.content),
+        as_attachment=True,
+        download_name=job.filename,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        etag=job.key
+    )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/healthz', methods=['GET'])
+@rpc_budget(reads=0, writes=0)
+def healthz():
+    """ヘルスチェック（ロードバランサー・監視用。認証不要で、ストレージへの読み込みは行わない）"""
+    return jsonify({
+        'status': 'ok',
+        'storage_available': firestore_manager.is_available(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/metrics', methods=['GET'])
+@rpc_budget(reads=0, writes=0)
+def metrics():
+    """Prometheus 形式のメトリクス（METRICS_TOKEN 設定時は Authorization: Bearer が必要）"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/debug/firestore', methods=['GET'])
+@app.route('/debug/firestore', methods=['GET'])
+@login_required_decorator
 def api_debug_firestore():
-    """Firestore状態をデバッグ用に表示（認証不要）"""
+    """Firestore状態をデバッグ用に表示（管理者用）
+    
+    ドキュメント数は count() 集計クエリで取得し、結果を DIAGNOSTICS_CACHE_TTL 秒保持する。
+    """
+    # 管理者権限チェック（簡単な実装）
+    current_user = get_auth_manager().get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
     try:
         debug_info = {
             'timestamp': datetime.now().isoformat(),
@@ -960,52 +1092,22 @@ def api_debug_firestore():
             'has_credentials': 'GOOGLE_APPLICATION_CREDENTIALS_BASE64' in os.environ,
             'environment': 'vercel' if 'VERCEL' in os.environ else 'local',
             'python_version': sys.version.split()[0],
+            'attendance_read_cache': get_attendance_manager().read_cache.stats(),
+            'report_cache': report_cache.stats(),
+            'export_jobs': export_job_queue.stats(),
+            'monthly_summaries': get_attendance_manager().monthly_summaries.stats(),
+            'auth_cache_size': len(firestore_auth_manager.users_cache),
         }
         
-        if firestore_manager.is_available():
-            try:
-                # ユーザー数を取得
-                users_docs = firestore_manager.get_collection('users')
-                user_count = len(users_docs) if users_docs else 0
-                
-                # ユーザー一覧を取得
-                user_list = []
-                if users_docs:
-                    for doc in users_docs:
-                        user_list.append({
-                            'username': doc.get('username', 'unknown'),
-                            'display_name': doc.get('display_name', 'unknown'),
-                            'created_at': doc.get('created_at', 'unknown')
-                        })
-                
-                # セッション数を取得
-                sessions_docs = firestore_manager.get_collection('user_sessions')
-                session_count = len(sessions_docs) if sessions_docs else 0
-                
-                # 勤怠データ数を取得
-                attendance_docs = firestore_manager.get_collection('user_attendance')
-                attendance_count = len(attendance_docs) if attendance_docs else 0
-                
-                # 認証管理の情報を取得
-                try:
-                    from auth_firestore import firestore_auth_manager
-                    auth_cache_size = len(firestore_auth_manager.users_cache)
-                    auth_cache_users = list(firestore_auth_manager.users_cache.keys())
-                except Exception as auth_e:
-                    auth_cache_size = 'Error'
-                    auth_cache_users = f'Error: {str(auth_e)}'
-                
-                debug_info.update({
-                    'user_count': user_count,
-                    'user_list': user_list,
-                    'session_count': session_count,
-                    'attendance_count': attendance_count,
-                    'auth_cache_size': auth_cache_size,
-                    'auth_cache_users': auth_cache_users
-                })
-                
-            except Exception as e:
-                debug_info['firestore_error'] = str(e)
+        diagnostics = storage_diagnostics.snapshot(firestore_manager)
+        counts = diagnostics['counts']
+        debug_info.update({
+            'user_count': counts.get('users'),
+            'session_count': counts.get('user_sessions'),
+            'attendance_count': counts.get('user_attendance'),
+            'counts_collected_at': diagnostics['collected_at'],
+            'counts_age_seconds': diagnostics['age_seconds'],
+        })
         
         return jsonify(debug_info)
         
@@ -1015,52 +1117,18 @@ def api_debug_firestore():
             'timestamp': datetime.now().isoformat()
         }), 500
 
-@app.route('/debug/firestore', methods=['GET'])
-def debug_firestore():
-    """Firestore状態をデバッグ用に表示"""
-    if not firestore_manager.is_available():
-        return jsonify({"error": "Firestore is disabled"}), 400
+@app.route('/api/debug/startup', methods=['GET'])
+@login_required_decorator
+def debug_startup():
+    """起動時間レポート（モジュールごとの import 時間・最初のリクエストまでの時間、管理者用）"""
+    # 管理者権限チェック（簡単な実装）
+    current_user = get_auth_manager().get_current_user()
+    if current_user != 'admin':  # 実際の管理者ユーザー名に変更
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
     
-    try:
-        # ユーザー数を取得
-        users_docs = firestore_manager.get_collection('users')
-        user_count = len(users_docs) if users_docs else 0
-        
-        # ユーザー一覧を取得
-        user_list = []
-        if users_docs:
-            for doc in users_docs:
-                user_list.append({
-                    'username': doc.get('username', 'unknown'),
-                    'display_name': doc.get('display_name', 'unknown'),
-                    'created_at': doc.get('created_at', 'unknown')
-                })
-        
-        # セッション数を取得
-        sessions_docs = firestore_manager.get_collection('user_sessions')
-        session_count = len(sessions_docs) if sessions_docs else 0
-        
-        # 勤怠データ数を取得
-        attendance_docs = firestore_manager.get_collection('user_attendance')
-        attendance_count = len(attendance_docs) if attendance_docs else 0
-        
-        debug_info = {
-            'firestore_available': firestore_manager.is_available(),
-            'use_firestore': True, # Firestore専用なので常にTrue
-            'firebase_project_id': os.environ.get('FIREBASE_PROJECT_ID', 'Not set'),
-            'has_credentials': 'GOOGLE_APPLICATION_CREDENTIALS_BASE64' in os.environ,
-            'user_count': user_count,
-            'user_list': user_list,
-            'session_count': session_count,
-            'attendance_count': attendance_count,
-            'auth_cache_size': len(firestore_auth_manager.users_cache),
-            'auth_cache_users': list(firestore_auth_manager.users_cache.keys())
-        }
-        
-        return jsonify(debug_info)
-        
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return jsonify(startup_report.to_dict())
+
+startup_report.mark_app_ready()
 
 if __name__ == '__main__':
     print(f"DEBUG: Firestore利用可能 = {firestore_manager.is_available()}")
@@ -0,0 +1,125 @@
+import asyncio
+import contextlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Generator
+
+from async_storage import AsyncStorageBackend, create_async_backend
+from compact_records import MonthRecords
+
+logger = logging.getLogger(__name__)
+
+class AsyncAttendanceManager:
+    """勤怠データの読み書きの非同期版（async ビュー用）
+    
+    メモリキャッシュ・読み込みキャッシュ・ジャーナル・月別集計は同期版の FirestoreAttendanceManager と
+    共有し、RPC だけを AsyncStorageBackend で await する。複数月の読み込みのように
+    互いに依存しない RPC は同時に実行する。
+    """
+    
+    def __init__(self, manager=None):
+        if manager is None:
+            from attendance_firestore import firestore_attendance_manager as manager
+        self.manager = manager
+        self._storage: Optional[AsyncStorageBackend] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def storage(self) -> AsyncStorageBackend:
+        """同期版のマネージャーが使っているバックエンドの非同期版（バックエンドの差し替え時は作り直す）"""
+        with self._lock:
+            if self._storage is None or self._storage.backend is not self.manager.firestore:
+                if self._storage is not None:
+                    self._storage.shutdown()
+                self._storage = create_async_backend(self.manager.firestore)
+            return self._storage
+    
+    async def _run_steps(self, steps: Generator[Tuple[str, tuple], Any, Any]) -> Any:
+        """同期版と共通の読み込みの手順を実行（手順が yield した RPC だけを await する）"""
+        try:
+            method, args = next(steps)
+            while True:
+                method, args = steps.send(await getattr(self.storage, method)(*args))
+        except StopIteration as done:
+            return done.value
+    
+    # --- 読み込み ---
+    
+    async def get_user_monthly_data(self, username: str, year: int, month: int) -> Dict[str, Any]:
+        """ユーザーの月別データを取得（同期版の get_user_monthly_data と同じ手順・結果）"""
+        try:
+            return await self._run_steps(self.manager._monthly_data_steps(username, f"{year:04d}-{month:02d}"))
+        except Exception as e:
+            logger.error(f"月別データ取得失敗: {str(e)}")
+            return {}
+    
+    async def get_user_month_records(self, username: str, year: int, month: int) -> MonthRecords:
+        """ユーザーの月別データをコンパクト形式で取得（画面表示・帳票用）"""
+        month_key = f"{year:04d}-{month:02d}"
+        if self.manager._serves_from_cache():
+            return self.manager._cached_month(username, month_key)
+        return MonthRecords.from_dict(month_key, await self.get_user_monthly_data(username, year, month))
+    
+    async def get_user_months_records(self, username: str, months: List[Tuple[int, int]]) -> List[MonthRecords]:
+        """複数月のデータを読み込む（月の順に返す）
+        
+        別々のドキュメントにある月は同時に読み込み、同じドキュメント（従来レイアウト）の月は
+        最初の読み込みの結果を読み込みキャッシュで共有する。
+        """
+        groups: Dict[tuple, List[Tuple[int, int]]] = {}
+        for year, month in months:
+            location = self.manager._document_location(username, f"{year:04d}-{month:02d}")
+            groups.setdefault(location, []).append((year, month))
+        
+        async def load(group: List[Tuple[int, int]]) -> List[MonthRecords]:
+            return [await self.get_user_month_records(username, year, month) for year, month in group]
+        
+        loaded: Dict[Tuple[int, int], MonthRecords] = {}
+        for group, records in zip(groups.values(), await asyncio.gather(*(load(group) for group in groups.values()))):
+            loaded.update(zip(group, records))
+        return [loaded[key] for key in months]
+    
+    async def get_user_daily_data(self, username: str, date_str: str) -> Dict[str, Any]:
+        """ユーザーの指定日のデータを取得（その日を含む月だけを読み込む）"""
+        try:
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return self.manager.get_user_attendance_data(username).get(date_str, {})
+        
+        monthly_data = await self.get_user_monthly_data(username, date_obj.year, date_obj.month)
+        return monthly_data.get(date_str, {})
+    
+    # --- 書き込み ---
+    
+    async def update_user_attendance_record(self, username: str, date_str: str, field: str, value: Any) -> Optional[Dict[str, Any]]:
+        """ユーザーの勤怠データを更新し、更新後のその日の記録を返す（同期版と同じ手順・戻り値）
+        
+        同じユーザーの書き込みは同期版と共通のロックで直列化する（差分の基準とする変更前の記録をずらさない）。
+        """
+        async with self._user_write_lock(username):
+            try:
+                return await self._run_steps(self.manager._record_update_steps(username, date_str, field, value))
+            except Exception as e:
+                logger.error(f"勤怠データ更新失敗: {str(e)}")
+                return None
+    
+    @contextlib.asynccontextmanager
+    async def _user_write_lock(self, username: str):
+        """同期版と共有するユーザーの書き込みロック（空くのを待つ間もイベントループを止めない）"""
+        lock = self.manager._user_write_lock(username)
+        if not lock.acquire(blocking=False):
+            acquired = asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                # 待機中に取り消された場合も、取得できた時点で解放する
+                acquired.add_done_callback(lambda _: lock.release())
+                raise
+        try:
+            yield
+        finally:
+            lock.release()
+
+# グローバルインスタンス
+async_attendance_manager = AsyncAttendanceManager()
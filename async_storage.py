@@ -0,0 +1,240 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+from rpc_ledger import READ, WRITE, mark_rpc_failed, recorded_rpc
+from storage_backend import StorageBackend, expand_field_paths, write_version
+
+logger = logging.getLogger(__name__)
+
+def async_client_enabled() -> bool:
+    """Firestore の RPC を AsyncClient で行うか（FIRESTORE_ASYNC_CLIENT=false で同期クライアントをスレッドで実行）"""
+    return os.environ.get('FIRESTORE_ASYNC_CLIENT', 'true').lower() in ('1', 'true', 'yes')
+
+class AsyncStorageBackend(ABC):
+    """async ビューから使うストレージ操作（勤怠の読み書きに使う分のみ）
+    
+    引数・戻り値・失敗時の値は同期版（StorageBackend）と同じで、どのイベントループからでも await できる。
+    """
+    
+    def __init__(self, backend: StorageBackend):
+        # 対応する同期版のバックエンド（利用可否の判定・設定の引き継ぎに使う）
+        self.backend = backend
+    
+    def is_available(self) -> bool:
+        return self.backend.is_available()
+    
+    @abstractmethod
+    async def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        ...
+    
+    @abstractmethod
+    async def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        ...
+    
+    @abstractmethod
+    async def create_document(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[str]:
+        ...
+    
+    @abstractmethod
+    async def update_fields(self, collection: str, document_id: str, data: Dict[str, Any],
+                            create_if_missing: bool = False) -> Optional[str]:
+        ...
+    
+    @abstractmethod
+    async def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        ...
+    
+    async def query_attendance_days(self, collection: str, username: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        """日単位の索引による範囲取得（非対応のバックエンドは None）"""
+        return None
+    
+    def shutdown(self):
+        """バックグラウンドのスレッド・チャネルを終了"""
+
+class ThreadedAsyncBackend(AsyncStorageBackend):
+    """同期版のバックエンドの呼び出しをスレッドプールで実行（SQLite・FakeFirestoreManager 用）"""
+    
+    async def _run(self, method: Callable, *args) -> Any:
+        # 呼び出し元のコンテキスト（リクエストの RPC 台帳）のままスレッドで実行する
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, method, *args))
+    
+    async def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        return await self._run(self.backend.get_document, collection_name, document_id)
+    
+    async def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        return await self._run(self.backend.get_document_fields, collection_name, document_id, field_names)
+    
+    async def create_document(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[str]:
+        return await self._run(self.backend.create_document, collection, document_id, data)
+    
+    async def update_fields(self, collection: str, document_id: str, data: Dict[str, Any],
+                            create_if_missing: bool = False) -> Optional[str]:
+        return await self._run(self.backend.update_fields, collection, document_id, data, create_if_missing)
+    
+    async def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        return await self._run(self.backend.batch_write, writes)
+    
+    async def query_attendance_days(self, collection: str, username: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self.backend.query_attendance_days, collection, username, start_date, end_date)
+
+class AsyncFirestoreManager(AsyncStorageBackend):
+    """firestore.AsyncClient による Firestore の非同期操作
+    
+    AsyncClient（gRPC の非同期チャネル）は作成したイベントループでしか使えないため、専用スレッドで
+    動かすイベントループ1つで全ての RPC を実行し、呼び出し元のループからはその結果を待つ。
+    リクエストごとにループが作られる Flask の async ビューからでもチャネルを共有できる。
+    認証情報・プロジェクトは同期版の FirestoreManager（最初の使用時に初期化）から引き継ぐ。
+    """
+    
+    def __init__(self, backend: StorageBackend):
+        super().__init__(backend)
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+    
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        # 最初の RPC でスレッドを起動する（import 時にスレッドを作らない）
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='firestore-async', daemon=True).start()
+                self._loop = loop
+            return self._loop
+    
+    def _get_client(self):
+        """AsyncClient（RPC 用のループ内で最初に呼ばれた時に作成）"""
+        if self._client is None:
+            from google.cloud import firestore
+            backend = self.backend
+            self._client = firestore.AsyncClient(project=backend.project_id, credentials=backend.credentials)
+        return self._client
+    
+    async def _call(self, operation: Callable, *args) -> Any:
+        """RPC 用のループでコルーチンを実行して結果を待つ"""
+        future = asyncio.run_coroutine_threadsafe(operation(*args), self._get_loop())
+        return await asyncio.wrap_future(future)
+    
+    @staticmethod
+    def _server_values(data: Dict[str, Any]) -> Dict[str, Any]:
+        from firestore_config import FirestoreManager
+        return FirestoreManager._server_values(data)
+    
+    @recorded_rpc(READ)
+    async def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        if not self.is_available():
+            logger.warning(f"Firestore利用不可: {collection_name}/{document_id}")
+            return None
+        try:
+            return await self._call(self._get, collection_name, document_id, None)
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    @recorded_rpc(READ)
+    async def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        if not self.is_available():
+            logger.warning(f"Firestore利用不可: {collection_name}/{document_id}")
+            return None
+        try:
+            return await self._call(self._get, collection_name, document_id, field_names)
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"フィールド取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    async def _get(self, collection_name: str, document_id: str, field_names: Optional[List[str]]) -> Optional[Dict]:
+        doc = await self._get_client().collection(collection_name).document(document_id).get(field_paths=field_names)
+        return doc.to_dict() if doc.exists else None
+    
+    @recorded_rpc(WRITE)
+    async def create_document(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[str]:
+        if not self.is_available():
+            logger.warning("Firestoreが利用できません")
+            return None
+        try:
+            await self._call(self._set, collection, document_id, data)
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return document_id
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    async def _set(self, collection: str, document_id: str, data: Dict[str, Any]):
+        await self._get_client().collection(collection).document(document_id).set(data)
+    
+    @recorded_rpc(WRITE)
+    async def update_fields(self, collection: str, document_id: str, data: Dict[str, Any],
+                            create_if_missing: bool = False) -> Optional[str]:
+        if not self.is_available():
+            logger.warning("Firestoreが利用できません")
+            return None
+        try:
+            version = await self._call(self._update, collection, document_id, data, create_if_missing)
+            logger.info(f"ドキュメント更新: {collection}/{document_id}")
+            return version
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント更新失敗: {str(e)}")
+            return None
+    
+    async def _update(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool) -> str:
+        from google.api_core import exceptions as google_exceptions
+        doc_ref = self._get_client().collection(collection).document(document_id)
+        try:
+            write_result = await doc_ref.update(self._server_values(data))
+        except google_exceptions.NotFound:
+            if not create_if_missing:
+                raise
+            try:
+                write_result = await doc_ref.create(expand_field_paths(data))
+            except google_exceptions.AlreadyExists:
+                # 他のワーカーが直前に作成した場合は部分更新をやり直す
+                write_result = await doc_ref.update(self._server_values(data))
+        return write_version(write_result.update_time)
+    
+    @recorded_rpc(WRITE)
+    async def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        if not self.is_available():
+            logger.warning("Firestoreが利用できません")
+            return None
+        if not writes:
+            return write_version(None)
+        try:
+            version = await self._call(self._commit, writes)
+            logger.info(f"バッチ書き込み: {len(writes)}ドキュメント")
+            return version
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"バッチ書き込み失敗: {str(e)}")
+            return None
+    
+    async def _commit(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> str:
+        client = self._get_client()
+        batch = client.batch()
+        for collection, document_id, data in writes:
+            batch.set(client.collection(collection).document(document_id), self._server_values(data), merge=True)
+        write_results = await batch.commit()
+        return write_version(write_results[0].update_time if write_results else None)
+    
+    def shutdown(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+            self._client = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+def create_async_backend(backend: StorageBackend) -> AsyncStorageBackend:
+    """同期版のバックエンドに対応する非同期版を作成（Firestore は AsyncClient、それ以外はスレッドで実行）"""
+    from firestore_config import FirestoreManager
+    if isinstance(backend, FirestoreManager) and async_client_enabled():
+        return AsyncFirestoreManager(backend)
+    return ThreadedAsyncBackend(backend)
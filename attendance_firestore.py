@@ -1,34 +1,275 @@
 import json
 import logging
-from typing import Dict, Any, Optional, List
-from datetime import datetime, date
+from typing import Dict, Any, Optional, List, Tuple, Callable, NamedTuple, Generator
+from datetime import datetime, date, timedelta
 import os
+import threading
+
+from firestore_config import field_path, write_version, snapshot_listeners_enabled
+from compact_records import UserRecords, MonthRecords, month_keys
+from local_journal import AttendanceJournal
+from read_cache import VersionedReadCache
+from rpc_ledger import estimate_size
+from monthly_summary import MonthlySummaryStore
 
 logger = logging.getLogger(__name__)
 
+# 保存レイアウト
+# legacy : user_attendance/{username} に全履歴を1ドキュメントで保持
+# monthly: user_attendance/{username}/months/{YYYY-MM} に月単位で分割して保持
+LAYOUT_LEGACY = 'legacy'
+LAYOUT_MONTHLY = 'monthly'
+
+class WritePlan(NamedTuple):
+    """勤怠データの変更を1回のコミットで保存する書き込み（同期版・非同期版で共通）
+    
+    field_update がある場合は1フィールドのドット区切りパスの部分更新、無い場合は
+    writes（保存先ドキュメントごとのマージ書き込みと月別集計の書き込み）を1回のバッチで実行する。
+    """
+    field_update: Optional[Tuple[str, str, Dict[str, Any]]]
+    writes: List[Tuple[str, str, Dict[str, Any]]]
+    summary_writes: List[Tuple[str, str, Dict[str, Any]]]
+
 class FirestoreAttendanceManager:
     """Firestore ベースの勤怠データ管理クラス"""
     
-    def __init__(self):
-        # Firestoreマネージャーをインポート
-        from firestore_config import firestore_manager
+    def __init__(self, firestore_manager=None):
+        # Firestoreマネージャー（未指定の場合は共有インスタンスを使用）
+        if firestore_manager is None:
+            from firestore_config import firestore_manager
         self.firestore = firestore_manager
         
         # コレクション名
         self.attendance_collection = 'attendance_data'
         self.user_attendance_collection = 'user_attendance'
+        self.months_subcollection = 'months'
+        
+        # 保存レイアウト（移行完了後に monthly へ切り替える）
+        self.storage_layout = os.environ.get('ATTENDANCE_STORAGE_LAYOUT', LAYOUT_LEGACY)
         
         # ローカルストレージのファイルパス（フォールバック用）
         self.local_file_path = 'attendance_data.json'
         
-        # メモリキャッシュ
+        # ローカル保存は変更の追記のみ（スナップショットへの圧縮はバックグラウンド）
+        self.journal = AttendanceJournal(self.local_file_path)
+        
+        # メモリキャッシュ（ユーザー名 -> UserRecords。日付ごとの記録を列形式で保持）
+        # 起動時には読み込まず、ユーザーごとに必要になった時点で読み込む
+        self.attendance_cache: Dict[str, UserRecords] = {}
+        self._cache_loaded = False
+        self._cache_load_lock = threading.Lock()
+        
+        # ユーザーごとの書き込みロック（月別集計の差分の基準となる変更前の記録を書き込み間で一致させる）
+        self._write_locks: Dict[str, threading.Lock] = {}
+        self._write_locks_lock = threading.Lock()
+        
+        # Firestoreからの読み込み結果のキャッシュ（TTL内は再読み込みしない）
+        self.read_cache = VersionedReadCache()
+        
+        # ユーザー × 月の集計ドキュメント（書き込み時に変更された日の差分を加算する）
+        self.monthly_summaries = MonthlySummaryStore(self.firestore)
+        
+        # スナップショットリスナー（有効時は他のワーカーの書き込みもキャッシュへ反映される）
+        self._snapshot_watch = None
+        self._snapshot_ready = threading.Event()
+        
+        # 起動時の先読み（最近ログインしたユーザーの当月分。既定では無効）
+        self.warmup_days = int(os.environ.get('ATTENDANCE_WARMUP_DAYS', '0'))
+        self.warmup_max_users = int(os.environ.get('ATTENDANCE_WARMUP_MAX_USERS', '50'))
+        self._warmup_thread = None
+        
+        # 勤怠データの変更通知先（ユーザー名, 変更された月キーのリスト。None は全ての月）
+        self._change_listeners: List[Callable[[str, Optional[List[str]]], None]] = []
+        
+        if snapshot_listeners_enabled():
+            self.start_snapshot_listener()
+        elif self.warmup_days > 0:
+            self.start_background_warmup()
+    
+    def set_storage_backend(self, firestore_manager):
+        """ストレージバックエンドを差し替えてキャッシュを再読み込み（テスト・ベンチマーク用）"""
+        listening = self._snapshot_watch is not None
+        self.stop_snapshot_listener()
+        self.firestore = firestore_manager
         self.attendance_cache = {}
+        self._cache_loaded = False
+        self.read_cache.clear()
+        self.monthly_summaries.storage = firestore_manager
+        if listening:
+            self.start_snapshot_listener()
+    
+    def start_snapshot_listener(self) -> bool:
+        """user_attendance（monthly では months サブコレクション）の変更購読を開始"""
+        if self._snapshot_watch is not None or not self.firestore.is_available():
+            return self._snapshot_watch is not None
+        
+        collection = self.months_subcollection if self.is_monthly_layout() else self.user_attendance_collection
+        self._snapshot_ready.clear()
+        self._snapshot_watch = self.firestore.watch_collection(collection, self._on_attendance_snapshot,
+                                                              group=self.is_monthly_layout())
+        return self._snapshot_watch is not None
+    
+    def stop_snapshot_listener(self):
+        """変更購読を終了"""
+        if self._snapshot_watch is not None:
+            self._snapshot_watch.unsubscribe()
+            self._snapshot_watch = None
+            self._snapshot_ready.clear()
+    
+    def add_change_listener(self, callback: Callable[[str, Optional[List[str]]], None]):
+        """勤怠データの変更通知を登録（作成済みレポートの破棄など）"""
+        self._change_listeners.append(callback)
+    
+    def _notify_changed(self, username: str, month_keys: Optional[List[str]] = None):
+        """変更されたユーザー・月を通知先へ伝える（通知先の失敗は書き込みに影響させない）"""
+        for callback in self._change_listeners:
+            try:
+                callback(username, month_keys)
+            except Exception as e:
+                logger.error(f"変更通知失敗: {username} - {e}")
+    
+    def is_snapshot_listener_live(self) -> bool:
+        """購読中かつ初回スナップショットを受信済み（キャッシュのみで読み込みに応答できる）か"""
+        return self._snapshot_watch is not None and self._snapshot_ready.is_set()
+    
+    def _on_attendance_snapshot(self, changes: List[Tuple[str, str, Optional[Dict[str, Any]]]]):
+        """変更されたドキュメントをキャッシュへ反映（リスナーのスレッドで呼ばれる）"""
+        for kind, path, data in changes:
+            parts = path.split('/')
+            if parts[0] != self.user_attendance_collection:
+                continue
+            
+            username = parts[1]
+            attendance_data = (data or {}).get('attendance_data', {})
+            if len(parts) == 2:
+                # user_attendance/{username}
+                if kind == 'REMOVED':
+                    self.attendance_cache.pop(username, None)
+                    self.read_cache.invalidate(path)
+                else:
+                    self._cache_user(username, attendance_data)
+                    self.read_cache.put(path, attendance_data, data.get('last_updated'))
+                self._notify_changed(username)
+            elif len(parts) == 4 and parts[2] == self.months_subcollection:
+                # user_attendance/{username}/months/{YYYY-MM}
+                self._replace_cached_month(username, parts[3], attendance_data)
+                self.read_cache.invalidate(self._months_collection(username))
+                if kind == 'REMOVED':
+                    self.read_cache.invalidate(path)
+                else:
+                    self.read_cache.put(path, attendance_data, data.get('last_updated'))
+                self._notify_changed(username, [parts[3]])
         
-        # 初期化時にデータをロード
-        self.load_attendance_cache()
+        self._snapshot_ready.set()
+        logger.debug(f"スナップショット反映: {len(changes)}件")
+    
+    def is_monthly_layout(self) -> bool:
+        """月別分割レイアウトを使用しているかチェック"""
+        return self.storage_layout == LAYOUT_MONTHLY
+    
+    def _months_collection(self, username: str) -> str:
+        """ユーザーの月別ドキュメントを格納するサブコレクションのパス"""
+        return f"{self.user_attendance_collection}/{username}/{self.months_subcollection}"
+    
+    @staticmethod
+    def _month_key(date_str: str) -> Optional[str]:
+        """日付文字列から月キー（YYYY-MM）を取得"""
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m')
+        except (TypeError, ValueError):
+            return None
+    
+    def _group_by_month(self, attendance_data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """日付キーの勤怠データを月キーごとに分割"""
+        months = {}
+        for date_str, daily_data in attendance_data.items():
+            month_key = self._month_key(date_str)
+            if month_key is None:
+                logger.warning(f"不正な日付形式: {date_str}")
+                continue
+            months.setdefault(month_key, {})[date_str] = daily_data
+        return months
+    
+    def _replace_cached_month(self, username: str, month_key: str, month_data: Dict[str, Any]):
+        """キャッシュ内の指定月のデータを置き換え
+        
+        リスナーのスレッドからも呼ばれるため、月の MonthRecords を作り直してから差し替える
+        （読み込み中の記録を変更しない）。
+        """
+        self._user_records(username).replace_month(month_key, month_data)
+    
+    def _user_records(self, username: str) -> UserRecords:
+        """キャッシュ内のユーザーの記録（無い場合は空で作成）"""
+        if not self.firestore.is_available():
+            # オフライン時はローカルファイルの内容に変更を重ねる
+            self._ensure_cache_loaded()
+        records = self.attendance_cache.get(username)
+        if records is None:
+            records = self.attendance_cache.setdefault(username, UserRecords())
+        return records
+    
+    def _cache_user(self, username: str, attendance_data: Dict[str, Any]) -> UserRecords:
+        """辞書形式の勤怠データをコンパクト形式に変換してキャッシュに設定"""
+        records = UserRecords.from_dict(attendance_data)
+        self.attendance_cache[username] = records
+        return records
+    
+    def _cached_user_data(self, username: str) -> Dict[str, Any]:
+        """キャッシュ内のユーザーの勤怠データを辞書形式で取得"""
+        if not self.firestore.is_available():
+            self._ensure_cache_loaded()
+        records = self.attendance_cache.get(username)
+        return records.to_dict() if records is not None else {}
+    
+    def _cache_as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """キャッシュ全体を辞書形式に変換（保存・バックアップ用）"""
+        return {username: records.to_dict() for username, records in self.attendance_cache.items()}
+    
+    def _ensure_cache_loaded(self):
+        """全ユーザー分のデータが必要な処理（保存・バックアップ・オフライン時の読み込み）の前に一度だけ読み込む"""
+        if self._cache_loaded:
+            return
+        with self._cache_load_lock:
+            if not self._cache_loaded:
+                self.load_attendance_cache()
+    
+    def start_background_warmup(self) -> Optional[threading.Thread]:
+        """最近ログインしたユーザーの当月データをバックグラウンドで先読み"""
+        if self._warmup_thread is not None and self._warmup_thread.is_alive():
+            return self._warmup_thread
+        self._warmup_thread = threading.Thread(target=self.warm_up_recent_users, name='attendance-cache-warmup', daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+    
+    def warm_up_recent_users(self, days: Optional[int] = None, max_users: Optional[int] = None) -> List[str]:
+        """直近 days 日にログインしたユーザー（user_sessions）の当月データを読み込む"""
+        days = days if days is not None else self.warmup_days
+        max_users = max_users if max_users is not None else self.warmup_max_users
+        warmed = []
+        try:
+            if not self.firestore.is_available():
+                return warmed
+            
+            cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+            sessions = self.firestore.query_documents('user_sessions', 'created_at', '>=', cutoff)
+            today = date.today()
+            for session_doc in sessions:
+                username = session_doc.get('username')
+                if not username or username in warmed:
+                    continue
+                self.get_user_monthly_data(username, today.year, today.month)
+                warmed.append(username)
+                if len(warmed) >= max_users:
+                    break
+            
+            logger.info(f"勤怠データ先読み完了: {len(warmed)}ユーザー")
+        except Exception as e:
+            logger.error(f"勤怠データ先読み失敗: {str(e)}")
+        return warmed
     
     def load_attendance_cache(self):
-        """勤怠データをキャッシュに読み込み"""
+        """全ユーザーの勤怠データをキャッシュに読み込み"""
+        self._cache_loaded = True
         try:
             if self.firestore.is_available():
                 # Firestoreから読み込み
@@ -44,6 +285,10 @@ class FirestoreAttendanceManager:
     def _load_from_firestore(self):
         """Firestoreから勤怠データを読み込み"""
         try:
+            if self.is_monthly_layout():
+                self._load_months_from_firestore()
+                return
+            
             # ユーザー別勤怠データを取得
             user_attendance_docs = self.firestore.get_collection(self.user_attendance_collection)
             
@@ -54,7 +299,7 @@ class FirestoreAttendanceManager:
                 attendance_data = doc.get('attendance_data', {})
                 
                 if username:
-                    self.attendance_cache[username] = attendance_data
+                    self._cache_user(username, attendance_data)
             
             logger.info(f"Firestoreから勤怠データロード完了: {len(self.attendance_cache)}ユーザー")
             
@@ -63,17 +308,29 @@ class FirestoreAttendanceManager:
             # フォールバックとしてローカルファイルから読み込み
             self._load_from_local_file()
     
+    def _load_months_from_firestore(self):
+        """月別ドキュメントを横断して勤怠データを読み込み"""
+        month_docs = self.firestore.get_collection_group(self.months_subcollection)
+        
+        users_data: Dict[str, Dict[str, Any]] = {}
+        
+        for doc in month_docs:
+            username = doc.get('username')
+            attendance_data = doc.get('attendance_data', {})
+            
+            if username:
+                users_data.setdefault(username, {}).update(attendance_data)
+        
+        self.attendance_cache = {username: UserRecords.from_dict(data) for username, data in users_data.items()}
+        
+        logger.info(f"Firestoreから月別勤怠データロード完了: {len(self.attendance_cache)}ユーザー / {len(month_docs)}ヶ月分")
+    
     def _load_from_local_file(self):
         """ローカルファイルから勤怠データを読み込み"""
         try:
-            if os.path.exists(self.local_file_path):
-                with open(self.local_file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.attendance_cache = data
-                logger.info(f"ローカルファイルから勤怠データロード完了: {len(self.attendance_cache)}ユーザー")
-            else:
-                self.attendance_cache = {}
-                logger.info("ローカルファイルが存在しません。空のキャッシュで開始")
+            # スナップショットを読み込み、その後の変更をジャーナルから再生
+            self.attendance_cache = {username: UserRecords.from_dict(data) for username, data in self.journal.load().items()}
+            logger.info(f"ローカルファイルから勤怠データロード完了: {len(self.attendance_cache)}ユーザー")
                 
         except Exception as e:
             logger.error(f"ローカルファイル読み込み失敗: {str(e)}")
@@ -84,6 +341,7 @@ class FirestoreAttendanceManager:
         success = False
         
         try:
+            self._ensure_cache_loaded()
             if self.firestore.is_available():
                 success = self._save_to_firestore()
             
@@ -99,12 +357,15 @@ class FirestoreAttendanceManager:
     def _save_to_firestore(self) -> bool:
         """Firestoreに勤怠データを保存"""
         try:
+            if self.is_monthly_layout():
+                return self._save_months_to_firestore()
+            
             success_count = 0
             
             for username, attendance_data in self.attendance_cache.items():
                 user_doc_data = {
                     'username': username,
-                    'attendance_data': attendance_data,
+                    'attendance_data': attendance_data.to_dict(),
                     'last_updated': datetime.now().isoformat()
                 }
                 
@@ -134,153 +395,450 @@ class FirestoreAttendanceManager:
             logger.error(f"Firestore保存失敗: {str(e)}")
             return False
     
-    def _save_to_local_file(self):
-        """ローカルファイルに勤怠データを保存"""
-        try:
-            with open(self.local_file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.attendance_cache, f, ensure_ascii=False, indent=2)
-            logger.info("ローカルファイル保存成功")
+    def _save_months_to_firestore(self) -> bool:
+        """全ユーザーの勤怠データを月別ドキュメントとして保存"""
+        success_count = 0
+        
+        for username, attendance_data in self.attendance_cache.items():
+            months = self._group_by_month(attendance_data.to_dict())
+            saved_months = 0
             
-        except Exception as e:
-            logger.error(f"ローカルファイル保存失敗: {str(e)}")
+            for month_key, month_data in months.items():
+                if self._save_month_document(username, month_key, month_data):
+                    saved_months += 1
+            
+            if saved_months == len(months):
+                success_count += 1
+        
+        logger.info(f"Firestore月別保存成功: {success_count}/{len(self.attendance_cache)}ユーザー")
+        return success_count > 0
+    
+    def _save_month_document(self, username: str, month_key: str, month_data: Dict[str, Any]) -> bool:
+        """1ヶ月分の勤怠データを月別ドキュメントに保存"""
+        month_doc_data = {
+            'username': username,
+            'month': month_key,
+            'attendance_data': month_data,
+            'last_updated': datetime.now().isoformat()
+        }
+        
+        result = self.firestore.create_document(
+            self._months_collection(username),
+            month_key,
+            month_doc_data
+        )
+        return bool(result)
+    
+    def _migrate_month_document(self, username: str, month_key: str, month_data: Dict[str, Any]) -> bool:
+        """1ヶ月分の旧形式の勤怠データを月別ドキュメントへ移行（既存の日の記録は上書きしない）
+        
+        月別ドキュメントが既にある場合（移行の再実行）は、移行後に月別レイアウトで
+        編集された記録を残すため、まだ無い日のみを追加する。
+        """
+        collection = self._months_collection(username)
+        created = self.firestore.create_document_if_absent(collection, month_key, {
+            'username': username,
+            'month': month_key,
+            'attendance_data': month_data,
+            'last_updated': datetime.now().isoformat()
+        })
+        if created is None:
+            return False
+        if created:
+            return True
+        
+        existing = self.firestore.get_document(collection, month_key)
+        if existing is None:
+            return False
+        existing_days = existing.get('attendance_data') or {}
+        missing_days = {
+            field_path('attendance_data', date_str): day_data
+            for date_str, day_data in month_data.items()
+            if date_str not in existing_days
+        }
+        if not missing_days:
+            return True
+        # 版を更新し、読み込みキャッシュの再検証で追加前の月を使い続けないようにする
+        missing_days['last_updated'] = datetime.now().isoformat()
+        return self.firestore.update_document(collection, month_key, missing_days)
+    
+    def _save_to_local_file(self):
+        """ローカルファイルに勤怠データ全体をスナップショットとして保存"""
+        self.journal.write_snapshot(self._cache_as_dict())
     
     def update_user_attendance_data(self, username: str, date_str: str, field: str, value: str) -> bool:
         """ユーザーの勤怠データを更新"""
-        try:
-            # ユーザーのデータが存在しない場合は初期化
-            if username not in self.attendance_cache:
-                self.attendance_cache[username] = {}
-            
-            # 日付のデータが存在しない場合は初期化
-            if date_str not in self.attendance_cache[username]:
-                self.attendance_cache[username][date_str] = {}
-            
-            # データを更新
-            self.attendance_cache[username][date_str][field] = value
-            
-            # Firestoreに即座に保存
-            success = self._save_single_user_data(username)
-            
-            if success:
-                logger.info(f"勤怠データ更新: {username} - {date_str} - {field} = {value}")
-                # 成功時は最新データでキャッシュを更新
-                self._refresh_user_cache(username)
-            else:
-                logger.error(f"勤怠データ更新失敗: {username} - {date_str} - {field} = {value}")
-                # 失敗時はキャッシュを元に戻す
-                if field in self.attendance_cache[username][date_str]:
-                    del self.attendance_cache[username][date_str][field]
-                    if not self.attendance_cache[username][date_str]:
-                        del self.attendance_cache[username][date_str]
-                    if not self.attendance_cache[username]:
-                        del self.attendance_cache[username]
-            
-            return success
-            
-        except Exception as e:
-            logger.error(f"勤怠データ更新失敗: {str(e)}")
-            return False
+        return self.update_user_attendance_record(username, date_str, field, value) is not None
     
-    def _save_single_user_data(self, username: str) -> bool:
-        """単一ユーザーのデータをFirestoreに保存"""
-        try:
-            if not self.firestore.is_available():
-                logger.warning("Firestore利用不可、ローカルファイルのみ保存")
-                self._save_to_local_file()
-                return True
-            
-            attendance_data = self.attendance_cache.get(username, {})
-            
-            user_doc_data = {
-                'username': username,
-                'attendance_data': attendance_data,
-                'last_updated': datetime.now().isoformat()
-            }
-            
-            # ユーザー名をドキュメントIDとして使用
-            result = self.firestore.create_document(
-                self.user_attendance_collection,
-                username,
-                user_doc_data
-            )
-            
-            if not result:
-                # 作成に失敗した場合は更新を試行
-                result = self.firestore.update_document(
-                    self.user_attendance_collection,
-                    username,
-                    user_doc_data
-                )
-            
-            # ローカルファイルにもバックアップ保存
-            self._save_to_local_file()
-            
-            # 結果をboolに変換
-            success = bool(result)
-            
-            if success:
-                logger.debug(f"Firestore保存成功: {username}")
-            else:
-                logger.error(f"Firestore保存失敗: {username}")
-            
-            return success
-            
-        except Exception as e:
-            logger.error(f"単一ユーザーデータ保存失敗: {str(e)}")
-            return False
+    def update_user_attendance_record(self, username: str, date_str: str, field: str, value: Any) -> Optional[Dict[str, Any]]:
+        """ユーザーの勤怠データを更新し、更新後のその日の記録を返す
+        
+        戻り値は {'date', 'data', 'version'}（失敗時は None）。version は書き込み結果の
+        update_time で、書き込み後にドキュメントを読み直すことはしない。月別集計の更新は
+        同じコミットに含める（書き込みは1回、読み込みは無し）。
+        """
+        with self._user_write_lock(username):
+            try:
+                return self._run_steps(self._record_update_steps(username, date_str, field, value))
+            except Exception as e:
+                logger.error(f"勤怠データ更新失敗: {str(e)}")
+                return None
     
-    def _refresh_user_cache(self, username: str):
-        """特定ユーザーのキャッシュを最新データで更新"""
-        try:
-            if not self.firestore.is_available():
-                return
-            
-            user_doc = self.firestore.get_document(self.user_attendance_collection, username)
-            if user_doc:
-                attendance_data = user_doc.get('attendance_data', {})
-                self.attendance_cache[username] = attendance_data
-                logger.debug(f"ユーザーキャッシュ更新: {username}")
+    def _record_update_steps(self, username: str, date_str: str, field: str,
+                             value: Any) -> Generator[Tuple[str, tuple], Any, Optional[Dict[str, Any]]]:
+        """1フィールドを更新する手順（同期版・非同期版で共通。RPC の実行方法は _document_data_steps と同じ）"""
+        # 変更したフィールドのみFirestoreに即座に保存
+        changes = [(date_str, field, value)]
+        last_updated = datetime.now().isoformat()
+        plan = self._plan_write(username, changes, last_updated)
+        if plan is None:
+            return None
+        version = yield from self._commit_steps(plan)
+        
+        if version is None:
+            logger.error(f"勤怠データ更新失敗: {username} - {date_str} - {field} = {value}")
+            return None
+        
+        # 書き込みに成功した値をキャッシュへ反映し、ローカルジャーナルに追記
+        user_records = self._apply_written_changes(username, changes, last_updated, plan)
+        
+        logger.info(f"勤怠データ更新: {username} - {date_str} - {field} = {value}")
+        return {'date': date_str, 'data': user_records[date_str], 'version': version}
+    
+    def bulk_update_user_attendance_data(self, username: str, changes: List[Tuple[str, str, Any]]) -> bool:
+        """複数の (日付, フィールド, 値) をまとめて1回のバッチコミットで保存"""
+        return self.bulk_update_user_attendance_records(username, changes) is not None
+    
+    def bulk_update_user_attendance_records(self, username: str, changes: List[Tuple[str, str, Any]]) -> Optional[Dict[str, Any]]:
+        """複数の (日付, フィールド, 値) をまとめて1回のバッチコミットで保存し、更新後の記録を返す
+        
+        フォーム送信や自動保存のまとめ送信で使用する。変更はドキュメント
+        （legacy ではユーザー、monthly では月）単位にまとめられ、全て成功した場合のみ
+        キャッシュに反映される。戻り値は {'records': {日付: 記録}, 'version'}（失敗時は None）。
+        変更が無い場合は書き込まない（version は None）。
+        """
+        if not changes:
+            return {'records': {}, 'version': None}
+        
+        with self._user_write_lock(username):
+            try:
+                # 保存先ドキュメントごとに変更をまとめ、月別集計の更新と合わせて1回のバッチで保存する
+                now = datetime.now().isoformat()
+                plan = self._plan_write(username, changes, now, batch=True)
+                if plan is None:
+                    return None
+                version = self._run_steps(self._commit_steps(plan))
+                if version is None:
+                    logger.error(f"勤怠データ一括更新失敗: {username} - {len(changes)}件")
+                    return None
+                
+                # 成功後にキャッシュへ反映し、ローカルジャーナルへまとめて追記
+                user_records = self._apply_written_changes(username, changes, now, plan)
+                
+                records = {date_str: user_records[date_str] for date_str, _, _ in changes}
+                logger.info(f"勤怠データ一括更新: {username} - {len(changes)}件 / {len(plan.writes) - len(plan.summary_writes)}ドキュメント")
+                return {'records': records, 'version': version}
+                
+            except Exception as e:
+                logger.error(f"勤怠データ一括更新失敗: {str(e)}")
+                return None
+    
+    def _plan_write(self, username: str, changes: List[Tuple[str, str, Any]], last_updated: str,
+                    batch: bool = False) -> Optional[WritePlan]:
+        """変更を1回のコミットで保存する書き込みを作成（不正な日付で保存先を決められない場合は None）
+        
+        月別集計はリスナーで同期中なら差分の加算、それ以外は要再集計の印を同じコミットに含め、
+        集計ドキュメント・月のデータは読まない。1件の変更で集計の書き込みが無い場合（batch=False）は
+        ドット区切りパスの部分更新にする。RPC を行わないため同期版・非同期版で共通に使う。
+        """
+        writes_by_location: Dict[tuple, Dict[str, Any]] = {}
+        for date_str, field, value in changes:
+            # 月別レイアウトでは保存先の月ドキュメントを日付から決定する
+            month_key = self._month_key(date_str)
+            if self.is_monthly_layout() and month_key is None:
+                logger.error(f"不正な日付形式のため保存できません: {date_str}")
+                return None
             
-        except Exception as e:
-            logger.error(f"ユーザーキャッシュ更新失敗: {str(e)}")
+            location = self._document_location(username, month_key)
+            doc_data = writes_by_location.get(location)
+            if doc_data is None:
+                doc_data = {'username': username, 'attendance_data': {}, 'last_updated': last_updated}
+                if self.is_monthly_layout():
+                    doc_data['month'] = month_key
+                writes_by_location[location] = doc_data
+            doc_data['attendance_data'].setdefault(date_str, {})[field] = value
+        
+        summary_writes = self._summary_writes(username, changes)
+        if not batch and len(changes) == 1 and not summary_writes:
+            date_str, field, value = changes[0]
+            field_update = self._field_update_write(username, date_str, field, value, self._month_key(date_str), last_updated)
+            return WritePlan(field_update, [], [])
+        
+        writes = [(collection, document_id, doc_data) for (collection, document_id), doc_data in writes_by_location.items()]
+        return WritePlan(None, writes + summary_writes, summary_writes)
+    
+    def _commit_steps(self, plan: WritePlan) -> Generator[Tuple[str, tuple], Any, Optional[str]]:
+        """書き込みを1回の RPC で実行する手順（書き込みのバージョンを返す。失敗時は None）"""
+        if not self.firestore.is_available():
+            logger.warning("Firestore利用不可、ローカルファイルのみ保存")
+            return write_version(None)
+        
+        if plan.field_update is not None:
+            collection, document_id, field_updates = plan.field_update
+            version = yield 'update_fields', (collection, document_id, field_updates, True)
+        else:
+            version = yield 'batch_write', (plan.writes,)
+        
+        if version is None:
+            logger.error(f"Firestore書き込み失敗: {len(plan.writes) or 1}ドキュメント")
+        return version
+    
+    def _apply_written_changes(self, username: str, changes: List[Tuple[str, str, Any]], last_updated: str,
+                               plan: Optional[WritePlan] = None) -> UserRecords:
+        """書き込みに成功した変更をキャッシュへ反映し、ローカルジャーナルに追記して変更を通知"""
+        if plan is not None:
+            self.monthly_summaries.record_writes(plan.summary_writes)
+        user_records = self._user_records(username)
+        for date_str, field, value in changes:
+            user_records.set_field(date_str, field, value)
+        self._apply_to_read_cache(username, changes, last_updated)
+        self.journal.append_changes(username, changes)
+        changed_months = {self._month_key(date_str) for date_str, _, _ in changes}
+        self._notify_changed(username, None if None in changed_months else sorted(changed_months))
+        return user_records
+    
+    def _user_write_lock(self, username: str) -> threading.Lock:
+        """ユーザーの書き込みを直列化するロック（同じ日への同時の書き込みで集計の差分がずれないようにする）"""
+        with self._write_locks_lock:
+            lock = self._write_locks.get(username)
+            if lock is None:
+                lock = self._write_locks[username] = threading.Lock()
+            return lock
+    
+    def _summary_baseline(self, username: str, date_strs: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """月別集計の差分計算に使う変更前のその日の記録（最新と確認できない場合は None）
+        
+        リスナーで同期中のメモリキャッシュのみを使い、RPC は発生させない。読み込みキャッシュの値は
+        TTL 内でも他のワーカーの書き込みを反映していない場合があるため使わない（要再集計の印を付ける）。
+        """
+        if not self.monthly_summaries.enabled or not self.firestore.is_available():
+            return None
+        if not self.is_snapshot_listener_live():
+            return None
+        
+        baseline: Dict[str, Dict[str, Any]] = {}
+        for date_str in date_strs:
+            month_key = self._month_key(date_str)
+            if month_key is None:
+                return None
+            if date_str in baseline:
+                continue
+            records = self.attendance_cache.get(username)
+            record = records.get(date_str) if records is not None else None
+            baseline[date_str] = dict(record) if record else {}
+        return baseline
+    
+    def _summary_writes(self, username: str, changes: List[Tuple[str, str, Any]]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """勤怠データと同じコミットに含める月別集計の書き込み（日付の不正な変更は集計に含めない）"""
+        if not self.monthly_summaries.enabled or not self.firestore.is_available():
+            return []
+        changes = [change for change in changes if self._month_key(change[0]) is not None]
+        if not changes:
+            return []
+        baseline = self._summary_baseline(username, [date_str for date_str, _, _ in changes])
+        return self.monthly_summaries.summary_writes(username, baseline, changes)
+    
+    def _rebuild_monthly_summary(self, username: str, month_key: str) -> Optional[Dict[str, Any]]:
+        """月のデータを読み直して月別集計を作り直す（読み込みキャッシュの値は使わない）"""
+        year, month = (int(part) for part in month_key.split('-'))
+        with self._user_write_lock(username):
+            self.read_cache.invalidate('/'.join(self._document_location(username, month_key)))
+            return self.monthly_summaries.rebuild(username, month_key, self.get_user_monthly_data(username, year, month))
+    
+    def get_user_monthly_summary(self, username: str, year: int, month: int) -> Dict[str, Any]:
+        """ユーザーの月別集計を取得（集計ドキュメントが無い・要再集計の場合は月のデータから作成する）"""
+        month_key = f"{year:04d}-{month:02d}"
+        summary = None
+        if self.monthly_summaries.enabled and self.firestore.is_available():
+            summary = self.monthly_summaries.get(username, month_key)
+            if summary is None or summary.get('dirty'):
+                summary = self._rebuild_monthly_summary(username, month_key)
+        if summary is None:
+            summary = self.monthly_summaries.totals_for(username, month_key, self.get_user_monthly_data(username, year, month))
+        return summary
+    
+    def _document_location(self, username: str, month_key: Optional[str]) -> tuple:
+        """ユーザーの勤怠データを保持するドキュメントの (コレクション, ドキュメントID)"""
+        if self.is_monthly_layout() and month_key:
+            return self._months_collection(username), month_key
+        return self.user_attendance_collection, username
+    
+    def _field_update_write(self, username: str, date_str: str, field: str, value: Any, month_key: Optional[str],
+                            last_updated: Optional[str]) -> Tuple[str, str, Dict[str, Any]]:
+        """1フィールドの部分更新の (コレクション, ドキュメントID, ドット区切りパスの更新内容)
+        
+        送信量は履歴の長さに依存せず、他のワーカーが更新した別フィールドを
+        古いキャッシュで上書きすることもない。ドキュメントが存在しない場合のみ新規作成する。
+        """
+        collection, document_id = self._document_location(username, month_key)
+        field_updates = {
+            field_path('attendance_data', date_str, field): value,
+            'username': username,
+            'last_updated': last_updated or datetime.now().isoformat()
+        }
+        if self.is_monthly_layout() and month_key:
+            field_updates['month'] = month_key
+        return collection, document_id, field_updates
     
     def get_user_attendance_data(self, username: str) -> Dict[str, Any]:
-        """特定ユーザーの勤怠データを取得（最新データを保証）"""
+        """特定ユーザーの勤怠データを取得（読み込みキャッシュの TTL 内は RPC なし）"""
         try:
-            # まずFirestoreから最新データを取得
+            if self.is_snapshot_listener_live():
+                # リスナーがキャッシュを最新に保っている
+                return self._cached_user_data(username)
+            
+            if self.firestore.is_available() and self.is_monthly_layout():
+                months_collection = self._months_collection(username)
+                attendance_data = self.read_cache.get(months_collection)
+                if attendance_data is None:
+                    month_docs = self.firestore.get_collection(months_collection)
+                    attendance_data = {}
+                    for month_doc in month_docs:
+                        attendance_data.update(month_doc.get('attendance_data', {}))
+                    self.read_cache.put(months_collection, attendance_data)
+                    # キャッシュも更新（読み直した場合のみ変換する）
+                    self._cache_user(username, attendance_data)
+                    logger.debug(f"最新データ取得（全{len(month_docs)}ヶ月）: {username}")
+                return attendance_data
+            
             if self.firestore.is_available():
-                user_doc = self.firestore.get_document(self.user_attendance_collection, username)
-                if user_doc:
-                    attendance_data = user_doc.get('attendance_data', {})
-                    # キャッシュも更新
-                    self.attendance_cache[username] = attendance_data
-                    logger.debug(f"最新データ取得: {username}")
+                attendance_data = self._get_document_attendance_data(
+                    self.user_attendance_collection, username,
+                    on_fetch=lambda data: self._cache_user(username, data))
+                if attendance_data is not None:
                     return attendance_data
             
             # Firestoreが利用できない場合はキャッシュから取得
-            return self.attendance_cache.get(username, {})
+            return self._cached_user_data(username)
             
         except Exception as e:
             logger.error(f"勤怠データ取得失敗: {str(e)}")
-            return self.attendance_cache.get(username, {})
+            return self._cached_user_data(username)
+    
+    def _get_document_attendance_data(self, collection: str, document_id: str,
+                                      on_fetch: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Optional[Dict[str, Any]]:
+        """ドキュメントの attendance_data を読み込みキャッシュ経由で取得（存在しない場合は None）"""
+        return self._run_steps(self._document_data_steps(collection, document_id, on_fetch))
+    
+    # --- 読み込みの手順（同期版・非同期版で共通） ---
+    
+    def _run_steps(self, steps: Generator[Tuple[str, tuple], Any, Any]) -> Any:
+        """読み込みの手順を実行（手順が yield した (メソッド名, 引数) の RPC を同期で実行して結果を返す）"""
+        try:
+            method, args = next(steps)
+            while True:
+                method, args = steps.send(getattr(self.firestore, method)(*args))
+        except StopIteration as done:
+            return done.value
+    
+    def _serves_from_cache(self) -> bool:
+        """RPC なしでメモリキャッシュから応答するかチェック（リスナーで同期中・Firestore 利用不可）"""
+        return self.is_snapshot_listener_live() or not self.firestore.is_available()
+    
+    def _document_data_steps(self, collection: str, document_id: str,
+                             on_fetch: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Generator[Tuple[str, tuple], Any, Optional[Dict[str, Any]]]:
+        """ドキュメントの attendance_data を読み込みキャッシュ経由で取得する手順
+        
+        TTL 切れの場合は last_updated のみを読み、変わっていなければ本体を読み直さない。
+        on_fetch はドキュメント本体を読み直した場合のみ呼ばれる（メモリキャッシュの更新用）。
+        RPC は (メソッド名, 引数) を yield して結果を受け取るため、同期版の _run_steps と
+        非同期版の AsyncAttendanceManager._run_steps のどちらでも同じ順序で実行される。
+        """
+        key = f"{collection}/{document_id}"
+        attendance_data = self.read_cache.get(key)
+        if attendance_data is not None:
+            return attendance_data
+        
+        if self.read_cache.stale_version(key) is not None:
+            current = yield 'get_document_fields', (collection, document_id, ['last_updated'])
+            attendance_data = self.read_cache.revalidate(key, current.get('last_updated') if current else None)
+            if attendance_data is not None:
+                logger.debug(f"読み込みキャッシュ再検証: {key}")
+                return attendance_data
+        
+        doc = yield 'get_document', (collection, document_id)
+        if not doc:
+            return None
+        attendance_data = doc.get('attendance_data', {})
+        self.read_cache.put(key, attendance_data, doc.get('last_updated'))
+        if on_fetch is not None:
+            on_fetch(attendance_data)
+        logger.debug(f"最新データ取得: {key}")
+        return attendance_data
+    
+    def _monthly_data_steps(self, username: str, month_key: str) -> Generator[Tuple[str, tuple], Any, Dict[str, Any]]:
+        """ユーザーの月のデータを取得する手順（RPC の実行方法は _document_data_steps と同じ）"""
+        if self._serves_from_cache():
+            # リスナーがキャッシュを最新に保っている（または Firestore 利用不可）
+            return self._cached_month(username, month_key).to_dict()
+        
+        # 日単位の索引を持つバックエンド（SQLite）は月の範囲だけを取得する（非対応時は None）
+        collection, document_id = self._document_location(username, month_key)
+        month_data = yield 'query_attendance_days', (collection, username, f"{month_key}-01", f"{month_key}-31")
+        if month_data is not None:
+            self._replace_cached_month(username, month_key, month_data)
+            logger.debug(f"月別データ取得（索引）: {username} - {month_key} - {len(month_data)}件")
+            return month_data
+        
+        if self.is_monthly_layout():
+            # 月別ドキュメントを1件だけ読み込む
+            month_data = yield from self._document_data_steps(
+                collection, document_id, on_fetch=lambda data: self._replace_cached_month(username, month_key, data))
+            if month_data is None:
+                month_data = {}
+                self._replace_cached_month(username, month_key, month_data)
+            return month_data
+        
+        # 従来レイアウトはユーザーのドキュメントを読み（メモリキャッシュの月別索引も最新になる）、
+        # 全履歴を走査せず月別索引から指定月だけを変換する
+        yield from self._document_data_steps(collection, document_id, on_fetch=lambda data: self._cache_user(username, data))
+        return self._cached_month(username, month_key).to_dict()
+    
+    def _apply_to_read_cache(self, username: str, changes: List[Tuple[str, str, Any]], last_updated: str):
+        """書き込みに成功した変更を読み込みキャッシュへ反映（ライトスルー）"""
+        def apply_changes(selected):
+            def mutate(attendance_data):
+                # 変更したフィールドの分だけ大きさを増減する（キャッシュのメモリ上限の判定用）
+                size_change = 0
+                for date_str, field, value in selected:
+                    day_data = attendance_data.get(date_str)
+                    if day_data is None:
+                        day_data = attendance_data[date_str] = {}
+                        size_change += len(date_str)
+                    if field in day_data:
+                        size_change -= estimate_size(day_data[field])
+                    else:
+                        size_change += len(field)
+                    day_data[field] = value
+                    size_change += estimate_size(value)
+                return size_change
+            return mutate
+        
+        changes_by_location: Dict[tuple, List[Tuple[str, str, Any]]] = {}
+        for change in changes:
+            location = self._document_location(username, self._month_key(change[0]))
+            changes_by_location.setdefault(location, []).append(change)
+        
+        for (collection, document_id), selected in changes_by_location.items():
+            self.read_cache.apply(f"{collection}/{document_id}", apply_changes(selected), last_updated)
+        if self.is_monthly_layout():
+            self.read_cache.apply(self._months_collection(username), apply_changes(changes))
     
     def get_user_monthly_data(self, username: str, year: int, month: int) -> Dict[str, Any]:
         """ユーザーの月別データを取得（最新データを保証）"""
-        # 最新データを取得
-        user_data = self.get_user_attendance_data(username)
-        monthly_data = {}
-        
+        month_key = f"{year:04d}-{month:02d}"
         try:
-            for date_str, daily_data in user_data.items():
-                try:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    if date_obj.year == year and date_obj.month == month:
-                        monthly_data[date_str] = daily_data
-                except ValueError:
-                    # 日付形式が不正な場合はスキップ
-                    logger.warning(f"不正な日付形式: {date_str}")
-                    continue
-            
+            monthly_data = self._run_steps(self._monthly_data_steps(username, month_key))
             logger.debug(f"月別データ取得: {username} - {year}/{month} - {len(monthly_data)}件")
             return monthly_data
             
@@ -288,26 +846,87 @@ class FirestoreAttendanceManager:
             logger.error(f"月別データ取得失敗: {str(e)}")
             return {}
     
+    def _cached_month(self, username: str, month_key: str) -> MonthRecords:
+        """キャッシュ内の指定月の記録（無い場合は空）"""
+        if not self.firestore.is_available():
+            self._ensure_cache_loaded()
+        records = self.attendance_cache.get(username)
+        month_records = records.month(month_key) if records is not None else None
+        return month_records if month_records is not None else MonthRecords(month_key)
+    
+    def get_user_month_records(self, username: str, year: int, month: int) -> MonthRecords:
+        """ユーザーの月別データをコンパクト形式で取得（画面表示・帳票用）
+        
+        リスナーで同期中・Firestore 利用不可の場合はキャッシュの記録をそのまま返す。
+        """
+        month_key = f"{year:04d}-{month:02d}"
+        if self._serves_from_cache():
+            return self._cached_month(username, month_key)
+        return MonthRecords.from_dict(month_key, self.get_user_monthly_data(username, year, month))
+    
+    def get_user_range_data(self, username: str, start: Any, end: Any) -> Dict[str, Any]:
+        """指定期間（両端を含む）の勤怠データを取得（複数月の画面用）
+        
+        start / end は date または 'YYYY-MM-DD'。期間に含まれる月だけを読み込む。
+        """
+        try:
+            start_date = start if isinstance(start, date) else datetime.strptime(start, '%Y-%m-%d').date()
+            end_date = end if isinstance(end, date) else datetime.strptime(end, '%Y-%m-%d').date()
+            
+            if self._serves_from_cache():
+                if not self.firestore.is_available():
+                    self._ensure_cache_loaded()
+                records = self.attendance_cache.get(username)
+                return records.range_to_dict(start_date, end_date) if records is not None else {}
+            
+            start_str, end_str = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+            range_data = {}
+            for month_key in month_keys(start_date, end_date):
+                monthly_data = self.get_user_monthly_data(username, int(month_key[:4]), int(month_key[5:]))
+                range_data.update((d, v) for d, v in monthly_data.items() if start_str <= d <= end_str)
+            
+            logger.debug(f"期間データ取得: {username} - {start_str}〜{end_str} - {len(range_data)}件")
+            return range_data
+            
+        except Exception as e:
+            logger.error(f"期間データ取得失敗: {str(e)}")
+            return {}
+    
+    def get_user_daily_data(self, username: str, date_str: str) -> Dict[str, Any]:
+        """ユーザーの指定日のデータを取得（その日を含む月だけを読み込む）"""
+        try:
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return self.get_user_attendance_data(username).get(date_str, {})
+        
+        monthly_data = self.get_user_monthly_data(username, date_obj.year, date_obj.month)
+        return monthly_data.get(date_str, {})
+    
     def get_all_users_data(self) -> Dict[str, Any]:
-        """全ユーザーの勤怠データを取得"""
+        """全ユーザーの勤怠データを取得（値はユーザーごとの UserRecords）"""
+        self._ensure_cache_loaded()
         return self.attendance_cache.copy()
     
     def migrate_from_legacy_format(self, legacy_data: Dict[str, Any]) -> bool:
         """従来形式のデータをFirestore形式に移行"""
         try:
+            self._ensure_cache_loaded()
             migrated_count = 0
             
+            migrated_users = set()
             for date_str, daily_data in legacy_data.items():
                 if isinstance(daily_data, dict):
                     for username, user_daily_data in daily_data.items():
-                        if username not in self.attendance_cache:
-                            self.attendance_cache[username] = {}
-                        
-                        self.attendance_cache[username][date_str] = user_daily_data
+                        self._user_records(username)[date_str] = user_daily_data
+                        migrated_users.add(username)
                         migrated_count += 1
+            for username in migrated_users:
+                self._notify_changed(username)
             
             # 移行後のデータを保存
             success = self.save_attendance_data()
+            if success and self.monthly_summaries.enabled:
+                self.rebuild_monthly_summaries(sorted(migrated_users))
             
             logger.info(f"データ移行完了: {migrated_count}件")
             return success
@@ -316,11 +935,126 @@ class FirestoreAttendanceManager:
             logger.error(f"データ移行失敗: {str(e)}")
             return False
     
+    def migrate_to_monthly_layout(self, usernames: Optional[List[str]] = None, purge_legacy: bool = False) -> Dict[str, Any]:
+        """user_attendance/{username} の全履歴を月別ドキュメントへ移行
+        
+        既に月別ドキュメントにある日の記録は上書きしないため、切り替え後に再実行しても安全。
+        purge_legacy=True の場合は移行に成功したユーザーの親ドキュメントから
+        attendance_data を取り除き、ドキュメントサイズを縮小する。
+        """
+        result = {'migrated_users': 0, 'migrated_months': 0, 'failed_users': []}
+        
+        if not self.firestore.is_available():
+            logger.warning("Firestore利用不可、月別レイアウトへの移行をスキップ")
+            return result
+        
+        try:
+            user_docs = self.firestore.get_collection(self.user_attendance_collection)
+            
+            for doc in user_docs:
+                username = doc.get('username') or doc.get('_id')
+                if usernames is not None and username not in usernames:
+                    continue
+                
+                attendance_data = doc.get('attendance_data')
+                if not username or attendance_data is None:
+                    continue
+                
+                months = self._group_by_month(attendance_data)
+                saved_months = 0
+                for month_key, month_data in months.items():
+                    if self._migrate_month_document(username, month_key, month_data):
+                        saved_months += 1
+                
+                if saved_months != len(months):
+                    logger.error(f"月別移行失敗: {username} ({saved_months}/{len(months)}ヶ月)")
+                    result['failed_users'].append(username)
+                    continue
+                
+                parent_doc_data = {
+                    'username': username,
+                    'storage_layout': LAYOUT_MONTHLY,
+                    'migrated_at': datetime.now().isoformat()
+                }
+                if purge_legacy:
+                    # set で上書きして旧形式の attendance_data を取り除く
+                    self.firestore.create_document(self.user_attendance_collection, username, parent_doc_data)
+                else:
+                    self.firestore.update_document(self.user_attendance_collection, username, parent_doc_data)
+                
+                result['migrated_users'] += 1
+                result['migrated_months'] += saved_months
+                logger.info(f"月別移行完了: {username} ({saved_months}ヶ月)")
+            
+            logger.info(f"月別レイアウト移行完了: {result['migrated_users']}ユーザー / {result['migrated_months']}ヶ月")
+            return result
+            
+        except Exception as e:
+            logger.error(f"月別レイアウト移行失敗: {str(e)}")
+            return result
+    
+    def rebuild_monthly_summaries(self, usernames: Optional[List[str]] = None,
+                                  months: Optional[List[Tuple[int, int]]] = None,
+                                  dirty_only: bool = False) -> Dict[str, Any]:
+        """勤怠データから月別集計ドキュメントを作り直す（導入時のバックフィル・復元後・集計方法の変更後）
+        
+        usernames が None の場合は全ユーザー、months（(年, 月) のリスト）が None の場合は
+        記録のある全ての月が対象。指定した月に記録が無い場合は 0 の集計で上書きする。
+        dirty_only=True の場合は、書き込み時に要再集計の印が付いた月のみを作り直す。
+        """
+        result = {'rebuilt_users': 0, 'rebuilt_months': 0, 'failed_users': []}
+        
+        if not self.firestore.is_available():
+            logger.warning("Firestore利用不可、月別集計の再集計をスキップ")
+            return result
+        
+        try:
+            target_months = [f"{year:04d}-{month:02d}" for year, month in months] if months else None
+            if dirty_only:
+                dirty: Dict[str, List[str]] = {}
+                for username, month_key in self.monthly_summaries.dirty_months():
+                    if (usernames is None or username in usernames) and (target_months is None or month_key in target_months):
+                        dirty.setdefault(username, []).append(month_key)
+                usernames = sorted(dirty)
+            elif usernames is None:
+                usernames = sorted(self.get_all_users_data())
+            
+            for username in usernames:
+                if dirty_only:
+                    month_keys = dirty[username]
+                    rebuilt = sum(1 for month_key in month_keys
+                                  if self._rebuild_monthly_summary(username, month_key) is not None)
+                else:
+                    with self._user_write_lock(username):
+                        # 他のワーカーの書き込みを含めるため読み込みキャッシュの値は使わない
+                        self.read_cache.invalidate(self._months_collection(username))
+                        self.read_cache.invalidate('/'.join(self._document_location(username, None)))
+                        months_data = self._group_by_month(self.get_user_attendance_data(username))
+                        month_keys = target_months if target_months is not None else sorted(months_data)
+                        rebuilt = sum(
+                            1 for month_key in month_keys
+                            if self.monthly_summaries.rebuild(username, month_key, months_data.get(month_key, {})) is not None
+                        )
+                if rebuilt != len(month_keys):
+                    logger.error(f"月別集計の再集計失敗: {username} ({rebuilt}/{len(month_keys)}ヶ月)")
+                    result['failed_users'].append(username)
+                    continue
+                result['rebuilt_users'] += 1
+                result['rebuilt_months'] += rebuilt
+            
+            logger.info(f"月別集計の再集計完了: {result['rebuilt_users']}ユーザー / {result['rebuilt_months']}ヶ月")
+            return result
+            
+        except Exception as e:
+            logger.error(f"月別集計の再集計失敗: {str(e)}")
+            return result
+    
     def backup_to_json(self, backup_file_path: str) -> bool:
         """勤怠データをJSONファイルにバックアップ"""
         try:
+            self._ensure_cache_loaded()
             with open(backup_file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.attendance_cache, f, ensure_ascii=False, indent=2)
+                json.dump(self._cache_as_dict(), f, ensure_ascii=False, indent=2)
             logger.info(f"バックアップ完了: {backup_file_path}")
             return True
             
@@ -333,10 +1067,16 @@ class FirestoreAttendanceManager:
         try:
             with open(backup_file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                self.attendance_cache = data
+                previous_users = set(self.attendance_cache)
+                self.attendance_cache = {username: UserRecords.from_dict(user_data) for username, user_data in data.items()}
+                self._cache_loaded = True
+            for username in previous_users | set(self.attendance_cache):
+                self._notify_changed(username)
             
             # 復元後のデータを保存
             success = self.save_attendance_data()
+            if success and self.monthly_summaries.enabled:
+                self.rebuild_monthly_summaries(sorted(self.attendance_cache))
             
             logger.info(f"復元完了: {backup_file_path}")
             return success
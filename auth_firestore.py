@@ -1,18 +1,23 @@
 import hashlib
+import inspect
 import secrets
 from functools import wraps
+from datetime import datetime
 from flask import session, request, redirect, url_for, jsonify
-from typing import Dict, Optional
+from typing import Dict, Optional, Any
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
 class FirestoreAuthManager:
     """Firestore ベースの認証管理クラス"""
     
-    def __init__(self):
-        # Firestoreマネージャーをインポート
-        from firestore_config import firestore_manager
+    def __init__(self, firestore_manager=None):
+        # Firestoreマネージャー（未指定の場合は共有インスタンスを使用）
+        if firestore_manager is None:
+            from firestore_config import firestore_manager
         self.firestore = firestore_manager
         
         # コレクション名
@@ -20,46 +25,184 @@ class FirestoreAuthManager:
         self.user_sessions_collection = 'user_sessions'
         
         # メモリキャッシュ（パフォーマンス向上のため）
+        # 起動時には読み込まず、ユーザー名ごとに必要になった時点で読み込む
         self.users_cache = {}
         self.user_display_names_cache = {}
+        self._cache_stats = {'hits': 0, 'misses': 0}
+        self._cache_stats_lock = threading.Lock()
         
-        # 初期化時にユーザー情報をロード
-        self.load_users_cache()
+        # 管理画面の一覧用の全件読み込み（ページ単位）と、その後の差分読み込みの基準
+        self.users_page_size = int(os.environ.get('USERS_CACHE_PAGE_SIZE', '500'))
+        self._users_fully_loaded = False
+        self._users_updated_at: Optional[str] = None
+        
+        # スナップショットリスナー（有効時は他のワーカーでのユーザー追加・変更も反映される）
+        self._snapshot_watch = None
+        self._snapshot_ready = threading.Event()
+        
+        from firestore_config import snapshot_listeners_enabled
+        if snapshot_listeners_enabled():
+            self.start_snapshot_listener()
+    
+    def set_storage_backend(self, firestore_manager):
+        """ストレージバックエンドを差し替えてキャッシュを再読み込み（テスト・ベンチマーク用）"""
+        listening = self._snapshot_watch is not None
+        self.stop_snapshot_listener()
+        self.firestore = firestore_manager
+        self.users_cache = {}
+        self.user_display_names_cache = {}
+        self._users_fully_loaded = False
+        self._users_updated_at = None
+        if listening:
+            self.start_snapshot_listener()
+    
+    def start_snapshot_listener(self) -> bool:
+        """users コレクションの変更購読を開始"""
+        if self._snapshot_watch is not None or not self.firestore.is_available():
+            return self._snapshot_watch is not None
+        
+        self._snapshot_ready.clear()
+        self._snapshot_watch = self.firestore.watch_collection(self.users_collection, self._on_users_snapshot)
+        return self._snapshot_watch is not None
+    
+    def stop_snapshot_listener(self):
+        """変更購読を終了"""
+        if self._snapshot_watch is not None:
+            self._snapshot_watch.unsubscribe()
+            self._snapshot_watch = None
+            self._snapshot_ready.clear()
+    
+    def is_snapshot_listener_live(self) -> bool:
+        """購読中かつ初回スナップショットを受信済みか"""
+        return self._snapshot_watch is not None and self._snapshot_ready.is_set()
+    
+    def _on_users_snapshot(self, changes):
+        """変更されたユーザーをキャッシュへ反映（リスナーのスレッドで呼ばれる）"""
+        for kind, path, data in changes:
+            username = path.split('/')[-1]
+            if kind == 'REMOVED' or not data or not data.get('password_hash'):
+                self.users_cache.pop(username, None)
+                self.user_display_names_cache.pop(username, None)
+            else:
+                username = data.get('username', username)
+                self.users_cache[username] = data['password_hash']
+                self.user_display_names_cache[username] = data.get('display_name', username)
+        
+        self._snapshot_ready.set()
+        logger.debug(f"ユーザースナップショット反映: {len(changes)}件")
     
     def hash_password(self, password: str) -> str:
         """パスワードをハッシュ化"""
         return hashlib.sha256(password.encode()).hexdigest()
     
+    def _cache_user_doc(self, user_doc: Dict[str, Any]) -> bool:
+        """ユーザードキュメントをキャッシュに反映（パスワード未設定の場合は反映しない）"""
+        username = user_doc.get('username')
+        password_hash = user_doc.get('password_hash')
+        if not username or not password_hash:
+            return False
+        
+        self.users_cache[username] = password_hash
+        self.user_display_names_cache[username] = user_doc.get('display_name', username)
+        updated_at = user_doc.get('updated_at')
+        if updated_at and (self._users_updated_at is None or updated_at > self._users_updated_at):
+            self._users_updated_at = updated_at
+        return True
+    
+    def _get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """ユーザーのパスワードハッシュと表示名を取得（キャッシュにない場合は1件だけ読み込む）"""
+        cached = username in self.users_cache
+        with self._cache_stats_lock:
+            self._cache_stats['hits' if cached else 'misses'] += 1
+        if cached:
+            return {
+                'password_hash': self.users_cache[username],
+                'display_name': self.user_display_names_cache.get(username, username)
+            }
+        
+        # リスナーで同期中はキャッシュにないユーザーは存在しない
+        if self.is_snapshot_listener_live():
+            logger.debug(f"ユーザー存在しない（スナップショット）: {username}")
+            return None
+        
+        if not username or not self.firestore.is_available():
+            return None
+        
+        user_doc = self.firestore.get_document(self.users_collection, username)
+        if not user_doc or not user_doc.get('password_hash'):
+            logger.debug(f"Firestoreにユーザー存在しない: {username}")
+            return None
+        
+        self._cache_user_doc(dict(user_doc, username=user_doc.get('username', username)))
+        return {
+            'password_hash': user_doc['password_hash'],
+            'display_name': user_doc.get('display_name', username)
+        }
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """ユーザーキャッシュのヒット・ミスの統計"""
+        with self._cache_stats_lock:
+            lookups = self._cache_stats['hits'] + self._cache_stats['misses']
+            return dict(self._cache_stats,
+                        entries=len(self.users_cache),
+                        hit_rate=self._cache_stats['hits'] / lookups if lookups else 0.0)
+    
     def load_users_cache(self):
-        """Firestoreからユーザー情報をキャッシュに読み込み"""
+        """Firestoreから全ユーザー情報をキャッシュに読み込み（ページ単位）"""
+        self.refresh_users_cache(full=True)
+    
+    def refresh_users_cache(self, full: bool = False) -> int:
+        """管理画面の一覧用にユーザーキャッシュを更新し、読み込んだ件数を返す
+        
+        初回（または full=True）は users コレクションを USERS_CACHE_PAGE_SIZE 件ずつ
+        ドキュメントID順に読み込んで置き換える。2回目以降は前回読み込んだ最新の updated_at
+        以降に更新されたユーザーのみを読み込む（他のワーカーでの削除は full=True で反映）。
+        """
         try:
-            # キャッシュをクリア
-            self.users_cache = {}
-            self.user_display_names_cache = {}
-            
             if not self.firestore.is_available():
-                logger.warning("Firestore利用不可、空のキャッシュを使用")
-                return
+                logger.warning("Firestore利用不可、ユーザーキャッシュ更新をスキップ")
+                return 0
+            
+            if self._users_fully_loaded and not full:
+                users_docs = self.firestore.query_documents(self.users_collection, 'updated_at', '>=',
+                                                            self._users_updated_at or '')
+                for user_doc in users_docs:
+                    self._cache_user_doc(user_doc)
+                logger.debug(f"ユーザーキャッシュ差分更新: {len(users_docs)}ユーザー")
+                return len(users_docs)
             
-            # 全ユーザー情報を取得
-            users_docs = self.firestore.get_collection(self.users_collection)
+            # 読み込み中も既存のキャッシュで応答できるよう、全ページを読み込んでから置き換える
+            users_docs = []
+            last_id = None
+            while True:
+                page = self.firestore.get_collection(self.users_collection, limit=self.users_page_size, start_after=last_id)
+                users_docs.extend(page)
+                if len(page) < self.users_page_size:
+                    break
+                last_id = page[-1]['_id']
             
+            self.users_cache, self.user_display_names_cache, self._users_updated_at = {}, {}, None
             for user_doc in users_docs:
-                username = user_doc.get('username')
-                password_hash = user_doc.get('password_hash')
-                display_name = user_doc.get('display_name', username)
-                
-                if username and password_hash:
-                    self.users_cache[username] = password_hash
-                    self.user_display_names_cache[username] = display_name
+                self._cache_user_doc(user_doc)
             
+            self._users_fully_loaded = True
             logger.info(f"ユーザーキャッシュロード完了: {len(self.users_cache)}ユーザー")
+            return len(users_docs)
             
         except Exception as e:
             logger.error(f"ユーザーキャッシュロード失敗: {str(e)}")
-            # エラー時も空のキャッシュを保持
-            self.users_cache = {}
-            self.user_display_names_cache = {}
+            return 0
+    
+    def _user_document(self, username: str, password_hash: str, display_name: str) -> Dict[str, Any]:
+        """保存するユーザードキュメント"""
+        now = datetime.now().isoformat()
+        return {
+            'username': username,
+            'password_hash': password_hash,
+            'display_name': display_name,
+            'created_at': now,
+            'updated_at': now
+        }
     
     def save_user_to_firestore(self, username: str, password_hash: str, display_name: str) -> bool:
         """Firestoreにユーザー情報を保存"""
@@ -68,12 +211,7 @@ class FirestoreAuthManager:
                 logger.warning("Firestore利用不可、保存スキップ")
                 return False
             
-            user_data = {
-                'username': username,
-                'password_hash': password_hash,
-                'display_name': display_name,
-                'created_at': self.firestore.db.collection('_metadata').document('_').get().create_time if self.firestore.db else None
-            }
+            user_data = self._user_document(username, password_hash, display_name)
             
             # ユーザー名をドキュメントIDとして使用
             result = self.firestore.create_document(
@@ -99,25 +237,13 @@ class FirestoreAuthManager:
         logger.debug(f"キャッシュ内ユーザー数: {len(self.users_cache)}")
         logger.debug(f"キャッシュ内ユーザー一覧: {list(self.users_cache.keys())}")
         
-        if username in self.users_cache:
-            stored_hash = self.users_cache[username]
-            input_hash = self.hash_password(password)
-            result = stored_hash == input_hash
-            logger.debug(f"キャッシュ認証結果: {result}")
-            return result
-        
-        # キャッシュにない場合、Firestoreから直接取得
-        logger.debug(f"キャッシュにないため、Firestore直接確認: {username}")
+        # キャッシュにない場合はこのユーザーのドキュメントのみ読み込む
         try:
-            user_doc = self.firestore.get_document(self.users_collection, username)
-            if user_doc and user_doc.get('password_hash'):
-                stored_hash = user_doc['password_hash']
-                input_hash = self.hash_password(password)
-                result = stored_hash == input_hash
-                logger.debug(f"Firestore直接認証結果: {result}")
+            user = self._get_user(username)
+            if user is not None:
+                result = user['password_hash'] == self.hash_password(password)
+                logger.debug(f"認証結果: {result}")
                 return result
-            else:
-                logger.debug(f"Firestoreにユーザー存在しない: {username}")
         except Exception as e:
             logger.error(f"パスワード認証エラー: {str(e)}")
         
@@ -127,12 +253,11 @@ class FirestoreAuthManager:
     def login_user(self, username: str) -> bool:
         """ユーザーをログイン状態にする"""
         # ユーザーの存在確認
-        if username not in self.users_cache:
-            user_doc = self.firestore.get_document(self.users_collection, username)
-            if not user_doc:
-                return False
+        user = self._get_user(username)
+        if user is None:
+            return False
         
-        display_name = self.user_display_names_cache.get(username, username)
+        display_name = user['display_name']
         session_id = secrets.token_hex(16)
         
         # セッション情報をセット
@@ -147,7 +272,7 @@ class FirestoreAuthManager:
                 session_data = {
                     'username': username,
                     'session_id': session_id,
-                    'created_at': self.firestore.db.collection('_metadata').document('_').get().create_time if self.firestore.db else None
+                    'created_at': datetime.now().isoformat()
                 }
                 self.firestore.create_document(
                     self.user_sessions_collection,
@@ -184,50 +309,55 @@ class FirestoreAuthManager:
         """現在のユーザーの表示名を取得"""
         return session.get('display_name', session.get('username', ''))
     
+    def get_display_name(self, username: str) -> str:
+        """ユーザーの表示名を取得（登録されていない場合はユーザー名）"""
+        user = self._get_user(username)
+        return user['display_name'] if user else username
+    
+    def get_display_names(self, usernames: list) -> Dict[str, str]:
+        """複数ユーザーの表示名をまとめて取得（キャッシュにないユーザーがいればキャッシュを1回だけ更新する）"""
+        if any(username not in self.users_cache for username in usernames) and not self.is_snapshot_listener_live():
+            self.refresh_users_cache()
+        return {username: self.user_display_names_cache.get(username, username) for username in usernames}
+    
     def get_user_list(self) -> list:
-        """登録ユーザー一覧を取得"""
+        """登録ユーザー一覧を取得（管理画面用。初回は全件、以降は差分のみ読み込む）"""
+        if not self.is_snapshot_listener_live():
+            self.refresh_users_cache()
         return list(self.users_cache.keys())
     
     def add_user(self, username: str, password: str, display_name: str = '') -> bool:
-        """新規ユーザーを追加"""
-        # 1. キャッシュをリフレッシュ
-        self.load_users_cache()
-        
-        # 2. キャッシュでの重複チェック
+        """新規ユーザーを追加（存在しない場合のみ作成する条件付き書き込み1回で重複を判定）"""
+        # 1. キャッシュでの重複チェック（RPC なし）
         if username in self.users_cache:
             logger.warning(f"ユーザー重複（キャッシュ）: {username}")
             return False  # ユーザーが既に存在
         
-        # 3. Firestoreでの直接重複チェック（キャッシュが古い場合の対策）
-        if self.firestore.is_available():
-            try:
-                existing_user = self.firestore.get_document(self.users_collection, username)
-                if existing_user:
-                    logger.warning(f"ユーザー重複（Firestore直接）: {username}")
-                    # キャッシュも更新
-                    self.load_users_cache()
-                    return False
-            except Exception as e:
-                logger.error(f"重複チェック失敗: {str(e)}")
-                return False
+        if not self.firestore.is_available():
+            logger.warning("Firestore利用不可、保存スキップ")
+            return False
         
-        # 4. ユーザー情報をFirestoreに保存
+        # 2. ユーザー情報をFirestoreに保存（既存の場合は作成しない）
         password_hash = self.hash_password(password)
         display_name = display_name or username
+        user_data = self._user_document(username, password_hash, display_name)
         
-        if self.save_user_to_firestore(username, password_hash, display_name):
+        created = self.firestore.create_document_if_absent(self.users_collection, username, user_data)
+        if created:
             # キャッシュを更新
-            self.users_cache[username] = password_hash
-            self.user_display_names_cache[username] = display_name
+            self._cache_user_doc(user_data)
             logger.info(f"新規ユーザー登録成功: {username}")
             return True
         
-        logger.error(f"新規ユーザー登録失敗: {username}")
+        if created is False:
+            logger.warning(f"ユーザー重複（Firestore）: {username}")
+        else:
+            logger.error(f"新規ユーザー登録失敗: {username}")
         return False
     
     def delete_user(self, username: str) -> bool:
         """ユーザーを削除"""
-        if username not in self.users_cache:
+        if self._get_user(username) is None:
             return False
         
         try:
@@ -236,9 +366,8 @@ class FirestoreAuthManager:
                 success = self.firestore.delete_document(self.users_collection, username)
                 if success:
                     # キャッシュからも削除
-                    del self.users_cache[username]
-                    if username in self.user_display_names_cache:
-                        del self.user_display_names_cache[username]
+                    self.users_cache.pop(username, None)
+                    self.user_display_names_cache.pop(username, None)
                     return True
             return False
             
@@ -248,7 +377,7 @@ class FirestoreAuthManager:
     
     def update_user_display_name(self, username: str, new_display_name: str) -> bool:
         """ユーザーの表示名を更新"""
-        if username not in self.users_cache:
+        if self._get_user(username) is None:
             return False
         
         try:
@@ -256,7 +385,7 @@ class FirestoreAuthManager:
                 success = self.firestore.update_document(
                     self.users_collection,
                     username,
-                    {'display_name': new_display_name}
+                    {'display_name': new_display_name, 'updated_at': datetime.now().isoformat()}
                 )
                 if success:
                     # キャッシュも更新
@@ -271,13 +400,25 @@ class FirestoreAuthManager:
 # グローバルインスタンス
 firestore_auth_manager = FirestoreAuthManager()
 
+def _login_required_response():
+    """未ログイン時の応答（API は 401、画面はログインページへ）"""
+    if request.is_json:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    return redirect(url_for('auth'))
+
 def firestore_login_required(f):
-    """Firestore認証必須デコレータ"""
+    """Firestore認証必須デコレータ（async ビューにも使用できる）"""
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_coroutine(*args, **kwargs):
+            if not firestore_auth_manager.is_logged_in():
+                return _login_required_response()
+            return await f(*args, **kwargs)
+        return decorated_coroutine
+    
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not firestore_auth_manager.is_logged_in():
-            if request.is_json:
-                return jsonify({'success': False, 'error': 'Authentication required'}), 401
-            return redirect(url_for('auth'))
+            return _login_required_response()
         return f(*args, **kwargs)
     return decorated_function 
\ No newline at end of file
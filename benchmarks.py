@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+勤怠システムのベンチマークスクリプト
+FakeFirestoreManager で Firestore の通信遅延・失敗を再現し、実際のプロジェクトなしで計測する
+
+使い方:
+    python benchmarks.py punch --latency-ms 40 --jitter-ms 20 --requests 200
+    python benchmarks.py save --history-days 730
+    python benchmarks.py export --error-rate 0.01
+    python benchmarks.py all
+    python benchmarks.py memory --users 1000 --years 5
+    python benchmarks.py startup --user-counts 10,100,1000
+    python benchmarks.py excel --requests 200
+    python benchmarks.py bulk --bulk-users 200 --workers 0,1,2,4
+    python benchmarks.py timesheet --users 1000
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable
+
+# 計測中はローカルジャーナルを書かない
+os.environ.setdefault('ATTENDANCE_JOURNAL_DURABILITY', 'off')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_USER = 'bench_user'
+
+@contextlib.contextmanager
+def quiet(verbose: bool = False):
+    """アプリの DEBUG 出力を抑制"""
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def percentile(values: List[float], ratio: float) -> float:
+    """ソート済みでない値のリストからパーセンタイルを取得"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(ratio * (len(ordered) - 1)))))
+    return ordered[index]
+
+def history_changes(days: int, end: datetime) -> List[tuple]:
+    """過去 days 日分の勤怠データ（(日付, フィールド, 値) のリスト）を生成"""
+    changes = []
+    for offset in range(days):
+        date_str = (end - timedelta(days=offset)).strftime('%Y-%m-%d')
+        changes.extend([
+            (date_str, 'check_in', '09:00'),
+            (date_str, 'check_out', '18:00'),
+            (date_str, 'transportation', '480'),
+            (date_str, 'notes', '通常勤務')
+        ])
+    return changes
+
+def setup_app(args):
+    """FakeFirestoreManager を注入したアプリとテストクライアントを準備"""
+    with quiet(args.verbose):
+        import app_firestore
+        from fake_firestore import FakeFirestoreManager
+        
+        fake = FakeFirestoreManager(seed=args.seed)
+        fake.create_document('users', BENCH_USER, {
+            'username': BENCH_USER,
+            'password_hash': '',
+            'display_name': 'ベンチマーク'
+        })
+        app_firestore.configure_storage_backend(fake)
+        # 履歴データの投入（遅延・失敗なし）
+        app_firestore.get_attendance_manager().bulk_update_user_attendance_records(
+            BENCH_USER, history_changes(args.history_days, datetime.now()))
+    
+    fake.latency = args.latency_ms / 1000
+    fake.jitter = args.jitter_ms / 1000
+    fake.error_rate = args.error_rate
+    
+    client = app_firestore.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+        sess['username'] = BENCH_USER
+        sess['display_name'] = 'ベンチマーク'
+    return client, fake
+
+def index_request(client, index: int):
+    """打刻画面の表示（本日の記録を読み込む）"""
+    return client.get('/')
+
+def punch_request(client, index: int):
+    """打刻API（出勤・退勤を交互に打刻）"""
+    field = 'check_in' if index % 2 == 0 else 'check_out'
+    return client.post('/api/punch', json={'date': datetime.now().strftime('%Y-%m-%d'), 'field': field})
+
+def save_request(client, index: int):
+    """勤怠フォーム保存（1か月分の全フィールド）"""
+    today = datetime.now()
+    form = {}
+    for day in range(1, 29):
+        date_str = today.replace(day=day).strftime('%Y-%m-%d')
+        form[f'check_in_{date_str}'] = '09:00'
+        form[f'check_out_{date_str}'] = f'18:{index % 4 * 15:02d}'
+        form[f'transportation_{date_str}'] = '480'
+        form[f'notes_{date_str}'] = ''
+    return client.post('/save_attendance', data=form)
+
+def export_request(client, index: int):
+    """当月のExcel出力"""
+    today = datetime.now()
+    return client.get(f'/export_excel?year={today.year}&month={today.month}')
+
+SCENARIOS: Dict[str, Callable] = {
+    'index': index_request,
+    'punch': punch_request,
+    'save': save_request,
+    'export': export_request,
+}
+
+def run_scenario(name: str, args) -> Dict[str, Any]:
+    """シナリオを実行して計測結果を返す"""
+    client, fake = setup_app(args)
+    request_func = SCENARIOS[name]
+    
+    # ウォームアップ（計測対象外）
+    with quiet(args.verbose):
+        request_func(client, 0)
+    
+    durations = []
+    failures = 0
+    import app_firestore
+    read_cache = app_firestore.get_attendance_manager().read_cache
+    fake.reset_stats()
+    read_cache.reset_stats()
+    for index in range(args.requests):
+        started = time.perf_counter()
+        with quiet(args.verbose):
+            response = request_func(client, index)
+        durations.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            failures += 1
+    
+    stats = fake.stats()
+    read_cache_stats = read_cache.stats()
+    return {
+        'scenario': name,
+        'requests': args.requests,
+        'failures': failures,
+        'mean_ms': sum(durations) / len(durations),
+        'p50_ms': percentile(durations, 0.50),
+        'p95_ms': percentile(durations, 0.95),
+        'p99_ms': percentile(durations, 0.99),
+        'rpc_per_request': stats['rpc_count'] / args.requests,
+        'bytes_sent_per_request': stats['bytes_sent'] / args.requests,
+        'bytes_received_per_request': stats['bytes_received'] / args.requests,
+        'rpc_errors': stats['error_count'],
+        'rpc_by_method': stats['rpc_by_method'],
+        'read_cache_hit_rate': read_cache_stats['hit_rate'],
+    }
+
+def sample_user_history(years: int, end: datetime, rng: random.Random) -> Dict[str, Dict[str, Any]]:
+    """1ユーザー分の勤怠履歴（平日のみ、辞書形式）を生成"""
+    stations = ['東京', '新宿', '渋谷', '品川', '池袋', '横浜', '大宮', '千葉']
+    home = rng.choice(stations)
+    history = {}
+    for offset in range(years * 365):
+        day = end - timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        record = {
+            'check_in': f"{rng.randint(8, 9):02d}:{rng.randrange(0, 60, 5):02d}",
+            'check_out': f"{rng.randint(17, 20):02d}:{rng.randrange(0, 60, 5):02d}",
+            'break_time': '1.0',
+        }
+        if rng.random() < 0.3:
+            record.update({'travel_from': home, 'travel_to': rng.choice(stations), 'travel_cost': str(rng.randint(2, 12) * 10)})
+        if rng.random() < 0.1:
+            record['notes'] = rng.choice(['客先訪問', '在宅勤務', '研修'])
+        history[day.strftime('%Y-%m-%d')] = record
+    return history
+
+def run_memory_benchmark(args) -> Dict[str, Any]:
+    """メモリキャッシュの使用量を辞書形式とコンパクト形式（UserRecords）で比較
+    
+    args.sample_users 人分を実測し、args.users 人分に換算する。
+    """
+    from compact_records import UserRecords
+    
+    rng = random.Random(args.seed)
+    end = datetime(2025, 12, 31)
+    # Firestore から読み込んだ直後と同じく、ユーザーごとに別の文字列を持たせる
+    payloads = [json.dumps(sample_user_history(args.years, end, rng), ensure_ascii=False)
+                for _ in range(args.sample_users)]
+    
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dict_cache = {f"user{i}": json.loads(payload) for i, payload in enumerate(payloads)}
+    dict_bytes = tracemalloc.get_traced_memory()[0] - before
+    
+    before = tracemalloc.get_traced_memory()[0]
+    compact_cache = {username: UserRecords.from_dict(data) for username, data in dict_cache.items()}
+    compact_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    
+    lossless = all(compact_cache[username].to_dict() == data for username, data in dict_cache.items())
+    records = sum(len(data) for data in dict_cache.values())
+    scale = args.users / args.sample_users
+    return {
+        'users': args.users,
+        'years': args.years,
+        'sample_users': args.sample_users,
+        'records_per_user': records / args.sample_users,
+        'dict_bytes': dict_bytes * scale,
+        'compact_bytes': compact_bytes * scale,
+        'lossless': lossless,
+    }
+
+def print_memory_result(result: Dict[str, Any]):
+    mib = 1024 * 1024
+    print(f"\n=== memory ({result['users']}ユーザー × {result['years']}年, "
+          f"{result['sample_users']}ユーザーの実測から換算) ===")
+    print(f"  記録数/ユーザー {result['records_per_user']:.0f}日")
+    print(f"  辞書形式 {result['dict_bytes'] / mib:.1f}MiB / コンパクト形式 {result['compact_bytes'] / mib:.1f}MiB "
+          f"({result['compact_bytes'] / result['dict_bytes']:.1%})")
+    print(f"  辞書形式との相互変換 {'一致' if result['lossless'] else '不一致'}")
+
+def run_startup_benchmark(args) -> List[Dict[str, Any]]:
+    """コールドスタート（マネージャー初期化と最初の月別表示）の時間をユーザー数ごとに計測
+    
+    比較のため、全ユーザーを一括で読み込んだ場合（load_attendance_cache）の時間も計測する。
+    """
+    from fake_firestore import FakeFirestoreManager
+    from attendance_firestore import FirestoreAttendanceManager
+    
+    today = datetime.now()
+    history = {date_str: {} for date_str, _, _ in history_changes(args.history_days, today)}
+    for date_str, field, value in history_changes(args.history_days, today):
+        history[date_str][field] = value
+    
+    results = []
+    for users in [int(count) for count in args.user_counts.split(',')]:
+        fake = FakeFirestoreManager(seed=args.seed)
+        for index in range(users):
+            username = f"user{index:05d}"
+            fake.create_document('user_attendance', username, {
+                'username': username,
+                'attendance_data': history,
+                'last_updated': today.isoformat()
+            })
+        fake.latency = args.latency_ms / 1000
+        fake.jitter = args.jitter_ms / 1000
+        
+        gc.collect()
+        fake.reset_stats()
+        started = time.perf_counter()
+        manager = FirestoreAttendanceManager(firestore_manager=fake)
+        init_ms = (time.perf_counter() - started) * 1000
+        init_rpc = fake.stats()['rpc_count']
+        
+        started = time.perf_counter()
+        manager.get_user_monthly_data('user00000', today.year, today.month)
+        first_request_ms = (time.perf_counter() - started) * 1000
+        
+        fake.reset_stats()
+        started = time.perf_counter()
+        manager.load_attendance_cache()
+        eager_ms = (time.perf_counter() - started) * 1000
+        
+        results.append({
+            'users': users,
+            'init_ms': init_ms,
+            'init_rpc': init_rpc,
+            'first_request_ms': first_request_ms,
+            'eager_load_ms': eager_ms,
+            'eager_load_bytes': fake.stats()['bytes_received'],
+        })
+        # 次の計測の初期化時間に解放のコストが含まれないようにする
+        del manager, fake
+    return results
+
+def print_startup_results(results: List[Dict[str, Any]]):
+    print("\n=== startup ===")
+    print(f"  {'ユーザー数':>8} {'初期化':>10} {'初期化RPC':>8} {'最初の月別表示':>14} {'全件読み込み(参考)':>18}")
+    for result in results:
+        print(f"  {result['users']:>8} {result['init_ms']:>8.2f}ms {result['init_rpc']:>8} "
+              f"{result['first_request_ms']:>12.2f}ms {result['eager_load_ms']:>10.2f}ms "
+              f"({result['eager_load_bytes'] / 1024:.0f}KiB)")
+
+def run_excel_benchmark(args) -> List[Dict[str, Any]]:
+    """作業時間報告書の作成時間を従来の処理（セル単位）と新しい処理（テンプレート）で比較
+    
+    どちらも同じ1か月分のデータから args.requests 回作成する。最初の1回（openpyxl の読み込み・
+    テンプレートの作成）は計測に含めず、別に記録する。
+    """
+    from excel_report import ExcelReportEngine, build_report_legacy
+    
+    rng = random.Random(args.seed)
+    history = sample_user_history(1, datetime(2025, 5, 31), rng)
+    data = {date_str: record for date_str, record in history.items() if date_str.startswith('2025-05')}
+    
+    engine = ExcelReportEngine()
+    builders = [('従来（セル単位）', build_report_legacy), ('テンプレート', engine.build)]
+    results = []
+    for name, build in builders:
+        started = time.perf_counter()
+        output, _ = build(2025, 5, data, 'ベンチマーク')
+        first_ms = (time.perf_counter() - started) * 1000
+        
+        durations = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            build(2025, 5, data, 'ベンチマーク')
+            durations.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'name': name,
+            'first_ms': first_ms,
+            'mean_ms': sum(durations) / len(durations),
+            'p95_ms': percentile(durations, 0.95),
+            'bytes': len(output.getvalue()),
+        })
+    return results
+
+def print_excel_results(results: List[Dict[str, Any]]):
+    print("\n=== excel (2025年5月, 1ユーザー分) ===")
+    for result in results:
+        print(f"  {result['name']:<12} 平均 {result['mean_ms']:.2f}ms / p95 {result['p95_ms']:.2f}ms / "
+              f"初回 {result['first_ms']:.2f}ms / {result['bytes'] / 1024:.1f}KiB")
+    if len(results) == 2:
+        print(f"  平均の比 {results[1]['mean_ms'] / results[0]['mean_ms']:.1%}")
+
+def run_bulk_benchmark(args) -> List[Dict[str, Any]]:
+    """一括出力（ZIP）のスループットをワーカープロセス数ごとに計測
+    
+    勤怠データの取得は args.latency_ms の待ち時間で再現する。プロセスの起動時間を含めないよう、
+    計測前に同じ設定で1回出力してワーカーを起動しておく。
+    """
+    from bulk_export import BulkExporter, ExportJob
+    
+    rng = random.Random(args.seed)
+    history = sample_user_history(1, datetime(2025, 5, 31), rng)
+    data = {date_str: record for date_str, record in history.items() if date_str.startswith('2025-05')}
+    jobs = [ExportJob(f"user{index:05d}", f"社員{index}", 2025, 5) for index in range(args.bulk_users)]
+    
+    def load_month(username, year, month):
+        time.sleep(args.latency_ms / 1000)
+        return data
+    
+    results = []
+    for workers in [int(count) for count in args.workers.split(',')]:
+        exporter = BulkExporter(max_workers=workers)
+        for _ in exporter.stream_zip(jobs[:max(workers, 1)], load_month):
+            pass
+        
+        started = time.perf_counter()
+        total_bytes = 0
+        largest_chunk = 0
+        for chunk in exporter.stream_zip(jobs, load_month):
+            total_bytes += len(chunk)
+            largest_chunk = max(largest_chunk, len(chunk))
+        elapsed = time.perf_counter() - started
+        exporter.shutdown()
+        results.append({
+            'workers': workers,
+            'seconds': elapsed,
+            'reports_per_second': len(jobs) / elapsed,
+            'zip_bytes': total_bytes,
+            'largest_chunk_bytes': largest_chunk,
+        })
+    return results
+
+def print_bulk_results(results: List[Dict[str, Any]], reports: int):
+    print(f"\n=== bulk ({reports}件, CPU {os.cpu_count()}コア) ===")
+    for result in results:
+        label = 'スレッドのみ' if result['workers'] == 0 else f"{result['workers']}プロセス"
+        print(f"  {label:<10} {result['reports_per_second']:>7.1f}件/秒 ({result['seconds']:.2f}秒) / "
+              f"ZIP {result['zip_bytes'] / 1024:.0f}KiB / 最大チャンク {result['largest_chunk_bytes'] / 1024:.1f}KiB")
+
+def scalar_month_totals(year: int, month: int, data: Dict[str, Any]) -> Dict[str, float]:
+    """1件分の集計を日ごとのループで計算（Timesheet と同じ定義、比較用）"""
+    from timesheet import (minutes_from_time, break_minutes_from, travel_cost_from,
+                           DAILY_STANDARD_MINUTES, WEEKLY_STANDARD_MINUTES, LATE_NIGHT_RANGES)
+    from work_calendar import work_calendar
+    
+    totals = {'work_minutes': 0, 'overtime_minutes': 0, 'late_night_minutes': 0, 'holiday_work_minutes': 0, 'travel_total': 0.0}
+    weekly_regular: Dict[int, int] = {}
+    days = work_calendar.month_days(year, month)
+    for day in days:
+        record = data.get(day.date.strftime('%Y-%m-%d')) or {}
+        totals['travel_total'] += travel_cost_from(record.get('travel_cost'))
+        check_in = minutes_from_time(record.get('check_in'))
+        check_out = minutes_from_time(record.get('check_out'))
+        if check_in is None or check_out is None:
+            continue
+        work = check_out - check_in - break_minutes_from(record.get('break_time'))
+        if work < 0:
+            continue
+        totals['work_minutes'] += work
+        totals['overtime_minutes'] += max(work - DAILY_STANDARD_MINUTES, 0)
+        week = (days[0].weekday + day.date.day - 1) // 7
+        weekly_regular[week] = weekly_regular.get(week, 0) + min(work, DAILY_STANDARD_MINUTES)
+        for low, high in LATE_NIGHT_RANGES:
+            totals['late_night_minutes'] += max(min(check_out, high) - max(check_in, low), 0)
+        if day.is_day_off:
+            totals['holiday_work_minutes'] += work
+    totals['overtime_minutes'] += sum(max(minutes - WEEKLY_STANDARD_MINUTES, 0) for minutes in weekly_regular.values())
+    return totals
+
+def run_timesheet_benchmark(args) -> List[Dict[str, Any]]:
+    """勤怠集計（args.users ユーザー × 12か月）を日ごとのループと Timesheet（NumPy）で比較
+    
+    Timesheet は辞書形式とコンパクト形式（MonthRecords、読み込みキャッシュの形式）の両方から計測する。
+    """
+    from compact_records import MonthRecords
+    from timesheet import Timesheet
+    
+    rng = random.Random(args.seed)
+    months = [(2025, month) for month in range(1, 13)]
+    entries = []
+    for index in range(args.users):
+        history = sample_user_history(1, datetime(2025, 12, 31), rng)
+        for year, month in months:
+            prefix = f"{year:04d}-{month:02d}"
+            data = {date_str: record for date_str, record in history.items() if date_str.startswith(prefix)}
+            entries.append((f"user{index:05d}", year, month, data))
+    compact_entries = [(key, year, month, MonthRecords.from_dict(f"{year:04d}-{month:02d}", data))
+                       for key, year, month, data in entries]
+    Timesheet.from_months(entries[:1])  # numpy の読み込み・カレンダーの作成を計測から除く
+    
+    def scalar():
+        return [scalar_month_totals(year, month, data) for _, year, month, data in entries]
+    
+    def vectorized(source):
+        return lambda: Timesheet.from_months(source).totals
+    
+    results = []
+    expected = None
+    for name, run in [('日ごとのループ', scalar), ('Timesheet（辞書）', vectorized(entries)),
+                      ('Timesheet（MonthRecords）', vectorized(compact_entries))]:
+        started = time.perf_counter()
+        totals = run()
+        elapsed = time.perf_counter() - started
+        work_minutes = sum(total['work_minutes'] for total in totals) if isinstance(totals, list) else int(totals['work_minutes'].sum())
+        if expected is None:
+            expected = work_minutes
+        results.append({
+            'name': name,
+            'seconds': elapsed,
+            'rows_per_second': len(entries) / elapsed,
+            'matches': work_minutes == expected,
+        })
+    return results
+
+def print_timesheet_results(results: List[Dict[str, Any]], users: int):
+    print(f"\n=== timesheet ({users}ユーザー × 12か月) ===")
+    for result in results:
+        print(f"  {result['name']:<24} {result['seconds'] * 1000:>8.1f}ms / {result['rows_per_second']:>9.0f}件/秒 / "
+              f"実働合計一致 {'○' if result['matches'] else '×'}")
+    print(f"  比 {results[0]['seconds'] / results[-1]['seconds']:.1f}倍（日ごとのループ / Timesheet（MonthRecords））")
+
+def print_result(result: Dict[str, Any]):
+    print(f"\n=== {result['scenario']} ({result['requests']}リクエスト, 失敗 {result['failures']}件) ===")
+    print(f"  平均 {result['mean_ms']:.2f}ms / p50 {result['p50_ms']:.2f}ms / "
+          f"p95 {result['p95_ms']:.2f}ms / p99 {result['p99_ms']:.2f}ms")
+    print(f"  RPC/リクエスト {result['rpc_per_request']:.2f} / "
+          f"送信 {result['bytes_sent_per_request']:.0f}B / 受信 {result['bytes_received_per_request']:.0f}B / "
+          f"RPC失敗 {result['rpc_errors']}件")
+    print(f"  RPC内訳 {result['rpc_by_method']} / 読み込みキャッシュ ヒット率 {result['read_cache_hit_rate']:.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description='勤怠システムのベンチマーク（FakeFirestoreManager 使用）')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS) + ['all', 'memory', 'startup', 'excel', 'bulk', 'timesheet'], help='計測するシナリオ')
+    parser.add_argument('--requests', type=int, default=100, help='計測するリクエスト数')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='1 RPC あたりの遅延（ミリ秒）')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='遅延に加えるゆらぎの最大値（ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='RPC の失敗率（0〜1）')
+    parser.add_argument('--history-days', type=int, default=365, help='事前に投入する勤怠履歴の日数')
+    parser.add_argument('--seed', type=int, default=0, help='遅延・失敗の乱数シード')
+    parser.add_argument('--users', type=int, default=1000, help='memory: 換算するユーザー数 / timesheet: 集計するユーザー数')
+    parser.add_argument('--years', type=int, default=5, help='memory: ユーザーごとの履歴の年数')
+    parser.add_argument('--sample-users', type=int, default=50, help='memory: 実測するユーザー数')
+    parser.add_argument('--user-counts', default='10,100,1000', help='startup: 計測するユーザー数（カンマ区切り）')
+    parser.add_argument('--bulk-users', type=int, default=100, help='bulk: 出力するユーザー数')
+    parser.add_argument('--workers', default='0,1,2,4', help='bulk: 計測するワーカープロセス数（カンマ区切り、0 はスレッドのみ）')
+    parser.add_argument('--verbose', action='store_true', help='アプリのログを表示')
+    args = parser.parse_args()
+    
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    
+    if args.scenario == 'memory':
+        print_memory_result(run_memory_benchmark(args))
+        return
+    if args.scenario == 'startup':
+        print_startup_results(run_startup_benchmark(args))
+        return
+    if args.scenario == 'excel':
+        print_excel_results(run_excel_benchmark(args))
+        return
+    if args.scenario == 'bulk':
+        print_bulk_results(run_bulk_benchmark(args), args.bulk_users)
+        return
+    if args.scenario == 'timesheet':
+        print_timesheet_results(run_timesheet_benchmark(args), args.users)
+        return
+    
+    names = sorted(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    print(f"設定: 遅延 {args.latency_ms}ms ± {args.jitter_ms}ms / 失敗率 {args.error_rate} / 履歴 {args.history_days}日")
+    for name in names:
+        print_result(run_scenario(name, args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, Callable, Iterable, Iterator, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+class ExportJob(NamedTuple):
+    """一括出力する1件（ユーザー × 月）"""
+    username: str
+    display_name: str
+    year: int
+    month: int
+    
+    @property
+    def month_key(self) -> str:
+        return f"{self.year:04d}-{self.month:02d}"
+
+def parse_months(spec: Optional[str]) -> List[Tuple[int, int]]:
+    """'2025-04,2025-05' 形式の月の指定を (年, 月) のリストに変換（不正な指定は ValueError）"""
+    months = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        year_str, _, month_str = part.partition('-')
+        year, month = int(year_str), int(month_str)
+        if not 1 <= month <= 12:
+            raise ValueError(f"不正な月: {part}")
+        if (year, month) not in months:
+            months.append((year, month))
+    return months
+
+def render_report(year: int, month: int, data: Dict[str, Any], display_name: str) -> Tuple[str, bytes]:
+    """作業時間報告書を作成して (ファイル名, バイト列) を返す（ワーカープロセスで実行）"""
+    from excel_report import excel_report_engine
+    output, filename = excel_report_engine.build(year, month, data, display_name)
+    return filename, output.getvalue()
+
+class _ZipStream(io.RawIOBase):
+    """ZipFile の書き込み先（書き込まれたバイト列を溜め、drain で取り出す）"""
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class BulkExporter:
+    """複数ユーザー × 複数月の作業時間報告書を ZIP で一括出力
+    
+    勤怠データの取得はスレッドプール（I/O 待ちを並行させる）、ブックの作成は
+    プロセスプール（CPU コア数に応じて並列化する）で行う。ZIP は作成できた順に
+    ストリーミングで返し、同時に保持するレポートは処理中の数件分のみ。
+    """
+    
+    def __init__(self, max_workers: Optional[int] = None, fetch_workers: Optional[int] = None):
+        # 0 の場合はプロセスプールを使わず取得したスレッドでそのまま作成する
+        workers = max_workers if max_workers is not None else os.environ.get('BULK_EXPORT_WORKERS')
+        self.max_workers = int(workers) if workers not in (None, '') else (os.cpu_count() or 1)
+        self.fetch_workers = fetch_workers or int(os.environ.get('BULK_EXPORT_FETCH_WORKERS', '8'))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+    
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        """プロセスプールを取得（最初の一括出力で作成し、以降は再利用する）"""
+        if self.max_workers <= 0:
+            return None
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    try:
+                        # gRPC のスレッドを持つプロセスを fork しないよう spawn で起動する
+                        self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                    except (OSError, NotImplementedError) as e:
+                        logger.warning(f"プロセスプールを作成できません（スレッドで作成します）: {e}")
+                        self.max_workers = 0
+                        return None
+        return self._pool
+    
+    def shutdown(self):
+        """プロセスプールを終了"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+    
+    def _fetch_and_submit(self, job: ExportJob, load_month: Callable[[str, int, int], Dict[str, Any]]) -> Future:
+        """勤怠データを取得して作成処理を投入（取得用スレッドで実行）"""
+        data = load_month(job.username, job.year, job.month)
+        pool = self._get_pool()
+        if pool is not None:
+            return pool.submit(render_report, job.year, job.month, data, job.display_name)
+        
+        future: Future = Future()
+        try:
+            future.set_result(render_report(job.year, job.month, data, job.display_name))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def iter_reports(self, jobs: Iterable[ExportJob],
+                     load_month: Callable[[str, int, int], Dict[str, Any]]) -> Iterator[Tuple[ExportJob, Optional[bytes], Optional[str]]]:
+        """(ジョブ, レポート, エラー) をジョブの順に返す（処理中のジョブはワーカー数の2倍まで）"""
+        window = max(self.max_workers, 1) * 2
+        jobs = iter(jobs)
+        pending: deque = deque()
+        with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='bulk-export') as fetch_pool:
+            def submit_next() -> bool:
+                job = next(jobs, None)
+                if job is None:
+                    return False
+                pending.append((job, fetch_pool.submit(self._fetch_and_submit, job, load_month)))
+                return True
+            
+            while len(pending) < window and submit_next():
+                pass
+            while pending:
+                job, fetched = pending.popleft()
+                try:
+                    _, content = fetched.result().result()
+                    yield job, content, None
+                except Exception as e:
+                    logger.error(f"一括出力失敗: {job.username} {job.month_key} - {e}")
+                    yield job, None, str(e)
+                submit_next()
+    
+    @staticmethod
+    def archive_name(job: ExportJob) -> str:
+        """ZIP 内のパス（月ごとのフォルダに、ユーザー名を付けて重複を避ける）"""
+        from excel_report import report_filename
+        return f"{job.month_key}/{job.username}_{report_filename(job.year, job.month, job.display_name)}"
+    
+    def stream_zip(self, jobs: Iterable[ExportJob],
+                   load_month: Callable[[str, int, int], Dict[str, Any]]) -> Iterator[bytes]:
+        """ZIP のバイト列をレポート1件ごとに返す（失敗したジョブは errors.txt に記録）"""
+        stream = _ZipStream()
+        errors = []
+        exported = 0
+        # xlsx は既に圧縮されているため、無圧縮で格納する
+        with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for job, content, error in self.iter_reports(jobs, load_month):
+                if content is None:
+                    errors.append(f"{job.month_key}\t{job.username}\t{error}")
+                    continue
+                archive.writestr(self.archive_name(job), content)
+                exported += 1
+                yield stream.drain()
+            if errors:
+                archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+        logger.info(f"一括出力完了: {exported}件 / 失敗 {len(errors)}件")
+        yield stream.drain()
+
+# グローバルインスタンス
+bulk_exporter = BulkExporter()
@@ -0,0 +1,347 @@
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+from datetime import date
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+# 列の値の特別な意味（int16）
+MISSING = -1  # フィールドなし
+EMPTY = -2    # 空文字
+INT16_MAX = 32767
+
+DAYS_PER_MONTH = 31
+
+# 数値として保持する列: フィールド名 -> 種類
+#   time : 'HH:MM' を分に変換
+#   hours: '1.0' のような時間数を分に変換
+#   int  : '480' のような整数
+NUMERIC_FIELDS = {
+    'check_in': 'time',
+    'check_out': 'time',
+    'break_time': 'hours',
+    'travel_cost': 'int',
+}
+
+# 月ごとの文字列表への添字として保持する列
+TEXT_FIELDS = ('travel_from', 'travel_to', 'notes')
+
+COLUMNS = tuple(NUMERIC_FIELDS) + TEXT_FIELDS
+_COLUMN_INDEX = {field: i for i, field in enumerate(COLUMNS)}
+
+# 文字列表に intern する文字列の最大長（駅名など繰り返し現れる値をユーザー間で共有）
+_INTERN_MAX_LENGTH = 64
+
+def _encode_time(value: Any) -> Optional[int]:
+    if value == '':
+        return EMPTY
+    if (isinstance(value, str) and len(value) == 5 and value[2] == ':' and value.isascii()
+            and value[:2].isdigit() and value[3:].isdigit() and int(value[3:]) < 60):
+        return int(value[:2]) * 60 + int(value[3:])
+    return None
+
+def _decode_time(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _encode_hours(value: Any) -> Optional[int]:
+    if value == '':
+        return EMPTY
+    if not isinstance(value, str):
+        return None
+    try:
+        minutes = round(float(value) * 60)
+    except (ValueError, OverflowError):
+        return None
+    if 0 <= minutes <= INT16_MAX and _decode_hours(minutes) == value:
+        return minutes
+    return None
+
+def _decode_hours(minutes: int) -> str:
+    return str(minutes / 60)
+
+def _encode_int(value: Any) -> Optional[int]:
+    if value == '':
+        return EMPTY
+    if isinstance(value, str) and value.isascii() and value.isdigit() and str(int(value)) == value \
+            and int(value) <= INT16_MAX:
+        return int(value)
+    return None
+
+_ENCODERS = {'time': _encode_time, 'hours': _encode_hours, 'int': _encode_int}
+_DECODERS = {'time': _decode_time, 'hours': _decode_hours, 'int': str}
+
+class MonthRecords(Mapping):
+    """1ユーザー1か月分の勤怠データ（日付 -> その日の記録）
+    
+    既知のフィールドは列ごとに int16 の配列（列数 × 31日）で保持し、文字列の列は
+    月ごとの文字列表への添字として保持する。表現できない値（'9:00' のような非正規の
+    書式や未知のフィールド）は extra にそのまま保持するため、辞書形式との変換は可逆。
+    """
+    
+    __slots__ = ('month_key', 'present', 'values', 'strings', 'extra')
+    
+    def __init__(self, month_key: str):
+        self.month_key = month_key
+        # 記録が存在する日のビットマスク（空の記録 {} も存在として扱う）
+        self.present = 0
+        self.values = array('h', [MISSING]) * (len(COLUMNS) * DAYS_PER_MONTH)
+        self.strings: List[str] = []
+        self.extra: Optional[Dict[int, Dict[str, Any]]] = None
+    
+    @classmethod
+    def from_dict(cls, month_key: str, days: Dict[str, Dict[str, Any]]) -> 'MonthRecords':
+        """辞書形式（'YYYY-MM-DD' -> 記録）から作成（month_key の月の日付のみ）"""
+        records = cls(month_key)
+        for date_str, day_data in days.items():
+            day = records._day_of(date_str)
+            if day is not None:
+                records.set_day(day, day_data)
+        return records
+    
+    def to_dict(self, first_day: int = 1, last_day: int = DAYS_PER_MONTH) -> Dict[str, Dict[str, Any]]:
+        """辞書形式に変換（first_day〜last_day の日のみ）"""
+        return {self._date_str(day): self.get_day(day) for day in self.days(first_day, last_day)}
+    
+    def days(self, first_day: int = 1, last_day: int = DAYS_PER_MONTH) -> List[int]:
+        """記録が存在する日（first_day〜last_day の範囲、既定は1〜31）"""
+        present = self.present
+        return [day for day in range(first_day, last_day + 1) if present >> (day - 1) & 1]
+    
+    def has_day(self, day: int) -> bool:
+        return bool(self.present >> (day - 1) & 1)
+    
+    def get_day(self, day: int) -> Optional[Dict[str, Any]]:
+        """指定日の記録を辞書で取得（記録がない場合は None）"""
+        if not self.has_day(day):
+            return None
+        record = {}
+        base = day - 1
+        for column, field in enumerate(COLUMNS):
+            code = self.values[column * DAYS_PER_MONTH + base]
+            if code == MISSING:
+                continue
+            if code == EMPTY:
+                record[field] = ''
+            elif field in NUMERIC_FIELDS:
+                record[field] = _DECODERS[NUMERIC_FIELDS[field]](code)
+            else:
+                record[field] = self.strings[code]
+        if self.extra and day in self.extra:
+            record.update(self.extra[day])
+        return record
+    
+    def set_day(self, day: int, day_data: Dict[str, Any]):
+        """指定日の記録を置き換え"""
+        self._clear_day(day)
+        self.present |= 1 << (day - 1)
+        for field, value in day_data.items():
+            self.set_field(day, field, value)
+    
+    def set_field(self, day: int, field: str, value: Any):
+        """指定日の1フィールドを設定"""
+        self.present |= 1 << (day - 1)
+        index = _COLUMN_INDEX.get(field)
+        code = self._encode(field, value) if index is not None else None
+        
+        if code is None:
+            # 列で表現できない値は extra に保持（列側の値は消す）
+            if index is not None:
+                self.values[index * DAYS_PER_MONTH + day - 1] = MISSING
+            extra = dict(self.extra or {})
+            extra[day] = dict(extra.get(day, {}))
+            extra[day][field] = value
+            self.extra = extra
+            return
+        
+        self.values[index * DAYS_PER_MONTH + day - 1] = code
+        if self.extra and field in self.extra.get(day, {}):
+            extra = dict(self.extra)
+            extra[day] = {k: v for k, v in extra[day].items() if k != field}
+            if not extra[day]:
+                del extra[day]
+            self.extra = extra or None
+    
+    def column(self, field: str) -> array:
+        """数値列（31日分、MISSING / EMPTY を含む）を取得（集計用）"""
+        start = _COLUMN_INDEX[field] * DAYS_PER_MONTH
+        return self.values[start:start + DAYS_PER_MONTH]
+    
+    def __getitem__(self, date_str: str) -> Dict[str, Any]:
+        day = self._day_of(date_str)
+        record = self.get_day(day) if day is not None else None
+        if record is None:
+            raise KeyError(date_str)
+        return record
+    
+    def __iter__(self) -> Iterator[str]:
+        return (self._date_str(day) for day in self.days())
+    
+    def __len__(self) -> int:
+        return bin(self.present).count('1')
+    
+    def _encode(self, field: str, value: Any) -> Optional[int]:
+        if field in NUMERIC_FIELDS:
+            return _ENCODERS[NUMERIC_FIELDS[field]](value)
+        if value == '':
+            return EMPTY
+        if not isinstance(value, str):
+            return None
+        try:
+            return self.strings.index(value)
+        except ValueError:
+            if len(self.strings) >= INT16_MAX:
+                return None
+            self.strings.append(sys.intern(value) if len(value) <= _INTERN_MAX_LENGTH else value)
+            return len(self.strings) - 1
+    
+    def _clear_day(self, day: int):
+        for column in range(len(COLUMNS)):
+            self.values[column * DAYS_PER_MONTH + day - 1] = MISSING
+        if self.extra and day in self.extra:
+            extra = {d: v for d, v in self.extra.items() if d != day}
+            self.extra = extra or None
+        self.present &= ~(1 << (day - 1))
+    
+    def _date_str(self, day: int) -> str:
+        return f"{self.month_key}-{day:02d}"
+    
+    def _day_of(self, date_str: str) -> Optional[int]:
+        month_key, day = _split_date(date_str)
+        return day if month_key == self.month_key else None
+
+class UserRecords(MutableMapping):
+    """1ユーザー分の勤怠データ（日付 -> その日の記録）を月ごとの MonthRecords で保持
+    
+    従来の辞書形式と同じく日付文字列で読み書きできる。取得した記録は辞書のコピーのため、
+    1フィールドの更新には set_field() を使う。日付として解釈できないキーは others に
+    そのまま保持する。
+    """
+    
+    def __init__(self, data: Optional[Dict[str, Dict[str, Any]]] = None):
+        # 月の追加はリスナーのスレッドからも行われるため辞書ごと差し替える
+        self.months: Dict[str, MonthRecords] = {}
+        self.others: Dict[str, Any] = {}
+        if data:
+            self.update_many(data)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, Any]]) -> 'UserRecords':
+        return cls(data)
+    
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """辞書形式に変換"""
+        result = {}
+        for month_key in sorted(self.months):
+            result.update(self.months[month_key].to_dict())
+        result.update(self.others)
+        return result
+    
+    def update_many(self, data: Dict[str, Dict[str, Any]]):
+        """複数日の記録をまとめて置き換え（月ごとにまとめて反映）"""
+        months = dict(self.months)
+        others = dict(self.others)
+        for date_str, day_data in data.items():
+            month_key, day = _split_date(date_str)
+            if day is None or not isinstance(day_data, dict):
+                others[date_str] = day_data
+                continue
+            records = months.get(month_key)
+            if records is None:
+                records = months[month_key] = MonthRecords(month_key)
+            records.set_day(day, day_data)
+        self.months = months
+        self.others = others
+    
+    def month(self, month_key: str) -> Optional[MonthRecords]:
+        """指定月（YYYY-MM）の記録"""
+        return self.months.get(month_key)
+    
+    def range_to_dict(self, start: date, end: date) -> Dict[str, Dict[str, Any]]:
+        """期間内（両端を含む）の記録を辞書形式で取得（期間内の月だけを参照）"""
+        result = {}
+        months = self.months
+        for month_key in month_keys(start, end):
+            records = months.get(month_key)
+            if records is None:
+                continue
+            first_day = start.day if month_key == start.strftime('%Y-%m') else 1
+            last_day = end.day if month_key == end.strftime('%Y-%m') else DAYS_PER_MONTH
+            result.update(records.to_dict(first_day, last_day))
+        return result
+    
+    def replace_month(self, month_key: str, month_data: Dict[str, Dict[str, Any]]):
+        """指定月の記録を置き換え"""
+        months = dict(self.months)
+        months[month_key] = MonthRecords.from_dict(month_key, month_data)
+        if not months[month_key]:
+            del months[month_key]
+        self.months = months
+    
+    def set_field(self, date_str: str, field: str, value: Any):
+        """指定日の1フィールドを設定"""
+        month_key, day = _split_date(date_str)
+        if day is None:
+            others = dict(self.others)
+            others[date_str] = dict(others.get(date_str) or {})
+            others[date_str][field] = value
+            self.others = others
+            return
+        records = self.months.get(month_key)
+        if records is None:
+            months = dict(self.months)
+            records = months[month_key] = MonthRecords(month_key)
+            self.months = months
+        records.set_field(day, field, value)
+    
+    def __getitem__(self, date_str: str) -> Dict[str, Any]:
+        month_key, day = _split_date(date_str)
+        if day is None:
+            return self.others[date_str]
+        records = self.months.get(month_key)
+        record = records.get_day(day) if records is not None else None
+        if record is None:
+            raise KeyError(date_str)
+        return record
+    
+    def __setitem__(self, date_str: str, day_data: Dict[str, Any]):
+        self.update_many({date_str: day_data})
+    
+    def __delitem__(self, date_str: str):
+        month_key, day = _split_date(date_str)
+        if day is None:
+            others = dict(self.others)
+            del others[date_str]
+            self.others = others
+            return
+        records = self.months.get(month_key)
+        if records is None or not records.has_day(day):
+            raise KeyError(date_str)
+        records._clear_day(day)
+    
+    def __iter__(self) -> Iterator[str]:
+        for month_key in sorted(self.months):
+            yield from self.months[month_key]
+        yield from list(self.others)
+    
+    def __len__(self) -> int:
+        return sum(len(records) for records in self.months.values()) + len(self.others)
+
+def month_keys(start: date, end: date) -> List[str]:
+    """期間（両端を含む）に含まれる月キー（YYYY-MM）の一覧"""
+    keys = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return keys
+
+def _split_date(date_str: Any) -> Tuple[Optional[str], Optional[int]]:
+    """'YYYY-MM-DD' を (月キー, 日) に分解（日付でない場合は日が None）"""
+    if not isinstance(date_str, str) or len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return None, None
+    try:
+        parsed = date(int(date_str[:4]), int(date_str[5:7]), int(date_str[8:]))
+    except ValueError:
+        return None, None
+    if parsed.strftime('%Y-%m-%d') != date_str:
+        return None, None
+    return date_str[:7], parsed.day
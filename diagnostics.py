@@ -0,0 +1,62 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ドキュメント数を表示するコレクション
+DIAGNOSTIC_COLLECTIONS: Tuple[str, ...] = ('users', 'user_sessions', 'user_attendance')
+
+class StorageDiagnostics:
+    """管理者向け診断情報（コレクションのドキュメント数）のキャッシュ
+    
+    ドキュメント数は集計クエリ（count_documents）で取得し、ドキュメント本体は読まない。
+    取得結果は DIAGNOSTICS_CACHE_TTL 秒（既定 60）保持し、期限切れの時に同時に来たリクエストは
+    1回の取得を待って同じ結果を返す（監視の頻度やアクセス数に関係なく RPC は TTL ごとにコレクション数分）。
+    """
+    
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('DIAGNOSTICS_CACHE_TTL', '60'))
+        
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._storage = None
+        self._collected = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'refreshes': 0}
+    
+    def snapshot(self, storage) -> Dict[str, Any]:
+        """ドキュメント数（TTL 内は前回の結果。'age_seconds' は取得からの経過秒数）"""
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or self._storage is not storage or now >= self._collected + self.ttl:
+                self._snapshot = self._collect(storage)
+                self._storage = storage
+                self._collected = time.monotonic()
+                self._stats['refreshes'] += 1
+            else:
+                self._stats['hits'] += 1
+            return dict(self._snapshot, age_seconds=round(time.monotonic() - self._collected, 1))
+    
+    @staticmethod
+    def _collect(storage) -> Dict[str, Any]:
+        counts: Dict[str, Optional[int]] = {}
+        if storage.is_available():
+            for collection in DIAGNOSTIC_COLLECTIONS:
+                counts[collection] = storage.count_documents(collection)
+        logger.debug(f"診断情報を取得: {counts}")
+        return {'counts': counts, 'collected_at': datetime.now().isoformat()}
+    
+    def invalidate(self):
+        """保持している結果を破棄（次の参照で取得し直す）"""
+        with self._lock:
+            self._snapshot = None
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, ttl=self.ttl)
+
+# グローバルインスタンス
+storage_diagnostics = StorageDiagnostics()
@@ -0,0 +1,544 @@
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Any, Optional, List, Tuple
+
+from metrics import excel_report_duration, excel_report_size
+from startup_report import startup_report
+from work_calendar import work_calendar, CalendarDay
+from timesheet import Timesheet
+
+# テンプレートの版（レイアウト・書式を変更したら上げる。作成済みレポートのキャッシュキーに含まれる）
+TEMPLATE_VERSION = '1'
+
+# 作業時間報告書のレイアウト
+FONT_NAME = 'MS Gothic'
+COLUMN_WIDTHS = [5, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4]
+ROW_COUNT = 59
+ROW_HEIGHT = 22
+TITLE_ROW_HEIGHT = 32
+HEADERS = ["日付", "曜日", "出勤時間", "退勤時間", "実働時間", "交通費", "出発駅", "目的駅", "備考"]
+CUSTOMER_NAME = "株式会社LINE"
+COMPANY_NAME = "HIGHFLAT"
+
+HEADER_ROW = 13
+FIRST_DAY_ROW = 14
+LEFT_DAYS = 16           # 左側（B列～J列）は 1-16日、右側（L列～T列）は 17日以降
+LEFT_FIRST_COLUMN = 2
+RIGHT_FIRST_COLUMN = 12
+SUM_ROW = FIRST_DAY_ROW + LEFT_DAYS
+NOTES_ROW = SUM_ROW + 2
+NOTES_ROWS = 8
+
+# 日ごとの行の列スタイル（曜日列は土日祝で赤字に差し替える）
+DAY_COLUMN_STYLES = ['report_cell', 'report_cell', 'report_cell', 'report_cell', 'report_cell',
+                     'report_cell', 'report_cell', 'report_cell', 'report_cell_left']
+WEEKDAY_COLUMN = 1
+
+def to_wareki(year: int, month: int) -> str:
+    """和暦（元号と年）"""
+    if year > 2019 or (year == 2019 and month >= 5):
+        return f"令和 {year-2018}"
+    else:
+        return f"平成 {year-1988 if year >= 1989 else year}"
+
+def day_row_values(calendar_day: CalendarDay, attendance: Dict[str, Any], work_min: Optional[int]) -> List[Any]:
+    """1日分の表の値（日付～備考）。実働時間（分）は Timesheet で計算したもの"""
+    return [
+        calendar_day.date.day,
+        calendar_day.jp_weekday,
+        attendance.get('check_in', ''),
+        attendance.get('check_out', ''),
+        f"{work_min/60:.2f}" if work_min is not None else "",
+        attendance.get('travel_cost', ''),
+        attendance.get('travel_from', ''),
+        attendance.get('travel_to', ''),
+        attendance.get('notes', ''),
+    ]
+
+def report_filename(year: int, month: int, user_display_name: Optional[str]) -> str:
+    return f"作業時間報告書_{year}年{month}月_{user_display_name or '氏名未入力'}.xlsx"
+
+class ReportTemplate:
+    """作業時間報告書の静的レイアウト（プロセス内で1回だけ作成）
+    
+    列幅・行高・結合セル・固定の見出しと、名前付きスタイルの定義を保持する。
+    rows は行ごと（1行目から）の列のリストで、各要素は (値, スタイル名) または None。
+    """
+    
+    def __init__(self):
+        openpyxl = startup_report.import_module('openpyxl')
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+        from openpyxl.utils import get_column_letter
+        
+        self.workbook_class = openpyxl.Workbook
+        self.cell_class = WriteOnlyCell
+        self.named_style_class = NamedStyle
+        
+        title_font = Font(name=FONT_NAME, size=16, bold=True)
+        header_font = Font(name=FONT_NAME, size=10, bold=True)
+        normal_font = Font(name=FONT_NAME, size=9)
+        red_font = Font(name=FONT_NAME, size=9, color="FF0000", bold=True)
+        bold_font = Font(name=FONT_NAME, size=9, bold=True)
+        
+        table_fill = PatternFill(start_color="CCFFCC", end_color="CCFFCC", fill_type="solid")
+        header_fill = PatternFill(start_color="99FF99", end_color="99FF99", fill_type="solid")
+        company_fill = PatternFill(start_color="E6FFE6", end_color="E6FFE6", fill_type="solid")
+        white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+        
+        thin = Side(style='thin', color='000000')
+        thin_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        
+        center = Alignment(horizontal='center', vertical='center')
+        left = Alignment(horizontal='left', vertical='center')
+        top = Alignment(horizontal='left', vertical='top')
+        
+        # 名前付きスタイル（NamedStyle はブックに結び付くため、ブックごとにこの定義から作成する）
+        self.style_specs: Dict[str, Dict[str, Any]] = {
+            'report_title': {'font': title_font, 'alignment': center},
+            'report_header': {'font': header_font, 'alignment': center},
+            'report_company': {'font': normal_font, 'alignment': left, 'fill': company_fill},
+            'report_table_header': {'font': header_font, 'alignment': center, 'fill': header_fill, 'border': thin_border},
+            'report_cell': {'font': normal_font, 'alignment': center, 'fill': table_fill, 'border': thin_border},
+            'report_cell_left': {'font': normal_font, 'alignment': left, 'fill': table_fill, 'border': thin_border},
+            'report_cell_red': {'font': red_font, 'alignment': center, 'fill': table_fill, 'border': thin_border},
+            'report_total': {'font': bold_font, 'alignment': center, 'fill': header_fill, 'border': thin_border},
+            'report_notes_label': {'font': header_font, 'alignment': top, 'fill': white_fill, 'border': thin_border},
+            'report_border': {'border': thin_border},
+            'report_info_label': {'font': header_font, 'alignment': left},
+            'report_info': {'font': normal_font, 'alignment': left},
+        }
+        
+        self.column_widths = {get_column_letter(i + 1): width for i, width in enumerate(COLUMN_WIDTHS)}
+        self.row_heights = {row: ROW_HEIGHT for row in range(1, ROW_COUNT + 1)}
+        self.row_heights[2] = TITLE_ROW_HEIGHT
+        self.merged_ranges = ['B2:T2', f'B{NOTES_ROW}:H{NOTES_ROW + NOTES_ROWS - 1}']
+        
+        self.rows: List[List[Optional[Tuple[Any, str]]]] = [[None] * len(COLUMN_WIDTHS) for _ in range(ROW_COUNT)]
+        self.put(2, 2, "作業時間報告書", 'report_title')
+        for column, value in ((4, "年"), (6, "月度")):
+            self.put(4, column, value, 'report_header')
+        for column, value in ((2, "対応客先名"), (6, "会社名"), (9, "氏名")):
+            self.put(7, column, value, 'report_header')
+        for column, value in ((3, CUSTOMER_NAME), (7, COMPANY_NAME)):
+            self.put(7, column, value, 'report_company')
+        for first_column in (LEFT_FIRST_COLUMN, RIGHT_FIRST_COLUMN):
+            for i, header in enumerate(HEADERS):
+                self.put(HEADER_ROW, first_column + i, header, 'report_table_header')
+        self.put(SUM_ROW, 15, "計", 'report_total')
+        self.put(SUM_ROW, 18, "交通費合計", 'report_total')
+        for row in range(NOTES_ROW, NOTES_ROW + NOTES_ROWS):
+            for column in range(2, 9):
+                self.put(row, column, None, 'report_border')
+        self.put(NOTES_ROW, 2, "備考", 'report_notes_label')
+        self.put(NOTES_ROW, 13, "実働時間合計", 'report_info_label')
+        self.put(NOTES_ROW + 2, 13, "自", 'report_info')
+        self.put(NOTES_ROW + 3, 13, "至", 'report_info')
+    
+    def put(self, row: int, column: int, value: Any, style: str, rows: Optional[List[list]] = None):
+        """セルの値とスタイルを設定（rows を省略した場合はテンプレート自体）"""
+        (self.rows if rows is None else rows)[row - 1][column - 1] = (value, style)
+
+class ExcelReportEngine:
+    """作業時間報告書の作成（静的レイアウトを再利用し、日ごとの行だけを埋める）
+    
+    ブックは write-only（ストリーミング）モードで作成し、セルには名前付きスタイルを
+    名前で割り当てる（セルごとに Font・PatternFill などを登録し直さない）。
+    """
+    
+    def __init__(self):
+        self._template: Optional[ReportTemplate] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def template(self) -> ReportTemplate:
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    self._template = ReportTemplate()
+        return self._template
+    
+    def fill_rows(self, year: int, month: int, data: Dict[str, Any], user_display_name: Optional[str]) -> List[list]:
+        """テンプレートの行をコピーして年月・氏名・日ごとの行・合計を埋める"""
+        template = self.template
+        rows = [list(row) for row in template.rows]
+        
+        wareki = [to_wareki(year, month), f"{year}", "年", f"{month}", "月度"]
+        for i, value in enumerate(wareki):
+            template.put(4, 2 + i, value, 'report_header', rows)
+        template.put(7, 10, user_display_name or "", 'report_company', rows)
+        
+        days = work_calendar.month_days(year, month)
+        sheet = Timesheet.from_month(year, month, data)
+        daily_work = sheet.daily_work_minutes()
+        for index, calendar_day in enumerate(days):
+            attendance = data.get(calendar_day.date.strftime('%Y-%m-%d'), {})
+            values = day_row_values(calendar_day, attendance, daily_work[index])
+            
+            if index < LEFT_DAYS:
+                row, first_column = FIRST_DAY_ROW + index, LEFT_FIRST_COLUMN
+            else:
+                row, first_column = FIRST_DAY_ROW + index - LEFT_DAYS, RIGHT_FIRST_COLUMN
+            cells = rows[row - 1]
+            for i, value in enumerate(values):
+                cells[first_column - 1 + i] = (value, DAY_COLUMN_STYLES[i])
+            if calendar_day.is_day_off:
+                cells[first_column - 1 + WEEKDAY_COLUMN] = (values[WEEKDAY_COLUMN], 'report_cell_red')
+        
+        total_work = int(sheet.totals['work_minutes'][0])
+        total_travel = float(sheet.totals['travel_total'][0])
+        template.put(SUM_ROW, 16, f"{total_work/60:.2f}", 'report_total', rows)
+        template.put(SUM_ROW, 19, f"{total_travel:.0f}", 'report_total', rows)
+        template.put(NOTES_ROW, 14, f"{total_work/60:.2f} h", 'report_info', rows)
+        template.put(NOTES_ROW + 2, 14, f"{year}年{month}月1日", 'report_info', rows)
+        template.put(NOTES_ROW + 3, 14, f"{year}年{month}月{days[-1].date.day}日", 'report_info', rows)
+        return rows
+    
+    def build(self, year: int, month: int, data: Dict[str, Any], user_display_name: Optional[str]) -> Tuple[BytesIO, str]:
+        """Excelレポートを作成（メモリ上で作成し、(BytesIO, ファイル名) を返す）"""
+        started = time.perf_counter()
+        template = self.template
+        rows = self.fill_rows(year, month, data, user_display_name)
+        
+        wb = template.workbook_class(write_only=True)
+        for name, spec in template.style_specs.items():
+            wb.add_named_style(template.named_style_class(name=name, **spec))
+        ws = wb.create_sheet("template")
+        for letter, width in template.column_widths.items():
+            ws.column_dimensions[letter].width = width
+        for row, height in template.row_heights.items():
+            ws.row_dimensions[row].height = height
+        for cell_range in template.merged_ranges:
+            ws.merged_cells.add(cell_range)
+        
+        cell_class = template.cell_class
+        for cells in rows:
+            row_cells = []
+            for entry in cells:
+                if entry is None:
+                    row_cells.append(None)
+                    continue
+                cell = cell_class(ws, entry[0])
+                cell.style = entry[1]
+                row_cells.append(cell)
+            ws.append(row_cells)
+        
+        output = BytesIO()
+        wb.save(output)
+        output.seek(0)
+        excel_report_duration.observe(time.perf_counter() - started)
+        excel_report_size.observe(output.getbuffer().nbytes)
+        return output, report_filename(year, month, user_display_name)
+
+def build_report_legacy(year, month, data, user_display_name):
+    """従来のセル単位の作成処理（新しい処理との比較・ベンチマーク用）"""
+    import calendar
+    openpyxl = startup_report.import_module('openpyxl')
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+    
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "template"
+    
+    # 和暦変換関数
+    def to_wareki(y, m):
+        if y > 2019 or (y == 2019 and m >= 5):
+            return f"令和 {y-2018}"
+        else:
+            return f"平成 {y-1988 if y >= 1989 else y}"
+    
+    # スタイル定義
+    title_font = Font(name='MS Gothic', size=16, bold=True)
+    header_font = Font(name='MS Gothic', size=10, bold=True)
+    normal_font = Font(name='MS Gothic', size=9)
+    red_font = Font(name='MS Gothic', size=9, color="FF0000", bold=True)
+    bold_font = Font(name='MS Gothic', size=9, bold=True)
+    
+    # 色定義
+    table_fill = PatternFill(start_color="CCFFCC", end_color="CCFFCC", fill_type="solid")
+    header_fill = PatternFill(start_color="99FF99", end_color="99FF99", fill_type="solid")
+    company_fill = PatternFill(start_color="E6FFE6", end_color="E6FFE6", fill_type="solid")
+    white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+    
+    # 罫線定義
+    thin = Side(style='thin', color='000000')
+    thin_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    
+    # 配置定義
+    center = Alignment(horizontal='center', vertical='center')
+    left = Alignment(horizontal='left', vertical='center')
+    top = Alignment(horizontal='left', vertical='top')
+    
+    # 列幅設定
+    col_widths = [5, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4, 10, 12, 14, 14, 14, 10, 14, 14, 18, 4]
+    for i, w in enumerate(col_widths):
+        ws.column_dimensions[get_column_letter(i+1)].width = w
+    
+    # 行高設定
+    for r in range(1, 60):
+        ws.row_dimensions[r].height = 22
+    ws.row_dimensions[2].height = 32
+    
+    # タイトル
+    ws.merge_cells('B2:T2')
+    ws['B2'] = "作業時間報告書"
+    ws['B2'].font = title_font
+    ws['B2'].alignment = center
+    
+    # 年月度
+    ws['B4'] = to_wareki(year, month)
+    ws['C4'] = f"{year}"
+    ws['D4'] = "年"
+    ws['E4'] = f"{month}"
+    ws['F4'] = "月度"
+    for cell in ['B4', 'C4', 'D4', 'E4', 'F4']:
+        ws[cell].font = header_font
+        ws[cell].alignment = center
+    
+    # 会社情報
+    ws['B7'] = "対応客先名"
+    ws['C7'] = "株式会社LINE"
+    ws['F7'] = "会社名"
+    ws['G7'] = "HIGHFLAT"
+    ws['I7'] = "氏名"
+    ws['J7'] = user_display_name or ""
+    
+    # 会社情報のスタイル
+    for label_cell in ['B7', 'F7', 'I7']:
+        ws[label_cell].font = header_font
+        ws[label_cell].alignment = center
+    for value_cell in ['C7', 'G7', 'J7']:
+        ws[value_cell].font = normal_font
+        ws[value_cell].alignment = left
+        ws[value_cell].fill = company_fill
+    
+    # テーブルヘッダー（左側と右側）
+    headers = ["日付", "曜日", "出勤時間", "退勤時間", "実働時間", "交通費", "出発駅", "目的駅", "備考"]
+    
+    # 左側ヘッダー（B列～J列）
+    for i, h in enumerate(headers):
+        cell = ws.cell(row=13, column=2+i, value=h)
+        cell.font = header_font
+        cell.alignment = center
+        cell.fill = header_fill
+        cell.border = thin_border
+    
+    # 右側ヘッダー（L列～T列）
+    for i, h in enumerate(headers):
+        cell = ws.cell(row=13, column=12+i, value=h)
+        cell.font = header_font
+        cell.alignment = center
+        cell.fill = header_fill
+        cell.border = thin_border
+    
+    # 月の日ごとの曜日・祝日（年ごとの表から取得）
+    days = work_calendar.month_days(year, month)
+    
+    # 左側（1-16日）と右側（17-31日）に分割
+    left_days = days[:16]
+    right_days = days[16:]
+    
+    total_work = 0
+    total_travel = 0
+    
+    # 左側データ（B列～J列）
+    for idx, calendar_day in enumerate(left_days):
+        r = 14 + idx
+        d = calendar_day.date
+        date_str = d.strftime('%Y-%m-%d')
+        jp_week = calendar_day.jp_weekday
+        
+        # データ取得（Firestoreデータフォーマットに対応）
+        att = data.get(date_str, {})
+        check_in = att.get('check_in', '')
+        check_out = att.get('check_out', '')
+        break_time = float(att.get('break_time', '1.0') or 1.0)
+        notes = att.get('notes', '')
+        travel_cost = att.get('travel_cost', '')
+        travel_from = att.get('travel_from', '')
+        travel_to = att.get('travel_to', '')
+        
+        is_holiday = calendar_day.is_holiday or calendar_day.is_closure
+        
+        # 実働時間計算
+        def get_minutes(t):
+            if not t: return None
+            try:
+                h, m = map(int, t.split(':'))
+                return h*60 + m
+            except:
+                return None
+        
+        work_min = None
+        if check_in and check_out:
+            in_min = get_minutes(check_in)
+            out_min = get_minutes(check_out)
+            if in_min is not None and out_min is not None:
+                work_min = out_min - in_min - int(break_time*60)
+                if work_min < 0: work_min = None
+        
+        if work_min:
+            total_work += work_min
+        
+        try:
+            if travel_cost:
+                total_travel += float(travel_cost)
+        except:
+            pass
+        
+        # セルに値を設定
+        ws.cell(row=r, column=2, value=d.day).font = normal_font
+        
+        # 曜日（土日祝は赤色）
+        weekday_cell = ws.cell(row=r, column=3, value=jp_week)
+        if jp_week in ['土','日'] or is_holiday:
+            weekday_cell.font = red_font
+        else:
+            weekday_cell.font = normal_font
+        
+        ws.cell(row=r, column=4, value=check_in).font = normal_font
+        ws.cell(row=r, column=5, value=check_out).font = normal_font
+        ws.cell(row=r, column=6, value=(f"{work_min/60:.2f}" if work_min is not None else "")).font = normal_font
+        ws.cell(row=r, column=7, value=travel_cost).font = normal_font
+        ws.cell(row=r, column=8, value=travel_from).font = normal_font
+        ws.cell(row=r, column=9, value=travel_to).font = normal_font
+        ws.cell(row=r, column=10, value=notes).font = normal_font
+        
+        # スタイル適用
+        for i in range(9):
+            c = ws.cell(row=r, column=2+i)
+            c.fill = table_fill
+            c.border = thin_border
+            c.alignment = center if i not in [8] else left  # 備考欄は左寄せ
+    
+    # 右側データ（L列～T列）
+    for idx, calendar_day in enumerate(right_days):
+        r = 14 + idx
+        d = calendar_day.date
+        date_str = d.strftime('%Y-%m-%d')
+        jp_week = calendar_day.jp_weekday
+        
+        # データ取得
+        att = data.get(date_str, {})
+        check_in = att.get('check_in', '')
+        check_out = att.get('check_out', '')
+        break_time = float(att.get('break_time', '1.0') or 1.0)
+        notes = att.get('notes', '')
+        travel_cost = att.get('travel_cost', '')
+        travel_from = att.get('travel_from', '')
+        travel_to = att.get('travel_to', '')
+        
+        is_holiday = calendar_day.is_holiday or calendar_day.is_closure
+        
+        # 実働時間計算
+        work_min = None
+        if check_in and check_out:
+            in_min = get_minutes(check_in)
+            out_min = get_minutes(check_out)
+            if in_min is not None and out_min is not None:
+                work_min = out_min - in_min - int(break_time*60)
+                if work_min < 0: work_min = None
+        
+        if work_min:
+            total_work += work_min
+        
+        try:
+            if travel_cost:
+                total_travel += float(travel_cost)
+        except:
+            pass
+        
+        # セルに値を設定
+        ws.cell(row=r, column=12, value=d.day).font = normal_font
+        
+        # 曜日（土日祝は赤色）
+        weekday_cell = ws.cell(row=r, column=13, value=jp_week)
+        if jp_week in ['土','日'] or is_holiday:
+            weekday_cell.font = red_font
+        else:
+            weekday_cell.font = normal_font
+        
+        ws.cell(row=r, column=14, value=check_in).font = normal_font
+        ws.cell(row=r, column=15, value=check_out).font = normal_font
+        ws.cell(row=r, column=16, value=(f"{work_min/60:.2f}" if work_min is not None else "")).font = normal_font
+        ws.cell(row=r, column=17, value=travel_cost).font = normal_font
+        ws.cell(row=r, column=18, value=travel_from).font = normal_font
+        ws.cell(row=r, column=19, value=travel_to).font = normal_font
+        ws.cell(row=r, column=20, value=notes).font = normal_font
+        
+        # スタイル適用
+        for i in range(9):
+            c = ws.cell(row=r, column=12+i)
+            c.fill = table_fill
+            c.border = thin_border
+            c.alignment = center if i not in [8] else left  # 備考欄は左寄せ
+    
+    # 合計行（右側のみ）
+    sum_row = 14+max(len(left_days), len(right_days))
+    
+    # 実働時間合計
+    ws.cell(row=sum_row, column=15, value="計").font = bold_font
+    ws.cell(row=sum_row, column=15).fill = header_fill
+    ws.cell(row=sum_row, column=15).border = thin_border
+    ws.cell(row=sum_row, column=15).alignment = center
+    
+    ws.cell(row=sum_row, column=16, value=f"{total_work/60:.2f}").font = bold_font
+    ws.cell(row=sum_row, column=16).fill = header_fill
+    ws.cell(row=sum_row, column=16).border = thin_border
+    ws.cell(row=sum_row, column=16).alignment = center
+    
+    # 交通費合計
+    ws.cell(row=sum_row, column=18, value="交通費合計").font = bold_font
+    ws.cell(row=sum_row, column=18).fill = header_fill
+    ws.cell(row=sum_row, column=18).border = thin_border
+    ws.cell(row=sum_row, column=18).alignment = center
+    
+    ws.cell(row=sum_row, column=19, value=f"{total_travel:.0f}").font = bold_font
+    ws.cell(row=sum_row, column=19).fill = header_fill
+    ws.cell(row=sum_row, column=19).border = thin_border
+    ws.cell(row=sum_row, column=19).alignment = center
+    
+    # 備考欄
+    notes_row = sum_row + 2
+    ws.merge_cells(f'B{notes_row}:H{notes_row+7}')
+    ws.cell(row=notes_row, column=2, value="備考").font = header_font
+    ws.cell(row=notes_row, column=2).alignment = top
+    ws.cell(row=notes_row, column=2).fill = white_fill
+    ws.cell(row=notes_row, column=2).border = thin_border
+    
+    # 備考欄の罫線
+    for r in range(notes_row, notes_row+8):
+        for c in range(2, 9):
+            ws.cell(row=r, column=c).border = thin_border
+    
+    # 下部情報
+    info_row = notes_row
+    ws.cell(row=info_row, column=13, value="実働時間合計").font = header_font
+    ws.cell(row=info_row, column=13).alignment = left
+    ws.cell(row=info_row, column=14, value=f"{total_work/60:.2f} h").font = normal_font
+    ws.cell(row=info_row, column=14).alignment = left
+    
+    ws.cell(row=info_row+2, column=13, value="自").font = normal_font
+    ws.cell(row=info_row+2, column=13).alignment = left
+    ws.cell(row=info_row+2, column=14, value=f"{year}年{month}月1日").font = normal_font
+    ws.cell(row=info_row+2, column=14).alignment = left
+    
+    ws.cell(row=info_row+3, column=13, value="至").font = normal_font
+    ws.cell(row=info_row+3, column=13).alignment = left
+    ws.cell(row=info_row+3, column=14, value=f"{year}年{month}月{days[-1].date.day}日").font = normal_font
+    ws.cell(row=info_row+3, column=14).alignment = left
+    
+    # ファイル名
+    filename = f"作業時間報告書_{year}年{month}月_{user_display_name or '氏名未入力'}.xlsx"
+    
+    # メモリ上でファイルを作成（Vercel環境対応）
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    
+    return output, filename
+
+# グローバルインスタンス
+excel_report_engine = ExcelReportEngine()
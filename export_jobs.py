@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple, Callable
+
+from bulk_export import render_report
+from report_cache import report_cache, month_data_version
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class ExportJobRecord:
+    """Excel出力ジョブ1件の状態"""
+    
+    __slots__ = ('job_id', 'key', 'username', 'year', 'month', 'display_name', 'status',
+                 'created_at', 'finished_at', 'expires_at', 'filename', 'content', 'error')
+    
+    def __init__(self, job_id: str, key: str, username: str, year: int, month: int, display_name: str):
+        self.job_id = job_id
+        self.key = key
+        self.username = username
+        self.year = year
+        self.month = month
+        self.display_name = display_name
+        self.status = JOB_QUEUED
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.expires_at: Optional[float] = None
+        self.filename: Optional[str] = None
+        self.content: Optional[bytes] = None
+        self.error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """状態をレスポンス用の辞書で取得（ファイルの内容は含めない）"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'year': self.year,
+            'month': self.month,
+            'filename': self.filename,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+        }
+
+class ExportJobQueue:
+    """Excel出力ジョブのキュー（登録はすぐに返し、作成はバックグラウンドのスレッドで行う）
+    
+    同じ (ユーザー, 年月, データの版, 表示名, テンプレートの版) のジョブが処理中・完了済みの場合は
+    新しく作らずに同じジョブを返す。完了したジョブのファイルは EXPORT_JOB_TTL 秒保持する。
+    """
+    
+    def __init__(self, workers: Optional[int] = None, ttl: Optional[float] = None, max_jobs: Optional[int] = None,
+                 render: Callable[[int, int, Dict[str, Any], str], Tuple[str, bytes]] = render_report,
+                 cache=None, clock: Callable[[], float] = time.monotonic):
+        self.workers = workers or int(os.environ.get('EXPORT_JOB_WORKERS', '2'))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('EXPORT_JOB_TTL', '600'))
+        self.max_jobs = max_jobs or int(os.environ.get('EXPORT_JOB_MAX_JOBS', '1000'))
+        self.render = render
+        self.cache = cache if cache is not None else report_cache
+        self._clock = clock
+        
+        self._jobs: Dict[str, ExportJobRecord] = {}
+        self._jobs_by_key: Dict[str, str] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'deduplicated': 0, 'cache_hits': 0, 'completed': 0, 'failed': 0, 'expired': 0}
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 最初のジョブ登録時に作成する（import 時にスレッドを起動しない）
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export-job')
+        return self._executor
+    
+    def submit(self, username: str, year: int, month: int, data: Dict[str, Any], display_name: str) -> ExportJobRecord:
+        """ジョブを登録して返す（同じ内容のジョブがあればそれを返す）"""
+        from excel_report import TEMPLATE_VERSION
+        key = self.cache.etag_for(username, year, month, month_data_version(data), display_name, TEMPLATE_VERSION)
+        
+        with self._lock:
+            self._sweep()
+            existing = self._jobs.get(self._jobs_by_key.get(key, ''))
+            if existing is not None and existing.status != JOB_FAILED:
+                self._stats['deduplicated'] += 1
+                return existing
+            
+            job = ExportJobRecord(uuid.uuid4().hex, key, username, year, month, display_name)
+            self._jobs[job.job_id] = job
+            self._jobs_by_key[key] = job.job_id
+            self._stats['submitted'] += 1
+        
+        # 作成済みのレポートがあればすぐに完了にする
+        content = self.cache.get(username, year, month, key)
+        if content is not None:
+            from excel_report import report_filename
+            with self._lock:
+                self._stats['cache_hits'] += 1
+                self._finish(job, content, report_filename(year, month, display_name))
+            return job
+        
+        self._get_executor().submit(self._run, job, data)
+        logger.info(f"Excel出力ジョブ登録: {job.job_id} - {username} {year}/{month}")
+        return job
+    
+    def _run(self, job: ExportJobRecord, data: Dict[str, Any]):
+        """ジョブを実行（ワーカースレッドで呼ばれる）"""
+        with self._lock:
+            job.status = JOB_RUNNING
+        try:
+            filename, content = self.render(job.year, job.month, data, job.display_name)
+            self.cache.put(job.username, job.year, job.month, job.key, content)
+            with self._lock:
+                self._finish(job, content, filename)
+                self._stats['completed'] += 1
+            logger.info(f"Excel出力ジョブ完了: {job.job_id} - {filename}")
+        except Exception as e:
+            with self._lock:
+                job.status = JOB_FAILED
+                job.error = str(e)
+                job.finished_at = datetime.now().isoformat()
+                job.expires_at = self._clock() + self.ttl
+                self._stats['failed'] += 1
+            logger.error(f"Excel出力ジョブ失敗: {job.job_id} - {e}")
+    
+    def _finish(self, job: ExportJobRecord, content: bytes, filename: str):
+        job.content = content
+        job.filename = filename
+        job.status = JOB_DONE
+        job.finished_at = datetime.now().isoformat()
+        job.expires_at = self._clock() + self.ttl
+    
+    def _sweep(self):
+        """期限切れのジョブを破棄し、上限を超えた場合は古い完了済みジョブから破棄（ロック内で呼ぶ）"""
+        now = self._clock()
+        expired = [job for job in self._jobs.values() if job.expires_at is not None and job.expires_at <= now]
+        overflow = len(self._jobs) - len(expired) - self.max_jobs + 1
+        if overflow > 0:
+            finished = sorted((job for job in self._jobs.values() if job.expires_at is not None and job.expires_at > now),
+                              key=lambda job: job.expires_at)
+            expired.extend(finished[:overflow])
+        for job in expired:
+            self._jobs.pop(job.job_id, None)
+            if self._jobs_by_key.get(job.key) == job.job_id:
+                del self._jobs_by_key[job.key]
+            self._stats['expired'] += 1
+    
+    def get(self, job_id: str, username: str) -> Optional[ExportJobRecord]:
+        """ジョブを取得（存在しない・期限切れ・他のユーザーのジョブの場合は None）"""
+        with self._lock:
+            self._sweep()
+            job = self._jobs.get(job_id)
+            if job is None or job.username != username:
+                return None
+            return job
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['jobs'] = len(self._jobs)
+            stats['pending'] = sum(1 for job in self._jobs.values() if job.status in (JOB_QUEUED, JOB_RUNNING))
+            return stats
+    
+    def shutdown(self, wait: bool = True):
+        """ワーカースレッドを終了"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+# グローバルインスタンス
+export_job_queue = ExportJobQueue()
@@ -0,0 +1,449 @@
+import copy
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+from google.api_core import exceptions as google_exceptions
+
+from rpc_ledger import READ, WRITE, mark_rpc_failed, payload_size, recorded_rpc
+from storage_backend import (StorageBackend, split_field_path, expand_field_paths, deep_merge, set_nested,
+                             matches_query, write_version)
+
+logger = logging.getLogger(__name__)
+
+class FakeFirestoreManager(StorageBackend):
+    """インメモリで動作する FirestoreManager の代替（テスト・ベンチマーク用）
+    
+    FirestoreManager と同じインターフェース・同じ失敗時の戻り値を持ち、1回の呼び出しを
+    1 RPC として、指定した遅延（latency + 0〜jitter 秒）と確率（error_rate）での
+    ServiceUnavailable を発生させる。RPC 数と送受信バイト数（JSON換算）を集計する。
+    """
+    
+    def __init__(self, latency: Optional[float] = None, jitter: Optional[float] = None,
+                 error_rate: Optional[float] = None, seed: Optional[int] = None):
+        self.latency = latency if latency is not None else float(os.environ.get('FAKE_FIRESTORE_LATENCY_MS', '0')) / 1000
+        self.jitter = jitter if jitter is not None else float(os.environ.get('FAKE_FIRESTORE_JITTER_MS', '0')) / 1000
+        self.error_rate = error_rate if error_rate is not None else float(os.environ.get('FAKE_FIRESTORE_ERROR_RATE', '0'))
+        self.is_initialized = True
+        
+        # {コレクションのパス: {ドキュメントID: (データ, update_time)}}
+        self._collections: Dict[str, Dict[str, Tuple[Dict[str, Any], str]]] = {}
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._last_update_time: Optional[datetime] = None
+        self._watches: List['FakeWatch'] = []
+        self.reset_stats()
+    
+    def is_available(self) -> bool:
+        """利用可能かチェック（RPC としては数えない）"""
+        return self.is_initialized
+    
+    # --- 集計 ---
+    
+    def reset_stats(self):
+        """RPC 数・バイト数の集計をリセット"""
+        with self._lock:
+            self.rpc_count = 0
+            self.rpc_by_method: Dict[str, int] = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.error_count = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """現在の集計を取得"""
+        with self._lock:
+            return {
+                'rpc_count': self.rpc_count,
+                'rpc_by_method': dict(self.rpc_by_method),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'error_count': self.error_count
+            }
+    
+    # --- ドキュメント操作 ---
+    
+    @recorded_rpc(WRITE)
+    def create_document(self, collection: str, document_id: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """ドキュメントを作成"""
+        try:
+            self._rpc('create_document', sent=data or {})
+            document_id = document_id or uuid.uuid4().hex[:20]
+            with self._lock:
+                self._store(collection, document_id, copy.deepcopy(data or {}), self._now())
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return document_id
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    @recorded_rpc(WRITE)
+    def create_document_if_absent(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[bool]:
+        """ドキュメントが存在しない場合のみ作成（Firestore の create と同じく1回の RPC）"""
+        try:
+            self._rpc('create_document_if_absent', sent=data)
+            with self._lock:
+                if document_id in self._collections.get(collection, {}):
+                    logger.info(f"ドキュメント既存のため作成しません: {collection}/{document_id}")
+                    return False
+                self._store(collection, document_id, copy.deepcopy(data), self._now())
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return True
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    @recorded_rpc(READ)
+    def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        """ドキュメントを取得"""
+        try:
+            self._rpc('get_document')
+            with self._lock:
+                document = self._collections.get(collection_name, {}).get(document_id)
+                data = copy.deepcopy(document[0]) if document else None
+            if data is None:
+                logger.debug(f"ドキュメント存在しない: {collection_name}/{document_id}")
+                return None
+            self._count_received(data)
+            return data
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    @recorded_rpc(READ)
+    def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        """ドキュメントの指定フィールドのみを取得（受信バイト数は指定フィールド分のみ）"""
+        try:
+            self._rpc('get_document_fields')
+            with self._lock:
+                document = self._collections.get(collection_name, {}).get(document_id)
+                if document is None:
+                    return None
+                data = {name: copy.deepcopy(document[0][name]) for name in field_names if name in document[0]}
+            self._count_received(data)
+            return data
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"フィールド取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    @recorded_rpc(WRITE)
+    def update_fields(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool = False) -> Optional[str]:
+        """ドキュメントを部分更新し、update_time をバージョンとして返す"""
+        try:
+            self._rpc('update_fields', sent=data)
+            with self._lock:
+                document = self._collections.get(collection, {}).get(document_id)
+                if document is None:
+                    if not create_if_missing:
+                        raise google_exceptions.NotFound(f"No document to update: {collection}/{document_id}")
+                    doc_data = expand_field_paths(copy.deepcopy(data))
+                else:
+                    doc_data = document[0]
+                    for key, value in copy.deepcopy(data).items():
+                        set_nested(doc_data, split_field_path(key), value)
+                update_time = self._now()
+                self._store(collection, document_id, doc_data, update_time)
+            logger.info(f"ドキュメント更新: {collection}/{document_id}")
+            return update_time
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント更新失敗: {str(e)}")
+            return None
+    
+    @recorded_rpc(WRITE)
+    def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        """複数ドキュメントへのマージ書き込みを1回のコミット（1 RPC）で実行"""
+        if not writes:
+            return write_version(None)
+        
+        try:
+            self._rpc('batch_write', sent=[data for _, _, data in writes])
+            with self._lock:
+                update_time = self._now()
+                for collection, document_id, data in writes:
+                    document = self._collections.get(collection, {}).get(document_id)
+                    merged = deep_merge(document[0] if document else {}, copy.deepcopy(data))
+                    self._store(collection, document_id, merged, update_time)
+            logger.info(f"バッチ書き込み: {len(writes)}ドキュメント")
+            return update_time
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"バッチ書き込み失敗: {str(e)}")
+            return None
+    
+    @recorded_rpc(WRITE)
+    def delete_document(self, collection: str, document_id: str) -> bool:
+        """ドキュメントを削除"""
+        try:
+            self._rpc('delete_document')
+            with self._lock:
+                self._remove(collection, document_id)
+            logger.info(f"ドキュメント削除: {collection}/{document_id}")
+            return True
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント削除失敗: {str(e)}")
+            return False
+    
+    @recorded_rpc(READ)
+    def get_collection(self, collection: str, limit: Optional[int] = None, start_after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """コレクション内の全ドキュメントを取得（start_after 指定時はドキュメントID順で続きから）"""
+        try:
+            self._rpc('get_collection')
+            results = self._documents([collection], limit=limit, start_after=start_after)
+            logger.info(f"コレクション取得: {collection} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"コレクション取得失敗: {str(e)}")
+            return []
+    
+    @recorded_rpc(READ)
+    def get_collection_group(self, collection_id: str) -> List[Dict[str, Any]]:
+        """同名のサブコレクションを横断して全ドキュメントを取得"""
+        try:
+            self._rpc('get_collection_group')
+            with self._lock:
+                paths = [path for path in self._collections
+                         if path == collection_id or path.endswith('/' + collection_id)]
+            results = self._documents(sorted(paths))
+            logger.info(f"コレクショングループ取得: {collection_id} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"コレクショングループ取得失敗: {str(e)}")
+            return []
+    
+    @recorded_rpc(READ)
+    def query_documents(self, collection: str, field: str, operator: str, value: Any, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """条件付きクエリでドキュメントを検索"""
+        try:
+            self._rpc('query_documents')
+            results = self._documents([collection], limit=limit,
+                                      condition=lambda data: matches_query(data, field, operator, value))
+            logger.info(f"クエリ実行: {collection} where {field} {operator} {value} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"クエリ実行失敗: {str(e)}")
+            return []
+    
+    @recorded_rpc(READ)
+    def count_documents(self, collection: str) -> Optional[int]:
+        """ドキュメント数を取得（count() 集計クエリ相当の 1 RPC）"""
+        try:
+            self._rpc('count_documents')
+            with self._lock:
+                count = len(self._collections.get(collection, {}))
+            logger.info(f"ドキュメント数取得: {collection} ({count}件)")
+            return count
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント数取得失敗: {str(e)}")
+            return None
+    
+    def watch_collection(self, collection: str, callback: Callable[[List[Tuple[str, str, Optional[Dict[str, Any]]]]], None],
+                         group: bool = False) -> Optional['FakeWatch']:
+        """コレクションの変更を購読（開始時に既存ドキュメントを ADDED として通知）"""
+        try:
+            self._rpc('watch_collection')
+            watch = FakeWatch(self, collection, callback, group)
+            with self._lock:
+                initial = [
+                    ('ADDED', f"{path}/{document_id}", copy.deepcopy(data))
+                    for path in sorted(self._collections) if watch.matches(path)
+                    for document_id, (data, _) in sorted(self._collections[path].items())
+                ]
+                self._watches.append(watch)
+                callback(initial)
+            logger.info(f"スナップショットリスナー開始: {collection}")
+            return watch
+        
+        except Exception as e:
+            logger.error(f"スナップショットリスナー開始失敗: {collection} - {str(e)}")
+            return None
+    
+    def run_transaction(self, callback: Callable[['FakeTransaction'], Any], max_attempts: int = 5) -> Any:
+        """トランザクションを実行し、callback の戻り値を返す
+        
+        Firestore と同じく楽観的に実行し、読み込んだドキュメントがコミットまでに
+        他から更新されていた場合は callback を再実行する（読み込み・コミットは各1 RPC）。
+        """
+        for attempt in range(max_attempts):
+            transaction = FakeTransaction(self)
+            result = callback(transaction)
+            if transaction._commit():
+                return result
+            logger.debug(f"トランザクション競合、再試行: {attempt + 1}/{max_attempts}")
+        raise google_exceptions.Aborted('Transaction contention: too many retries')
+    
+    # --- 内部処理 ---
+    
+    def _rpc(self, method: str, sent: Any = None):
+        """1 RPC 分の遅延・失敗を発生させて集計"""
+        with self._lock:
+            self.rpc_count += 1
+            self.rpc_by_method[method] = self.rpc_by_method.get(method, 0) + 1
+            if sent is not None:
+                self.bytes_sent += payload_size(sent)
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+        
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise google_exceptions.ServiceUnavailable(f"Injected failure: {method}")
+    
+    def _count_received(self, data: Any):
+        with self._lock:
+            self.bytes_received += payload_size(data)
+    
+    def _documents(self, paths: List[str], limit: Optional[int] = None,
+                   condition: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                   start_after: Optional[str] = None) -> List[Dict[str, Any]]:
+        results = []
+        with self._lock:
+            for path in paths:
+                for document_id in sorted(self._collections.get(path, {})):
+                    if start_after is not None and document_id <= start_after:
+                        continue
+                    data = self._collections[path][document_id][0]
+                    if not data or (condition and not condition(data)):
+                        continue
+                    data = copy.deepcopy(data)
+                    data['_id'] = document_id
+                    results.append(data)
+                    if limit and len(results) >= limit:
+                        break
+                if limit and len(results) >= limit:
+                    break
+        self._count_received(results)
+        return results
+    
+    def _snapshot(self, collection: str, document_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        with self._lock:
+            document = self._collections.get(collection, {}).get(document_id)
+            if document is None:
+                return None, None
+            return copy.deepcopy(document[0]), document[1]
+    
+    def _store(self, collection: str, document_id: str, data: Dict[str, Any], update_time: str):
+        documents = self._collections.setdefault(collection, {})
+        kind = 'MODIFIED' if document_id in documents else 'ADDED'
+        documents[document_id] = (data, update_time)
+        self._notify(collection, document_id, kind, data)
+    
+    def _remove(self, collection: str, document_id: str):
+        if self._collections.get(collection, {}).pop(document_id, None) is not None:
+            self._notify(collection, document_id, 'REMOVED', None)
+    
+    def _notify(self, collection: str, document_id: str, kind: str, data: Optional[Dict[str, Any]]):
+        # 購読中のリスナーへ同期的に通知（ロック内で呼ぶため書き込み順に届く）
+        for watch in list(self._watches):
+            if watch.matches(collection):
+                watch.callback([(kind, f"{collection}/{document_id}", copy.deepcopy(data))])
+    
+    def _now(self) -> str:
+        # 同一マイクロ秒内の書き込みでもバージョンが単調増加するようにずらす（ロック内で呼ぶ）
+        now = datetime.now(timezone.utc)
+        if self._last_update_time is not None and now <= self._last_update_time:
+            now = self._last_update_time + timedelta(microseconds=1)
+        self._last_update_time = now
+        return now.isoformat()
+
+class FakeWatch:
+    """FakeFirestoreManager.watch_collection の購読ハンドル"""
+    
+    def __init__(self, manager: FakeFirestoreManager, collection: str, callback: Callable, group: bool):
+        self._manager = manager
+        self.collection = collection
+        self.callback = callback
+        self.group = group
+    
+    def matches(self, path: str) -> bool:
+        if self.group:
+            return path == self.collection or path.endswith('/' + self.collection)
+        return path == self.collection
+    
+    def unsubscribe(self):
+        """購読を終了"""
+        with self._manager._lock:
+            if self in self._manager._watches:
+                self._manager._watches.remove(self)
+
+class FakeTransaction:
+    """FakeFirestoreManager.run_transaction に渡されるトランザクション"""
+    
+    def __init__(self, manager: FakeFirestoreManager):
+        self._manager = manager
+        self._read_versions: Dict[Tuple[str, str], Optional[str]] = {}
+        self._writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]] = []
+    
+    def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """ドキュメントを読み込み（読み込み時点のバージョンを記録）"""
+        self._manager._rpc('transaction_get')
+        data, update_time = self._manager._snapshot(collection, document_id)
+        self._read_versions.setdefault((collection, document_id), update_time)
+        if data is not None:
+            self._manager._count_received(data)
+        return data
+    
+    def set(self, collection: str, document_id: str, data: Dict[str, Any], merge: bool = False):
+        """ドキュメントを書き込み（コミット時に反映）"""
+        self._writes.append(('merge' if merge else 'set', collection, document_id, copy.deepcopy(data)))
+    
+    def update(self, collection: str, document_id: str, data: Dict[str, Any]):
+        """ドット区切りのフィールドパスで部分更新（コミット時に反映）"""
+        self._writes.append(('update', collection, document_id, copy.deepcopy(data)))
+    
+    def delete(self, collection: str, document_id: str):
+        """ドキュメントを削除（コミット時に反映）"""
+        self._writes.append(('delete', collection, document_id, None))
+    
+    def _commit(self) -> bool:
+        manager = self._manager
+        manager._rpc('transaction_commit', sent=[data for _, _, _, data in self._writes if data])
+        with manager._lock:
+            for (collection, document_id), version in self._read_versions.items():
+                if manager._snapshot(collection, document_id)[1] != version:
+                    return False
+            
+            update_time = manager._now()
+            for kind, collection, document_id, data in self._writes:
+                current = manager._collections.get(collection, {}).get(document_id)
+                if kind == 'delete':
+                    manager._remove(collection, document_id)
+                    continue
+                if kind == 'update':
+                    if current is None:
+                        raise google_exceptions.NotFound(f"No document to update: {collection}/{document_id}")
+                    merged = copy.deepcopy(current[0])
+                    for key, value in data.items():
+                        set_nested(merged, split_field_path(key), value)
+                elif kind == 'merge':
+                    merged = deep_merge(current[0] if current else {}, data)
+                else:
+                    merged = data
+                manager._store(collection, document_id, merged, update_time)
+        return True
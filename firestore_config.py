@@ -1,46 +1,85 @@
+import base64
 import logging
-from typing import Dict, Any, Optional, List
-from google.cloud import firestore
-from google.oauth2 import service_account
-import firebase_admin
-from firebase_admin import credentials
+import threading
+from typing import Dict, Any, Optional, List, Tuple, Callable
 import os
 import json
 
+from rpc_ledger import READ, WRITE, mark_rpc_failed, recorded_rpc
+# 部分更新・バージョン用の補助関数はバックエンド共通（従来どおりここからも import 可能）
+from storage_backend import StorageBackend, Increment, field_path, split_field_path, expand_field_paths, write_version
+
 # ログ設定
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class FirestoreManager:
-    """Firebase Firestore データベース管理クラス"""
+class FirestoreManager(StorageBackend):
+    """Firebase Firestore データベース管理クラス
+    
+    Firestore・Firebase Admin SDK の読み込みとクライアント（gRPC チャネル）の作成は
+    最初に使用した時点で行う（コールドスタートで全てのリクエストが負担しないように）。
+    """
     
     def __init__(self):
-        self.db = None
+        self._db = None
         self.app = None
-        self.is_initialized = False
-        
-        # 初期化を試行
-        self._initialize_firestore()
+        # クライアントの作成に使った認証情報・プロジェクト（AsyncClient の作成にも使う）
+        self.credentials = None
+        self.project_id: Optional[str] = None
+        # None: 未初期化（最初の使用時に初期化する）
+        self._initialized: Optional[bool] = None
+        self._init_lock = threading.Lock()
+    
+    @property
+    def db(self):
+        """Firestoreクライアント（最初のアクセス時に作成）"""
+        self._ensure_initialized()
+        return self._db
+    
+    @property
+    def is_initialized(self) -> bool:
+        self._ensure_initialized()
+        return bool(self._initialized)
+    
+    def _ensure_initialized(self):
+        if self._initialized is None:
+            with self._init_lock:
+                if self._initialized is None:
+                    self._initialize_firestore()
     
     def _initialize_firestore(self):
         """Firestoreクライアントを初期化"""
+        self._initialized = False
         try:
             # 環境変数からサービスアカウントキーのパスまたはJSONを取得
             service_account_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
             service_account_json = os.environ.get('FIREBASE_SERVICE_ACCOUNT_JSON')
+            service_account_base64 = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_BASE64')
             project_id = os.environ.get('FIREBASE_PROJECT_ID')
             
-            if service_account_json:
-                # JSON文字列から認証情報を作成
-                service_account_info = json.loads(service_account_json)
+            if not (service_account_json or service_account_base64 or
+                    (service_account_path and os.path.exists(service_account_path))):
+                logger.warning("Firebase認証情報が見つかりません。ローカルストレージを使用します。")
+                return
+            
+            # 認証情報がある場合のみ読み込む（gRPC を含み読み込みに時間がかかる）
+            from startup_report import startup_report
+            with startup_report.measure('google.cloud.firestore', deferred=True):
+                import firebase_admin
+                from firebase_admin import credentials
+                from google.cloud import firestore
+            
+            if service_account_json or service_account_base64:
+                # JSON文字列（Vercel では Base64 エンコードしたもの）から認証情報を作成（一時ファイルは作らない）
+                if service_account_json:
+                    service_account_info = json.loads(service_account_json)
+                else:
+                    service_account_info = json.loads(base64.b64decode(service_account_base64).decode('utf-8'))
                 cred = credentials.Certificate(service_account_info)
                 project_id = service_account_info.get('project_id', project_id)
-            elif service_account_path and os.path.exists(service_account_path):
+            else:
                 # ファイルパスから認証情報を作成
                 cred = credentials.Certificate(service_account_path)
-            else:
-                logger.warning("Firebase認証情報が見つかりません。ローカルストレージを使用します。")
-                return
             
             # Firebase Admin SDKを初期化
             if not firebase_admin._apps:
@@ -51,18 +90,21 @@ class FirestoreManager:
                 self.app = firebase_admin.get_app()
             
             # Firestoreクライアントを取得
-            self.db = firestore.Client(project=project_id)
-            self.is_initialized = True
+            self.credentials = cred.get_credential()
+            self.project_id = project_id
+            self._db = firestore.Client(project=project_id, credentials=self.credentials)
+            self._initialized = True
             logger.info(f"Firestore初期化成功: プロジェクト {project_id}")
             
         except Exception as e:
             logger.error(f"Firestore初期化失敗: {str(e)}")
-            self.is_initialized = False
+            self._initialized = False
     
     def is_available(self) -> bool:
-        """Firestoreが利用可能かチェック"""
-        return self.is_initialized and self.db is not None
+        """Firestoreが利用可能かチェック（最初の呼び出しでクライアントを作成）"""
+        return self.is_initialized and self._db is not None
     
+    @recorded_rpc(WRITE)
     def create_document(self, collection: str, document_id: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> Optional[str]:
         """ドキュメントを作成"""
         if not self.is_available() or self.db is None:
@@ -84,9 +126,32 @@ class FirestoreManager:
                 return doc_id
                 
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"ドキュメント作成失敗: {str(e)}")
             return None
     
+    @recorded_rpc(WRITE)
+    def create_document_if_absent(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[bool]:
+        """ドキュメントが存在しない場合のみ作成（create の事前条件で1回の書き込みで判定）"""
+        if not self.is_available() or self.db is None:
+            logger.warning("Firestoreが利用できません")
+            return None
+        
+        from google.api_core import exceptions as google_exceptions
+        try:
+            self.db.collection(collection).document(document_id).create(data)
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return True
+        
+        except google_exceptions.AlreadyExists:
+            logger.info(f"ドキュメント既存のため作成しません: {collection}/{document_id}")
+            return False
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    @recorded_rpc(READ)
     def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
         """ドキュメントを取得"""
         try:
@@ -107,25 +172,98 @@ class FirestoreManager:
                 return None
                 
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"ドキュメント取得失敗: {collection_name}/{document_id} - {str(e)}")
             return None
     
-    def update_document(self, collection: str, document_id: str, data: Dict[str, Any]) -> bool:
-        """ドキュメントを更新"""
+    @recorded_rpc(READ)
+    def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        """ドキュメントの指定フィールドのみを取得（射影読み込みで転送量を抑える）"""
+        if not self.is_available() or self.db is None:
+            logger.warning(f"Firestore利用不可: {collection_name}/{document_id}")
+            return None
+        
+        try:
+            doc = self.db.collection(collection_name).document(document_id).get(field_paths=field_names)
+            return doc.to_dict() if doc.exists else None
+            
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"フィールド取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    @staticmethod
+    def _server_values(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Increment を Firestore の Increment（サーバー側での加算）に変換"""
+        if not any(isinstance(value, (Increment, dict)) for value in data.values()):
+            return data
+        from google.cloud import firestore
+        return {
+            key: FirestoreManager._server_values(value) if isinstance(value, dict) else
+            firestore.Increment(value.value) if isinstance(value, Increment) else value
+            for key, value in data.items()
+        }
+    
+    @recorded_rpc(WRITE)
+    def update_fields(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool = False) -> Optional[str]:
+        """ドキュメントを部分更新し、書き込み結果の update_time をバージョンとして返す（失敗時は None）"""
         if not self.is_available() or self.db is None:
             logger.warning("Firestoreが利用できません")
-            return False
+            return None
         
+        from google.api_core import exceptions as google_exceptions
         try:
             doc_ref = self.db.collection(collection).document(document_id)
-            doc_ref.update(data)
+            try:
+                write_result = doc_ref.update(self._server_values(data))
+            except google_exceptions.NotFound:
+                if not create_if_missing:
+                    raise
+                try:
+                    write_result = doc_ref.create(expand_field_paths(data))
+                    logger.info(f"ドキュメント作成（更新対象なし）: {collection}/{document_id}")
+                    return write_version(write_result.update_time)
+                except google_exceptions.AlreadyExists:
+                    # 他のワーカーが直前に作成した場合は部分更新をやり直す
+                    write_result = doc_ref.update(self._server_values(data))
             logger.info(f"ドキュメント更新: {collection}/{document_id}")
-            return True
+            return write_version(write_result.update_time)
             
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"ドキュメント更新失敗: {str(e)}")
-            return False
+            return None
+    
+    @recorded_rpc(WRITE)
+    def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        """複数ドキュメントへのマージ書き込みを1回のバッチコミットで実行
+        
+        writes は (コレクション, ドキュメントID, データ) のリスト。データはネストした辞書で、
+        含まれる末端フィールドのみが書き換えられる（存在しないドキュメントは作成される）。
+        コミットの update_time をバージョンとして返す（失敗時は None）。
+        """
+        if not self.is_available() or self.db is None:
+            logger.warning("Firestoreが利用できません")
+            return None
+        
+        if not writes:
+            return write_version(None)
+        
+        try:
+            batch = self.db.batch()
+            for collection, document_id, data in writes:
+                doc_ref = self.db.collection(collection).document(document_id)
+                batch.set(doc_ref, self._server_values(data), merge=True)
+            write_results = batch.commit()
+            logger.info(f"バッチ書き込み: {len(writes)}ドキュメント")
+            return write_version(write_results[0].update_time if write_results else None)
+            
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"バッチ書き込み失敗: {str(e)}")
+            return None
     
+    @recorded_rpc(WRITE)
     def delete_document(self, collection: str, document_id: str) -> bool:
         """ドキュメントを削除"""
         if not self.is_available() or self.db is None:
@@ -139,22 +277,25 @@ class FirestoreManager:
             return True
             
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"ドキュメント削除失敗: {str(e)}")
             return False
     
-    def get_collection(self, collection: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
-        """コレクション内の全ドキュメントを取得"""
+    @recorded_rpc(READ)
+    def get_collection(self, collection: str, limit: Optional[int] = None, start_after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """コレクション内の全ドキュメントを取得（start_after 指定時はドキュメントID順で続きから）"""
         if not self.is_available() or self.db is None:
             logger.warning("Firestoreが利用できません")
             return []
         
         try:
-            collection_ref = self.db.collection(collection)
+            query = self.db.collection(collection)
             
+            if start_after:
+                query = query.order_by('__name__').start_after({'__name__': start_after})
             if limit:
-                docs = collection_ref.limit(limit).stream()
-            else:
-                docs = collection_ref.stream()
+                query = query.limit(limit)
+            docs = query.stream()
             
             results = []
             for doc in docs:
@@ -167,9 +308,36 @@ class FirestoreManager:
             return results
             
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"コレクション取得失敗: {str(e)}")
             return []
     
+    @recorded_rpc(READ)
+    def get_collection_group(self, collection_id: str) -> List[Dict[str, Any]]:
+        """同名のサブコレクションを横断して全ドキュメントを取得"""
+        if not self.is_available() or self.db is None:
+            logger.warning("Firestoreが利用できません")
+            return []
+        
+        try:
+            docs = self.db.collection_group(collection_id).stream()
+            
+            results = []
+            for doc in docs:
+                data = doc.to_dict()
+                if data:
+                    data['_id'] = doc.id
+                    results.append(data)
+            
+            logger.info(f"コレクショングループ取得: {collection_id} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"コレクショングループ取得失敗: {str(e)}")
+            return []
+    
+    @recorded_rpc(READ)
     def query_documents(self, collection: str, field: str, operator: str, value: Any, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """条件付きクエリでドキュメントを検索"""
         if not self.is_available() or self.db is None:
@@ -195,8 +363,79 @@ class FirestoreManager:
             return results
             
         except Exception as e:
+            mark_rpc_failed()
             logger.error(f"クエリ実行失敗: {str(e)}")
             return []
+    
+    @recorded_rpc(READ)
+    def count_documents(self, collection: str) -> Optional[int]:
+        """count() 集計クエリでドキュメント数を取得（ドキュメント本体は読まない）"""
+        if not self.is_available() or self.db is None:
+            logger.warning("Firestoreが利用できません")
+            return None
+        
+        try:
+            results = self.db.collection(collection).count(alias='count').get()
+            count = int(results[0][0].value)
+            logger.info(f"ドキュメント数取得: {collection} ({count}件)")
+            return count
+            
+        except Exception as e:
+            mark_rpc_failed()
+            logger.error(f"ドキュメント数取得失敗: {str(e)}")
+            return None
+    
+    def watch_collection(self, collection: str, callback: Callable[[List[Tuple[str, str, Optional[Dict[str, Any]]]]], None],
+                         group: bool = False) -> Optional[Any]:
+        """on_snapshot でコレクションの変更を購読"""
+        if not self.is_available() or self.db is None:
+            logger.warning("Firestoreが利用できません")
+            return None
+        
+        def on_snapshot(docs, changes, read_time):
+            try:
+                callback([
+                    (change.type.name, change.document.reference.path,
+                     None if change.type.name == 'REMOVED' else change.document.to_dict())
+                    for change in changes
+                ])
+            except Exception as e:
+                logger.error(f"スナップショット処理失敗: {collection} - {str(e)}")
+        
+        try:
+            query = self.db.collection_group(collection) if group else self.db.collection(collection)
+            watch = query.on_snapshot(on_snapshot)
+            logger.info(f"スナップショットリスナー開始: {collection}")
+            return watch
+            
+        except Exception as e:
+            logger.error(f"スナップショットリスナー開始失敗: {collection} - {str(e)}")
+            return None
+
+def snapshot_listeners_enabled() -> bool:
+    """スナップショットリスナーでキャッシュを同期するか（FIRESTORE_SNAPSHOT_LISTENERS）"""
+    return os.environ.get('FIRESTORE_SNAPSHOT_LISTENERS', 'false').lower() in ('1', 'true', 'yes')
+
+def create_storage_backend() -> StorageBackend:
+    """環境変数 STORAGE_BACKEND に応じたストレージバックエンドを生成
+    
+    firestore（既定）: Firebase Firestore
+    sqlite          : ローカルのSQLite（オンプレミス・CI・ベンチマーク用）
+    fake            : インメモリの代替実装（認証情報なしでの動作確認・ベンチマーク用）
+    """
+    backend = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+    
+    if backend == 'sqlite':
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(os.environ.get('SQLITE_DB_PATH', 'attendance.sqlite3'))
+    
+    if backend == 'fake':
+        from fake_firestore import FakeFirestoreManager
+        return FakeFirestoreManager()
+    
+    if backend != 'firestore':
+        logger.warning(f"不明なストレージバックエンド: {backend}（Firestoreを使用）")
+    return FirestoreManager()
 
-# グローバルインスタンス
-firestore_manager = FirestoreManager() 
\ No newline at end of file
+# グローバルインスタンス（名前は互換性のため firestore_manager のまま）
+firestore_manager = create_storage_backend() 
\ No newline at end of file
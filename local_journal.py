@@ -0,0 +1,263 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows ではプロセス間のロックなし（1プロセスでの開発用）
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 書き込み耐久性モード
+# fsync: 追記ごとに fsync してから戻る（最も安全・最も遅い）
+# batch: 追記はバッファに書き、バックグラウンドで一定間隔ごとに flush + fsync
+# off  : ジャーナルを書かない（/tmp が揮発するサーバーレス環境向け）
+DURABILITY_FSYNC = 'fsync'
+DURABILITY_BATCH = 'batch'
+DURABILITY_OFF = 'off'
+
+def default_durability() -> str:
+    """環境変数から耐久性モードを決定（Vercel では既定で off）"""
+    mode = os.environ.get('ATTENDANCE_JOURNAL_DURABILITY')
+    if mode in (DURABILITY_FSYNC, DURABILITY_BATCH, DURABILITY_OFF):
+        return mode
+    if mode:
+        logger.warning(f"不明なジャーナル耐久性モード: {mode}（batch を使用）")
+    return DURABILITY_OFF if 'VERCEL' in os.environ else DURABILITY_BATCH
+
+class AttendanceJournal:
+    """勤怠データのローカル追記型ジャーナル
+    
+    変更は1行1件のJSONとしてジャーナルファイルに追記し、一定件数ごとに
+    バックグラウンドでスナップショット（従来の attendance_data.json 形式）へ圧縮する。
+    起動時はスナップショットを読み込んだ後にジャーナルを再生する。
+    
+    同じパスを複数のプロセス（gunicorn のワーカー）が使うため、追記・ジャーナルの切り替えは
+    ジャーナルのロックファイル、圧縮・スナップショットの書き出しはスナップショットのロックファイルを
+    flock で排他する。他のプロセスがジャーナルを切り替えた場合は、追記の前に開き直す。
+    """
+    
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None, durability: Optional[str] = None,
+                 compact_threshold: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + '.journal'
+        # 圧縮中のジャーナル（圧縮が中断された場合も起動時に再生する）
+        self.compacting_path = self.journal_path + '.compacting'
+        # プロセス間の排他に使うロックファイル
+        self.journal_lock_path = self.journal_path + '.lock'
+        self.snapshot_lock_path = self.snapshot_path + '.lock'
+        self.durability = durability or default_durability()
+        self.compact_threshold = compact_threshold or int(os.environ.get('ATTENDANCE_JOURNAL_COMPACT_EVERY', '1000'))
+        self.flush_interval = flush_interval or float(os.environ.get('ATTENDANCE_JOURNAL_FLUSH_INTERVAL', '1.0'))
+        
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._file = None
+        self._entries_since_compaction = 0
+        self._dirty = False
+        self._flusher = None
+        self._compactor = None
+        
+        if self.is_enabled():
+            # 終了時にバッファ中の追記を書き出す
+            atexit.register(self.close)
+    
+    def is_enabled(self) -> bool:
+        """ジャーナルへの書き込みが有効かチェック"""
+        return self.durability != DURABILITY_OFF
+    
+    def load(self) -> Dict[str, Any]:
+        """スナップショットを読み込み、ジャーナルを再生した状態を返す"""
+        with self._process_lock(self.snapshot_lock_path), self._process_lock(self.journal_lock_path):
+            state = self._read_snapshot()
+            replayed = self._replay(self.compacting_path, state)
+            replayed += self._replay(self.journal_path, state)
+        self._entries_since_compaction = replayed
+        logger.info(f"ローカルジャーナル再生完了: {len(state)}ユーザー / {replayed}件")
+        return state
+    
+    def append_changes(self, username: str, changes: List[Tuple[str, str, Any]]):
+        """ユーザーの (日付, フィールド, 値) の変更をジャーナルに追記"""
+        if not self.is_enabled() or not changes:
+            return
+        
+        lines = ''.join(
+            json.dumps({'u': username, 'd': date_str, 'f': field, 'v': value},
+                       ensure_ascii=False, separators=(',', ':')) + '\n'
+            for date_str, field, value in changes
+        )
+        
+        try:
+            with self._lock, self._process_lock(self.journal_lock_path):
+                handle = self._open()
+                handle.write(lines)
+                # ロックを放す前にファイルへ書き出す（他のプロセスの切り替えでバッファ中の追記を失わない）
+                handle.flush()
+                if self.durability == DURABILITY_FSYNC:
+                    os.fsync(handle.fileno())
+                else:
+                    self._dirty = True
+                    self._ensure_flusher()
+                self._entries_since_compaction += len(changes)
+                needs_compaction = self._entries_since_compaction >= self.compact_threshold
+            
+            if needs_compaction:
+                self.compact_in_background()
+        
+        except Exception as e:
+            logger.error(f"ジャーナル追記失敗: {str(e)}")
+    
+    def write_snapshot(self, state: Dict[str, Any]):
+        """全データをスナップショットとして書き出し、ジャーナルを空にする"""
+        if not self.is_enabled():
+            return
+        
+        try:
+            with self._compaction_lock, self._process_lock(self.snapshot_lock_path):
+                with self._lock, self._process_lock(self.journal_lock_path):
+                    self._close()
+                    self._write_snapshot_file(state)
+                    for path in (self.journal_path, self.compacting_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    self._entries_since_compaction = 0
+            logger.info("ローカルスナップショット保存成功")
+        
+        except Exception as e:
+            logger.error(f"ローカルスナップショット保存失敗: {str(e)}")
+    
+    def compact_in_background(self) -> Optional[threading.Thread]:
+        """ジャーナルを切り替え、古いジャーナルをバックグラウンドでスナップショットへ圧縮"""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return None
+            with self._process_lock(self.journal_lock_path):
+                if not os.path.exists(self.compacting_path):
+                    self._close()
+                    if not os.path.exists(self.journal_path):
+                        return None
+                    os.replace(self.journal_path, self.compacting_path)
+            self._entries_since_compaction = 0
+            self._compactor = threading.Thread(target=self._compact, name='attendance-journal-compactor', daemon=True)
+            self._compactor.start()
+            return self._compactor
+    
+    def flush(self):
+        """バッファ中の追記を flush + fsync"""
+        with self._lock:
+            if self._file is not None and self._dirty:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+    
+    def close(self):
+        """ジャーナルを閉じる（バッファ中の追記は書き出す）"""
+        with self._lock:
+            self._close()
+    
+    def _compact(self):
+        """圧縮中のジャーナルをスナップショットへ反映（メモリ上のキャッシュには触れない）"""
+        started = time.time()
+        try:
+            with self._compaction_lock, self._process_lock(self.snapshot_lock_path):
+                if not os.path.exists(self.compacting_path):
+                    return
+                state = self._read_snapshot()
+                replayed = self._replay(self.compacting_path, state)
+                self._write_snapshot_file(state)
+                os.remove(self.compacting_path)
+            logger.info(f"ジャーナル圧縮完了: {replayed}件 ({(time.time() - started) * 1000:.1f}ms)")
+        
+        except Exception as e:
+            logger.error(f"ジャーナル圧縮失敗: {str(e)}")
+    
+    @staticmethod
+    @contextmanager
+    def _process_lock(path: str):
+        """プロセス間の排他ロック（fcntl の無い環境では何もしない）"""
+        if fcntl is None:
+            yield
+            return
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _open(self):
+        if self._file is not None and not self._is_current_journal():
+            # 他のプロセスがジャーナルを切り替えた（追記済みの分は切り替え前に書き出し済み）
+            self._close()
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return self._file
+    
+    def _is_current_journal(self) -> bool:
+        try:
+            current = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(self._file.fileno())
+        return (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev)
+    
+    def _close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._dirty = False
+    
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name='attendance-journal-flusher', daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"ジャーナル flush 失敗: {str(e)}")
+    
+    def _read_snapshot(self) -> Dict[str, Any]:
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _write_snapshot_file(self, state: Dict[str, Any]):
+        # 一時ファイルに書いてから置き換え、途中で落ちても既存のスナップショットを壊さない
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+    
+    @staticmethod
+    def _replay(path: str, state: Dict[str, Any]) -> int:
+        if not os.path.exists(path):
+            return 0
+        
+        count = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で終了した最終行は無視する
+                    logger.warning(f"ジャーナルの不正な行をスキップ: {path}")
+                    continue
+                state.setdefault(entry['u'], {}).setdefault(entry['d'], {})[entry['f']] = entry['v']
+                count += 1
+        return count
@@ -0,0 +1,254 @@
+import bisect
+import itertools
+import math
+import threading
+from typing import Dict, Any, List, Tuple, Callable, Iterable
+
+# 1つのメトリクスの値を分けて持つ数（スレッドごとに割り当て、同時に記録するスレッドのロックの競合を避ける）
+_STRIPES = 16
+_stripe_numbers = itertools.count()
+_thread_stripe = threading.local()
+
+def _stripe_index() -> int:
+    index = getattr(_thread_stripe, 'index', None)
+    if index is None:
+        index = _thread_stripe.index = next(_stripe_numbers) % _STRIPES
+    return index
+
+# 応答時間・RPC の所要時間（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Excel レポートの大きさ（バイト）
+SIZE_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+class _Stripe:
+    __slots__ = ('lock', 'values')
+    
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.values = [0.0] * size
+
+class _Child:
+    """ラベルの値の組ごとの値（スレッドごとの区画に加算し、出力時に合計する）"""
+    
+    def __init__(self, size: int):
+        self._stripes = [_Stripe(size) for _ in range(_STRIPES)]
+    
+    def _add(self, index: int, amount: float):
+        stripe = self._stripes[_stripe_index()]
+        with stripe.lock:
+            stripe.values[index] += amount
+    
+    def _totals(self) -> List[float]:
+        totals = [0.0] * len(self._stripes[0].values)
+        for stripe in self._stripes:
+            with stripe.lock:
+                values = list(stripe.values)
+            for index, value in enumerate(values):
+                totals[index] += value
+        return totals
+
+class _Metric:
+    """メトリクスの共通部分（ラベルの値の組ごとの子を作成・保持する）"""
+    
+    type_name = ''
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values: Any):
+        """ラベルの値の組に対応する子（2回目以降はロックなしで取得）"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"ラベルの数が一致しません: {self.name} {self.labelnames} {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            children = list(self._children.items())
+        samples: List[Sample] = []
+        for key, child in sorted(children):
+            samples.extend(self._child_samples(dict(zip(self.labelnames, key)), child))
+        return samples
+    
+    def _child_samples(self, labels: Dict[str, str], child) -> List[Sample]:
+        raise NotImplementedError
+
+class _CounterChild(_Child):
+    def __init__(self):
+        super().__init__(1)
+    
+    def inc(self, amount: float = 1):
+        self._add(0, amount)
+    
+    def value(self) -> float:
+        return self._totals()[0]
+
+class Counter(_Metric):
+    """増加のみのカウンター（名前は _total で終える）"""
+    
+    type_name = 'counter'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+    
+    def _child_samples(self, labels: Dict[str, str], child: _CounterChild) -> List[Sample]:
+        return [(self.name, labels, child.value())]
+
+class Gauge(_Metric):
+    """増減する値（処理中のリクエスト数など）"""
+    
+    type_name = 'gauge'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+    
+    def dec(self, amount: float = 1):
+        self.labels().inc(-amount)
+    
+    def _child_samples(self, labels: Dict[str, str], child: _CounterChild) -> List[Sample]:
+        return [(self.name, labels, child.value())]
+
+class _HistogramChild(_Child):
+    def __init__(self, buckets: Tuple[float, ...]):
+        # 各バケットの件数（累積しない）・上限超過・合計
+        super().__init__(len(buckets) + 2)
+        self._buckets = buckets
+    
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        stripe = self._stripes[_stripe_index()]
+        with stripe.lock:
+            stripe.values[index] += 1
+            stripe.values[-1] += value
+
+class Histogram(_Metric):
+    """値の分布（バケットごとの累積件数・合計・件数）"""
+    
+    type_name = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float):
+        self.labels().observe(value)
+    
+    def _child_samples(self, labels: Dict[str, str], child: _HistogramChild) -> List[Sample]:
+        totals = child._totals()
+        samples: List[Sample] = []
+        cumulative = 0.0
+        for bound, count in zip(list(self.buckets) + [math.inf], totals[:-1]):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+        samples.append((f"{self.name}_sum", labels, totals[-1]))
+        samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """メトリクスの登録と Prometheus のテキスト形式での出力
+    
+    記録時のロックはスレッドごとの区画のみで、出力時に区画を合計する。キャッシュの統計のように
+    既に集計されている値は、出力時に呼ばれるコレクターから (名前, 種類, 説明, サンプル) で返す。
+    """
+    
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+        self._lock = threading.Lock()
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]):
+        """出力時に呼ばれるコレクターを登録"""
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def render(self) -> str:
+        """Prometheus のテキスト形式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            for name, type_name, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+# グローバルインスタンス
+metrics_registry = MetricsRegistry()
+
+request_duration = metrics_registry.histogram(
+    'http_request_duration_seconds', 'エンドポイントごとの応答時間', ('endpoint', 'method'))
+requests_total = metrics_registry.counter(
+    'http_requests_total', 'エンドポイント・ステータスごとのリクエスト数', ('endpoint', 'method', 'status'))
+requests_in_flight = metrics_registry.gauge(
+    'http_requests_in_flight', '処理中のリクエスト数')
+storage_operation_duration = metrics_registry.histogram(
+    'firestore_operation_duration_seconds', 'バックエンド・操作ごとの RPC の所要時間', ('backend', 'operation'))
+storage_operation_errors = metrics_registry.counter(
+    'firestore_operation_errors_total', 'バックエンド・操作ごとの RPC の失敗数', ('backend', 'operation'))
+excel_report_duration = metrics_registry.histogram(
+    'excel_report_duration_seconds', 'Excel レポートの作成時間')
+excel_report_size = metrics_registry.histogram(
+    'excel_report_bytes', '作成した Excel レポートの大きさ', buckets=SIZE_BUCKETS)
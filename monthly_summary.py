@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Mapping
+
+from storage_backend import Increment
+from timesheet import ADDITIVE_TOTALS, Timesheet, day_totals
+from work_calendar import work_calendar
+
+logger = logging.getLogger(__name__)
+
+# 月別集計ドキュメントのコレクション（monthly_summaries/{username}_{YYYY-MM}）
+SUMMARY_COLLECTION = 'monthly_summaries'
+
+def summaries_enabled() -> bool:
+    """月別集計ドキュメントを書き込むかチェック（MONTHLY_SUMMARIES=false で無効）"""
+    return os.environ.get('MONTHLY_SUMMARIES', 'true').lower() == 'true'
+
+def summary_document_id(username: str, month_key: str) -> str:
+    return f"{username}_{month_key}"
+
+def _number(value: Any) -> Any:
+    # 整数になる値は int で保存する（Firestore で double にしない）
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+class MonthlySummaryStore:
+    """ユーザー × 月の集計ドキュメントの管理
+    
+    ドキュメントには日ごとの寄与を足し合わせて求められる月合計（ADDITIVE_TOTALS）を保持する。
+    勤怠の書き込み時は変更された日の変更前後の寄与の差分を Increment で、勤怠データと同じコミットで加算する。
+    変更前の記録が最新と確認できない（リスナーで同期していない）場合は読み込まずに要再集計（dirty）の印を付け、
+    rebuild_monthly_summaries.py --dirty（または集計の参照時）に月のデータから集計し直す。
+    月末の集計やチームの一覧は、ユーザー数分の小さなドキュメントを読むだけで済む。
+    """
+    
+    def __init__(self, storage=None, enabled: Optional[bool] = None):
+        self.storage = storage
+        self.enabled = summaries_enabled() if enabled is None else enabled
+        
+        self._lock = threading.Lock()
+        self._stats = {'increments': 0, 'dirty_marks': 0, 'rebuilds': 0, 'reads': 0}
+    
+    @staticmethod
+    def day_delta(date_str: str, before: Optional[Mapping], after: Optional[Mapping]) -> Dict[str, Any]:
+        """1日分の記録の変更による月合計の差分（変化の無い項目は含めない）"""
+        is_day_off = work_calendar.day(datetime.strptime(date_str, '%Y-%m-%d').date()).is_day_off
+        old = day_totals(before, is_day_off)
+        new = day_totals(after, is_day_off)
+        return {name: _number(new[name] - old[name]) for name in ADDITIVE_TOTALS if new[name] != old[name]}
+    
+    def changes_delta(self, baseline: Dict[str, Mapping],
+                      changes: List[Tuple[str, str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """(日付, フィールド, 値) の変更による月ごとの差分（baseline は変更前のその日の記録）"""
+        after: Dict[str, Dict[str, Any]] = {}
+        for date_str, field, value in changes:
+            after.setdefault(date_str, dict(baseline.get(date_str) or {}))[field] = value
+        
+        deltas: Dict[str, Dict[str, Any]] = {}
+        for date_str, record in after.items():
+            delta = deltas.setdefault(date_str[:7], {})
+            for name, value in self.day_delta(date_str, baseline.get(date_str), record).items():
+                delta[name] = _number(delta.get(name, 0) + value)
+        return deltas
+    
+    def delta_write(self, username: str, month_key: str, delta: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+        """差分を加算する書き込み (コレクション, ドキュメントID, データ)（batch_write にそのまま渡せる）"""
+        data: Dict[str, Any] = {name: Increment(value) for name, value in delta.items()}
+        data.update({'username': username, 'month': month_key, 'last_updated': datetime.now().isoformat()})
+        return SUMMARY_COLLECTION, summary_document_id(username, month_key), data
+    
+    def dirty_write(self, username: str, month_key: str) -> Tuple[str, str, Dict[str, Any]]:
+        """要再集計の印を付ける書き込み（集計値は変えない。集計し直すと印は消える）"""
+        data = {'username': username, 'month': month_key, 'dirty': True, 'last_updated': datetime.now().isoformat()}
+        return SUMMARY_COLLECTION, summary_document_id(username, month_key), data
+    
+    def summary_writes(self, username: str, baseline: Optional[Dict[str, Mapping]],
+                       changes: List[Tuple[str, str, Any]]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """勤怠データの変更と同じコミットに含める集計ドキュメントの書き込み
+        
+        baseline（変更前のその日の記録）がある場合は月ごとの差分の加算、None の場合は
+        変更した月への要再集計の印。どちらも集計ドキュメントを読まない。
+        """
+        if baseline is None:
+            return [self.dirty_write(username, month_key) for month_key in sorted({date_str[:7] for date_str, _, _ in changes})]
+        deltas = self.changes_delta(baseline, changes)
+        return [self.delta_write(username, month_key, delta) for month_key, delta in sorted(deltas.items()) if delta]
+    
+    def record_writes(self, writes: List[Tuple[str, str, Dict[str, Any]]]):
+        """コミットに含めた集計ドキュメントの書き込みを記録"""
+        with self._lock:
+            for _, _, data in writes:
+                self._stats['dirty_marks' if data.get('dirty') else 'increments'] += 1
+    
+    @staticmethod
+    def totals_for(username: str, month_key: str, month_data: Mapping) -> Dict[str, Any]:
+        """月のデータから集計ドキュメントの内容を作成（書き込みはしない）"""
+        year, month = (int(part) for part in month_key.split('-'))
+        totals = Timesheet.from_month(year, month, month_data).totals
+        summary: Dict[str, Any] = {name: _number(totals[name][0].item()) for name in ADDITIVE_TOTALS}
+        summary.update({'username': username, 'month': month_key, 'last_updated': datetime.now().isoformat()})
+        return summary
+    
+    def rebuild(self, username: str, month_key: str, month_data: Mapping) -> Optional[Dict[str, Any]]:
+        """月のデータから集計し直して集計ドキュメントを上書き（要再集計の印も消える。失敗時は None）"""
+        summary = self.totals_for(username, month_key, month_data)
+        summary['rebuilt_at'] = summary['last_updated']
+        
+        if not self.storage.create_document(SUMMARY_COLLECTION, summary_document_id(username, month_key), summary):
+            logger.error(f"月別集計の再集計失敗: {username} - {month_key}")
+            return None
+        with self._lock:
+            self._stats['rebuilds'] += 1
+        logger.debug(f"月別集計を再集計: {username} - {month_key}")
+        return summary
+    
+    def get(self, username: str, month_key: str) -> Optional[Dict[str, Any]]:
+        """ユーザーの月の集計を取得（無い場合は None）"""
+        with self._lock:
+            self._stats['reads'] += 1
+        return self.storage.get_document(SUMMARY_COLLECTION, summary_document_id(username, month_key))
+    
+    def get_month(self, month_key: str) -> List[Dict[str, Any]]:
+        """月の全ユーザーの集計を取得（ユーザー名順）"""
+        with self._lock:
+            self._stats['reads'] += 1
+        summaries = self.storage.query_documents(SUMMARY_COLLECTION, 'month', '==', month_key)
+        return sorted(summaries, key=lambda summary: summary.get('username', ''))
+    
+    def dirty_months(self) -> List[Tuple[str, str]]:
+        """要再集計の印が付いた (ユーザー名, 月キー)"""
+        with self._lock:
+            self._stats['reads'] += 1
+        summaries = self.storage.query_documents(SUMMARY_COLLECTION, 'dirty', '==', True)
+        return sorted((summary['username'], summary['month']) for summary in summaries
+                      if summary.get('username') and summary.get('month'))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled)
+
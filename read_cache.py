@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Hashable
+
+from rpc_ledger import estimate_size
+
+logger = logging.getLogger(__name__)
+
+class _CacheEntry:
+    __slots__ = ('value', 'version', 'expires_at', 'size')
+    
+    def __init__(self, value: Any, version: Optional[str], expires_at: float, size: int):
+        self.value = value
+        self.version = version
+        self.expires_at = expires_at
+        self.size = size
+
+class VersionedReadCache:
+    """TTL・LRU・メモリ上限付きの読み込みキャッシュ
+    
+    値はドキュメントの版（last_updated / update_time）と共に保持する。TTL 内の値は
+    RPC なしで返し、TTL 切れの値は版を確認して変わっていなければ再利用できる
+    （revalidate）。古い版での上書きは無視するため、書き込みと並行した読み込みが
+    新しい値を巻き戻すことはない。
+    """
+    
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('ATTENDANCE_READ_CACHE_TTL', '30'))
+        self.max_entries = max_entries or int(os.environ.get('ATTENDANCE_READ_CACHE_MAX_ENTRIES', '512'))
+        self.max_bytes = max_bytes or int(os.environ.get('ATTENDANCE_READ_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        self._clock = clock
+        
+        self._entries: 'OrderedDict[Hashable, _CacheEntry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+    
+    def is_enabled(self) -> bool:
+        """キャッシュが有効かチェック（TTL 0 で無効）"""
+        return self.ttl > 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """TTL 内の値を取得（無い・期限切れの場合は None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= self._clock():
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry.value
+    
+    def stale_version(self, key: Hashable) -> Optional[str]:
+        """期限切れで残っている値の版を取得（再検証用）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.version if entry is not None else None
+    
+    def revalidate(self, key: Hashable, version: Optional[str]) -> Optional[Any]:
+        """最新の版が保持中の版と一致すれば期限を延長して値を返す（不一致なら破棄して None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or version is None or entry.version != version:
+                if entry is not None:
+                    self._remove(key)
+                return None
+            entry.expires_at = self._clock() + self.ttl
+            self._entries.move_to_end(key)
+            self._stats['revalidations'] += 1
+            return entry.value
+    
+    def put(self, key: Hashable, value: Any, version: Optional[str] = None):
+        """値を保持（保持中より古い版の値は無視）"""
+        if not self.is_enabled():
+            return
+        
+        size = estimate_size(value)
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current.version and version and version < current.version:
+                logger.debug(f"古い版の読み込み結果を破棄: {key}")
+                return
+            if current is not None:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(value, version, self._clock() + self.ttl, size)
+            self._bytes += size
+            self._evict()
+    
+    def apply(self, key: Hashable, mutate: Callable[[Any], int], version: Optional[str] = None):
+        """保持中の値に書き込み内容を反映（ライトスルー。期限は延長しない）
+        
+        mutate は変更した部分の大きさの増減（estimate_size の単位）を返す。値全体は数え直さない。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size_change = mutate(entry.value)
+            entry.version = version or entry.version
+            self._bytes -= entry.size
+            entry.size = max(0, entry.size + size_change)
+            self._bytes += entry.size
+            self._evict()
+    
+    def invalidate(self, key: Hashable):
+        """値を破棄"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+    
+    def clear(self):
+        """全ての値を破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def reset_stats(self):
+        """統計をリセット（保持中の値はそのまま）"""
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'evictions': 0}
+    
+    def stats(self) -> Dict[str, Any]:
+        """ヒット・ミスなどの統計を取得"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        hit_rate=self._stats['hits'] / lookups if lookups else 0.0)
+    
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+    
+    def _evict(self):
+        # 最も長く使われていない値から上限内に収まるまで破棄（最新の1件は残す）
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._stats['evictions'] += 1
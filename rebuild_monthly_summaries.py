@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+月別集計ドキュメントの再集計
+勤怠データから monthly_summaries/{username}_{YYYY-MM} を作り直す（導入時のバックフィル・復元後・集計方法の変更後）
+書き込み時に要再集計の印が付いた月は --dirty で修復する（定期実行を想定）
+
+使い方:
+    python rebuild_monthly_summaries.py                                  # 全ユーザー × 記録のある全ての月
+    python rebuild_monthly_summaries.py --users user1,user2 --months 2025-04,2025-05
+    python rebuild_monthly_summaries.py --dirty                          # 要再集計の印が付いた月のみ
+"""
+
+import argparse
+import sys
+
+from bulk_export import parse_months
+
+def main():
+    parser = argparse.ArgumentParser(description='月別集計ドキュメントの再集計')
+    parser.add_argument('--users', default='', help='対象のユーザー名（カンマ区切り、省略時は全ユーザー）')
+    parser.add_argument('--months', default='', help='対象の月（2025-04,2025-05 形式、省略時は記録のある全ての月）')
+    parser.add_argument('--dirty', action='store_true', help='要再集計の印が付いた月のみを作り直す')
+    args = parser.parse_args()
+    
+    try:
+        months = parse_months(args.months) or None
+    except ValueError as e:
+        print(f"❌ 不正な月の指定: {e}")
+        sys.exit(2)
+    usernames = [name.strip() for name in args.users.split(',') if name.strip()] or None
+    
+    from attendance_firestore import firestore_attendance_manager
+    if not firestore_attendance_manager.firestore.is_available():
+        print("❌ Firestore接続に失敗しました")
+        sys.exit(1)
+    
+    print("🔍 月別集計の再集計を開始...")
+    result = firestore_attendance_manager.rebuild_monthly_summaries(usernames=usernames, months=months,
+                                                                    dirty_only=args.dirty)
+    print(f"✅ 再集計: {result['rebuilt_users']}ユーザー / {result['rebuilt_months']}ヶ月")
+    if result['failed_users']:
+        print(f"❌ 失敗したユーザー: {', '.join(result['failed_users'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
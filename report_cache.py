@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+def month_data_version(month_data: Any) -> str:
+    """月の勤怠データの内容から版（ハッシュ）を計算"""
+    if hasattr(month_data, 'to_dict'):
+        month_data = month_data.to_dict()
+    payload = json.dumps(month_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ReportCache:
+    """作成済みの Excel レポート（バイト列）のキャッシュ
+    
+    キーはユーザー・年月・データの版・表示名・テンプレートの版から計算するハッシュで、
+    そのまま ETag として使う（内容が変われば別のキーになるため、古いレポートを返すことはない）。
+    メモリ上は合計サイズの上限付き LRU、REPORT_CACHE_DIR を指定した場合はディスクにも保持する。
+    編集時は変更された月のレポートだけを破棄する。
+    """
+    
+    def __init__(self, max_bytes: Optional[int] = None, cache_dir: Optional[str] = None,
+                 disk_max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get('REPORT_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+        self.cache_dir = cache_dir if cache_dir is not None else os.environ.get('REPORT_CACHE_DIR', '')
+        self.disk_max_bytes = disk_max_bytes if disk_max_bytes is not None else \
+            int(os.environ.get('REPORT_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+        
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._entry_months: Dict[str, Tuple[str, str]] = {}
+        self._month_entries: Dict[Tuple[str, str], Set[str]] = {}
+        self._bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+    
+    def is_enabled(self) -> bool:
+        """キャッシュが有効かチェック（メモリ上限 0 かつディスク未指定で無効）"""
+        return self.max_bytes > 0 or bool(self.cache_dir)
+    
+    @staticmethod
+    def month_key(year: int, month: int) -> str:
+        return f"{int(year):04d}-{int(month):02d}"
+    
+    def etag_for(self, username: str, year: int, month: int, data_version: str,
+                 display_name: Optional[str], template_version: str) -> str:
+        """レポートのキー（ETag）を計算"""
+        parts = [username, self.month_key(year, month), data_version, display_name or '', template_version]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:32]
+    
+    def _user_dir(self, username: str) -> str:
+        # ユーザー名をそのままパスに使わない
+        return os.path.join(self.cache_dir, hashlib.sha256(username.encode('utf-8')).hexdigest()[:16])
+    
+    def _disk_path(self, username: str, month_key: str, etag: str) -> str:
+        return os.path.join(self._user_dir(username), month_key, f"{etag}.xlsx")
+    
+    def get(self, username: str, year: int, month: int, etag: str) -> Optional[bytes]:
+        """レポートを取得（メモリ、次にディスク。無い場合は None）"""
+        with self._lock:
+            content = self._entries.get(etag)
+            if content is not None:
+                self._entries.move_to_end(etag)
+                self._stats['memory_hits'] += 1
+                return content
+        
+        if self.cache_dir:
+            path = self._disk_path(username, self.month_key(year, month), etag)
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                os.utime(path)
+            except OSError:
+                content = None
+            if content is not None:
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+                self._remember(username, self.month_key(year, month), etag, content)
+                return content
+        
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+    
+    def put(self, username: str, year: int, month: int, etag: str, content: bytes):
+        """作成したレポートを保持"""
+        if not self.is_enabled():
+            return
+        month_key = self.month_key(year, month)
+        self._remember(username, month_key, etag, content)
+        with self._lock:
+            self._stats['stores'] += 1
+        if self.cache_dir:
+            self._write_disk(username, month_key, etag, content)
+    
+    def _remember(self, username: str, month_key: str, etag: str, content: bytes):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if etag in self._entries:
+                self._entries.move_to_end(etag)
+                return
+            self._entries[etag] = content
+            self._entry_months[etag] = (username, month_key)
+            self._month_entries.setdefault((username, month_key), set()).add(etag)
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+    
+    def _remove(self, etag: str):
+        content = self._entries.pop(etag)
+        self._bytes -= len(content)
+        month = self._entry_months.pop(etag)
+        etags = self._month_entries.get(month)
+        if etags is not None:
+            etags.discard(etag)
+            if not etags:
+                del self._month_entries[month]
+    
+    def _write_disk(self, username: str, month_key: str, etag: str, content: bytes):
+        path = self._disk_path(username, month_key, etag)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"レポートのディスク保存失敗: {e}")
+            return
+        
+        # 合計サイズが未計算（起動直後・破棄の後）の場合はディレクトリを走査する
+        disk_bytes = None if self._disk_bytes is not None else sum(size for _, size, _ in self._disk_files())
+        with self._lock:
+            if disk_bytes is not None:
+                self._disk_bytes = disk_bytes
+            else:
+                self._disk_bytes += len(content)
+            over_budget = self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._trim_disk()
+    
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        """ディスク上のレポート（更新時刻, サイズ, パス）"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.xlsx'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+    
+    def _trim_disk(self):
+        """ディスク上のレポートを古い順に削除して上限の 9 割まで減らす"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self._stats['disk_evictions'] += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+    
+    def invalidate_month(self, username: str, month_key: str):
+        """指定したユーザー・月のレポートを破棄"""
+        with self._lock:
+            for etag in list(self._month_entries.get((username, month_key), ())):
+                self._remove(etag)
+            self._stats['invalidations'] += 1
+            self._disk_bytes = None
+        if self.cache_dir:
+            shutil.rmtree(os.path.join(self._user_dir(username), month_key), ignore_errors=True)
+    
+    def invalidate_user(self, username: str):
+        """指定したユーザーの全ての月のレポートを破棄"""
+        with self._lock:
+            for (entry_user, _), etags in list(self._month_entries.items()):
+                if entry_user == username:
+                    for etag in list(etags):
+                        self._remove(etag)
+            self._stats['invalidations'] += 1
+            self._disk_bytes = None
+        if self.cache_dir:
+            shutil.rmtree(self._user_dir(username), ignore_errors=True)
+    
+    def on_months_changed(self, username: str, month_keys: Optional[List[str]]):
+        """勤怠データの変更通知（month_keys が None の場合はユーザーの全ての月）"""
+        if month_keys is None:
+            self.invalidate_user(username)
+        else:
+            for month_key in month_keys:
+                self.invalidate_month(username, month_key)
+    
+    def clear(self):
+        """全てのレポートを破棄（ディスク上のレポートファイルも含む）"""
+        with self._lock:
+            self._entries.clear()
+            self._entry_months.clear()
+            self._month_entries.clear()
+            self._bytes = 0
+            self._disk_bytes = None
+        if self.cache_dir:
+            for _, _, path in self._disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def reset_stats(self):
+        """統計をリセット（保持中のレポートはそのまま）"""
+        with self._lock:
+            self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0,
+                           'evictions': 0, 'disk_evictions': 0, 'invalidations': 0, 'not_modified': 0}
+    
+    def record_not_modified(self):
+        """If-None-Match で 304 を返した回数を記録"""
+        with self._lock:
+            self._stats['not_modified'] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'entries': len(self._entries), 'bytes': self._bytes, 'disk_enabled': bool(self.cache_dir)})
+            return stats
+
+# グローバルインスタンス
+report_cache = ReportCache()
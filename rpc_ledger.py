@@ -0,0 +1,253 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, NamedTuple, Callable
+
+from metrics import storage_operation_duration, storage_operation_errors
+
+logger = logging.getLogger(__name__)
+
+# 遅い RPC としてログに出すしきい値（ミリ秒）
+SLOW_CALL_MS = float(os.environ.get('FIRESTORE_SLOW_CALL_MS', '300'))
+
+# 送受信バイト数を JSON に変換して正確に数える（デバッグ用。既定は文字列の長さによる概算）
+EXACT_BYTES = os.environ.get('RPC_LEDGER_EXACT_BYTES', 'false').lower() in ('1', 'true', 'yes')
+
+READ = 'read'
+WRITE = 'write'
+
+def payload_size(data: Any) -> int:
+    """送受信データの大きさ（JSON換算のバイト数）"""
+    return len(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+
+def estimate_size(data: Any) -> int:
+    """送受信データの大きさの概算（キー・文字列は文字数、それ以外の値は 8 バイトとして数える）"""
+    if isinstance(data, (str, bytes)):
+        return len(data)
+    if isinstance(data, dict):
+        return sum(len(key) + estimate_size(value) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return sum(estimate_size(value) for value in data)
+    return 8
+
+class RpcCall(NamedTuple):
+    """1回の RPC の記録"""
+    operation: str
+    kind: str
+    collection: str
+    duration_ms: float
+    bytes_sent: int
+    bytes_received: int
+    documents: int
+    failed: bool = False
+
+class RpcLedger:
+    """RPC の台帳（リクエスト・テストのブロック単位）
+    
+    入れ子にした台帳の記録は外側の台帳にも記録される。async ビューの同時実行や
+    スレッドプールからも記録されるため、追加はロックで保護する。
+    """
+    
+    def __init__(self, parent: Optional['RpcLedger'] = None):
+        self.parent = parent
+        self.calls: List[RpcCall] = []
+        self._lock = threading.Lock()
+    
+    def record(self, call: RpcCall):
+        ledger = self
+        while ledger is not None:
+            with ledger._lock:
+                ledger.calls.append(call)
+            ledger = ledger.parent
+    
+    def count(self, kind: str) -> int:
+        with self._lock:
+            return sum(1 for call in self.calls if call.kind == kind)
+    
+    @property
+    def reads(self) -> int:
+        return self.count(READ)
+    
+    @property
+    def writes(self) -> int:
+        return self.count(WRITE)
+    
+    def summary(self) -> Dict[str, Any]:
+        """RPC 数・読み書きしたドキュメント数・送受信バイト数・所要時間の合計"""
+        with self._lock:
+            calls = list(self.calls)
+        by_operation: Dict[str, int] = {}
+        for call in calls:
+            by_operation[call.operation] = by_operation.get(call.operation, 0) + 1
+        return {
+            'rpc_count': len(calls),
+            'reads': sum(1 for call in calls if call.kind == READ),
+            'writes': sum(1 for call in calls if call.kind == WRITE),
+            'documents_read': sum(call.documents for call in calls if call.kind == READ),
+            'documents_written': sum(call.documents for call in calls if call.kind == WRITE),
+            'bytes_sent': sum(call.bytes_sent for call in calls),
+            'bytes_received': sum(call.bytes_received for call in calls),
+            'errors': sum(1 for call in calls if call.failed),
+            'duration_ms': round(sum(call.duration_ms for call in calls), 1),
+            'by_operation': by_operation,
+        }
+    
+    def server_timing(self) -> str:
+        """Server-Timing ヘッダーの値（ブラウザの開発者ツールで RPC の合計時間と回数を確認できる）"""
+        summary = self.summary()
+        return f'firestore;dur={summary["duration_ms"]};desc="reads={summary["reads"]} writes={summary["writes"]}"'
+
+_current_ledger: contextvars.ContextVar = contextvars.ContextVar('rpc_ledger', default=None)
+
+def current_ledger() -> Optional[RpcLedger]:
+    """実行中のリクエスト・ブロックの台帳（無い場合は None）"""
+    return _current_ledger.get()
+
+def open_ledger() -> contextvars.Token:
+    """台帳を開始（実行中の台帳があればその内側）し、close_ledger に渡すトークンを返す"""
+    return _current_ledger.set(RpcLedger(parent=current_ledger()))
+
+def close_ledger(token: contextvars.Token):
+    _current_ledger.reset(token)
+
+@contextmanager
+def ledger():
+    """ブロック内の RPC を記録する台帳"""
+    token = open_ledger()
+    try:
+        yield current_ledger()
+    finally:
+        close_ledger(token)
+
+# 実行中の RPC の失敗の印（操作ごとに recorded_rpc が設定する）
+_call_failed: contextvars.ContextVar = contextvars.ContextVar('rpc_call_failed', default=None)
+
+def mark_rpc_failed():
+    """実行中の RPC を失敗として記録（バックエンドの例外処理から呼ぶ）"""
+    failed = _call_failed.get()
+    if failed is not None:
+        failed[0] = True
+
+def _collection_of(args: tuple) -> str:
+    if args and isinstance(args[0], str):
+        return args[0]
+    if args and isinstance(args[0], list):
+        # batch_write の (コレクション, ドキュメントID, データ) のリスト
+        return ','.join(sorted({write[0] for write in args[0]}))
+    return ''
+
+def _record_call(backend: Any, operation: str, kind: str, args: tuple, kwargs: Dict[str, Any], result: Any,
+                 started: float, failed: bool):
+    duration_ms = (time.perf_counter() - started) * 1000
+    collection = _collection_of(args)
+    
+    backend_name = type(backend).__name__
+    storage_operation_duration.labels(backend_name, operation).observe(duration_ms / 1000)
+    if failed:
+        storage_operation_errors.labels(backend_name, operation).inc()
+    
+    ledger = current_ledger()
+    if ledger is not None:
+        # 引数のうちデータ（辞書・リスト）を送信、結果の辞書・リストを受信として数える
+        size = payload_size if EXACT_BYTES else estimate_size
+        sent = [value for value in list(args) + list(kwargs.values()) if isinstance(value, (dict, list))]
+        if kind == WRITE:
+            documents = len(args[0]) if args and isinstance(args[0], list) else 1
+        else:
+            documents = len(result) if isinstance(result, list) else 1
+        ledger.record(RpcCall(
+            operation=operation,
+            kind=kind,
+            collection=collection,
+            duration_ms=duration_ms,
+            bytes_sent=size(sent) if sent else 0,
+            bytes_received=size(result) if isinstance(result, (dict, list)) else 0,
+            documents=documents,
+            failed=failed,
+        ))
+    
+    if duration_ms >= SLOW_CALL_MS:
+        logger.warning(f"遅い RPC: {operation} {collection} {duration_ms:.0f}ms")
+
+def recorded_rpc(kind: str) -> Callable:
+    """ストレージの操作を RPC として台帳・メトリクス・遅い RPC のログに記録するデコレータ（async 関数にも使用できる）
+    
+    操作の失敗は、操作の中の例外処理で mark_rpc_failed() を呼んで記録する。
+    """
+    def decorator(method: Callable) -> Callable:
+        operation = method.__name__
+        
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def recorded_coroutine(self, *args, **kwargs):
+                if not self.is_available():
+                    # 利用不可の場合は RPC を行わないため記録しない
+                    return await method(self, *args, **kwargs)
+                failed = [False]
+                token = _call_failed.set(failed)
+                started = time.perf_counter()
+                try:
+                    result = await method(self, *args, **kwargs)
+                finally:
+                    _call_failed.reset(token)
+                _record_call(self, operation, kind, args, kwargs, result, started, failed[0])
+                return result
+            return recorded_coroutine
+        
+        @functools.wraps(method)
+        def recorded(self, *args, **kwargs):
+            if not self.is_available():
+                return method(self, *args, **kwargs)
+            failed = [False]
+            token = _call_failed.set(failed)
+            started = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                _call_failed.reset(token)
+            _record_call(self, operation, kind, args, kwargs, result, started, failed[0])
+            return result
+        return recorded
+    return decorator
+
+class RpcBudgetExceeded(AssertionError):
+    """RPC の予算超過（テスト・RPC_BUDGET_STRICT 有効時に送出）"""
+
+class RpcBudget(NamedTuple):
+    """読み込み・書き込みの RPC 数の上限（None は制限なし）"""
+    reads: Optional[int] = None
+    writes: Optional[int] = None
+    
+    def violations(self, ledger: RpcLedger) -> List[str]:
+        messages = []
+        if self.reads is not None and ledger.reads > self.reads:
+            messages.append(f"reads {ledger.reads} > {self.reads}")
+        if self.writes is not None and ledger.writes > self.writes:
+            messages.append(f"writes {ledger.writes} > {self.writes}")
+        return messages
+    
+    def check(self, ledger: RpcLedger, label: str = ''):
+        """予算を超えていれば RpcBudgetExceeded を送出"""
+        messages = self.violations(ledger)
+        if messages:
+            raise RpcBudgetExceeded(f"RPC予算超過 {label}: {', '.join(messages)} {ledger.summary()['by_operation']}")
+
+def rpc_budget(reads: Optional[int] = None, writes: Optional[int] = None) -> Callable:
+    """ビューの RPC 予算（1リクエストの読み込み・書き込みの RPC 数の上限）を宣言するデコレータ"""
+    def decorator(view: Callable) -> Callable:
+        view.rpc_budget = RpcBudget(reads, writes)
+        return view
+    return decorator
+
+@contextmanager
+def expect_rpc_budget(reads: Optional[int] = None, writes: Optional[int] = None, label: str = ''):
+    """テスト用: ブロック内の RPC が予算内であることを確認（超えた場合は RpcBudgetExceeded）"""
+    with ledger() as block_ledger:
+        yield block_ledger
+    RpcBudget(reads, writes).check(block_ledger, label)
@@ -0,0 +1,391 @@
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Tuple
+
+from storage_backend import StorageBackend, split_field_path, deep_merge, set_nested, matches_query
+
+logger = logging.getLogger(__name__)
+
+# 日単位のテーブルに分けて保存するフィールド
+ATTENDANCE_FIELD = 'attendance_data'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS documents (
+        collection TEXT NOT NULL,
+        doc_id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        update_time TEXT NOT NULL,
+        PRIMARY KEY (collection, doc_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS attendance_days (
+        collection TEXT NOT NULL,
+        doc_id TEXT NOT NULL,
+        username TEXT NOT NULL,
+        date TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (collection, doc_id, date)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_days_username_date ON attendance_days (username, date)',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_days_date ON attendance_days (date)',
+]
+
+class SQLiteBackend(StorageBackend):
+    """SQLite によるローカルストレージバックエンド
+    
+    ドキュメントは documents テーブルにJSONで保存し、勤怠データ（attendance_data）は
+    日単位で attendance_days テーブルに分けて保存する。(username, date) と (date) の
+    索引により、期間指定の読み込みで履歴全体を走査しない。WALモードで動作するため
+    複数スレッド・複数ワーカープロセスから同時に読み込める。
+    """
+    
+    def __init__(self, db_path: str = 'attendance.sqlite3'):
+        self.db_path = db_path
+        self.is_initialized = False
+        self._local = threading.local()
+        
+        # 初期化を試行
+        self._initialize_database()
+    
+    def _initialize_database(self):
+        """データベースを開き、WALモードとスキーマを設定"""
+        try:
+            conn = self._connection()
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self.is_initialized = True
+            logger.info(f"SQLite初期化成功: {self.db_path}")
+        
+        except Exception as e:
+            logger.error(f"SQLite初期化失敗: {str(e)}")
+            self.is_initialized = False
+    
+    def _connection(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得（トランザクションは明示的に開始する）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        """書き込みトランザクション（BEGIN IMMEDIATE で書き込みロックを先に取得）"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    def is_available(self) -> bool:
+        """SQLiteが利用可能かチェック"""
+        return self.is_initialized
+    
+    def create_document(self, collection: str, document_id: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """ドキュメントを作成（既存の場合は上書き）"""
+        try:
+            document_id = document_id or uuid.uuid4().hex[:20]
+            with self._transaction() as conn:
+                self._write_document(conn, collection, document_id, dict(data or {}), self._now())
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return document_id
+        
+        except Exception as e:
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    def create_document_if_absent(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[bool]:
+        """ドキュメントが存在しない場合のみ作成（確認と作成を1つのトランザクションで行う）"""
+        try:
+            with self._transaction() as conn:
+                if self._read_document(conn, collection, document_id, with_attendance=False) is not None:
+                    logger.info(f"ドキュメント既存のため作成しません: {collection}/{document_id}")
+                    return False
+                self._write_document(conn, collection, document_id, dict(data), self._now())
+            logger.info(f"ドキュメント作成: {collection}/{document_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"ドキュメント作成失敗: {str(e)}")
+            return None
+    
+    def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        """ドキュメントを取得"""
+        try:
+            document = self._read_document(self._connection(), collection_name, document_id)
+            if document is None:
+                logger.debug(f"ドキュメント存在しない: {collection_name}/{document_id}")
+                return None
+            return document[0]
+        
+        except Exception as e:
+            logger.error(f"ドキュメント取得失敗: {collection_name}/{document_id} - {str(e)}")
+            return None
+    
+    def update_fields(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool = False) -> Optional[str]:
+        """ドキュメントを部分更新し、更新時刻をバージョンとして返す"""
+        try:
+            update_time = self._now()
+            with self._transaction() as conn:
+                document = self._read_document(conn, collection, document_id, with_attendance=False)
+                if document is None:
+                    if not create_if_missing:
+                        logger.error(f"ドキュメント更新失敗: {collection}/{document_id} が存在しません")
+                        return None
+                    doc_data = {}
+                    self._insert_document_row(conn, collection, document_id, doc_data, update_time)
+                else:
+                    doc_data = document[0]
+                
+                for key, value in data.items():
+                    self._apply_field_update(conn, collection, document_id, doc_data, split_field_path(key), value)
+                self._insert_document_row(conn, collection, document_id, doc_data, update_time)
+                self._sync_attendance_username(conn, collection, document_id, doc_data)
+            
+            logger.info(f"ドキュメント更新: {collection}/{document_id}")
+            return update_time
+        
+        except Exception as e:
+            logger.error(f"ドキュメント更新失敗: {str(e)}")
+            return None
+    
+    def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        """複数ドキュメントへのマージ書き込みを1トランザクションで実行"""
+        try:
+            update_time = self._now()
+            with self._transaction() as conn:
+                for collection, document_id, data in writes:
+                    document = self._read_document(conn, collection, document_id, with_attendance=False)
+                    doc_data = document[0] if document else {}
+                    
+                    for key, value in data.items():
+                        if key == ATTENDANCE_FIELD and isinstance(value, dict):
+                            doc_data[ATTENDANCE_FIELD] = {}
+                            for date_str, daily_data in value.items():
+                                day = self._read_day(conn, collection, document_id, date_str)
+                                self._write_day(conn, collection, document_id, doc_data, date_str,
+                                                deep_merge(day, daily_data) if isinstance(daily_data, dict) else daily_data)
+                        elif isinstance(value, dict) and isinstance(doc_data.get(key), dict):
+                            doc_data[key] = deep_merge(doc_data[key], value)
+                        else:
+                            doc_data[key] = deep_merge(doc_data, {key: value})[key]
+                    
+                    self._insert_document_row(conn, collection, document_id, doc_data, update_time)
+                    self._sync_attendance_username(conn, collection, document_id, doc_data)
+            
+            logger.info(f"バッチ書き込み: {len(writes)}ドキュメント")
+            return update_time
+        
+        except Exception as e:
+            logger.error(f"バッチ書き込み失敗: {str(e)}")
+            return None
+    
+    def delete_document(self, collection: str, document_id: str) -> bool:
+        """ドキュメントを削除"""
+        try:
+            with self._transaction() as conn:
+                conn.execute('DELETE FROM documents WHERE collection = ? AND doc_id = ?', (collection, document_id))
+                conn.execute('DELETE FROM attendance_days WHERE collection = ? AND doc_id = ?', (collection, document_id))
+            logger.info(f"ドキュメント削除: {collection}/{document_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"ドキュメント削除失敗: {str(e)}")
+            return False
+    
+    def get_collection(self, collection: str, limit: Optional[int] = None, start_after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """コレクション内の全ドキュメントを取得（start_after 指定時はドキュメントID順で続きから）"""
+        try:
+            sql = 'SELECT collection, doc_id FROM documents WHERE collection = ?'
+            params: List[Any] = [collection]
+            if start_after:
+                sql += ' AND doc_id > ?'
+                params.append(start_after)
+            sql += ' ORDER BY doc_id'
+            if limit:
+                sql += ' LIMIT ?'
+                params.append(limit)
+            results = self._read_documents(sql, params)
+            logger.info(f"コレクション取得: {collection} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            logger.error(f"コレクション取得失敗: {str(e)}")
+            return []
+    
+    def get_collection_group(self, collection_id: str) -> List[Dict[str, Any]]:
+        """同名のサブコレクションを横断して全ドキュメントを取得"""
+        try:
+            sql = 'SELECT collection, doc_id FROM documents WHERE collection = ? OR collection LIKE ? ORDER BY collection, doc_id'
+            results = self._read_documents(sql, [collection_id, f'%/{collection_id}'])
+            logger.info(f"コレクショングループ取得: {collection_id} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            logger.error(f"コレクショングループ取得失敗: {str(e)}")
+            return []
+    
+    def query_documents(self, collection: str, field: str, operator: str, value: Any, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """条件付きクエリでドキュメントを検索"""
+        try:
+            results = []
+            for doc in self.get_collection(collection):
+                if matches_query(doc, field, operator, value):
+                    results.append(doc)
+                    if limit and len(results) >= limit:
+                        break
+            
+            logger.info(f"クエリ実行: {collection} where {field} {operator} {value} ({len(results)}件)")
+            return results
+        
+        except Exception as e:
+            logger.error(f"クエリ実行失敗: {str(e)}")
+            return []
+    
+    def count_documents(self, collection: str) -> Optional[int]:
+        """ドキュメント数を取得（本体の JSON は読まない）"""
+        try:
+            count = self._connection().execute(
+                'SELECT COUNT(*) FROM documents WHERE collection = ?', (collection,)
+            ).fetchone()[0]
+            logger.info(f"ドキュメント数取得: {collection} ({count}件)")
+            return count
+        
+        except Exception as e:
+            logger.error(f"ドキュメント数取得失敗: {str(e)}")
+            return None
+    
+    def query_attendance_days(self, collection: str, username: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        """(username, date) の索引を使って勤怠データを日付範囲で取得"""
+        try:
+            rows = self._connection().execute(
+                'SELECT date, data FROM attendance_days '
+                'WHERE username = ? AND date BETWEEN ? AND ? AND collection = ? ORDER BY date',
+                (username, start_date, end_date, collection)
+            ).fetchall()
+            return {date_str: json.loads(data) for date_str, data in rows}
+        
+        except Exception as e:
+            logger.error(f"勤怠データ期間取得失敗: {str(e)}")
+            return None
+    
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+    
+    @staticmethod
+    def _username_for(collection: str, document_id: str, doc_data: Dict[str, Any]) -> str:
+        """勤怠行に記録するユーザー名（user_attendance/{username}/months の場合はパスから取得）"""
+        if doc_data.get('username'):
+            return doc_data['username']
+        parts = collection.split('/')
+        return parts[1] if len(parts) >= 3 else document_id
+    
+    def _read_documents(self, sql: str, params: List[Any]) -> List[Dict[str, Any]]:
+        conn = self._connection()
+        results = []
+        for collection, document_id in conn.execute(sql, params).fetchall():
+            document = self._read_document(conn, collection, document_id)
+            if document and document[0]:
+                data = document[0]
+                data['_id'] = document_id
+                results.append(data)
+        return results
+    
+    def _read_document(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                       with_attendance: bool = True) -> Optional[Tuple[Dict[str, Any], str]]:
+        row = conn.execute(
+            'SELECT data, update_time FROM documents WHERE collection = ? AND doc_id = ?',
+            (collection, document_id)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        data = json.loads(row[0])
+        if with_attendance and ATTENDANCE_FIELD in data:
+            data[ATTENDANCE_FIELD] = {
+                date_str: json.loads(day)
+                for date_str, day in conn.execute(
+                    'SELECT date, data FROM attendance_days WHERE collection = ? AND doc_id = ? ORDER BY date',
+                    (collection, document_id)
+                )
+            }
+        return data, row[1]
+    
+    def _insert_document_row(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                             doc_data: Dict[str, Any], update_time: str):
+        # 勤怠データ本体は attendance_days に保存し、ドキュメントには存在を示す空の辞書のみ残す
+        stored = dict(doc_data)
+        if ATTENDANCE_FIELD in stored:
+            stored[ATTENDANCE_FIELD] = {}
+        conn.execute(
+            'INSERT OR REPLACE INTO documents (collection, doc_id, data, update_time) VALUES (?, ?, ?, ?)',
+            (collection, document_id, json.dumps(stored, ensure_ascii=False, default=str), update_time)
+        )
+    
+    def _write_document(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                        doc_data: Dict[str, Any], update_time: str):
+        conn.execute('DELETE FROM attendance_days WHERE collection = ? AND doc_id = ?', (collection, document_id))
+        attendance_data = doc_data.get(ATTENDANCE_FIELD)
+        if isinstance(attendance_data, dict):
+            for date_str, daily_data in attendance_data.items():
+                self._write_day(conn, collection, document_id, doc_data, date_str, daily_data)
+        self._insert_document_row(conn, collection, document_id, doc_data, update_time)
+    
+    def _read_day(self, conn: sqlite3.Connection, collection: str, document_id: str, date_str: str) -> Dict[str, Any]:
+        row = conn.execute(
+            'SELECT data FROM attendance_days WHERE collection = ? AND doc_id = ? AND date = ?',
+            (collection, document_id, date_str)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+    
+    def _write_day(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                   doc_data: Dict[str, Any], date_str: str, daily_data: Any):
+        conn.execute(
+            'INSERT OR REPLACE INTO attendance_days (collection, doc_id, username, date, data) VALUES (?, ?, ?, ?, ?)',
+            (collection, document_id, self._username_for(collection, document_id, doc_data), date_str,
+             json.dumps(daily_data, ensure_ascii=False, default=str))
+        )
+    
+    def _sync_attendance_username(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                                  doc_data: Dict[str, Any]):
+        # username フィールドが後から書かれた場合でも索引上のユーザー名を揃える
+        conn.execute(
+            'UPDATE attendance_days SET username = ? WHERE collection = ? AND doc_id = ? AND username != ?',
+            (self._username_for(collection, document_id, doc_data), collection, document_id,
+             self._username_for(collection, document_id, doc_data))
+        )
+    
+    def _apply_field_update(self, conn: sqlite3.Connection, collection: str, document_id: str,
+                            doc_data: Dict[str, Any], names: List[str], value: Any):
+        """ドット区切りパス1件分の更新を適用"""
+        if names[0] != ATTENDANCE_FIELD:
+            set_nested(doc_data, names, value)
+            return
+        
+        if len(names) == 1:
+            # attendance_data 全体の置き換え
+            conn.execute('DELETE FROM attendance_days WHERE collection = ? AND doc_id = ?', (collection, document_id))
+            doc_data[ATTENDANCE_FIELD] = {}
+            for date_str, daily_data in (value or {}).items():
+                self._write_day(conn, collection, document_id, doc_data, date_str, daily_data)
+            return
+        
+        doc_data.setdefault(ATTENDANCE_FIELD, {})
+        date_str = names[1]
+        if len(names) == 2:
+            day = value
+        else:
+            day = self._read_day(conn, collection, document_id, date_str)
+            set_nested(day, names[2:], value)
+        self._write_day(conn, collection, document_id, doc_data, date_str, day)
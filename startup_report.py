@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+起動時間レポート
+モジュールごとの import 時間と、プロセス開始から最初のリクエストの応答までの時間を記録する
+
+使い方:
+    python startup_report.py                       # /auth への最初のリクエストまでを計測
+    python startup_report.py --path / --budget-ms 800
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# このモジュールが最初に import された時刻（wsgi.py で最初に import する）
+PROCESS_STARTED_AT = time.perf_counter()
+
+class StartupReport:
+    """起動時間の内訳を記録するクラス
+    
+    imports には起動時に読み込んだモジュール、deferred_imports には最初の使用時に
+    読み込んだモジュールの所要時間（ミリ秒）を記録する。計測は記録順に累積しないため、
+    先に読み込まれた依存モジュールの時間は後のモジュールには含まれない。
+    """
+    
+    def __init__(self, started_at: float, budget_ms: Optional[float] = None):
+        self.started_at = started_at
+        self.budget_ms = budget_ms if budget_ms is not None else float(os.environ.get('STARTUP_BUDGET_MS', '1500'))
+        self.imports: Dict[str, float] = {}
+        self.deferred_imports: Dict[str, float] = {}
+        self.app_ready_ms: Optional[float] = None
+        self.first_request_ms: Optional[float] = None
+        self.first_request_path: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    def elapsed_ms(self) -> float:
+        """プロセス開始からの経過時間（ミリ秒）"""
+        return (time.perf_counter() - self.started_at) * 1000
+    
+    @contextmanager
+    def measure(self, name: str, deferred: bool = False):
+        """ブロック内の import 時間を記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                target = self.deferred_imports if deferred else self.imports
+                target[name] = target.get(name, 0.0) + duration_ms
+    
+    def import_module(self, name: str):
+        """モジュールを最初の使用時に import（初回の所要時間を deferred_imports に記録）"""
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        with self.measure(name, deferred=True):
+            return importlib.import_module(name)
+    
+    def mark_app_ready(self):
+        """アプリの初期化（ルート定義まで）が完了した時刻を記録"""
+        if self.app_ready_ms is None:
+            self.app_ready_ms = self.elapsed_ms()
+    
+    def mark_first_request(self, path: str):
+        """最初のリクエストの応答時刻を記録（2回目以降は何もしない）"""
+        if self.first_request_ms is not None:
+            return
+        with self._lock:
+            if self.first_request_ms is None:
+                self.first_request_ms = self.elapsed_ms()
+                self.first_request_path = path
+                logger.info(f"最初のリクエスト応答: {path} - 起動から {self.first_request_ms:.1f}ms")
+    
+    def within_budget(self) -> Optional[bool]:
+        """最初のリクエストまでの時間が予算内か（未計測の場合は None）"""
+        if self.first_request_ms is None:
+            return None
+        return self.first_request_ms <= self.budget_ms
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """レポートを辞書で取得"""
+        with self._lock:
+            return {
+                'imports_ms': dict(self.imports),
+                'deferred_imports_ms': dict(self.deferred_imports),
+                'app_ready_ms': self.app_ready_ms,
+                'first_request_ms': self.first_request_ms,
+                'first_request_path': self.first_request_path,
+                'budget_ms': self.budget_ms,
+                'within_budget': self.within_budget(),
+            }
+
+# グローバルインスタンス
+startup_report = StartupReport(PROCESS_STARTED_AT)
+
+# 新しいプロセスで wsgi を読み込み、最初のリクエストを送ってレポートを出力するスクリプト
+_MEASURE_SCRIPT = '''
+import json, logging, sys
+sys.path.insert(0, {root!r})
+import startup_report
+logging.disable(logging.CRITICAL)
+from wsgi import app
+app.test_client().get({path!r})
+print("STARTUP_REPORT=" + json.dumps(startup_report.startup_report.to_dict()))
+'''
+
+def measure_cold_start(path: str = '/auth', budget_ms: Optional[float] = None) -> Dict[str, Any]:
+    """新しいプロセスでコールドスタートを計測してレポートを返す"""
+    env = dict(os.environ)
+    if budget_ms is not None:
+        env['STARTUP_BUDGET_MS'] = str(budget_ms)
+    root = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run(
+        [sys.executable, '-c', _MEASURE_SCRIPT.format(root=root, path=path)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith('STARTUP_REPORT='):
+            return json.loads(line[len('STARTUP_REPORT='):])
+    raise RuntimeError(f"起動時間レポートを取得できませんでした: {completed.stderr[-500:]}")
+
+def print_report(report: Dict[str, Any]):
+    print("=== 起動時に読み込んだモジュール ===")
+    for name, duration_ms in report['imports_ms'].items():
+        print(f"  {name:<24} {duration_ms:>8.1f}ms")
+    print("=== 最初の使用時に読み込んだモジュール ===")
+    for name, duration_ms in report['deferred_imports_ms'].items():
+        print(f"  {name:<24} {duration_ms:>8.1f}ms")
+    print(f"アプリ初期化完了: {report['app_ready_ms']:.1f}ms")
+    print(f"最初のリクエスト（{report['first_request_path']}）応答: {report['first_request_ms']:.1f}ms "
+          f"/ 予算 {report['budget_ms']:.0f}ms -> {'OK' if report['within_budget'] else '超過'}")
+
+def main():
+    parser = argparse.ArgumentParser(description='コールドスタートの起動時間レポート')
+    parser.add_argument('--path', default='/auth', help='最初に送るリクエストのパス')
+    parser.add_argument('--budget-ms', type=float, default=None, help='最初のリクエストまでの予算（既定は STARTUP_BUDGET_MS）')
+    args = parser.parse_args()
+    
+    report = measure_cold_start(args.path, args.budget_ms)
+    print_report(report)
+    sys.exit(0 if report['within_budget'] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -356,30 +356,181 @@ function saveField(date, field, value) {
     });
 }
 
+// 自動保存の送信待ち編集（フィールド名 → {date, field, value}）
+const pendingSaves = new Map();
+let saveTimeout;
+
+// フィールド名（例: check_in_2025-07-08）を日付とフィールドに分解
+function parseFieldName(name) {
+  const match = /^(.+)_(\d{4}-\d{2}-\d{2})$/.exec(name || "");
+  return match ? { field: match[1], date: match[2] } : null;
+}
+
+// 編集を送信待ちに追加し、最後の変更から1秒後にまとめて送信
+function queueFieldSave(date, field, value) {
+  pendingSaves.set(`${field}_${date}`, { date: date, field: field, value: value });
+  clearTimeout(saveTimeout);
+  saveTimeout = setTimeout(flushPendingSaves, 1000);
+}
+
+// 送信待ちの編集を1回のリクエストでまとめて保存
+function flushPendingSaves(useBeacon = false) {
+  clearTimeout(saveTimeout);
+  if (pendingSaves.size === 0) {
+    return;
+  }
+
+  const batch = new Map(pendingSaves);
+  pendingSaves.clear();
+  const body = JSON.stringify({ changes: Array.from(batch.values()) });
+
+  // ページ離脱時は sendBeacon で送信（レスポンスは待たない）
+  if (useBeacon && navigator.sendBeacon) {
+    navigator.sendBeacon(
+      "/api/save_fields",
+      new Blob([body], { type: "application/json" })
+    );
+    return;
+  }
+
+  fetch("/api/save_fields", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: body,
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.success) {
+        showNotification("データを保存しました", "success");
+      } else {
+        requeueFailedSaves(batch);
+        showNotification("保存に失敗しました", "danger");
+      }
+    })
+    .catch((error) => {
+      console.error("Error:", error);
+      requeueFailedSaves(batch);
+      showNotification("保存に失敗しました: " + error.message, "danger");
+    });
+}
+
+// 失敗した編集を送信待ちに戻す（送信中に新しい値が入った項目は上書きしない）
+function requeueFailedSaves(batch) {
+  batch.forEach((change, key) => {
+    if (!pendingSaves.has(key)) {
+      pendingSaves.set(key, change);
+    }
+  });
+}
+
 // 自動保存機能の改善
 function setupAutoSave() {
   const inputs = document.querySelectorAll(
-    'input[type="time"], input[type="text"], input[type="number"]'
+    'input[type="time"], input[type="text"], input[type="number"], select'
   );
-  let saveTimeout;
 
   inputs.forEach((input) => {
     input.addEventListener("change", function () {
-      clearTimeout(saveTimeout);
-
       // フィールド名から日付とフィールドを抽出
-      const name = this.name;
-      if (name.includes("_")) {
-        const parts = name.split("_");
-        const field = parts[0];
-        const date = parts.slice(1).join("_");
-
-        saveTimeout = setTimeout(() => {
-          saveField(date, field, this.value);
-        }, 1000);
+      const parsed = parseFieldName(this.name);
+      if (parsed) {
+        queueFieldSave(parsed.date, parsed.field, this.value);
       }
     });
   });
+
+  // ページを離れる前に送信待ちの編集を送る
+  document.addEventListener("visibilitychange", function () {
+    if (document.visibilityState === "hidden") {
+      flushPendingSaves(true);
+    }
+  });
+}
+
+// Excel出力をジョブとして登録し、作成が終わったらダウンロード
+function setupExportJobs() {
+  document.querySelectorAll('a[href*="export_excel"]').forEach((link) => {
+    link.addEventListener("click", function (e) {
+      if (!window.fetch) {
+        return; // 従来どおりリンク先で作成してダウンロード
+      }
+      e.preventDefault();
+      const params = new URL(link.href, window.location.origin).searchParams;
+      startExportJob(link, params.get("year"), params.get("month"));
+    });
+  });
+}
+
+function startExportJob(link, year, month) {
+  if (link.classList.contains("disabled")) {
+    return;
+  }
+  const originalHtml = link.innerHTML;
+  link.classList.add("disabled");
+  link.innerHTML =
+    '<span class="spinner-border spinner-border-sm" role="status"></span> 作成中...';
+
+  const restore = () => {
+    link.classList.remove("disabled");
+    link.innerHTML = originalHtml;
+  };
+  // ジョブAPIが使えない場合は従来の出力にフォールバック
+  const fallback = (error) => {
+    console.error("Error:", error);
+    restore();
+    window.location.href = link.href;
+  };
+
+  fetch("/api/export_jobs", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({ year: year, month: month }),
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (!data.success) {
+        throw new Error(data.error || "不明なエラー");
+      }
+      pollExportJob(data.job, restore, fallback, Date.now());
+    })
+    .catch(fallback);
+}
+
+// ジョブの状態を0.5秒ごとに確認（60秒で打ち切り）
+function pollExportJob(job, restore, fallback, startedAt) {
+  if (job.status === "done") {
+    restore();
+    window.location.href = job.download_url;
+    return;
+  }
+  if (job.status === "failed") {
+    restore();
+    showNotification(
+      "Excel出力に失敗しました: " + (job.error || "不明なエラー"),
+      "danger"
+    );
+    return;
+  }
+  if (Date.now() - startedAt > 60 * 1000) {
+    fallback(new Error("Excel出力ジョブがタイムアウトしました"));
+    return;
+  }
+
+  setTimeout(() => {
+    fetch(job.status_url)
+      .then((response) => response.json())
+      .then((data) => {
+        if (!data.success) {
+          throw new Error(data.error || "不明なエラー");
+        }
+        pollExportJob(data.job, restore, fallback, startedAt);
+      })
+      .catch(fallback);
+  }, 500);
 }
 
 // ページ読み込み時の初期化（更新）
@@ -393,6 +544,9 @@ document.addEventListener("DOMContentLoaded", function () {
   // キーボードショートカット
   setupKeyboardShortcuts();
 
+  // Excel出力（バックグラウンドで作成）
+  setupExportJobs();
+
   // 5分ごとに最新データを取得
   setInterval(() => {
     refreshPageData();
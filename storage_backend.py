@@ -0,0 +1,240 @@
+import operator
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Tuple, Callable, NamedTuple, Union
+
+_SIMPLE_FIELD_NAME = re.compile(r'^[_a-zA-Z][_a-zA-Z0-9]*$')
+
+class Increment(NamedTuple):
+    """数値フィールドへの加算（Firestore の Increment と同じく、書き込み時点の値に加える）
+    
+    update_fields / batch_write の値に指定できる。フィールドが無い・数値でない場合は 0 に加える。
+    """
+    value: Union[int, float]
+    
+    def apply(self, current: Any) -> Union[int, float]:
+        if isinstance(current, bool) or not isinstance(current, (int, float)):
+            current = 0
+        return current + self.value
+
+def resolve_increments(data: Dict[str, Any]) -> Dict[str, Any]:
+    """新規作成するドキュメントの Increment を加算後の値（0 + 加算値）に置き換え"""
+    return {
+        key: resolve_increments(value) if isinstance(value, dict) else
+        value.apply(None) if isinstance(value, Increment) else value
+        for key, value in data.items()
+    }
+
+def field_path(*field_names: str) -> str:
+    """ネストしたフィールド名からFirestoreのフィールドパス文字列を生成
+    
+    '2025-07-08' のように英数字以外を含む名前はバッククォートで囲む。
+    例: field_path('attendance_data', '2025-07-08', 'check_out')
+        -> 'attendance_data.`2025-07-08`.check_out'
+    """
+    parts = []
+    for name in field_names:
+        if _SIMPLE_FIELD_NAME.match(name):
+            parts.append(name)
+        else:
+            escaped = name.replace('\\', '\\\\').replace('`', '\\`')
+            parts.append(f'`{escaped}`')
+    return '.'.join(parts)
+
+def split_field_path(path: str) -> List[str]:
+    """フィールドパス文字列をフィールド名のリストに分解（field_path の逆変換）"""
+    names = []
+    current = []
+    quoted = False
+    i = 0
+    while i < len(path):
+        ch = path[i]
+        if quoted and ch == '\\' and i + 1 < len(path):
+            current.append(path[i + 1])
+            i += 2
+            continue
+        if ch == '`':
+            quoted = not quoted
+        elif ch == '.' and not quoted:
+            names.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    names.append(''.join(current))
+    return names
+
+def expand_field_paths(data: Dict[str, Any]) -> Dict[str, Any]:
+    """ドット区切りのフィールドパスをキーに持つ更新内容をネストした辞書に展開"""
+    expanded: Dict[str, Any] = {}
+    for key, value in data.items():
+        names = split_field_path(key)
+        target = expanded
+        for name in names[:-1]:
+            target = target.setdefault(name, {})
+        target[names[-1]] = value.apply(None) if isinstance(value, Increment) else value
+    return expanded
+
+def write_version(update_time: Optional[Any]) -> str:
+    """書き込み結果の update_time をバージョン文字列（RFC 3339）に変換"""
+    if update_time is None:
+        return datetime.now(timezone.utc).isoformat()
+    if hasattr(update_time, 'rfc3339'):
+        return update_time.rfc3339()
+    return update_time.isoformat()
+
+# query_documents の比較演算子（Firestore の where と同じ表記）
+QUERY_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda field_value, value: field_value in value,
+    'array-contains': lambda field_value, value: isinstance(field_value, list) and value in field_value,
+}
+
+def deep_merge(base: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
+    """ネストした辞書をマージ（Firestore の set(merge=True) と同じく末端のみ書き換え）"""
+    merged = dict(base)
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        elif isinstance(value, dict):
+            merged[key] = resolve_increments(value)
+        elif isinstance(value, Increment):
+            merged[key] = value.apply(merged.get(key))
+        else:
+            merged[key] = value
+    return merged
+
+def get_nested(data: Dict[str, Any], names: List[str]) -> Any:
+    """フィールド名のリストでネストした値を取得（途中が存在しない場合は None）"""
+    for name in names:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(name)
+    return data
+
+def set_nested(data: Dict[str, Any], names: List[str], value: Any):
+    """フィールド名のリストでネストした値を設定（途中の辞書は必要に応じて作成）"""
+    for name in names[:-1]:
+        child = data.get(name)
+        if not isinstance(child, dict):
+            child = {}
+            data[name] = child
+        data = child
+    data[names[-1]] = value.apply(data.get(names[-1])) if isinstance(value, Increment) else value
+
+def matches_query(data: Dict[str, Any], field: str, operator: str, value: Any) -> bool:
+    """ドキュメントが where 条件に一致するかチェック（フィールドが無い場合は一致しない）"""
+    field_value = get_nested(data, split_field_path(field))
+    if field_value is None and operator != '==':
+        return False
+    try:
+        return QUERY_OPERATORS[operator](field_value, value)
+    except TypeError:
+        return False
+
+class StorageBackend(ABC):
+    """ドキュメントストレージの共通インターフェース
+    
+    FirestoreManager の create/get/update/delete/query を抽象化したもの。
+    コレクション名には 'user_attendance/{username}/months' のようなサブコレクションの
+    パスも指定できる。勤怠・認証マネージャーはこのインターフェースのみを使用する。
+    """
+    
+    @abstractmethod
+    def is_available(self) -> bool:
+        """バックエンドが利用可能かチェック"""
+    
+    @abstractmethod
+    def create_document(self, collection: str, document_id: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """ドキュメントを作成（既存の場合は上書き）し、ドキュメントIDを返す"""
+    
+    def create_document_if_absent(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[bool]:
+        """ドキュメントが存在しない場合のみ作成（True: 作成 / False: 既に存在 / None: 失敗）
+        
+        既定の実装は確認と作成が別の操作になるため、条件付き作成に対応する
+        バックエンドは1回の書き込みで判定するように上書きする。
+        """
+        if self.get_document(collection, document_id) is not None:
+            return False
+        return True if self.create_document(collection, document_id, data) else None
+    
+    @abstractmethod
+    def get_document(self, collection_name: str, document_id: str) -> Optional[Dict]:
+        """ドキュメントを取得（存在しない場合は None）"""
+    
+    def get_document_fields(self, collection_name: str, document_id: str, field_names: List[str]) -> Optional[Dict]:
+        """ドキュメントの指定フィールドのみを取得（版の確認など、本体を読まずに済ませる用途）"""
+        data = self.get_document(collection_name, document_id)
+        if data is None:
+            return None
+        return {name: data[name] for name in field_names if name in data}
+    
+    def update_document(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool = False) -> bool:
+        """ドキュメントを更新
+        
+        data のキーにはドット区切りのフィールドパス（field_path() で生成）を指定でき、
+        指定したフィールドのみが書き換えられる。create_if_missing=True の場合、
+        ドキュメントが存在しないときに限り同じ内容で新規作成する。
+        """
+        return self.update_fields(collection, document_id, data, create_if_missing) is not None
+    
+    @abstractmethod
+    def update_fields(self, collection: str, document_id: str, data: Dict[str, Any], create_if_missing: bool = False) -> Optional[str]:
+        """ドキュメントを部分更新し、書き込みのバージョンを返す（失敗時は None）"""
+    
+    @abstractmethod
+    def batch_write(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> Optional[str]:
+        """(コレクション, ドキュメントID, ネストした辞書) のマージ書き込みを一括で実行しバージョンを返す"""
+    
+    @abstractmethod
+    def delete_document(self, collection: str, document_id: str) -> bool:
+        """ドキュメントを削除"""
+    
+    @abstractmethod
+    def get_collection(self, collection: str, limit: Optional[int] = None, start_after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """コレクション内の全ドキュメントを取得（各ドキュメントに '_id' を含める）
+        
+        start_after を指定した場合はドキュメントID順でそのIDより後のドキュメントを返す
+        （limit と組み合わせてページ単位で読み込む）。
+        """
+    
+    @abstractmethod
+    def get_collection_group(self, collection_id: str) -> List[Dict[str, Any]]:
+        """同名のサブコレクションを横断して全ドキュメントを取得"""
+    
+    @abstractmethod
+    def query_documents(self, collection: str, field: str, operator: str, value: Any, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """条件付きクエリでドキュメントを検索"""
+    
+    def count_documents(self, collection: str) -> Optional[int]:
+        """コレクション内のドキュメント数（失敗時は None）
+        
+        既定の実装は全ドキュメントを読み込むため、集計クエリに対応する
+        バックエンドはドキュメントを読まずに数えるように上書きする。
+        """
+        return len(self.get_collection(collection))
+    
+    def query_attendance_days(self, collection: str, username: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        """勤怠データを日付範囲で取得（日付 -> その日の記録）
+        
+        日付単位の索引を持つバックエンドのみが実装する。未対応の場合は None を返し、
+        呼び出し側はドキュメント単位の読み込みにフォールバックする。
+        """
+        return None
+    
+    def watch_collection(self, collection: str, callback: Callable[[List[Tuple[str, str, Optional[Dict[str, Any]]]]], None],
+                         group: bool = False) -> Optional[Any]:
+        """コレクションの変更を購読し、unsubscribe() を持つハンドルを返す（未対応の場合は None）
+        
+        callback には (種別, ドキュメントのパス, データ) のリストが渡される。種別は
+        'ADDED' / 'MODIFIED' / 'REMOVED'（REMOVED のデータは None）で、購読開始時には
+        既存の全ドキュメントが ADDED として通知される。group=True の場合は同名の
+        サブコレクションを横断して購読する。
+        """
+        return None
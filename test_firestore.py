@@ -108,6 +108,1567 @@ def test_attendance_manager_methods():
         print(f"✗ AttendanceManager機能テストエラー: {e}")
         return False
 
+def test_monthly_layout_helpers():
+    """月別分割レイアウトの補助関数テスト"""
+    try:
+        from attendance_firestore import firestore_attendance_manager as mgr
+        
+        if mgr._month_key('2025-07-08') != '2025-07' or mgr._month_key('invalid') is not None:
+            print("✗ 月キー変換異常")
+            return False
+        print("✓ 月キー変換正常")
+        
+        months = mgr._group_by_month({
+            '2025-07-08': {'check_in': '09:00'},
+            '2025-07-31': {'check_out': '18:00'},
+            '2025-08-01': {'check_in': '10:00'},
+            'invalid': {}
+        })
+        if sorted(months.keys()) != ['2025-07', '2025-08'] or len(months['2025-07']) != 2:
+            print("✗ 月別分割異常")
+            return False
+        print("✓ 月別分割正常")
+        
+        if mgr._months_collection('alice') != 'user_attendance/alice/months':
+            print("✗ 月別コレクションパス異常")
+            return False
+        print("✓ 月別コレクションパス正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 月別レイアウトテストエラー: {e}")
+        return False
+
+def test_field_path_helpers():
+    """部分更新用フィールドパス補助関数テスト"""
+    try:
+        from firestore_config import field_path, split_field_path, expand_field_paths
+        
+        path = field_path('attendance_data', '2025-07-08', 'check_out')
+        if path != 'attendance_data.`2025-07-08`.check_out':
+            print(f"✗ フィールドパス生成異常: {path}")
+            return False
+        print("✓ フィールドパス生成正常")
+        
+        if split_field_path(path) != ['attendance_data', '2025-07-08', 'check_out']:
+            print("✗ フィールドパス分解異常")
+            return False
+        print("✓ フィールドパス分解正常")
+        
+        expanded = expand_field_paths({path: '18:00', 'username': 'alice'})
+        if expanded != {'attendance_data': {'2025-07-08': {'check_out': '18:00'}}, 'username': 'alice'}:
+            print("✗ フィールドパス展開異常")
+            return False
+        print("✓ フィールドパス展開正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ フィールドパステストエラー: {e}")
+        return False
+
+def test_attendance_form_key_parsing():
+    """勤怠フォームのフィールド名分解テスト"""
+    try:
+        from app_firestore import parse_attendance_field_key
+        
+        cases = {
+            'check_in_2025-07-08': ('check_in', '2025-07-08'),
+            'travel_cost_2025-07-31': ('travel_cost', '2025-07-31'),
+            'notes_2025-08-01': ('notes', '2025-08-01'),
+            'year': None,
+            'check_in_invalid': None,
+        }
+        for key, expected in cases.items():
+            if parse_attendance_field_key(key) != expected:
+                print(f"✗ フィールド名分解異常: {key}")
+                return False
+        print("✓ フィールド名分解正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ フィールド名分解テストエラー: {e}")
+        return False
+
+def test_local_journal():
+    """ローカル追記型ジャーナルテスト"""
+    try:
+        import tempfile
+        from local_journal import AttendanceJournal
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            snapshot_path = os.path.join(tmp_dir, 'attendance_data.json')
+            
+            journal = AttendanceJournal(snapshot_path, durability='fsync', compact_threshold=3)
+            journal.write_snapshot({'alice': {'2025-07-01': {'check_in': '09:00'}}})
+            journal.append_changes('alice', [('2025-07-01', 'check_out', '18:00')])
+            journal.append_changes('bob', [('2025-07-02', 'check_in', '10:00'), ('2025-07-02', 'notes', '在宅')])
+            
+            # 閾値到達で圧縮されるため完了を待つ
+            compactor = journal._compactor
+            if compactor is not None:
+                compactor.join(5)
+            journal.close()
+            
+            state = AttendanceJournal(snapshot_path, durability='fsync').load()
+            expected = {
+                'alice': {'2025-07-01': {'check_in': '09:00', 'check_out': '18:00'}},
+                'bob': {'2025-07-02': {'check_in': '10:00', 'notes': '在宅'}}
+            }
+            if state != expected:
+                print(f"✗ ジャーナル再生異常: {state}")
+                return False
+            print("✓ ジャーナル追記・圧縮・再生正常")
+            
+            # 同じパスを使う2つのプロセス（ワーカー）: 一方の圧縮で切り替えられたジャーナルへの追記を失わない
+            shared_path = os.path.join(tmp_dir, 'shared.json')
+            worker_a = AttendanceJournal(shared_path, durability='batch', compact_threshold=1000)
+            worker_b = AttendanceJournal(shared_path, durability='batch', compact_threshold=1000)
+            worker_b.append_changes('bob', [('2025-07-01', 'check_in', '09:00')])
+            worker_a.append_changes('alice', [('2025-07-01', 'check_in', '08:30')])
+            worker_a.compact_in_background().join(5)
+            worker_b.append_changes('bob', [('2025-07-01', 'check_out', '18:00')])
+            worker_a.append_changes('alice', [('2025-07-01', 'check_out', '17:30')])
+            worker_b.compact_in_background().join(5)
+            worker_a.append_changes('alice', [('2025-07-02', 'notes', '在宅')])
+            for worker in (worker_a, worker_b):
+                worker.close()
+            state = AttendanceJournal(shared_path, durability='batch').load()
+            expected = {
+                'alice': {'2025-07-01': {'check_in': '08:30', 'check_out': '17:30'}, '2025-07-02': {'notes': '在宅'}},
+                'bob': {'2025-07-01': {'check_in': '09:00', 'check_out': '18:00'}}
+            }
+            if state != expected:
+                print(f"✗ 複数プロセスのジャーナルの追記が失われました: {state}")
+                return False
+            print("✓ 複数プロセスでの追記・圧縮正常")
+            
+            off_path = os.path.join(tmp_dir, 'off.json')
+            off_journal = AttendanceJournal(off_path, durability='off')
+            off_journal.append_changes('alice', [('2025-07-01', 'check_in', '09:00')])
+            off_journal.write_snapshot({'alice': {}})
+            if os.path.exists(off_path) or os.path.exists(off_journal.journal_path):
+                print("✗ off モードでファイルが書き込まれました")
+                return False
+            print("✓ off モードでは書き込みなし")
+        
+        return True
+    except Exception as e:
+        print(f"✗ ローカルジャーナルテストエラー: {e}")
+        return False
+
+def test_sqlite_backend():
+    """SQLiteストレージバックエンドテスト"""
+    try:
+        import tempfile
+        from sqlite_backend import SQLiteBackend
+        from firestore_config import field_path
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            backend = SQLiteBackend(os.path.join(tmp_dir, 'attendance.sqlite3'))
+            if not backend.is_available():
+                print("✗ SQLite初期化失敗")
+                return False
+            
+            # 存在しないドキュメントの部分更新は create_if_missing 指定時のみ作成
+            if backend.update_fields('user_attendance', 'alice', {'username': 'alice'}) is not None:
+                print("✗ 存在しないドキュメントが更新されました")
+                return False
+            version = backend.update_fields('user_attendance', 'alice', {
+                field_path('attendance_data', '2025-07-01', 'check_in'): '09:00',
+                'username': 'alice'
+            }, create_if_missing=True)
+            backend.batch_write([('user_attendance', 'alice', {
+                'attendance_data': {'2025-07-01': {'check_out': '18:00'}, '2025-08-01': {'check_in': '10:00'}}
+            })])
+            
+            doc = backend.get_document('user_attendance', 'alice')
+            expected = {
+                '2025-07-01': {'check_in': '09:00', 'check_out': '18:00'},
+                '2025-08-01': {'check_in': '10:00'}
+            }
+            if not version or doc.get('attendance_data') != expected or doc.get('username') != 'alice':
+                print(f"✗ 部分更新・マージ結果異常: {doc}")
+                return False
+            print("✓ 部分更新・バッチマージ正常")
+            
+            july = backend.query_attendance_days('user_attendance', 'alice', '2025-07-01', '2025-07-31')
+            if july != {'2025-07-01': expected['2025-07-01']}:
+                print(f"✗ 日付範囲取得異常: {july}")
+                return False
+            print("✓ 日付範囲取得正常")
+            
+            backend.create_document('user_attendance/bob/months', '2025-07', {'attendance_data': {'2025-07-02': {'check_in': '08:30'}}})
+            group = backend.get_collection_group('months')
+            if len(group) != 1 or group[0]['_id'] != '2025-07':
+                print(f"✗ コレクショングループ取得異常: {group}")
+                return False
+            if backend.query_attendance_days('user_attendance/bob/months', 'bob', '2025-07-01', '2025-07-31') != {'2025-07-02': {'check_in': '08:30'}}:
+                print("✗ 月別ドキュメントの日付範囲取得異常")
+                return False
+            if len(backend.query_documents('user_attendance', 'username', '==', 'alice')) != 1:
+                print("✗ クエリ結果異常")
+                return False
+            
+            backend.delete_document('user_attendance', 'alice')
+            if backend.get_document('user_attendance', 'alice') is not None or \
+                    backend.query_attendance_days('user_attendance', 'alice', '2025-01-01', '2025-12-31'):
+                print("✗ ドキュメント削除異常")
+                return False
+            print("✓ コレクショングループ・クエリ・削除正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ SQLiteバックエンドテストエラー: {e}")
+        return False
+
+def test_fake_firestore_manager():
+    """インメモリ Firestore 代替での読み書きテスト"""
+    try:
+        import tempfile
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        
+        fake = FakeFirestoreManager(seed=1)
+        manager = FirestoreAttendanceManager(firestore_manager=fake)
+        # 月別集計の書き込みは test_monthly_summaries で確認する
+        manager.monthly_summaries.enabled = False
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            
+            fake.reset_stats()
+            result = manager.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:00')
+            if not result or fake.stats()['rpc_count'] != 1:
+                print(f"✗ 打刻の書き込み異常: {result} / {fake.stats()}")
+                return False
+            print("✓ 打刻は1 RPC で書き込み")
+            
+            manager.bulk_update_user_attendance_records('alice', [('2025-07-01', 'check_out', '18:00'), ('2025-07-02', 'notes', '在宅')])
+            doc = fake.get_document('user_attendance', 'alice')
+            if doc['attendance_data'] != {'2025-07-01': {'check_in': '09:00', 'check_out': '18:00'}, '2025-07-02': {'notes': '在宅'}}:
+                print(f"✗ バッチ書き込み結果異常: {doc}")
+                return False
+            if fake.stats()['bytes_sent'] <= 0 or fake.stats()['bytes_received'] <= 0:
+                print("✗ バイト数が集計されていません")
+                return False
+            print("✓ バッチ書き込み・バイト数集計正常")
+            
+            # 変更の無い自動保存のまとめ送信は書き込まない
+            fake.reset_stats()
+            result = manager.bulk_update_user_attendance_records('alice', [])
+            if result != {'records': {}, 'version': None} or fake.stats()['rpc_count'] != 0:
+                print(f"✗ 空の一括保存で書き込みが発生しました: {result} / {fake.stats()}")
+                return False
+            
+            # トランザクション（競合時は再実行される）
+            def increment(transaction):
+                current = transaction.get('counters', 'punch') or {'count': 0}
+                if current['count'] == 0:
+                    fake.create_document('counters', 'punch', {'count': 10})
+                transaction.set('counters', 'punch', {'count': current['count'] + 1})
+            fake.run_transaction(increment)
+            if fake.get_document('counters', 'punch') != {'count': 11}:
+                print(f"✗ トランザクション結果異常: {fake.get_document('counters', 'punch')}")
+                return False
+            print("✓ トランザクションの競合再試行正常")
+            
+            if len(fake.query_documents('user_attendance', 'username', '==', 'alice')) != 1:
+                print("✗ クエリ結果異常")
+                return False
+            
+            # 失敗注入時は FirestoreManager と同じく None を返し、キャッシュを更新しない
+            fake.error_rate = 1.0
+            if manager.update_user_attendance_record('alice', '2025-07-03', 'check_in', '09:00') is not None:
+                print("✗ 失敗注入時に書き込み成功扱いになりました")
+                return False
+            if '2025-07-03' in manager.attendance_cache.get('alice', {}):
+                print("✗ 失敗した書き込みがキャッシュに反映されました")
+                return False
+            print("✓ 失敗注入正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ Firestore代替テストエラー: {e}")
+        return False
+
+def test_read_cache():
+    """バージョン付き読み込みキャッシュテスト"""
+    try:
+        import tempfile
+        from read_cache import VersionedReadCache
+        from rpc_ledger import estimate_size
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        
+        now = [0.0]
+        cache = VersionedReadCache(ttl=10, max_entries=2, clock=lambda: now[0])
+        cache.put('a', {'x': 1}, '2025-07-01T09:00:00')
+        cache.put('a', {'x': 0}, '2025-07-01T08:00:00')
+        if cache.get('a') != {'x': 1}:
+            print("✗ 古い版で上書きされました")
+            return False
+        cache.put('b', {}, None)
+        cache.get('a')
+        cache.put('c', {}, None)
+        if cache.get('b') is not None or cache.get('a') is None:
+            print("✗ LRU 破棄の順序が不正です")
+            return False
+        now[0] = 11.0
+        if cache.get('a') is not None or cache.revalidate('a', '2025-07-01T09:00:00') != {'x': 1}:
+            print("✗ TTL 切れ・再検証の動作が不正です")
+            return False
+        stats = cache.stats()
+        if stats['hits'] != 3 or stats['evictions'] != 1 or stats['revalidations'] != 1:
+            print(f"✗ 統計が不正です: {stats}")
+            return False
+        print("✓ TTL・LRU・版の比較正常")
+        
+        fake = FakeFirestoreManager()
+        manager = FirestoreAttendanceManager(firestore_manager=fake)
+        manager.read_cache = VersionedReadCache(ttl=10, clock=lambda: now[0])
+        manager.monthly_summaries.enabled = False
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:00')
+            
+            fake.reset_stats()
+            manager.get_user_attendance_data('alice')
+            manager.get_user_attendance_data('alice')
+            if fake.stats()['rpc_by_method'] != {'get_document': 1}:
+                print(f"✗ TTL 内の読み込みで RPC が発生しました: {fake.stats()}")
+                return False
+            
+            # 書き込みはキャッシュへ反映され、読み直しは不要
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_out', '18:00')
+            fake.reset_stats()
+            data = manager.get_user_attendance_data('alice')
+            if data['2025-07-01'] != {'check_in': '09:00', 'check_out': '18:00'} or fake.stats()['rpc_count'] != 0:
+                print(f"✗ ライトスルー異常: {data} / {fake.stats()}")
+                return False
+            
+            # ライトスルーは変更したフィールドの分だけ大きさを増減する（値全体を数え直した場合と一致）
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_out', '18:30')
+            manager.update_user_attendance_record('alice', '2025-07-02', 'notes', '在宅')
+            data = manager.get_user_attendance_data('alice')
+            if manager.read_cache.stats()['bytes'] != estimate_size(data):
+                print(f"✗ ライトスルー後のキャッシュの大きさが不正です: {manager.read_cache.stats()} / {estimate_size(data)}")
+                return False
+            fake.reset_stats()
+            
+            # TTL 切れでも版が同じなら last_updated のみ読む
+            now[0] = 30.0
+            manager.get_user_attendance_data('alice')
+            if fake.stats()['rpc_by_method'] != {'get_document_fields': 1}:
+                print(f"✗ 再検証の RPC が不正です: {fake.stats()}")
+                return False
+            print("✓ 勤怠データ読み込みのキャッシュ・再検証正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 読み込みキャッシュテストエラー: {e}")
+        return False
+
+def test_snapshot_listeners():
+    """スナップショットリスナーによるワーカー間のキャッシュ同期テスト"""
+    try:
+        import tempfile
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager, LAYOUT_MONTHLY
+        from auth_firestore import FirestoreAuthManager
+        from local_journal import AttendanceJournal
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for layout in ('legacy', LAYOUT_MONTHLY):
+                fake = FakeFirestoreManager()
+                reader = FirestoreAttendanceManager(firestore_manager=fake)
+                writer = FirestoreAttendanceManager(firestore_manager=fake)
+                for manager in (reader, writer):
+                    manager.storage_layout = layout
+                    manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+                
+                if not reader.start_snapshot_listener() or not reader.is_snapshot_listener_live():
+                    print(f"✗ リスナー開始失敗 ({layout})")
+                    return False
+                
+                # 別ワーカーの書き込みがリスナー経由で反映され、読み込みに RPC は不要
+                writer.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:00')
+                writer.bulk_update_user_attendance_records('alice', [('2025-08-01', 'notes', '在宅')])
+                fake.reset_stats()
+                data = reader.get_user_attendance_data('alice')
+                daily = reader.get_user_daily_data('alice', '2025-07-01')
+                if data != {'2025-07-01': {'check_in': '09:00'}, '2025-08-01': {'notes': '在宅'}} or \
+                        daily != {'check_in': '09:00'} or fake.stats()['rpc_count'] != 0:
+                    print(f"✗ キャッシュ同期異常 ({layout}): {data} / {daily} / {fake.stats()}")
+                    return False
+                
+                reader.stop_snapshot_listener()
+                writer.update_user_attendance_record('alice', '2025-07-02', 'check_in', '09:30')
+                if '2025-07-02' in reader.attendance_cache.get('alice', {}):
+                    print(f"✗ 購読終了後に反映されました ({layout})")
+                    return False
+                print(f"✓ 勤怠キャッシュ同期正常 ({layout})")
+            
+            reader_auth = FirestoreAuthManager(firestore_manager=fake)
+            writer_auth = FirestoreAuthManager(firestore_manager=fake)
+            reader_auth.start_snapshot_listener()
+            writer_auth.save_user_to_firestore('bob', writer_auth.hash_password('secret'), 'ボブ')
+            if not reader_auth.verify_password('bob', 'secret') or reader_auth.user_display_names_cache.get('bob') != 'ボブ':
+                print("✗ ユーザーキャッシュ同期異常")
+                return False
+            fake.delete_document('users', 'bob')
+            if 'bob' in reader_auth.users_cache or reader_auth.verify_password('bob', 'secret'):
+                print("✗ ユーザー削除が反映されていません")
+                return False
+            reader_auth.stop_snapshot_listener()
+            print("✓ ユーザーキャッシュ同期正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ スナップショットリスナーテストエラー: {e}")
+        return False
+
+def test_compact_records():
+    """勤怠記録のコンパクト表現テスト"""
+    try:
+        import json
+        import tempfile
+        from compact_records import UserRecords, MonthRecords, MISSING
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        
+        data = {
+            '2025-07-01': {'check_in': '09:00', 'check_out': '18:30', 'break_time': '1.0', 'travel_cost': '480',
+                           'travel_from': '東京', 'travel_to': '新宿', 'notes': ''},
+            '2025-07-02': {},
+            '2025-07-03': {'check_in': '9:00', 'break_time': '1', 'travel_cost': 480, 'overtime': '2'},
+            '2025-08-31': {'notes': '在宅'},
+            'invalid-date': {'check_in': '09:00'},
+        }
+        records = UserRecords.from_dict(data)
+        if records.to_dict() != data or len(records) != len(data):
+            print(f"✗ 辞書形式との相互変換が一致しません: {records.to_dict()}")
+            return False
+        
+        records.set_field('2025-07-02', 'check_in', '08:45')
+        del records['2025-08-31']
+        if records['2025-07-02'] != {'check_in': '08:45'} or '2025-08-31' in records:
+            print("✗ 記録の更新・削除が不正です")
+            return False
+        column = records.month('2025-07').column('check_in')
+        if column[0] != 9 * 60 or column[1] != 8 * 60 + 45 or column[3] != MISSING:
+            print(f"✗ 列の値が不正です: {list(column[:4])}")
+            return False
+        if MonthRecords.from_dict('2025-07', data).to_dict() != {d: v for d, v in data.items() if d.startswith('2025-07')}:
+            print("✗ 月の記録の変換が不正です")
+            return False
+        print("✓ 辞書形式との可逆変換正常")
+        
+        fake = FakeFirestoreManager()
+        manager = FirestoreAttendanceManager(firestore_manager=fake)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            result = manager.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:00')
+            manager.bulk_update_user_attendance_records('alice', [('2025-07-01', 'notes', '客先')])
+            if not isinstance(manager.attendance_cache['alice'], UserRecords) or result['data'] != {'check_in': '09:00'}:
+                print("✗ キャッシュがコンパクト形式になっていません")
+                return False
+            
+            month_records = manager.get_user_month_records('alice', 2025, 7)
+            if month_records.get('2025-07-01') != {'check_in': '09:00', 'notes': '客先'}:
+                print(f"✗ 月別データ取得異常: {dict(month_records)}")
+                return False
+            
+            backup_path = os.path.join(tmp_dir, 'backup.json')
+            manager.backup_to_json(backup_path)
+            with open(backup_path, 'r', encoding='utf-8') as f:
+                if json.load(f) != {'alice': {'2025-07-01': {'check_in': '09:00', 'notes': '客先'}}}:
+                    print("✗ バックアップが辞書形式になっていません")
+                    return False
+        print("✓ 勤怠キャッシュのコンパクト形式正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ コンパクト表現テストエラー: {e}")
+        return False
+
+def test_date_range_lookup():
+    """月別索引による月・期間の検索テスト"""
+    try:
+        import tempfile
+        from datetime import date
+        from compact_records import UserRecords, month_keys
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        from read_cache import VersionedReadCache
+        
+        if month_keys(date(2024, 11, 15), date(2025, 2, 1)) != ['2024-11', '2024-12', '2025-01', '2025-02']:
+            print("✗ 月キーの列挙が不正です")
+            return False
+        
+        data = {d: {'check_in': '09:00'} for d in ('2024-11-30', '2024-12-01', '2024-12-31', '2025-01-15', '2025-02-01')}
+        records = UserRecords.from_dict(data)
+        if list(records.range_to_dict(date(2024, 12, 1), date(2025, 1, 31))) != ['2024-12-01', '2024-12-31', '2025-01-15']:
+            print(f"✗ 期間検索が不正です: {list(records.range_to_dict(date(2024, 12, 1), date(2025, 1, 31)))}")
+            return False
+        print("✓ 月別索引の期間検索正常")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for layout in ('legacy', 'monthly'):
+                fake = FakeFirestoreManager()
+                manager = FirestoreAttendanceManager(firestore_manager=fake)
+                manager.storage_layout = layout
+                manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+                manager.bulk_update_user_attendance_records(
+                    'alice', [(d, 'check_in', '09:00') for d in data] + [('2024-12-01', 'notes', '在宅')])
+                manager.update_user_attendance_record('alice', '2025-01-16', 'check_out', '18:00')
+                
+                monthly = manager.get_user_monthly_data('alice', 2024, 12)
+                range_data = manager.get_user_range_data('alice', '2024-12-15', date(2025, 2, 1))
+                if monthly != {'2024-12-01': {'check_in': '09:00', 'notes': '在宅'}, '2024-12-31': {'check_in': '09:00'}} or \
+                        list(range_data) != ['2024-12-31', '2025-01-15', '2025-01-16', '2025-02-01']:
+                    print(f"✗ 月別・期間データ取得異常 ({layout}): {monthly} / {list(range_data)}")
+                    return False
+        print("✓ 月別・期間データ取得正常")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fake = FakeFirestoreManager()
+            legacy, monthly = FirestoreAttendanceManager(firestore_manager=fake), FirestoreAttendanceManager(firestore_manager=fake)
+            monthly.storage_layout = 'monthly'
+            for manager in (legacy, monthly):
+                manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            legacy.bulk_update_user_attendance_records('alice', [('2025-03-03', 'check_in', '09:00'), ('2025-03-04', 'check_in', '09:00')])
+            legacy.migrate_to_monthly_layout()
+            monthly.update_user_attendance_record('alice', '2025-03-03', 'check_in', '08:30')
+            legacy.update_user_attendance_record('alice', '2025-03-05', 'check_in', '10:00')
+            now = [0.0]
+            monthly.read_cache = VersionedReadCache(ttl=10, clock=lambda: now[0])
+            monthly.get_user_monthly_data('alice', 2025, 3)
+            result = legacy.migrate_to_monthly_layout()
+            
+            # 追加した日は版の再検証で読み込みキャッシュにも反映される
+            now[0] = 30.0
+            if '2025-03-05' not in monthly.get_user_monthly_data('alice', 2025, 3):
+                print("✗ 移行の再実行で追加した日が読み込みキャッシュの再検証で反映されません")
+                return False
+            
+            reader = FirestoreAttendanceManager(firestore_manager=fake)
+            reader.storage_layout = 'monthly'
+            migrated = reader.get_user_monthly_data('alice', 2025, 3)
+            if result['failed_users'] or migrated != {'2025-03-03': {'check_in': '08:30'}, '2025-03-04': {'check_in': '09:00'},
+                                                      '2025-03-05': {'check_in': '10:00'}}:
+                print(f"✗ 移行の再実行で月別の記録が上書きされました: {migrated} / {result}")
+                return False
+        print("✓ 月別レイアウト移行の再実行正常（既存の日は上書きしない）")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 期間検索テストエラー: {e}")
+        return False
+
+def test_lazy_loading():
+    """勤怠データの遅延読み込みテスト"""
+    try:
+        import tempfile
+        from datetime import datetime
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        
+        fake = FakeFirestoreManager()
+        for username in ('alice', 'bob', 'carol'):
+            fake.create_document('user_attendance', username, {
+                'username': username,
+                'attendance_data': {'2025-07-01': {'check_in': '09:00'}}
+            })
+        fake.create_document('user_sessions', 's1', {'username': 'bob', 'created_at': datetime.now().isoformat()})
+        
+        fake.reset_stats()
+        manager = FirestoreAttendanceManager(firestore_manager=fake)
+        if fake.stats()['rpc_count'] != 0 or manager.attendance_cache:
+            print(f"✗ 初期化時に読み込みが発生しました: {fake.stats()}")
+            return False
+        
+        data = manager.get_user_monthly_data('alice', 2025, 7)
+        if data != {'2025-07-01': {'check_in': '09:00'}} or set(manager.attendance_cache) != {'alice'} or \
+                fake.stats()['rpc_by_method'] != {'get_document': 1}:
+            print(f"✗ ユーザー単位の読み込み異常: {set(manager.attendance_cache)} / {fake.stats()}")
+            return False
+        print("✓ 初期化時の読み込みなし・ユーザー単位の読み込み正常")
+        
+        if manager.warm_up_recent_users(days=7) != ['bob'] or 'bob' not in manager.attendance_cache:
+            print("✗ 最近ログインしたユーザーの先読み異常")
+            return False
+        if set(manager.get_all_users_data()) != {'alice', 'bob', 'carol'}:
+            print("✗ 全ユーザーのデータが読み込まれていません")
+            return False
+        print("✓ 先読み・全件読み込み正常")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal_path = os.path.join(tmp_dir, 'attendance_data.json')
+            AttendanceJournal(journal_path, durability='batch').write_snapshot({'alice': {'2025-07-01': {'check_in': '09:00'}}})
+            fake.is_initialized = False
+            offline = FirestoreAttendanceManager(firestore_manager=fake)
+            offline.journal = AttendanceJournal(journal_path, durability='off')
+            offline.update_user_attendance_record('alice', '2025-07-01', 'check_out', '18:00')
+            if offline.get_user_attendance_data('alice') != {'2025-07-01': {'check_in': '09:00', 'check_out': '18:00'}}:
+                print(f"✗ オフライン時の読み込み異常: {offline.get_user_attendance_data('alice')}")
+                return False
+        print("✓ オフライン時のローカルファイル読み込み正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 遅延読み込みテストエラー: {e}")
+        return False
+
+def test_auth_lazy_cache():
+    """ユーザーキャッシュの遅延読み込み・条件付き登録テスト"""
+    try:
+        from fake_firestore import FakeFirestoreManager
+        from auth_firestore import FirestoreAuthManager
+        
+        fake = FakeFirestoreManager()
+        seed = FirestoreAuthManager(firestore_manager=fake)
+        for index in range(5):
+            seed.add_user(f"user{index}", 'secret', f"ユーザー{index}")
+        
+        fake.reset_stats()
+        manager = FirestoreAuthManager(firestore_manager=fake)
+        if fake.stats()['rpc_count'] != 0 or manager.users_cache:
+            print(f"✗ 初期化時に読み込みが発生しました: {fake.stats()}")
+            return False
+        if not manager.verify_password('user1', 'secret') or not manager.verify_password('user1', 'secret') or \
+                fake.stats()['rpc_by_method'] != {'get_document': 1}:
+            print(f"✗ ユーザー単位の読み込み異常: {fake.stats()}")
+            return False
+        print("✓ ユーザー単位の遅延読み込み正常")
+        
+        fake.reset_stats()
+        if not manager.add_user('newcomer', 'secret') or manager.add_user('user3', 'other') or \
+                fake.stats()['rpc_by_method'] != {'create_document_if_absent': 2}:
+            print(f"✗ 条件付き登録異常: {fake.stats()}")
+            return False
+        if not seed.verify_password('user3', 'secret'):
+            print("✗ 既存ユーザーが上書きされました")
+            return False
+        print("✓ 条件付き登録（1回の書き込みで重複判定）正常")
+        
+        manager.users_page_size = 2
+        fake.reset_stats()
+        if sorted(manager.get_user_list()) != ['newcomer', 'user0', 'user1', 'user2', 'user3', 'user4'] or \
+                fake.stats()['rpc_by_method'] != {'get_collection': 4}:
+            print(f"✗ ページ単位の全件読み込み異常: {fake.stats()}")
+            return False
+        seed.add_user('latecomer', 'secret')
+        fake.reset_stats()
+        if 'latecomer' not in manager.get_user_list() or fake.stats()['rpc_by_method'] != {'query_documents': 1}:
+            print(f"✗ 差分読み込み異常: {fake.stats()}")
+            return False
+        print("✓ 一覧のページ単位読み込み・差分更新正常")
+        
+        fake.reset_stats()
+        names = FirestoreAuthManager(firestore_manager=fake).get_display_names(['user0', 'user4', 'ghost'])
+        if names != {'user0': 'ユーザー0', 'user4': 'ユーザー4', 'ghost': 'ghost'} or \
+                set(fake.stats()['rpc_by_method']) != {'get_collection'}:
+            print(f"✗ 表示名の一括取得異常: {names} / {fake.stats()}")
+            return False
+        print("✓ 表示名の一括取得（ユーザーごとの読み込みなし）正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ ユーザーキャッシュテストエラー: {e}")
+        return False
+
+def test_cold_start():
+    """コールドスタート（重いモジュールの遅延読み込み・起動時間レポート）テスト"""
+    try:
+        import subprocess
+        from startup_report import measure_cold_start
+        
+        root = os.path.dirname(os.path.abspath(__file__))
+        heavy_modules = ['openpyxl', 'requests', 'jpholiday', 'numpy', 'google.cloud.firestore', 'grpc']
+        script = (
+            "import logging, sys; sys.path.insert(0, %r); logging.disable(logging.CRITICAL); "
+            "import app_firestore; print(','.join(m for m in %r if m in sys.modules))"
+        ) % (root, heavy_modules)
+        completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        loaded = completed.stdout.strip().splitlines()[-1] if completed.stdout.strip() else ''
+        if loaded:
+            print(f"✗ import 時に重いモジュールが読み込まれました: {loaded}")
+            return False
+        print("✓ 重いモジュールの遅延読み込み正常")
+        
+        report = measure_cold_start('/auth', budget_ms=60000)
+        if 'flask' not in report['imports_ms'] or report['first_request_path'] != '/auth' or \
+                report['first_request_ms'] is None or report['first_request_ms'] < report['app_ready_ms'] or \
+                report['within_budget'] is not True:
+            print(f"✗ 起動時間レポート異常: {report}")
+            return False
+        print(f"✓ 起動時間レポート正常（最初のリクエストまで {report['first_request_ms']:.0f}ms）")
+        
+        return True
+    except Exception as e:
+        print(f"✗ コールドスタートテストエラー: {e}")
+        return False
+
+def test_work_calendar():
+    """祝日・土日・休業日カレンダーテスト"""
+    try:
+        from datetime import date, timedelta
+        from work_calendar import WorkCalendar
+        
+        calendar = WorkCalendar(closure_days='12-29:年末休業,2025-08-13:夏季休業,02-29,invalid')
+        days = calendar.month_days(2025, 5)
+        if len(days) != 31 or days[4].holiday_name != 'こどもの日' or not days[4].is_holiday or \
+                days[2].weekday_name != 'Saturday' or not days[2].is_weekend or days[1].is_day_off:
+            print(f"✗ 月の表異常: {days[:5]}")
+            return False
+        if calendar.year(2025) is not calendar.year(2025) or calendar.stats()['cached_years'] != [2025]:
+            print("✗ 年ごとの表がメモ化されていません")
+            return False
+        print("✓ 年ごとの祝日表正常")
+        
+        if calendar.jpholiday_available:
+            import jpholiday
+            day = date(2025, 1, 1)
+            while day.year == 2025:
+                if calendar.day(day).is_holiday != bool(jpholiday.is_holiday(day)):
+                    print(f"✗ jpholiday と判定が異なります: {day}")
+                    return False
+                day += timedelta(days=1)
+            print("✓ jpholiday と同じ判定")
+        
+        closures = [calendar.day(d) for d in (date(2025, 12, 29), date(2026, 12, 29), date(2025, 8, 13), date(2028, 2, 29))]
+        if not all(entry.is_closure for entry in closures) or closures[0].holiday_name != '年末休業' or \
+                calendar.day(date(2026, 8, 13)).is_closure or not calendar.is_holiday(date(2025, 8, 13)):
+            print(f"✗ 休業日異常: {closures}")
+            return False
+        calendar.add_closure_day(date(2025, 11, 4), '創立記念日')
+        if calendar.holiday_name(date(2025, 11, 4)) != '創立記念日':
+            print("✗ 休業日の追加が反映されません")
+            return False
+        print("✓ 会社独自の休業日正常")
+        
+        fallback = WorkCalendar(closure_days='')
+        fallback.jpholiday_available = False
+        if fallback.is_holiday(date(2025, 5, 5)) or not fallback.day(date(2025, 5, 4)).is_day_off:
+            print("✗ jpholiday なしの判定異常")
+            return False
+        print("✓ jpholiday なしでも土日判定正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ カレンダーテストエラー: {e}")
+        return False
+
+def test_excel_report():
+    """作業時間報告書（テンプレート・名前付きスタイル）テスト"""
+    try:
+        import openpyxl
+        from excel_report import ExcelReportEngine, build_report_legacy
+        
+        data = {
+            '2025-05-07': {'check_in': '09:00', 'check_out': '18:00', 'break_time': '1.0', 'travel_cost': '320',
+                           'travel_from': '渋谷', 'travel_to': '新宿', 'notes': '客先訪問'},
+            '2025-05-20': {'check_in': '09:00', 'check_out': '18:30', 'travel_cost': 'abc'},
+        }
+        engine = ExcelReportEngine()
+        output, filename = engine.build(2025, 5, data, '山田')
+        legacy, legacy_filename = build_report_legacy(2025, 5, data, '山田')
+        if filename != legacy_filename or engine.template is not engine.template:
+            print(f"✗ ファイル名・テンプレート異常: {filename}")
+            return False
+        
+        sheet = openpyxl.load_workbook(output).active
+        expected = openpyxl.load_workbook(legacy).active
+        if set(map(str, sheet.merged_cells.ranges)) != set(map(str, expected.merged_cells.ranges)):
+            print(f"✗ 結合セル異常: {sheet.merged_cells.ranges}")
+            return False
+        for row in range(1, 60):
+            if sheet.row_dimensions[row].height != expected.row_dimensions[row].height:
+                print(f"✗ 行の高さ異常: {row}行目")
+                return False
+            for column in range(1, 22):
+                cell, expected_cell = sheet.cell(row, column), expected.cell(row, column)
+                if (cell.value, cell.font.b, cell.font.color and cell.font.color.rgb, cell.fill.fgColor.rgb, cell.alignment.horizontal) != \
+                        (expected_cell.value, expected_cell.font.b, expected_cell.font.color and expected_cell.font.color.rgb,
+                         expected_cell.fill.fgColor.rgb, expected_cell.alignment.horizontal):
+                    print(f"✗ セル異常: {cell.coordinate} {cell.value!r} != {expected_cell.value!r}")
+                    return False
+        if sheet['P30'].value != '16.50' or sheet['S30'].value != '320' or sheet['C17'].font.color.rgb != '00FF0000':
+            print(f"✗ 合計・土日祝の表示異常: {sheet['P30'].value} {sheet['S30'].value}")
+            return False
+        print("✓ 従来の処理と同じ内容・書式で作成")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 作業時間報告書テストエラー: {e}")
+        return False
+
+def test_report_cache():
+    """作成済みレポートのキャッシュ（ETag・ディスク・月単位の破棄）テスト"""
+    try:
+        import tempfile
+        from report_cache import ReportCache, month_data_version
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        
+        cache = ReportCache(max_bytes=250)
+        may = cache.etag_for('taro', 2025, 5, month_data_version({'2025-05-07': {'check_in': '09:00'}}), '太郎', '1')
+        if may == cache.etag_for('taro', 2025, 5, month_data_version({'2025-05-07': {'check_in': '09:15'}}), '太郎', '1') or \
+                may == cache.etag_for('taro', 2025, 5, month_data_version({'2025-05-07': {'check_in': '09:00'}}), '太郎', '2'):
+            print("✗ データ・テンプレートの版が ETag に反映されません")
+            return False
+        cache.put('taro', 2025, 5, may, b'x' * 100)
+        cache.put('taro', 2025, 6, 'june', b'y' * 100)
+        cache.put('hanako', 2025, 5, 'hanako-may', b'z' * 100)
+        if cache.get('taro', 2025, 5, may) is not None or cache.stats()['evictions'] != 1 or cache.stats()['bytes'] != 200:
+            print(f"✗ サイズ上限による破棄異常: {cache.stats()}")
+            return False
+        print("✓ ETag 計算・サイズ上限付きメモリキャッシュ正常")
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            disk = ReportCache(max_bytes=1024, cache_dir=temp_dir)
+            disk.put('taro', 2025, 5, 'may', b'report-may')
+            disk.put('taro', 2025, 6, 'june', b'report-june')
+            restarted = ReportCache(max_bytes=1024, cache_dir=temp_dir)
+            if restarted.get('taro', 2025, 5, 'may') != b'report-may' or restarted.stats()['disk_hits'] != 1:
+                print(f"✗ ディスクからの読み込み異常: {restarted.stats()}")
+                return False
+            restarted.invalidate_month('taro', '2025-05')
+            if ReportCache(max_bytes=1024, cache_dir=temp_dir).get('taro', 2025, 5, 'may') is not None or \
+                    restarted.get('taro', 2025, 6, 'june') != b'report-june':
+                print("✗ 月単位の破棄異常")
+                return False
+        print("✓ ディスク・月単位の破棄正常")
+        
+        manager = FirestoreAttendanceManager(firestore_manager=FakeFirestoreManager())
+        tracked = ReportCache(max_bytes=1024)
+        manager.add_change_listener(tracked.on_months_changed)
+        tracked.put('taro', 2025, 5, 'may', b'may')
+        tracked.put('taro', 2025, 6, 'june', b'june')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            manager.update_user_attendance_data('taro', '2025-06-02', 'check_in', '09:00')
+        if tracked.get('taro', 2025, 6, 'june') is not None or tracked.get('taro', 2025, 5, 'may') != b'may':
+            print(f"✗ 編集時の破棄異常: {tracked.stats()}")
+            return False
+        print("✓ 編集した月のレポートのみ破棄")
+        
+        return True
+    except Exception as e:
+        print(f"✗ レポートキャッシュテストエラー: {e}")
+        return False
+
+def test_bulk_export():
+    """一括出力（ZIP のストリーミング・プロセスプール）テスト"""
+    try:
+        import io
+        import zipfile
+        import openpyxl
+        from bulk_export import BulkExporter, ExportJob, parse_months
+        
+        if parse_months('2025-04, 2025-05,2025-04') != [(2025, 4), (2025, 5)]:
+            print("✗ 月の指定の解析異常")
+            return False
+        try:
+            parse_months('2025-13')
+            print("✗ 不正な月が受け付けられました")
+            return False
+        except ValueError:
+            pass
+        
+        def load_month(username, year, month):
+            if username == 'broken':
+                raise RuntimeError('読み込み失敗')
+            return {f"{year:04d}-{month:02d}-07": {'check_in': '09:00', 'check_out': '18:00'}}
+        
+        jobs = [ExportJob(username, f"{username}さん", 2025, month)
+                for month in (4, 5) for username in ('taro', 'broken', 'hanako')]
+        for workers in (0, 1):
+            exporter = BulkExporter(max_workers=workers, fetch_workers=2)
+            chunks = list(exporter.stream_zip(jobs, load_month))
+            exporter.shutdown()
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+            names = archive.namelist()
+            if len(chunks) != 5 or len(names) != 5 or names[0] != '2025-04/taro_作業時間報告書_2025年4月_taroさん.xlsx' or \
+                    archive.read('errors.txt').decode('utf-8').count('broken') != 2:
+                print(f"✗ ZIP の内容異常（ワーカー {workers}）: {names}")
+                return False
+            sheet = openpyxl.load_workbook(io.BytesIO(archive.read(names[1]))).active
+            if sheet['J7'].value != 'hanakoさん' or sheet['F20'].value != '8.00':
+                print(f"✗ レポートの内容異常（ワーカー {workers}）")
+                return False
+        print("✓ ZIP のストリーミング出力正常（スレッドのみ・プロセスプール）")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 一括出力テストエラー: {e}")
+        return False
+
+def test_timesheet():
+    """勤怠集計（Timesheet）テスト"""
+    try:
+        from compact_records import MonthRecords
+        from timesheet import Timesheet, format_minutes
+        
+        # 2025年4月: 1日は火曜、5日は土曜、29日は祝日（昭和の日）
+        data = {
+            '2025-04-01': {'check_in': '09:00', 'check_out': '18:00', 'break_time': '1.0', 'travel_cost': '320'},
+            '2025-04-02': {'check_in': '08:00', 'check_out': '21:30', 'break_time': '0.75'},
+            '2025-04-03': {'check_in': '21:00', 'check_out': '26:00', 'break_time': '0'},
+            '2025-04-05': {'check_in': '10:00', 'check_out': '15:00'},
+            '2025-04-07': {'check_in': '9:30', 'check_out': '12:00', 'travel_cost': '12.5'},
+            '2025-04-08': {'check_in': '18:00', 'check_out': '09:00'},
+            '2025-04-09': {'check_in': '09:00', 'check_out': ''},
+            '2025-04-29': {'check_in': '09:00', 'check_out': '13:00', 'break_time': ''},
+        }
+        expected = {
+            'work_minutes': 480 + 765 + 300 + 240 + 90 + 180, 'work_days': 6,
+            'overtime_minutes': 285, 'late_night_minutes': 240,
+            'holiday_work_minutes': 240 + 180, 'holiday_work_days': 2, 'travel_total': 332.5,
+        }
+        for source in (data, MonthRecords.from_dict('2025-04', data)):
+            summary = Timesheet.from_month(2025, 4, source).summary(daily=True)
+            for name, value in expected.items():
+                if summary[name] != value:
+                    print(f"✗ 集計異常（{type(source).__name__}）: {name}={summary[name]} 期待値 {value}")
+                    return False
+            daily = summary['daily_work_minutes']
+            if len(daily) != 30 or daily[:9] != [480, 765, 300, None, 240, None, 90, None, None] or \
+                    summary['weekly_minutes'] != [1785, 90, 0, 0, 180]:
+                print(f"✗ 日・週ごとの実働異常（{type(source).__name__}）: {daily} / {summary['weekly_minutes']}")
+                return False
+        print("✓ 実働・時間外・深夜・休日出勤・交通費の集計正常（辞書・MonthRecords）")
+        
+        # 週 40時間を超えた分も時間外になる（1日 8時間ちょうどを6日）
+        full_week = {f"2025-04-{day:02d}": {'check_in': '09:00', 'check_out': '18:00'} for day in range(7, 13)}
+        sheet = Timesheet.from_months([('a', 2025, 4, full_week), ('b', 2025, 5, {})])
+        if sheet.totals['overtime_minutes'].tolist() != [480, 0] or sheet.summary(1)['work_minutes'] != 0:
+            print(f"✗ 週の時間外・複数件の集計異常: {sheet.totals['overtime_minutes']}")
+            return False
+        if format_minutes(765) != '12:45' or format_minutes(None) != '' or format_minutes(0) != '':
+            print("✗ 時間表示の変換異常")
+            return False
+        print("✓ 週の時間外・複数件の集計正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 勤怠集計テストエラー: {e}")
+        return False
+
+def test_export_jobs():
+    """Excel出力ジョブ（重複排除・状態遷移・保持期間）テスト"""
+    try:
+        import threading
+        from report_cache import ReportCache
+        from export_jobs import ExportJobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+        
+        release = threading.Event()
+        renders = []
+        def render(year, month, data, display_name):
+            renders.append((year, month))
+            release.wait(5)
+            if data.get('broken'):
+                raise RuntimeError('作成失敗')
+            return f"{year}-{month}.xlsx", b'report'
+        
+        now = [1000.0]
+        queue = ExportJobQueue(workers=1, ttl=60, render=render, cache=ReportCache(max_bytes=1024, cache_dir=''),
+                               clock=lambda: now[0])
+        data = {'2025-04-07': {'check_in': '09:00'}}
+        job = queue.submit('taro', 2025, 4, data, '太郎')
+        if job.status not in (JOB_QUEUED, JOB_RUNNING) or queue.submit('taro', 2025, 4, dict(data), '太郎') is not job:
+            print("✗ 同じ内容のジョブが重複排除されていません")
+            return False
+        if queue.get(job.job_id, 'hanako') is not None:
+            print("✗ 他のユーザーのジョブが取得できます")
+            return False
+        release.set()
+        queue.shutdown()
+        if job.status != JOB_DONE or job.content != b'report' or len(renders) != 1:
+            print(f"✗ ジョブの状態異常: {job.status} / 作成 {len(renders)}回")
+            return False
+        print("✓ 重複排除・状態遷移正常")
+        
+        # 完了後も同じ内容なら作成済みのジョブを返し、内容が変われば別のジョブになる
+        changed = queue.submit('taro', 2025, 4, {'2025-04-08': {'check_in': '10:00'}}, '太郎')
+        if queue.submit('taro', 2025, 4, data, '太郎') is not job or changed is job:
+            print("✗ 完了済みジョブの再利用異常")
+            return False
+        failed = queue.submit('taro', 2025, 5, {'broken': True}, '太郎')
+        queue.shutdown()
+        if failed.status != JOB_FAILED or queue.submit('taro', 2025, 5, {'broken': True}, '太郎') is failed:
+            print("✗ 失敗したジョブの扱い異常")
+            return False
+        queue.shutdown()
+        
+        # 保持期間を過ぎたジョブは破棄され、レポートキャッシュから即座に完了する
+        now[0] += 61
+        if queue.get(job.job_id, 'taro') is not None:
+            print("✗ 保持期間を過ぎたジョブが残っています")
+            return False
+        again = queue.submit('taro', 2025, 4, data, '太郎')
+        if again is job or again.status != JOB_DONE or len(renders) != 4 or queue.stats()['cache_hits'] != 1:
+            print(f"✗ 作成済みレポートの再利用異常: {queue.stats()}")
+            return False
+        print("✓ 保持期間・作成済みレポートの再利用正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ Excel出力ジョブテストエラー: {e}")
+        return False
+
+def test_monthly_summaries():
+    """月別集計ドキュメント（差分の加算・再集計・チーム一覧）テスト"""
+    try:
+        import tempfile
+        from fake_firestore import FakeFirestoreManager
+        from sqlite_backend import SQLiteBackend
+        from storage_backend import Increment
+        from attendance_firestore import FirestoreAttendanceManager
+        from local_journal import AttendanceJournal
+        from monthly_summary import MonthlySummaryStore, SUMMARY_COLLECTION
+        from timesheet import ADDITIVE_TOTALS
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Increment は書き込み時点の値に加算される（無いフィールドは 0 から）
+            for backend in (FakeFirestoreManager(), SQLiteBackend(os.path.join(tmp_dir, 'summary.sqlite3'))):
+                backend.update_fields('counters', 'c', {'total': Increment(5)}, create_if_missing=True)
+                backend.update_fields('counters', 'c', {'total': Increment(-2), 'extra': Increment(1.5)})
+                backend.batch_write([('counters', 'c', {'total': Increment(10)}), ('counters', 'd', {'total': Increment(1)})])
+                c, d = backend.get_document('counters', 'c'), backend.get_document('counters', 'd')
+                if c['total'] != 13 or c['extra'] != 1.5 or d['total'] != 1:
+                    print(f"✗ Increment の加算異常 ({type(backend).__name__}): {c} / {d}")
+                    return False
+            print("✓ Increment の加算正常")
+            
+            fake = FakeFirestoreManager()
+            manager = FirestoreAttendanceManager(firestore_manager=fake)
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            
+            # リスナーで同期していない書き込みは、読み込まずに同じコミットで要再集計の印を付ける
+            fake.reset_stats()
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:30')
+            if fake.stats()['rpc_by_method'] != {'batch_write': 1} or \
+                    not fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07').get('dirty'):
+                print(f"✗ 要再集計の印の書き込み異常: {fake.stats()}")
+                return False
+            
+            # 集計の参照時に作り直す
+            if manager.get_user_monthly_summary('alice', 2025, 7).get('dirty'):
+                print("✗ 参照時に要再集計の月が作り直されません")
+                return False
+            
+            # リスナーで同期していない場合、読み込みキャッシュの変更前の記録は他のワーカーの書き込みを
+            # 反映していないことがあるため、差分を加算せずに要再集計の印を付ける
+            other = FirestoreAttendanceManager(firestore_manager=fake)
+            other.journal = AttendanceJournal(os.path.join(tmp_dir, 'other.json'), durability='off')
+            for worker in (manager, other):
+                worker.get_user_monthly_data('alice', 2025, 7)
+            other.update_user_attendance_record('alice', '2025-07-01', 'check_out', '18:00')
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_out', '19:00')
+            if not fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07').get('dirty'):
+                print("✗ 他のワーカーと同じ日への書き込みで要再集計の印が付きません")
+                return False
+            summary = manager.get_user_monthly_summary('alice', 2025, 7)
+            manager.read_cache.clear()
+            expected = MonthlySummaryStore.totals_for('alice', '2025-07', manager.get_user_monthly_data('alice', 2025, 7))
+            if summary.get('dirty') or summary['work_minutes'] != expected['work_minutes'] or \
+                    expected['work_minutes'] != 510:
+                print(f"✗ 他のワーカーの書き込み後の月別集計が不正です: {summary} / {expected}")
+                return False
+            print("✓ 他のワーカーとの書き込みが交互でも月別集計は再集計と一致")
+            
+            # リスナーで同期中は、変更された日の差分のみを勤怠データと同じコミットで加算する
+            if not manager.start_snapshot_listener():
+                print("✗ リスナー開始失敗")
+                return False
+            fake.reset_stats()
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_out', '23:00')
+            if fake.stats()['rpc_by_method'] != {'batch_write': 1} or \
+                    fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07').get('dirty'):
+                print(f"✗ 差分の加算が1回のコミットになりません: {fake.stats()}")
+                return False
+            manager.bulk_update_user_attendance_records('alice', [
+                ('2025-07-05', 'check_in', '09:00'), ('2025-07-05', 'check_out', '15:00'),
+                ('2025-07-01', 'break_time', '0:30'), ('2025-07-02', 'travel_cost', '320'),
+            ])
+            manager.update_user_attendance_record('alice', '2025-07-01', 'check_out', '')
+            stored = fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07')
+            expected = MonthlySummaryStore.totals_for('alice', '2025-07', manager.get_user_monthly_data('alice', 2025, 7))
+            if stored.get('dirty') or any(stored[name] != expected[name] for name in ADDITIVE_TOTALS):
+                print(f"✗ 差分の加算結果が再集計と一致しません: {stored} / {expected}")
+                return False
+            manager.stop_snapshot_listener()
+            manager.read_cache.clear()
+            fake.reset_stats()
+            manager.update_user_attendance_record('alice', '2025-07-02', 'check_in', '08:45')
+            manager.update_user_attendance_record('alice', '2025-07-02', 'check_out', '18:00')
+            if fake.stats()['rpc_by_method'] != {'batch_write': 2}:
+                print(f"✗ 書き込み時に読み込み・再集計が発生しました: {fake.stats()}")
+                return False
+            
+            # 要再集計の月は --dirty の再集計で作り直す
+            result = manager.rebuild_monthly_summaries(dirty_only=True)
+            stored = fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07')
+            if result != {'rebuilt_users': 1, 'rebuilt_months': 1, 'failed_users': []} or stored.get('dirty') or \
+                    manager.monthly_summaries.dirty_months():
+                print(f"✗ 要再集計の月の作り直し異常: {result} / {stored}")
+                return False
+            expected = MonthlySummaryStore.totals_for('alice', '2025-07', manager.get_user_monthly_data('alice', 2025, 7))
+            if any(stored[name] != expected[name] for name in ADDITIVE_TOTALS):
+                print(f"✗ 再集計の結果が月のデータと一致しません: {stored} / {expected}")
+                return False
+            if stored['work_days'] != 2 or stored['holiday_work_days'] != 1 or stored['late_arrivals'] != 1 or \
+                    stored['travel_total'] != 320:
+                print(f"✗ 月別集計の値が不正です: {stored}")
+                return False
+            print("✓ 差分の加算結果が再集計と一致")
+            
+            # チーム一覧は集計ドキュメントを1回のクエリで取得する
+            manager.update_user_attendance_record('bob', '2025-07-03', 'check_in', '09:00')
+            fake.reset_stats()
+            summaries = manager.monthly_summaries.get_month('2025-07')
+            if [summary['username'] for summary in summaries] != ['alice', 'bob'] or \
+                    fake.stats()['rpc_by_method'] != {'query_documents': 1}:
+                print(f"✗ チーム一覧の取得異常: {summaries} / {fake.stats()}")
+                return False
+            
+            # 再集計は記録の無い指定月を 0 で上書きする
+            fake.create_document(SUMMARY_COLLECTION, 'bob_2025-08', {'username': 'bob', 'month': '2025-08', 'work_days': 9})
+            result = manager.rebuild_monthly_summaries(usernames=['bob'], months=[(2025, 7), (2025, 8)])
+            if result != {'rebuilt_users': 1, 'rebuilt_months': 2, 'failed_users': []} or \
+                    fake.get_document(SUMMARY_COLLECTION, 'bob_2025-08')['work_days'] != 0:
+                print(f"✗ 再集計異常: {result}")
+                return False
+            print("✓ チーム一覧・再集計正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 月別集計テストエラー: {e}")
+        return False
+
+def test_async_views():
+    """非同期の読み書き（AsyncAttendanceManager・async ビュー）テスト"""
+    try:
+        import asyncio
+        import tempfile
+        from fake_firestore import FakeFirestoreManager
+        from attendance_firestore import FirestoreAttendanceManager
+        from async_attendance import AsyncAttendanceManager
+        from local_journal import AttendanceJournal
+        from monthly_summary import MonthlySummaryStore, SUMMARY_COLLECTION
+        from timesheet import ADDITIVE_TOTALS
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fake = FakeFirestoreManager()
+            manager = FirestoreAttendanceManager(firestore_manager=fake)
+            manager.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            async_manager = AsyncAttendanceManager(manager)
+            
+            # 別々の日の書き込みを同時に行っても、月別集計は再集計と一致する（差分はリスナーで同期中のみ加算）
+            async def write_days():
+                await async_manager.update_user_attendance_record('alice', '2025-07-01', 'check_in', '09:30')
+                manager.get_user_monthly_summary('alice', 2025, 7)
+                manager.start_snapshot_listener()
+                return await asyncio.gather(*(
+                    async_manager.update_user_attendance_record('alice', date_str, field, value)
+                    for date_str, field, value in [
+                        ('2025-07-01', 'check_out', '19:00'), ('2025-07-02', 'check_in', '09:00'),
+                        ('2025-07-03', 'check_in', '08:30'), ('2025-07-03', 'check_out', '17:30'),
+                    ]
+                ))
+            
+            results = asyncio.run(write_days())
+            if not all(results) or results[0]['data'] != {'check_in': '09:30', 'check_out': '19:00'}:
+                print(f"✗ 非同期の書き込み結果が不正です: {results}")
+                return False
+            stored = fake.get_document(SUMMARY_COLLECTION, 'alice_2025-07')
+            expected = MonthlySummaryStore.totals_for('alice', '2025-07', manager.get_user_monthly_data('alice', 2025, 7))
+            if stored.get('dirty') or any(stored[name] != expected[name] for name in ADDITIVE_TOTALS):
+                print(f"✗ 同時書き込み後の月別集計が再集計と一致しません: {stored} / {expected}")
+                return False
+            manager.stop_snapshot_listener()
+            print("✓ 非同期の同時書き込み・月別集計正常")
+            
+            # 従来レイアウトの複数月はユーザーのドキュメントを1回だけ読む
+            months = [(2025, 5), (2025, 6), (2025, 7)]
+            manager.read_cache.clear()
+            fake.reset_stats()
+            records = asyncio.run(async_manager.get_user_months_records('alice', months))
+            if fake.stats()['rpc_by_method'] != {'get_document': 1}:
+                print(f"✗ 複数月の読み込みで重複した読み込みが発生しました: {fake.stats()}")
+                return False
+            if [month_records.to_dict() for month_records in records] != \
+                    [manager.get_user_monthly_data('alice', year, month) for year, month in months]:
+                print("✗ 非同期の読み込み結果が同期版と一致しません")
+                return False
+            
+            # 同期版と同じ手順で読み込む（キャッシュの状態が同じなら RPC も同じ）
+            for layout in ('legacy', 'monthly'):
+                manager.storage_layout = layout
+                manager.read_cache.clear()
+                fake.reset_stats()
+                sync_data, sync_rpcs = manager.get_user_monthly_data('alice', 2025, 7), fake.stats()['rpc_by_method']
+                manager.read_cache.clear()
+                fake.reset_stats()
+                async_data = asyncio.run(async_manager.get_user_monthly_data('alice', 2025, 7))
+                if async_data != sync_data or fake.stats()['rpc_by_method'] != sync_rpcs:
+                    print(f"✗ 非同期の読み込み手順が同期版と異なります ({layout}): {sync_rpcs} / {fake.stats()}")
+                    return False
+            manager.storage_layout = 'legacy'
+            print("✓ 非同期の複数月読み込み正常")
+        
+        # async ビューもログイン必須（未ログインの API は 401）
+        import app_firestore
+        client = app_firestore.app.test_client()
+        response = client.post('/api/punch', json={'date': '2025-07-01', 'field': 'check_in'})
+        if response.status_code != 401:
+            print(f"✗ 未ログインの async ビューの応答が不正です: {response.status_code}")
+            return False
+        
+        previous_backend = app_firestore.get_attendance_manager().firestore
+        app_firestore.configure_storage_backend(FakeFirestoreManager())
+        try:
+            with client.session_transaction() as session:
+                session['logged_in'] = True
+                session['username'] = 'alice'
+            response = client.get('/api/timesheet_summary?months=2025-06,2025-07')
+            summaries = response.get_json().get('summaries')
+            if response.status_code != 200 or len(summaries) != 2:
+                print(f"✗ async ビューの応答が不正です: {response.status_code} {response.get_json()}")
+                return False
+        finally:
+            app_firestore.configure_storage_backend(previous_backend)
+        print("✓ async ビュー正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 非同期テストエラー: {e}")
+        return False
+
+def test_diagnostics():
+    """ヘルスチェック・診断情報（集計クエリ・TTL キャッシュ・管理者認証）テスト"""
+    try:
+        import tempfile
+        from fake_firestore import FakeFirestoreManager
+        from sqlite_backend import SQLiteBackend
+        from diagnostics import StorageDiagnostics
+        
+        # ドキュメント数は本体を読まずに1回の集計クエリで数える
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend in (FakeFirestoreManager(), SQLiteBackend(os.path.join(tmp_dir, 'diagnostics.sqlite3'))):
+                for username in ('alice', 'bob'):
+                    backend.create_document('users', username, {'username': username})
+                if backend.count_documents('users') != 2 or backend.count_documents('user_sessions') != 0:
+                    print(f"✗ ドキュメント数の取得異常 ({type(backend).__name__})")
+                    return False
+        print("✓ ドキュメント数の取得正常")
+        
+        # TTL 内は集計クエリを再実行しない
+        fake = FakeFirestoreManager()
+        fake.create_document('users', 'alice', {'username': 'alice'})
+        diagnostics = StorageDiagnostics(ttl=60)
+        fake.reset_stats()
+        first = diagnostics.snapshot(fake)
+        second = diagnostics.snapshot(fake)
+        if first['counts'] != {'users': 1, 'user_sessions': 0, 'user_attendance': 0} or \
+                second['counts'] != first['counts'] or fake.stats()['rpc_by_method'] != {'count_documents': 3}:
+            print(f"✗ 診断情報のキャッシュ異常: {first} / {fake.stats()}")
+            return False
+        diagnostics.invalidate()
+        fake.create_document('users', 'bob', {'username': 'bob'})
+        if diagnostics.snapshot(fake)['counts']['users'] != 2 or diagnostics.stats()['refreshes'] != 2:
+            print(f"✗ 診断情報の再取得異常: {diagnostics.stats()}")
+            return False
+        print("✓ 診断情報のキャッシュ正常")
+        
+        # /healthz は読み込みなし、診断情報は管理者のみ
+        import app_firestore
+        client = app_firestore.app.test_client()
+        previous_backend = app_firestore.get_attendance_manager().firestore
+        app_firestore.configure_storage_backend(fake)
+        try:
+            fake.reset_stats()
+            response = client.get('/healthz')
+            if response.status_code != 200 or response.get_json()['status'] != 'ok' or fake.stats()['rpc_count'] != 0:
+                print(f"✗ ヘルスチェック異常: {response.status_code} / {fake.stats()}")
+                return False
+            
+            if client.get('/api/debug/firestore', headers={'Content-Type': 'application/json'}).status_code != 401:
+                print("✗ 未ログインで診断情報が参照できます")
+                return False
+            with client.session_transaction() as session:
+                session['logged_in'] = True
+                session['username'] = 'alice'
+            if client.get('/debug/firestore').status_code != 403 or client.get('/api/debug/startup').status_code != 403:
+                print("✗ 管理者以外が診断情報を参照できます")
+                return False
+            
+            with client.session_transaction() as session:
+                session['username'] = 'admin'
+            fake.reset_stats()
+            response = client.get('/api/debug/firestore')
+            if response.status_code != 200 or response.get_json()['user_count'] != 2 or \
+                    'get_collection' in fake.stats()['rpc_by_method']:
+                print(f"✗ 診断情報の応答異常: {response.status_code} {response.get_json()} / {fake.stats()}")
+                return False
+            if client.get('/api/debug/startup').status_code != 200:
+                print("✗ 管理者が起動時間レポートを参照できません")
+                return False
+        finally:
+            app_firestore.configure_storage_backend(previous_backend)
+        print("✓ ヘルスチェック・診断情報の認証正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ 診断情報テストエラー: {e}")
+        return False
+
+def test_rpc_ledger():
+    """RPC 台帳（操作・バイト数の記録・遅い RPC のログ・ビューの RPC 予算）テスト"""
+    try:
+        import asyncio
+        import logging
+        import tempfile
+        import rpc_ledger
+        from fake_firestore import FakeFirestoreManager
+        from async_storage import ThreadedAsyncBackend
+        from local_journal import AttendanceJournal
+        from rpc_ledger import ledger, expect_rpc_budget, RpcBudgetExceeded
+        
+        # 台帳には操作・コレクション・バイト数が記録され、入れ子の台帳は外側にも記録される
+        fake = FakeFirestoreManager()
+        fake.create_document('users', 'alice', {'username': 'alice'})
+        with ledger() as outer:
+            fake.get_document('users', 'alice')
+            with ledger() as inner:
+                fake.update_fields('users', 'alice', {'display_name': 'Alice'})
+                fake.batch_write([('users', 'bob', {'username': 'bob'}), ('user_sessions', 's1', {'username': 'bob'})])
+        summary = outer.summary()
+        if (summary['reads'], summary['writes'], summary['documents_written']) != (1, 2, 3) or \
+                inner.summary()['rpc_count'] != 2 or summary['bytes_received'] <= 0 or summary['bytes_sent'] <= 0:
+            print(f"✗ 台帳の記録異常: {summary}")
+            return False
+        if [call.collection for call in outer.calls] != ['users', 'users', 'user_sessions,users']:
+            print(f"✗ 台帳のコレクション異常: {outer.calls}")
+            return False
+        
+        # バイト数は既定で概算し、RPC_LEDGER_EXACT_BYTES 有効時のみ JSON で数える
+        if rpc_ledger.estimate_size({'name': 'alice', 'days': [1, 2]}) != 4 + 5 + 4 + 16:
+            print("✗ バイト数の概算異常")
+            return False
+        previous_exact = rpc_ledger.EXACT_BYTES
+        rpc_ledger.EXACT_BYTES = True
+        try:
+            with ledger() as exact:
+                fake.get_document('users', 'alice')
+        finally:
+            rpc_ledger.EXACT_BYTES = previous_exact
+        if exact.calls[0].bytes_received != rpc_ledger.payload_size(fake.get_document('users', 'alice')):
+            print(f"✗ 正確なバイト数の記録異常: {exact.calls}")
+            return False
+        
+        # スレッドプールで実行する async の RPC も呼び出し元の台帳に記録される
+        async def read_async():
+            with ledger() as async_ledger:
+                await asyncio.gather(*(ThreadedAsyncBackend(fake).get_document('users', name) for name in ('alice', 'bob')))
+            return async_ledger
+        if asyncio.run(read_async()).reads != 2:
+            print("✗ async の RPC が台帳に記録されません")
+            return False
+        print("✓ RPC 台帳の記録正常")
+        
+        # しきい値を超えた RPC はログに出る
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logging.getLogger('rpc_ledger').addHandler(handler)
+        previous_threshold = rpc_ledger.SLOW_CALL_MS
+        rpc_ledger.SLOW_CALL_MS = 0
+        try:
+            fake.get_document('users', 'alice')
+        finally:
+            rpc_ledger.SLOW_CALL_MS = previous_threshold
+            logging.getLogger('rpc_ledger').removeHandler(handler)
+        if not any('遅い RPC: get_document users' in message for message in messages):
+            print(f"✗ 遅い RPC のログ異常: {messages}")
+            return False
+        
+        try:
+            with expect_rpc_budget(reads=0, label='test'):
+                fake.get_document('users', 'alice')
+            print("✗ RPC 予算の超過が検出されません")
+            return False
+        except RpcBudgetExceeded:
+            pass
+        print("✓ 遅い RPC のログ・予算の確認正常")
+        
+        # 宣言したビューの RPC 予算（打刻・保存は読み込み 0・書き込み 1）
+        import app_firestore
+        from rpc_ledger import RpcBudget
+        for endpoint in ('api_punch', 'api_save_attendance', 'api_save_field'):
+            if getattr(app_firestore.app.view_functions[endpoint], 'rpc_budget', None) != RpcBudget(reads=0, writes=1):
+                print(f"✗ {endpoint} の RPC 予算が宣言されていません")
+                return False
+        
+        client = app_firestore.app.test_client()
+        attendance_mgr = app_firestore.get_attendance_manager()
+        previous_backend, previous_journal = attendance_mgr.firestore, attendance_mgr.journal
+        previous_testing, previous_strict = app_firestore.app.testing, app_firestore.app.config['RPC_BUDGET_STRICT']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            app_firestore.configure_storage_backend(FakeFirestoreManager())
+            attendance_mgr.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            app_firestore.app.testing = True
+            app_firestore.app.config['RPC_BUDGET_STRICT'] = True
+            try:
+                with client.session_transaction() as session:
+                    session['logged_in'] = True
+                    session['username'] = 'alice'
+                
+                # キャッシュの無い最初の打刻も読み込み 0・書き込み 1（超えた場合は RpcBudgetExceeded）
+                response = client.post('/api/punch', json={'date': '2025-07-01', 'field': 'check_in'})
+                if response.status_code != 200 or 'reads=0 writes=1' not in response.headers.get('Server-Timing', ''):
+                    print(f"✗ 最初の打刻の RPC が予算を超えています: {response.headers.get('Server-Timing')}")
+                    return False
+                
+                response = client.post('/api/punch', json={'date': '2025-07-01', 'field': 'check_out'})
+                if response.status_code != 200 or 'reads=0 writes=1' not in response.headers.get('Server-Timing', ''):
+                    print(f"✗ 打刻APIの RPC が予算を超えています: {response.headers.get('Server-Timing')}")
+                    return False
+                response = client.post('/api/save_attendance', json={'date': '2025-07-01', 'field': 'break_time', 'value': '1:00'})
+                if response.status_code != 200 or not response.get_json()['success']:
+                    print(f"✗ 保存APIの RPC が予算を超えています: {response.headers.get('Server-Timing')}")
+                    return False
+                response = client.post('/api/save_field', json={'date': '2025-07-02', 'field': 'notes', 'value': '在宅'})
+                if response.status_code != 200 or 'reads=0 writes=1' not in response.headers.get('Server-Timing', ''):
+                    print(f"✗ フィールド保存APIの RPC が予算を超えています: {response.headers.get('Server-Timing')}")
+                    return False
+                
+                # strict でない場合の予算超過はログの警告として出力する
+                app_firestore.app.config['RPC_BUDGET_STRICT'] = False
+                view = app_firestore.app.view_functions['api_save_field']
+                warnings = []
+                handler = logging.Handler(logging.WARNING)
+                handler.emit = warnings.append
+                app_firestore.logger.addHandler(handler)
+                view.rpc_budget = RpcBudget(reads=0, writes=0)
+                try:
+                    response = client.post('/api/save_field', json={'date': '2025-07-02', 'field': 'notes', 'value': '出社'})
+                finally:
+                    view.rpc_budget = RpcBudget(reads=0, writes=1)
+                    app_firestore.logger.removeHandler(handler)
+                if response.status_code != 200 or not any('RPC予算超過 api_save_field' in record.getMessage() for record in warnings):
+                    print(f"✗ 予算超過の警告がログに出力されません: {[record.getMessage() for record in warnings]}")
+                    return False
+            finally:
+                app_firestore.app.testing = previous_testing
+                app_firestore.app.config['RPC_BUDGET_STRICT'] = previous_strict
+                app_firestore.configure_storage_backend(previous_backend)
+                attendance_mgr.journal = previous_journal
+        print("✓ ビューの RPC 予算正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ RPC 台帳テストエラー: {e}")
+        return False
+
+def test_metrics():
+    """メトリクス（ヒストグラム・カウンター・/metrics の出力）テスト"""
+    try:
+        import re
+        import tempfile
+        import threading
+        from fake_firestore import FakeFirestoreManager
+        from local_journal import AttendanceJournal
+        from metrics import MetricsRegistry
+        
+        # 複数スレッドからの同時記録でも件数は失われない
+        registry = MetricsRegistry()
+        counter = registry.counter('test_events_total', 'テスト', ('kind',))
+        histogram = registry.histogram('test_seconds', 'テスト', buckets=(0.1, 1.0))
+        
+        def record():
+            for _ in range(5000):
+                counter.labels('a').inc()
+                histogram.observe(0.5)
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        histogram.observe(2)
+        text = registry.render()
+        expected_lines = ['test_events_total{kind="a"} 40000', 'test_seconds_bucket{le="0.1"} 0',
+                          'test_seconds_bucket{le="1"} 40000', 'test_seconds_bucket{le="+Inf"} 40001',
+                          'test_seconds_count 40001', 'test_seconds_sum 20002']
+        if any(line not in text.splitlines() for line in expected_lines):
+            print(f"✗ メトリクスの出力異常:\n{text}")
+            return False
+        print("✓ 同時記録・Prometheus 形式の出力正常")
+        
+        # RPC の所要時間・失敗数はバックエンド・操作ごとに記録される
+        import app_firestore
+        from metrics import metrics_registry
+        failing = FakeFirestoreManager(error_rate=1.0)
+        failing.get_document('users', 'alice')
+        if not re.search(r'^firestore_operation_errors_total\{backend="FakeFirestoreManager",operation="get_document"\} [1-9]',
+                         metrics_registry.render(), re.MULTILINE):
+            print("✗ RPC の失敗数が記録されません")
+            return False
+        
+        client = app_firestore.app.test_client()
+        attendance_mgr = app_firestore.get_attendance_manager()
+        previous_backend, previous_journal = attendance_mgr.firestore, attendance_mgr.journal
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            app_firestore.configure_storage_backend(FakeFirestoreManager())
+            attendance_mgr.journal = AttendanceJournal(os.path.join(tmp_dir, 'attendance_data.json'), durability='off')
+            try:
+                with client.session_transaction() as session:
+                    session['logged_in'] = True
+                    session['username'] = 'alice'
+                client.post('/api/punch', json={'date': '2025-07-01', 'field': 'check_in'})
+                app_firestore.excel_report_engine.build(2025, 7, attendance_mgr.get_user_monthly_data('alice', 2025, 7), 'Alice')
+                
+                response = client.get('/metrics')
+                text = response.get_data(as_text=True)
+                patterns = [
+                    r'^http_request_duration_seconds_bucket\{endpoint="api_punch",method="POST",le="\+Inf"\} [1-9]',
+                    r'^http_requests_total\{endpoint="api_punch",method="POST",status="200"\} [1-9]',
+                    r'^http_requests_in_flight 1$',
+                    r'^firestore_operation_duration_seconds_count\{backend="FakeFirestoreManager",operation="update_fields"\} [1-9]',
+                    r'^excel_report_bytes_count [1-9]',
+                    r'^cache_hit_ratio\{cache="attendance_read"\} ',
+                    r'^cache_requests_total\{cache="auth_users",result="hit"\} ',
+                ]
+                missing = [pattern for pattern in patterns if not re.search(pattern, text, re.MULTILINE)]
+                if response.status_code != 200 or not response.content_type.startswith('text/plain') or missing:
+                    print(f"✗ /metrics の出力に不足があります: {missing}")
+                    return False
+                
+                os.environ['METRICS_TOKEN'] = 'secret'
+                try:
+                    if client.get('/metrics').status_code != 401 or \
+                            client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code != 200:
+                        print("✗ METRICS_TOKEN による認証異常")
+                        return False
+                finally:
+                    del os.environ['METRICS_TOKEN']
+            finally:
+                app_firestore.configure_storage_backend(previous_backend)
+                attendance_mgr.journal = previous_journal
+        print("✓ /metrics の出力正常")
+        
+        return True
+    except Exception as e:
+        print(f"✗ メトリクステストエラー: {e}")
+        return False
+
 def test_app_firestore_imports():
     """app_firestore.py インポートテスト"""
     try:
@@ -141,7 +1702,31 @@ def test_environment_variables():
         'USE_FIRESTORE',
         'FIREBASE_PROJECT_ID',
         'GOOGLE_APPLICATION_CREDENTIALS',
-        'FIREBASE_SERVICE_ACCOUNT_JSON'
+        'FIREBASE_SERVICE_ACCOUNT_JSON',
+        'ATTENDANCE_STORAGE_LAYOUT',
+        'ATTENDANCE_JOURNAL_DURABILITY',
+        'STORAGE_BACKEND',
+        'FAKE_FIRESTORE_LATENCY_MS',
+        'ATTENDANCE_READ_CACHE_TTL',
+        'FIRESTORE_SNAPSHOT_LISTENERS',
+        'ATTENDANCE_WARMUP_DAYS',
+        'USERS_CACHE_PAGE_SIZE',
+        'STARTUP_BUDGET_MS',
+        'COMPANY_CLOSURE_DAYS',
+        'REPORT_CACHE_DIR',
+        'BULK_EXPORT_WORKERS',
+        'EXPORT_JOB_WORKERS',
+        'EXPORT_JOB_TTL',
+        'TIMESHEET_DAILY_STANDARD_MINUTES',
+        'TIMESHEET_WEEKLY_STANDARD_MINUTES',
+        'TIMESHEET_LATE_AFTER',
+        'MONTHLY_SUMMARIES',
+        'FIRESTORE_ASYNC_CLIENT',
+        'DIAGNOSTICS_CACHE_TTL',
+        'FIRESTORE_SLOW_CALL_MS',
+        'RPC_LEDGER_EXACT_BYTES',
+        'RPC_BUDGET_STRICT',
+        'METRICS_TOKEN'
     ]
     
     for var in env_vars:
@@ -167,7 +1752,31 @@ def run_all_tests():
         ("FirestoreManager初期化テスト", test_firestore_manager_initialization),
         ("AuthManager機能テスト", test_auth_manager_methods),
         ("AttendanceManager機能テスト", test_attendance_manager_methods),
+        ("月別レイアウトテスト", test_monthly_layout_helpers),
+        ("フィールドパステスト", test_field_path_helpers),
+        ("ローカルジャーナルテスト", test_local_journal),
+        ("SQLiteバックエンドテスト", test_sqlite_backend),
+        ("Firestore代替テスト", test_fake_firestore_manager),
+        ("読み込みキャッシュテスト", test_read_cache),
+        ("スナップショットリスナーテスト", test_snapshot_listeners),
+        ("コンパクト表現テスト", test_compact_records),
+        ("期間検索テスト", test_date_range_lookup),
+        ("遅延読み込みテスト", test_lazy_loading),
+        ("ユーザーキャッシュテスト", test_auth_lazy_cache),
+        ("コールドスタートテスト", test_cold_start),
+        ("カレンダーテスト", test_work_calendar),
+        ("作業時間報告書テスト", test_excel_report),
+        ("レポートキャッシュテスト", test_report_cache),
+        ("一括出力テスト", test_bulk_export),
+        ("勤怠集計テスト", test_timesheet),
+        ("Excel出力ジョブテスト", test_export_jobs),
+        ("月別集計テスト", test_monthly_summaries),
+        ("非同期ビューテスト", test_async_views),
+        ("診断情報テスト", test_diagnostics),
+        ("RPC台帳テスト", test_rpc_ledger),
+        ("メトリクステスト", test_metrics),
         ("app_firestore インポートテスト", test_app_firestore_imports),
+        ("フォームフィールド名テスト", test_attendance_form_key_parsing),
     ]
     
     passed = 0
@@ -0,0 +1,291 @@
+import logging
+import os
+from calendar import monthrange
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Mapping
+
+from startup_report import startup_report
+from work_calendar import work_calendar
+from compact_records import MonthRecords, COLUMNS, DAYS_PER_MONTH
+
+logger = logging.getLogger(__name__)
+
+# 法定労働時間（分）。1日・1週間の上限を超えた分を時間外労働とする
+DAILY_STANDARD_MINUTES = int(os.environ.get('TIMESHEET_DAILY_STANDARD_MINUTES', '480'))
+WEEKLY_STANDARD_MINUTES = int(os.environ.get('TIMESHEET_WEEKLY_STANDARD_MINUTES', '2400'))
+
+# 休憩時間が未入力の場合の既定値（分）
+DEFAULT_BREAK_MINUTES = 60
+
+# 始業時刻。平日にこれより後に出勤した日を遅刻として数える
+LATE_ARRIVAL_AFTER = os.environ.get('TIMESHEET_LATE_AFTER', '09:00')
+
+# 深夜の時間帯（0時からの分、22:00〜翌5:00。退勤が '26:00' のような表記の場合も含む）
+LATE_NIGHT_RANGES = ((0, 5 * 60), (22 * 60, 29 * 60))
+
+# 月曜始まりで1か月が掛かる週の最大数
+WEEKS_PER_MONTH = 6
+
+# コンパクト表現（compact_records）の列の位置
+_CHECK_IN = COLUMNS.index('check_in')
+_CHECK_OUT = COLUMNS.index('check_out')
+_BREAK_TIME = COLUMNS.index('break_time')
+_TRAVEL_COST = COLUMNS.index('travel_cost')
+
+def minutes_from_time(value: Any) -> Optional[int]:
+    """'HH:MM' を分に変換（不正な値は None）"""
+    if not value:
+        return None
+    try:
+        hours, minutes = map(int, value.split(':'))
+        return hours * 60 + minutes
+    except Exception:
+        return None
+
+def break_minutes_from(value: Any) -> int:
+    """休憩時間（'1.0' のような時間数）を分に変換（未入力・不正な値は1時間）"""
+    if not value:
+        return DEFAULT_BREAK_MINUTES
+    try:
+        return int(float(value) * 60)
+    except (TypeError, ValueError, OverflowError):
+        return DEFAULT_BREAK_MINUTES
+
+def travel_cost_from(value: Any) -> float:
+    """交通費を数値に変換（未入力・不正な値は 0）"""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+# 日ごとの値を足し合わせて求められる月合計（月別集計ドキュメントの項目）
+# 週 40時間を超えた分の時間外は週単位でしか決まらないため含めない（daily_overtime_minutes は1日 8時間を超えた分のみ）
+ADDITIVE_TOTALS = ('work_minutes', 'work_days', 'daily_overtime_minutes', 'late_night_minutes',
+                   'holiday_work_minutes', 'holiday_work_days', 'late_arrivals', 'travel_total')
+
+def day_totals(record: Optional[Mapping], is_day_off: bool) -> Dict[str, Any]:
+    """1日分の記録の ADDITIVE_TOTALS への寄与（Timesheet と同じ定義を1日分だけ計算）"""
+    totals: Dict[str, Any] = dict.fromkeys(ADDITIVE_TOTALS, 0)
+    if not record:
+        return totals
+    totals['travel_total'] = travel_cost_from(record.get('travel_cost'))
+    check_in = minutes_from_time(record.get('check_in'))
+    check_out = minutes_from_time(record.get('check_out'))
+    late_after = minutes_from_time(LATE_ARRIVAL_AFTER)
+    if check_in is not None and late_after is not None and check_in > late_after and not is_day_off:
+        totals['late_arrivals'] = 1
+    if check_in is None or check_out is None:
+        return totals
+    work = check_out - check_in - break_minutes_from(record.get('break_time'))
+    if work < 0:
+        return totals
+    totals['work_minutes'] = work
+    totals['work_days'] = 1
+    totals['daily_overtime_minutes'] = max(work - DAILY_STANDARD_MINUTES, 0)
+    totals['late_night_minutes'] = sum(max(min(check_out, high) - max(check_in, low), 0) for low, high in LATE_NIGHT_RANGES)
+    if is_day_off:
+        totals['holiday_work_minutes'] = work
+        totals['holiday_work_days'] = 1
+    return totals
+
+def format_minutes(minutes: Any) -> str:
+    """分を 'H:MM' 形式に変換（0 以下・未計算は空文字）"""
+    if minutes is None or minutes <= 0:
+        return ''
+    minutes = int(minutes)
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+class Timesheet:
+    """ユーザー × 月ごとの勤怠を (件数, 31日) の配列にまとめて集計
+    
+    1行が1件（ユーザー × 月）、列が日（1日〜31日）。文字列の解析は作成時に1回だけ行い、
+    実働時間・時間外・深夜・休日出勤・交通費の集計はすべて配列演算で行う。
+    実働時間は 退勤 - 出勤 - 休憩 で、出勤・退勤のどちらかが無い日や負になる日は実働なしとする。
+    """
+    
+    def __init__(self, entries: List[Tuple[str, int, int]], check_in, check_out, break_minutes, travel):
+        np = startup_report.import_module('numpy')
+        self.entries = entries
+        count = len(entries)
+        
+        # 月ごとのカレンダー（同じ月の行は同じ配列を共有する）
+        months = sorted({(year, month) for _, year, month in entries})
+        month_rows = {key: index for index, key in enumerate(months)}
+        day_off = np.zeros((max(len(months), 1), DAYS_PER_MONTH), dtype=bool)
+        month_length = np.zeros(max(len(months), 1), dtype=np.int64)
+        first_weekday = np.zeros(max(len(months), 1), dtype=np.int64)
+        for index, (year, month) in enumerate(months):
+            days = work_calendar.month_days(year, month)
+            day_off[index, :len(days)] = [day.is_day_off for day in days]
+            month_length[index] = len(days)
+            first_weekday[index] = days[0].weekday
+        rows = np.array([month_rows[(year, month)] for _, year, month in entries], dtype=np.int64)
+        self.days_in_month = month_length[rows]
+        self.first_weekday = first_weekday[rows]
+        self.day_off = day_off[rows]
+        in_month = np.arange(DAYS_PER_MONTH) < self.days_in_month[:, None]
+        
+        # 日ごとの実働時間（分）
+        work = check_out - check_in - break_minutes
+        with np.errstate(invalid='ignore'):
+            self.worked = in_month & ~np.isnan(work) & (work >= 0)
+        self.work_minutes = np.where(self.worked, work, 0).astype(np.int64)
+        self.travel = np.where(in_month, travel, 0.0)
+        
+        # 時間外: 1日 8時間を超えた分 + 週 40時間（1日 8時間までの分の合計）を超えた分
+        regular = np.minimum(self.work_minutes, DAILY_STANDARD_MINUTES)
+        self.daily_overtime = self.work_minutes - regular
+        self.weekly_minutes = self._by_week(self.work_minutes)
+        self.weekly_overtime = np.maximum(self._by_week(regular) - WEEKLY_STANDARD_MINUTES, 0)
+        
+        # 深夜: 出勤〜退勤のうち 22:00〜翌5:00 に掛かる分（休憩は差し引かない）
+        late_night = np.zeros((count, DAYS_PER_MONTH))
+        start = np.where(self.worked, check_in, 0)
+        end = np.where(self.worked, check_out, 0)
+        for low, high in LATE_NIGHT_RANGES:
+            late_night += np.clip(np.minimum(end, high) - np.maximum(start, low), 0, None)
+        self.late_night_minutes = late_night.astype(np.int64)
+        
+        # 休日出勤: 土日・祝日・休業日の実働
+        self.holiday_work_minutes = np.where(self.day_off, self.work_minutes, 0)
+        
+        # 遅刻: 平日に始業時刻より後の出勤（退勤の有無は問わない）
+        late_after = minutes_from_time(LATE_ARRIVAL_AFTER)
+        with np.errstate(invalid='ignore'):
+            self.late_arrivals = in_month & ~self.day_off & (check_in > (late_after if late_after is not None else np.inf))
+        self._totals: Optional[Dict[str, Any]] = None
+    
+    @classmethod
+    def from_months(cls, months: Iterable[Tuple[str, int, int, Mapping]]) -> 'Timesheet':
+        """(キー, 年, 月, 月の勤怠データ) の並びから作成
+        
+        勤怠データは MonthRecords（コンパクト表現）または日付 -> 記録 の辞書。MonthRecords は
+        数値の列をそのまま配列に変換し、列で表現できない値（extra）と辞書の記録のみ1件ずつ解析する。
+        """
+        np = startup_report.import_module('numpy')
+        months = list(months)
+        count = len(months)
+        check_in = np.full((count, DAYS_PER_MONTH), np.nan)
+        check_out = np.full((count, DAYS_PER_MONTH), np.nan)
+        break_minutes = np.full((count, DAYS_PER_MONTH), float(DEFAULT_BREAK_MINUTES))
+        travel = np.zeros((count, DAYS_PER_MONTH))
+        arrays = (check_in, check_out, break_minutes, travel)
+        
+        compact = []
+        for row, (_, year, month, data) in enumerate(months):
+            if isinstance(data, MonthRecords) and data.month_key == f"{year:04d}-{month:02d}":
+                compact.append(row)
+            else:
+                prefix = f"{year:04d}-{month:02d}-"
+                for day in range(1, monthrange(year, month)[1] + 1):
+                    record = data.get(f"{prefix}{day:02d}")
+                    if record:
+                        cls._parse_fields(arrays, row, day, record)
+        
+        if compact:
+            # MonthRecords の int16 の列（列数 × 31日）を1つの配列にまとめて変換
+            codes = np.frombuffer(b''.join(months[row][3].values.tobytes() for row in compact), dtype=np.int16)
+            codes = codes.reshape(len(compact), len(COLUMNS), DAYS_PER_MONTH).astype(np.float64)
+            check_in[compact] = np.where(codes[:, _CHECK_IN] >= 0, codes[:, _CHECK_IN], np.nan)
+            check_out[compact] = np.where(codes[:, _CHECK_OUT] >= 0, codes[:, _CHECK_OUT], np.nan)
+            # 休憩は従来どおり int(float('0.75') * 60) と同じ丸めにする
+            break_codes = codes[:, _BREAK_TIME]
+            break_minutes[compact] = np.where(break_codes >= 0, np.trunc(break_codes / 60 * 60), DEFAULT_BREAK_MINUTES)
+            travel[compact] = np.where(codes[:, _TRAVEL_COST] >= 0, codes[:, _TRAVEL_COST], 0.0)
+            for row in compact:
+                for day, record in (months[row][3].extra or {}).items():
+                    cls._parse_fields(arrays, row, day, record)
+        
+        return cls([(key, year, month) for key, year, month, _ in months], *arrays)
+    
+    @classmethod
+    def from_month(cls, year: int, month: int, data: Mapping, key: str = '') -> 'Timesheet':
+        """1件（1ユーザー × 1か月）から作成"""
+        return cls.from_months([(key, int(year), int(month), data)])
+    
+    @staticmethod
+    def _parse_fields(arrays, row: int, day: int, record: Mapping):
+        """1日分の記録のうち集計に使うフィールドを配列に書き込む"""
+        check_in, check_out, break_minutes, travel = arrays
+        index = day - 1
+        if 'check_in' in record:
+            value = minutes_from_time(record['check_in'])
+            check_in[row, index] = value if value is not None else float('nan')
+        if 'check_out' in record:
+            value = minutes_from_time(record['check_out'])
+            check_out[row, index] = value if value is not None else float('nan')
+        if 'break_time' in record:
+            break_minutes[row, index] = break_minutes_from(record['break_time'])
+        if 'travel_cost' in record:
+            travel[row, index] = travel_cost_from(record['travel_cost'])
+    
+    def _by_week(self, values):
+        """日ごとの値を月曜始まりの週ごとに合計（件数 × WEEKS_PER_MONTH）"""
+        np = startup_report.import_module('numpy')
+        count = len(self.entries)
+        padded = np.zeros((count, WEEKS_PER_MONTH * 7), dtype=values.dtype)
+        columns = self.first_weekday[:, None] + np.arange(DAYS_PER_MONTH)
+        padded[np.arange(count)[:, None], columns] = values
+        return padded.reshape(count, WEEKS_PER_MONTH, 7).sum(axis=2)
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    @property
+    def totals(self) -> Dict[str, Any]:
+        """件ごとの月合計（各値は長さ = 件数の配列）"""
+        if self._totals is None:
+            worked_day_off = self.worked & self.day_off
+            self._totals = {
+                'work_minutes': self.work_minutes.sum(axis=1),
+                'work_days': self.worked.sum(axis=1),
+                'overtime_minutes': self.daily_overtime.sum(axis=1) + self.weekly_overtime.sum(axis=1),
+                'daily_overtime_minutes': self.daily_overtime.sum(axis=1),
+                'late_night_minutes': self.late_night_minutes.sum(axis=1),
+                'holiday_work_minutes': self.holiday_work_minutes.sum(axis=1),
+                'holiday_work_days': worked_day_off.sum(axis=1),
+                'late_arrivals': self.late_arrivals.sum(axis=1),
+                'travel_total': self.travel.sum(axis=1),
+            }
+        return self._totals
+    
+    def daily_work_minutes(self, row: int = 0) -> List[Optional[int]]:
+        """指定した件の日ごとの実働時間（分、実働なしの日は None）"""
+        length = int(self.days_in_month[row])
+        return [int(minutes) if worked else None
+                for minutes, worked in zip(self.work_minutes[row, :length].tolist(), self.worked[row, :length].tolist())]
+    
+    def weeks(self, row: int = 0) -> List[int]:
+        """指定した件の週ごとの実働時間（分、月曜始まりで月に掛かる週のみ）"""
+        length = int(self.days_in_month[row])
+        weeks = (int(self.first_weekday[row]) + length + 6) // 7
+        return self.weekly_minutes[row, :weeks].tolist()
+    
+    def summary(self, row: int = 0, daily: bool = False) -> Dict[str, Any]:
+        """指定した件の集計を辞書で取得（JSON にそのまま変換できる）"""
+        key, year, month = self.entries[row]
+        totals = {name: values[row].item() for name, values in self.totals.items()}
+        travel_total = totals['travel_total']
+        summary = {
+            'key': key,
+            'year': year,
+            'month': month,
+            'work_minutes': totals['work_minutes'],
+            'work_hours': round(totals['work_minutes'] / 60, 2),
+            'work_days': totals['work_days'],
+            'overtime_minutes': totals['overtime_minutes'],
+            'late_night_minutes': totals['late_night_minutes'],
+            'holiday_work_minutes': totals['holiday_work_minutes'],
+            'holiday_work_days': totals['holiday_work_days'],
+            'late_arrivals': totals['late_arrivals'],
+            'travel_total': int(travel_total) if float(travel_total).is_integer() else travel_total,
+            'weekly_minutes': self.weeks(row),
+        }
+        if daily:
+            summary['daily_work_minutes'] = self.daily_work_minutes(row)
+        return summary
+    
+    def summaries(self, daily: bool = False) -> List[Dict[str, Any]]:
+        """全ての件の集計"""
+        return [self.summary(row, daily) for row in range(len(self.entries))]
@@ -0,0 +1,216 @@
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, List, NamedTuple, Tuple
+
+from startup_report import startup_report
+
+logger = logging.getLogger(__name__)
+
+# 曜日名（date.weekday() の値が添字）
+WEEKDAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+JP_WEEKDAY_NAMES = ('月', '火', '水', '木', '金', '土', '日')
+
+# 日ごとのフラグ（年ごとの bytearray に保持）
+WEEKEND = 1
+HOLIDAY = 2   # 国民の祝日（jpholiday）
+CLOSURE = 4   # 会社独自の休業日
+
+class CalendarDay(NamedTuple):
+    """1日分のカレンダー情報"""
+    date: date
+    weekday: int
+    is_weekend: bool
+    is_holiday: bool
+    is_closure: bool
+    holiday_name: str
+    
+    @property
+    def weekday_name(self) -> str:
+        return WEEKDAY_NAMES[self.weekday]
+    
+    @property
+    def jp_weekday(self) -> str:
+        return JP_WEEKDAY_NAMES[self.weekday]
+    
+    @property
+    def is_day_off(self) -> bool:
+        """土日・祝日・休業日のいずれか"""
+        return self.is_weekend or self.is_holiday or self.is_closure
+
+class YearCalendar:
+    """1年分の曜日・土日・祝日・休業日の表
+    
+    flags は1月1日からの通し日数を添字とするフラグ列、names は祝日・休業日の名前。
+    """
+    
+    __slots__ = ('year', 'first_day', 'first_weekday', 'flags', 'names')
+    
+    def __init__(self, year: int, holidays: Dict[date, str], closures: Dict[date, str]):
+        self.year = year
+        self.first_day = date(year, 1, 1)
+        self.first_weekday = self.first_day.weekday()
+        length = (date(year + 1, 1, 1) - self.first_day).days
+        self.flags = bytearray(length)
+        self.names: Dict[int, str] = {}
+        
+        for index in range(length):
+            if (self.first_weekday + index) % 7 >= 5:
+                self.flags[index] = WEEKEND
+        for flag, days in ((HOLIDAY, holidays), (CLOSURE, closures)):
+            for day, name in days.items():
+                if day.year != year:
+                    continue
+                index = (day - self.first_day).days
+                self.flags[index] |= flag
+                if name and index not in self.names:
+                    self.names[index] = name
+    
+    def _day_at(self, index: int) -> CalendarDay:
+        flags = self.flags[index]
+        return CalendarDay(
+            self.first_day + timedelta(days=index),
+            (self.first_weekday + index) % 7,
+            bool(flags & WEEKEND),
+            bool(flags & HOLIDAY),
+            bool(flags & CLOSURE),
+            self.names.get(index, '')
+        )
+    
+    def day(self, day: date) -> CalendarDay:
+        return self._day_at((day - self.first_day).days)
+    
+    def days(self, start: date, end: date) -> List[CalendarDay]:
+        """start から end まで（両端を含む、同じ年の範囲）の日"""
+        first = (start - self.first_day).days
+        last = (end - self.first_day).days
+        return [self._day_at(index) for index in range(first, last + 1)]
+    
+    def month(self, month: int) -> List[CalendarDay]:
+        start = date(self.year, month, 1)
+        end = date(self.year + 1, 1, 1) if month == 12 else date(self.year, month + 1, 1)
+        return self.days(start, end - timedelta(days=1))
+
+def parse_closure_days(spec: str) -> Tuple[Dict[date, str], Dict[Tuple[int, int], str]]:
+    """休業日の指定を解析
+    
+    カンマ区切りで 'YYYY-MM-DD'（その日のみ）または 'MM-DD'（毎年）を指定する。
+    ':' の後に名前を付けられる（例: '12-29:年末休業,2025-08-13:夏季休業'）。
+    """
+    fixed: Dict[date, str] = {}
+    yearly: Dict[Tuple[int, int], str] = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        day_spec, _, name = entry.partition(':')
+        parts = day_spec.strip().split('-')
+        try:
+            if len(parts) == 3:
+                fixed[date(int(parts[0]), int(parts[1]), int(parts[2]))] = name.strip() or '休業日'
+            elif len(parts) == 2:
+                month, day = int(parts[0]), int(parts[1])
+                date(2000, month, day)  # 日付として妥当か確認（うるう年を含む）
+                yearly[(month, day)] = name.strip() or '休業日'
+            else:
+                raise ValueError(entry)
+        except ValueError:
+            logger.warning(f"休業日の指定を解析できません: {entry}")
+    return fixed, yearly
+
+class WorkCalendar:
+    """祝日・土日・休業日の判定（年ごとの表をプロセス内でメモ化）
+    
+    国民の祝日は jpholiday から1年分をまとめて取得する。jpholiday を読み込めない場合は
+    土日と休業日のみで判定する。
+    """
+    
+    def __init__(self, closure_days: Optional[str] = None):
+        if closure_days is None:
+            closure_days = os.environ.get('COMPANY_CLOSURE_DAYS', '')
+        self._fixed_closures, self._yearly_closures = parse_closure_days(closure_days)
+        self._years: Dict[int, YearCalendar] = {}
+        self._lock = threading.Lock()
+        self.jpholiday_available: Optional[bool] = None
+    
+    def _load_jpholiday(self):
+        if self.jpholiday_available is False:
+            return None
+        try:
+            module = startup_report.import_module('jpholiday')
+            self.jpholiday_available = True
+            return module
+        except (ImportError, TypeError) as e:
+            logger.warning(f"jpholidayインポートエラー（土日・休業日のみで判定）: {e}")
+            self.jpholiday_available = False
+            return None
+    
+    def _national_holidays(self, year: int) -> Dict[date, str]:
+        jpholiday = self._load_jpholiday()
+        if jpholiday is None:
+            return {}
+        try:
+            return {day: name for day, name in jpholiday.year_holidays(year)}
+        except Exception as e:
+            logger.error(f"祝日取得エラー: {year}年 - {e}")
+            return {}
+    
+    def _closures(self, year: int) -> Dict[date, str]:
+        closures = {day: name for day, name in self._fixed_closures.items() if day.year == year}
+        for (month, day), name in self._yearly_closures.items():
+            try:
+                closures.setdefault(date(year, month, day), name)
+            except ValueError:
+                pass  # うるう年以外の 2月29日
+        return closures
+    
+    def year(self, year: int) -> YearCalendar:
+        """1年分の表を取得（初回のみ作成）"""
+        table = self._years.get(year)
+        if table is None:
+            with self._lock:
+                table = self._years.get(year)
+                if table is None:
+                    table = YearCalendar(year, self._national_holidays(year), self._closures(year))
+                    self._years[year] = table
+        return table
+    
+    def day(self, day: date) -> CalendarDay:
+        if isinstance(day, datetime):
+            day = day.date()
+        return self.year(day.year).day(day)
+    
+    def month_days(self, year: int, month: int) -> List[CalendarDay]:
+        """指定した年月の全ての日"""
+        return self.year(int(year)).month(int(month))
+    
+    def is_holiday(self, day: date) -> bool:
+        """祝日または休業日か（土日は含まない）"""
+        entry = self.day(day)
+        return entry.is_holiday or entry.is_closure
+    
+    def holiday_name(self, day: date) -> str:
+        return self.day(day).holiday_name
+    
+    def add_closure_day(self, day: date, name: str = '休業日'):
+        """休業日を追加（該当する年の表は次回の参照時に作り直す）"""
+        with self._lock:
+            self._fixed_closures[day] = name
+            self._years.pop(day.year, None)
+    
+    def clear(self):
+        """メモ化した表を破棄"""
+        with self._lock:
+            self._years.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'cached_years': sorted(self._years),
+            'jpholiday_available': self.jpholiday_available,
+            'fixed_closures': len(self._fixed_closures),
+            'yearly_closures': len(self._yearly_closures),
+        }
+
+# グローバルインスタンス
+work_calendar = WorkCalendar()